@@ -0,0 +1,245 @@
+"""
+API Benchmarks
+Query-count and latency regression suite for the list endpoints whose
+serializers are prone to N+1 queries (vendor profiles, product and vendor
+search, orders, conversations).
+
+seed() bulk-loads a marketplace of the requested size into the configured
+database, run() calls every endpoint through DRF's request factory as the
+user it is meant for and measures queries and p50/p95 latency, and
+compare() checks a run against each endpoint's query budget and a JSON
+baseline:
+
+    python manage.py benchmark_api                      # fails on regressions
+    python manage.py benchmark_api --update-baseline    # after an intended change
+
+Query counts must not grow at all; latencies may grow by the tolerance.
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from rest_framework import generics, permissions
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .dynamic_fields import DynamicFieldsViewMixin
+
+DEFAULT_SCALE = {
+    'vendors': 50,
+    'products_per_vendor': 20,
+    'customers': 100,
+    'orders_per_vendor': 30,
+    'conversations': 100,
+    'messages_per_conversation': 20,
+}
+DEFAULT_ROUNDS = 20
+DEFAULT_TOLERANCE = 0.25
+LATENCY_SLACK_MS = 2.0  # Timer noise on endpoints that take a few milliseconds
+SEED_BATCH_SIZE = 500
+CITY = (27.7172, 85.3240)  # Kathmandu
+
+
+class ConversationListView(DynamicFieldsViewMixin, generics.ListAPIView):
+    """message_views.ConversationListView's queryset and serializer"""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_serializer_class(self):
+        from .message_serializers import ConversationSerializer
+        return ConversationSerializer
+
+    def get_queryset(self):
+        from .message_models import Conversation
+        return Conversation.objects.filter(participants=self.request.user).order_by('-updated_at')
+
+
+class Endpoint:
+    """One benchmarked request: the view, how it is called, as whom and its query budget"""
+
+    def __init__(self, name, view, path, user, budget, params=None):
+        self.name = name
+        self.view = view
+        self.path = path
+        self.user = user  # 'admin', 'vendor', 'customer' or None for anonymous
+        self.budget = budget
+        self.params = params or {}
+
+
+def endpoints():
+    from .api_views import CustomerProductSearchView, CustomerVendorSearchView, VendorProfileListCreateView
+    from .order_views import CustomerOrderListView, VendorOrderListView
+    return [
+        Endpoint('vendor_profiles', VendorProfileListCreateView.as_view(), '/api/vendor-profiles/', 'admin', 4),
+        Endpoint('vendor_search', CustomerVendorSearchView.as_view(), '/api/search/vendors/', None, 4),
+        Endpoint('product_search', CustomerProductSearchView.as_view(), '/api/search/products/', None, 5),
+        Endpoint('vendor_orders', VendorOrderListView.as_view(), '/api/vendor/orders/', 'vendor', 6),
+        Endpoint('customer_orders', CustomerOrderListView.as_view(), '/api/orders/', 'customer', 6),
+        Endpoint('conversations', ConversationListView.as_view(), '/api/messaging/conversations/', 'customer', 7),
+    ]
+
+
+def seed(scale=None, seed_value=0, prefix='bench'):
+    """Bulk-load a marketplace; returns {'admin', 'vendor', 'customer'} users to call the endpoints as"""
+    from .message_models import Conversation, Message
+    from .models import CustomUser, Product, VendorProfile
+    from .order_models import Order, OrderItem
+    from .vendor_schedule import DAYS, refresh
+    scale = {**DEFAULT_SCALE, **(scale or {})}
+    rng = random.Random(seed_value)
+
+    def bulk(model, objects):
+        if connection.features.can_return_rows_from_bulk_insert:
+            return model.objects.bulk_create(objects, batch_size=SEED_BATCH_SIZE)
+        # MySQL does not hand back primary keys; read the new rows back in insertion order
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        model.objects.bulk_create(objects, batch_size=SEED_BATCH_SIZE)
+        return list(model.objects.filter(pk__gt=last).order_by('pk'))
+
+    admin = CustomUser.objects.create(username=f'{prefix}_admin', is_superuser=True, is_staff=True)
+    vendor_users = bulk(CustomUser, [CustomUser(username=f'{prefix}_vendor_{n}', user_type='vendor')
+                                     for n in range(scale['vendors'])])
+    customers = bulk(CustomUser, [CustomUser(username=f'{prefix}_customer_{n}', first_name=f'Customer {n}')
+                                  for n in range(scale['customers'])])
+
+    always_open = {f'{day}_{part}': datetime.time(0) for day in DAYS for part in ('open', 'close')}
+    vendors = []
+    for n, user in enumerate(vendor_users):
+        vendor = VendorProfile(
+            user=user, business_name=f'{prefix} Store {n}', business_email=f'{user.username}@example.com',
+            business_phone='9800000000', business_address='New Road, Kathmandu', state='Bagmati',
+            latitude=CITY[0] + rng.uniform(-0.05, 0.05), longitude=CITY[1] + rng.uniform(-0.05, 0.05),
+            delivery_radius=rng.choice((3, 5, 8)), is_approved=True, **always_open,
+        )
+        refresh(vendor)
+        vendors.append(vendor)
+    vendors = bulk(VendorProfile, vendors)
+
+    products = bulk(Product, [
+        Product(vendor=vendor, name=f'Product {vendor.id}-{n}', category=rng.choice(('Groceries', 'Bakery', 'Dairy')),
+                price=Decimal(rng.randint(50, 2000)), quantity=rng.randint(0, 100), description='Benchmark product',
+                tags=['bench'], status='active')
+        for vendor in vendors for n in range(scale['products_per_vendor'])
+    ])
+    products_by_vendor = {}
+    for product in products:
+        products_by_vendor.setdefault(product.vendor_id, []).append(product)
+
+    statuses = [status for status, _ in Order.ORDER_STATUS_CHOICES]
+    orders = bulk(Order, [
+        Order(order_number=f'B{vendor.id:06d}{n:05d}', customer=rng.choice(customers), vendor=vendor,
+              status=rng.choice(statuses), payment_method='cash_on_delivery', delivery_name='Benchmark',
+              delivery_phone='9800000000', delivery_address='Baluwatar', delivery_latitude=CITY[0],
+              delivery_longitude=CITY[1], delivery_distance=2, subtotal=Decimal(500), total_amount=Decimal(500))
+        for vendor in vendors for n in range(scale['orders_per_vendor'])
+    ])
+    items = []
+    for order in orders:
+        for product in rng.sample(products_by_vendor[order.vendor_id], min(3, scale['products_per_vendor'])):
+            items.append(OrderItem(order=order, product=product, quantity=2, unit_price=product.price,
+                                   total_price=product.price * 2, product_name=product.name,
+                                   vendor_name='Benchmark'))
+    bulk(OrderItem, items)
+
+    # The customer calling the endpoints talks to the first vendors; the rest is background volume
+    customer = customers[0]
+    conversations = bulk(Conversation, [Conversation() for _ in range(scale['conversations'])])
+    Participants = Conversation.participants.through
+    pairs = [(conversation, customer if n < len(vendor_users) else rng.choice(customers),
+              vendor_users[n % len(vendor_users)]) for n, conversation in enumerate(conversations)]
+    bulk(Participants, [Participants(conversation_id=conversation.id, customuser_id=user.id)
+                        for conversation, *users in pairs for user in users])
+    bulk(Message, [Message(conversation=conversation, sender=rng.choice(users), content=f'Message {n}')
+                   for conversation, *users in pairs for n in range(scale['messages_per_conversation'])])
+
+    return {'admin': admin, 'vendor': vendor_users[0], 'customer': customer}
+
+
+def cleanup(prefix='bench'):
+    """Delete what seed() created with this prefix"""
+    from .message_models import Conversation
+    from .models import CustomUser
+    users = CustomUser.objects.filter(username__startswith=f'{prefix}_')
+    Conversation.objects.filter(participants__in=users).delete()
+    users.delete()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(users, rounds=DEFAULT_ROUNDS, selected=None):
+    """{endpoint name: {'queries', 'p50_ms', 'p95_ms', 'status'}} for every (or every selected) endpoint"""
+    factory = APIRequestFactory()
+    results = {}
+    for endpoint in endpoints():
+        if selected and endpoint.name not in selected:
+            continue
+        timings, queries, status = [], 0, None
+        # Round 0 warms up caches; the following rounds are measured
+        for round_number in range(rounds + 1):
+            request = factory.get(endpoint.path, endpoint.params, HTTP_HOST='localhost')
+            if endpoint.user:
+                force_authenticate(request, user=users[endpoint.user])
+            # Several views still print debugging output per request
+            with contextlib.redirect_stdout(io.StringIO()), CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = endpoint.view(request)
+                response.render()
+                elapsed = (time.perf_counter() - started) * 1000
+            status = response.status_code
+            if round_number:
+                timings.append(elapsed)
+                queries = len(captured)
+        results[endpoint.name] = {
+            'queries': queries,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'status': status,
+        }
+    return results
+
+
+def compare(results, baseline=None, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of a run against the query budgets and a baseline's endpoints, as messages"""
+    budgets = {endpoint.name: endpoint.budget for endpoint in endpoints()}
+    baseline = baseline or {}
+    problems = []
+    for name, result in results.items():
+        if result['status'] != 200:
+            problems.append(f"{name}: HTTP {result['status']}")
+        if result['queries'] > budgets[name]:
+            problems.append(f"{name}: {result['queries']} queries, budget is {budgets[name]}")
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result['queries'] > previous['queries']:
+            problems.append(f"{name}: {result['queries']} queries, baseline has {previous['queries']}")
+        for key in ('p50_ms', 'p95_ms'):
+            limit = previous[key] * (1 + tolerance) + LATENCY_SLACK_MS
+            if result[key] > limit:
+                problems.append(f"{name}: {key} {result[key]:.1f}ms, baseline {previous[key]:.1f}ms "
+                                f"(limit {limit:.1f}ms)")
+    return problems
+
+
+def load_baseline(path):
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results, scale, rounds):
+    with open(path, 'w') as baseline_file:
+        json.dump({'scale': scale, 'rounds': rounds, 'endpoints': results}, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
@@ -6,6 +6,7 @@ from . import fcm_test_views
 from . import call_api_views
 from . import call_actions_api
 from . import call_status_api
+from . import protected_media
 
 urlpatterns = [
     # Authentication
@@ -80,6 +81,12 @@ urlpatterns = [
     # Messaging
     path('messaging/', include('accounts.message_urls')),
 
+    # Protected media (access checked here, bytes sent by the web server)
+    path('media/vendor-profiles/<int:pk>/<str:field>/', protected_media.vendor_profile_file_api, name='protected_vendor_profile_file'),
+    path('media/vendor-documents/<int:pk>/', protected_media.vendor_document_api, name='protected_vendor_document'),
+    path('media/refunds/<int:refund_id>/<str:field>/<int:index>/', protected_media.refund_document_api, name='protected_refund_document'),
+    path('media/messages/<int:message_id>/', protected_media.message_file_api, name='protected_message_file'),
+
     # Vendor Notifications
     path('vendor-notifications/', include('accounts.notification_urls')),
 
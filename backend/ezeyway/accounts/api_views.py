@@ -18,8 +18,12 @@ from rest_framework.exceptions import AuthenticationFailed
 import uuid
 
 logger = logging.getLogger(__name__)
-from .models import CustomUser, VendorProfile, VendorDocument, VendorShopImage, Product, ProductImage, VendorWallet, WalletTransaction, UserFavorite, Cart, CartItem, Category, SubCategory, DeliveryRadius, Slider, FeaturedProductPackage, ProductFeaturedPurchase
+from .models import CustomUser, VendorProfile, VendorDocument, VendorShopImage, Product, ProductImage, VendorWallet, WalletTransaction, UserFavorite, Cart, CartItem, Category, SubCategory, DeliveryRadius, Slider, FeaturedProductPackage, ProductFeaturedPurchase, FCMToken
 from .parameter_models import CategoryParameter, SubCategoryParameter
+from .cart_pricing import VENDOR_OFFLINE, cart_pricing
+from .catalog_cache import catalog_cached
+from .dynamic_fields import DynamicFieldsViewMixin
+from .vendor_schedule import filter_open
 from datetime import timedelta
 from .complete_onboarding_view import complete_vendor_onboarding
 from .serializers import (
@@ -707,10 +711,12 @@ def resend_verification_api(request):
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
 # Vendor API Views
-class VendorProfileListCreateView(generics.ListCreateAPIView):
+class VendorProfileListCreateView(DynamicFieldsViewMixin, generics.ListCreateAPIView):
     serializer_class = VendorProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    # A vendor's own profile screen reads this list; ?profile=lite is still available
+    lite_list = False
 
     def get_queryset(self):
         if self.request.user.is_superuser:
@@ -1505,27 +1511,14 @@ class CustomerProductSearchView(generics.ListAPIView):
         print("\nPRODUCT SEARCH DEBUG - Starting query")
         print(f"Query params: {dict(self.request.query_params)}")
         
-        # Get current time and day for vendor availability check
-        current_time = timezone.now().time()
-        current_day = timezone.now().strftime('%A').lower()
-        current_date = timezone.now().date()
-        
         # Initial filter with vendor online status
         queryset = Product.objects.filter(
             status='active',
             vendor__is_approved=True
-        ).select_related('vendor').prefetch_related('images')
-        
-        # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-        # Filter for online vendors only - simplified to just check is_active
-        online_vendors = []
-        for product in queryset:
-            vendor = product.vendor
-            # Only check if vendor is manually set to active, ignore business hours
-            if vendor.is_active:
-                online_vendors.append(product.id)
+        ).select_related('vendor')  # Images are loaded for fragment cache misses only
         
-        queryset = queryset.filter(id__in=online_vendors)
+        # Open vendors only: opening hours or today's manual status (see vendor_schedule)
+        queryset = queryset.filter(vendor__is_open_now=True)
         
         initial_count = queryset.count()
         print(f"Initial products (active, approved, online vendors): {initial_count}")
@@ -1593,7 +1586,7 @@ class CustomerProductSearchView(generics.ListAPIView):
         
         return queryset.order_by('-created_at')
 
-class CustomerVendorSearchView(generics.ListAPIView):
+class CustomerVendorSearchView(DynamicFieldsViewMixin, generics.ListAPIView):
     serializer_class = VendorProfileSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = SearchPagination
@@ -1602,23 +1595,11 @@ class CustomerVendorSearchView(generics.ListAPIView):
         print("\nVENDOR SEARCH DEBUG - Starting query")
         print(f"Query params: {dict(self.request.query_params)}")
         
-        # Get current time and day for vendor availability check
-        current_time = timezone.now().time()
-        current_day = timezone.now().strftime('%A').lower()
-        current_date = timezone.now().date()
-        
         # Initial filter - only approved vendors
         queryset = VendorProfile.objects.filter(is_approved=True)
         
-        # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-        # Filter for online vendors only - simplified to just check is_active
-        online_vendors = []
-        for vendor in queryset:
-            # Only check if vendor is manually set to active, ignore business hours
-            if vendor.is_active:
-                online_vendors.append(vendor.id)
-        
-        queryset = queryset.filter(id__in=online_vendors)
+        # Open vendors only: opening hours or today's manual status (see vendor_schedule)
+        queryset = filter_open(queryset)
         
         initial_count = queryset.count()
         print(f"Initial vendors (approved & online): {initial_count}")
@@ -1708,23 +1689,10 @@ class UserFavoriteListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Get current time and day for vendor availability check
-        current_time = timezone.now().time()
-        current_day = timezone.now().strftime('%A').lower()
-        current_date = timezone.now().date()
+        queryset = UserFavorite.objects.filter(user=self.request.user).select_related('product__vendor')
         
-        queryset = UserFavorite.objects.filter(user=self.request.user)
-        
-        # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-        # Filter out favorites from offline vendors - simplified to just check is_active
-        online_favorites = []
-        for favorite in queryset:
-            vendor = favorite.product.vendor
-            # Only check if vendor is manually set to active, ignore business hours
-            if vendor.is_active:
-                online_favorites.append(favorite.id)
-        
-        return queryset.filter(id__in=online_favorites)
+        # Leave out favorites of closed vendors (see vendor_schedule)
+        return queryset.filter(product__vendor__is_open_now=True)
 
 @csrf_exempt
 @api_view(['POST'])
@@ -1783,25 +1751,17 @@ def toggle_favorite_api(request):
 @permission_classes([permissions.IsAuthenticated])
 def get_cart_api(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
-    
-    # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-    # Filter out items from offline vendors - simplified to just check is_active
-    current_time = timezone.now().time()
-    current_day = timezone.now().strftime('%A').lower()
-    current_date = timezone.now().date()
-    
-    offline_items = []
-    for item in cart.items.all():
-        vendor = item.product.vendor
-        # Only check if vendor is manually set to active, ignore business hours
-        if not vendor.is_active:
-            offline_items.append(item.id)
+    quote = cart_pricing.quote(cart)
     
     # Remove offline vendor items from cart
+    offline_items = quote.item_ids(VENDOR_OFFLINE)
     if offline_items:
         CartItem.objects.filter(id__in=offline_items).delete()
+        cart_pricing.invalidate([cart.pk])
+        cart_pricing.forget_items(cart)
+        quote = cart_pricing.quote(cart)
     
-    serializer = CartSerializer(cart, context={'request': request})
+    serializer = CartSerializer(cart, context={'request': request, 'cart_quote': quote})
     return Response(serializer.data)
 
 @csrf_exempt
@@ -1889,6 +1849,7 @@ def clear_cart_api(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('categories')
 def get_categories_api(request):
     categories = Category.objects.filter(is_active=True).order_by('display_order', 'name')
     serializer = CategorySerializer(categories, many=True, context={'request': request})
@@ -1898,6 +1859,7 @@ def get_categories_api(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('subcategories')
 def get_subcategories_api(request, category_name):
     try:
         category = Category.objects.get(name=category_name, is_active=True)
@@ -1914,6 +1876,7 @@ def get_subcategories_api(request, category_name):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('subcategories')
 def get_subcategories_detailed_api(request, category_name):
     """Return detailed subcategory objects (id, name) for a category"""
     try:
@@ -1935,6 +1898,7 @@ def get_subcategories_detailed_api(request, category_name):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('category_parameters')
 def get_category_parameters_api(request, category_id):
     """Get parameters for a specific category"""
     try:
@@ -1979,6 +1943,7 @@ def get_category_parameters_api(request, category_id):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('category_parameters')
 def get_subcategory_parameters_api(request, subcategory_id):
     """Get parameters for a specific subcategory"""
     try:
@@ -2023,6 +1988,7 @@ def get_subcategory_parameters_api(request, subcategory_id):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('category_parameters')
 def get_category_parameters_compat_api(request):
     """Compatibility endpoint for old frontend requests using query params:
     /api/accounts/categories/parameters/?target_id=3&target_type=category
@@ -2061,6 +2027,7 @@ def get_category_parameters_compat_api(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('delivery_radius')
 def get_delivery_radius_api(request):
     # Get the first (smallest) delivery radius as default
     radius = DeliveryRadius.objects.first()
@@ -2192,25 +2159,20 @@ def register_fcm_token_api(request):
         if not fcm_token:
             return Response({'error': 'FCM token is required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Update vendor profile with FCM token
-        try:
-            vendor_profile = VendorProfile.objects.get(user=request.user, is_approved=True)
-            vendor_profile.fcm_token = fcm_token
-            vendor_profile.fcm_updated_at = timezone.now()
-            vendor_profile.save()
-            
-            return Response({
-                'success': True,
-                'message': 'FCM token registered successfully',
-                'platform': platform
-            })
-        except VendorProfile.DoesNotExist:
-            # For customers, you can store FCM token in user profile or separate model
-            return Response({
-                'success': True,
-                'message': 'FCM token registered for customer',
-                'platform': platform
-            })
+        # Every device gets its own row, for customers and vendors alike
+        FCMToken.register(request.user, fcm_token, platform)
+        
+        # Keep the vendor profile column current for code that still reads it
+        VendorProfile.objects.filter(user=request.user, is_approved=True).update(
+            fcm_token=fcm_token,
+            fcm_updated_at=timezone.now()
+        )
+        
+        return Response({
+            'success': True,
+            'message': 'FCM token registered successfully',
+            'platform': platform
+        })
             
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -2468,10 +2430,16 @@ def purchase_featured_package_api(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def slider_audience(request):
+    """Sliders differ for vendors and customers; part of the catalog cache key"""
+    return request.user.user_type if request.user.is_authenticated else 'customer'
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('sliders', variant=slider_audience)
 def get_sliders_api(request):
     from .models import Slider
+    from .responsive_images import variant_urls
     from django.db.models import Q
 
     # Determine user type
@@ -2499,6 +2467,7 @@ def get_sliders_api(request):
             'title': slider.title,
             'description': slider.description,
             'image_url': request.build_absolute_uri(slider.image.url) if slider.image else None,
+            'image_variants': variant_urls(slider.image_variants, request),
             'link_url': slider.link_url,
             'visibility': slider.visibility,
             'display_order': slider.display_order,
@@ -3116,6 +3085,7 @@ def send_web_push_notification_api(request):
 # Missing API endpoints that frontend is calling
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@catalog_cached('categories')
 def categories_api(request):
     """Get all active categories"""
     try:
@@ -3151,27 +3121,14 @@ def image_search_api(request):
         # In a real implementation, you would use AI/ML for image recognition
         # This is a placeholder that returns random products for demo
         
-        # Get current time and day for vendor availability check
-        current_time = timezone.now().time()
-        current_day = timezone.now().strftime('%A').lower()
-        current_date = timezone.now().date()
-        
         # Get active products from online vendors
         queryset = Product.objects.filter(
             status='active',
             vendor__is_approved=True
-        ).select_related('vendor').prefetch_related('images')
+        ).select_related('vendor')  # Images are loaded for fragment cache misses only
         
-        # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-        # Filter for online vendors only - simplified to just check is_active
-        online_vendors = []
-        for product in queryset:
-            vendor = product.vendor
-            # Only check if vendor is manually set to active, ignore business hours
-            if vendor.is_active:
-                online_vendors.append(product.id)
-        
-        queryset = queryset.filter(id__in=online_vendors)
+        # Open vendors only: opening hours or today's manual status (see vendor_schedule)
+        queryset = queryset.filter(vendor__is_open_now=True)
         
         # Location-based filtering
         user_lat = request.POST.get('latitude')
@@ -3228,27 +3185,14 @@ def search_products_api(request):
     print("\nPRODUCT SEARCH API DEBUG - Starting query")
     print(f"Query params: {dict(request.query_params)}")
 
-    # Get current time and day for vendor availability check
-    current_time = timezone.now().time()
-    current_day = timezone.now().strftime('%A').lower()
-    current_date = timezone.now().date()
-
     # Initial filter with vendor online status
     queryset = Product.objects.filter(
         status='active',
         vendor__is_approved=True
-    ).select_related('vendor').prefetch_related('images')
-
-    # TEMPORARILY DISABLE BUSINESS HOURS FILTERING FOR TESTING
-    # Filter for online vendors only - simplified to just check is_active
-    online_vendors = []
-    for product in queryset:
-        vendor = product.vendor
-        # Only check if vendor is manually set to active, ignore business hours
-        if vendor.is_active:
-            online_vendors.append(product.id)
+    ).select_related('vendor')  # Images are loaded for fragment cache misses only
 
-    queryset = queryset.filter(id__in=online_vendors)
+    # Open vendors only: opening hours or today's manual status (see vendor_schedule)
+    queryset = queryset.filter(vendor__is_open_now=True)
 
     initial_count = queryset.count()
     print(f"Initial products (active, approved, online vendors): {initial_count}")
@@ -3818,6 +3762,7 @@ def send_call_invite_api(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@catalog_cached('featured_packages')
 def get_featured_packages_api(request):
     """Get list of active featured packages"""
     packages = FeaturedProductPackage.objects.filter(is_active=True).values(
@@ -36,8 +36,10 @@ def accept_call_api(request, call_id):
         
         channel_layer = get_channel_layer()
         if channel_layer:
-            async_to_sync(channel_layer.group_send)(
+            from .event_log import send_user_event
+            send_user_event(
                 f"user_{call.caller.id}",
+                call.caller.id,
                 {
                     'type': 'call_accepted',
                     'call_id': call_id,
@@ -169,8 +171,10 @@ def end_call_api(request, call_id):
         
         channel_layer = get_channel_layer()
         if channel_layer:
-            async_to_sync(channel_layer.group_send)(
+            from .event_log import send_user_event
+            send_user_event(
                 f"user_{other_user.id}",
+                other_user.id,
                 {
                     'type': 'call_ended',
                     'call_id': call_id,
@@ -132,24 +132,19 @@ def update_fcm_token_api(request):
         if not fcm_token:
             return Response({'error': 'fcm_token is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Update FCM token in vendor profile
-        from .models import VendorProfile
-        try:
-            vendor_profile = VendorProfile.objects.get(user=request.user)
-            vendor_profile.fcm_token = fcm_token
-            vendor_profile.fcm_updated_at = timezone.now()
-            vendor_profile.save()
-            
-            return Response({
-                'success': True,
-                'message': 'FCM token updated successfully'
-            })
-        except VendorProfile.DoesNotExist:
-            # For customers, store in user model (you may need to add fcm_token field to CustomUser)
-            return Response({
-                'success': True,
-                'message': 'FCM token updated for customer'
-            })
+        from .models import FCMToken, VendorProfile
+        FCMToken.register(request.user, fcm_token, request.data.get('platform', 'android'))
+
+        # Keep the vendor profile column current for code that still reads it
+        VendorProfile.objects.filter(user=request.user).update(
+            fcm_token=fcm_token,
+            fcm_updated_at=timezone.now()
+        )
+
+        return Response({
+            'success': True,
+            'message': 'FCM token updated successfully'
+        })
 
     except Exception as e:
         logger.error(f"FCM token update error: {e}")
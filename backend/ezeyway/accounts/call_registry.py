@@ -0,0 +1,238 @@
+"""
+Active Call Registry
+Keeps participants and status of live calls in memory so WebRTC
+signaling (offer/answer/ICE) is authorized and routed without touching
+the database. Status transitions are persisted write-behind in batches.
+
+The registry is per worker. Calls saved through the ORM in this process
+refresh their entry via the post_save hook in message_models; a worker
+that has never seen a call loads it from the database once.
+"""
+
+import asyncio
+import threading
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('ended', 'declined', 'rejected', 'missed')
+DEFAULT_FLUSH_INTERVAL = 0.25  # seconds status writes are coalesced for
+DEFAULT_MAX_ACTIVE_CALLS = 10000
+
+
+class ActiveCall:
+    __slots__ = ('call_id', 'pk', 'caller_id', 'receiver_id', 'participants', 'status', 'answered_at')
+
+    def __init__(self, call_id, pk, caller_id, receiver_id, participants, status, answered_at=None):
+        self.call_id = call_id
+        self.pk = pk
+        self.caller_id = caller_id
+        self.receiver_id = receiver_id
+        self.participants = set(participants or ()) | {caller_id, receiver_id}
+        self.participants.discard(None)
+        self.status = status
+        self.answered_at = answered_at
+
+    @classmethod
+    def from_model(cls, call):
+        return cls(call.call_id, call.pk, call.caller_id, call.receiver_id,
+                   call.participants, call.status, call.answered_at)
+
+    def has_access(self, user_id):
+        return user_id in self.participants
+
+
+class CallRegistry:
+    def __init__(self, flush_interval=None, max_calls=None):
+        self._flush_interval = flush_interval
+        self._max_calls = max_calls
+        self._calls = {}  # call_id -> ActiveCall
+        self._aliases = {}  # str(pk) -> call_id, for clients that use the numeric id
+        self._pending = {}  # call_id -> [(status, timestamp), ...] not yet persisted
+        self._pending_participants = {}  # call_id -> participant list not yet persisted
+        self._lock = threading.Lock()
+        self._flush_task = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is None:
+            return getattr(settings, 'CALL_REGISTRY_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        return self._flush_interval
+
+    @property
+    def max_calls(self):
+        if self._max_calls is None:
+            return getattr(settings, 'CALL_REGISTRY_MAX_CALLS', DEFAULT_MAX_ACTIVE_CALLS)
+        return self._max_calls
+
+    def __len__(self):
+        return len(self._calls)
+
+    def lookup(self, call_id):
+        """In-memory lookup only; None if this worker does not know the call"""
+        call_id = str(call_id)
+        with self._lock:
+            active = self._calls.get(call_id)
+            if active is None and call_id in self._aliases:
+                active = self._calls.get(self._aliases[call_id])
+            return active
+
+    async def get(self, call_id):
+        """Active call entry, loading it from the database on first use"""
+        active = self.lookup(call_id)
+        if active is None:
+            active = await database_sync_to_async(self._load)(call_id)
+        return active
+
+    def register(self, call):
+        """Remember a call that was just created or saved in this process"""
+        if call.status in TERMINAL_STATUSES:
+            self.forget(call.call_id)
+            return None
+        active = ActiveCall.from_model(call)
+        with self._lock:
+            if active.call_id not in self._calls:
+                while len(self._calls) >= self.max_calls:
+                    # Bound memory: drop the oldest entry (dicts keep insertion order)
+                    oldest_id, oldest = next(iter(self._calls.items()))
+                    del self._calls[oldest_id]
+                    self._aliases.pop(str(oldest.pk), None)
+            self._calls[active.call_id] = active
+            self._aliases[str(active.pk)] = active.call_id
+        return active
+
+    def forget(self, call_id):
+        with self._lock:
+            active = self._calls.pop(call_id, None)
+            if active is not None:
+                self._aliases.pop(str(active.pk), None)
+
+    def sync_from_model(self, call, created=False):
+        """post_save hook: keep known (or newly created) calls in step with the database"""
+        if call.call_id in self._pending:
+            # Our own write-behind is still catching up; memory is ahead of this row
+            return
+        if created or call.call_id in self._calls:
+            self.register(call)
+
+    def _load(self, call_id):
+        from .message_models import Call
+        try:
+            call = Call.objects.get(call_id=call_id)
+        except Call.DoesNotExist:
+            try:
+                call = Call.objects.get(id=int(call_id))
+            except (Call.DoesNotExist, ValueError):
+                return None
+        active = ActiveCall.from_model(call)
+        if call.status not in TERMINAL_STATUSES:
+            self.register(call)
+        return active
+
+    async def set_status(self, call_id, status):
+        """Apply a status transition in memory and queue it for persistence"""
+        active = await self.get(call_id)
+        if active is None:
+            return False
+        if active.status == status:
+            return True
+
+        now = timezone.now()
+        active.status = status
+        if status == 'answered' and not active.answered_at:
+            active.answered_at = now
+        with self._lock:
+            self._pending.setdefault(active.call_id, []).append((status, now))
+        if status in TERMINAL_STATUSES:
+            self.forget(active.call_id)
+            # Final states are flushed right away instead of waiting for the batch window
+            self._schedule_flush(0)
+        else:
+            self._schedule_flush(self.flush_interval)
+        return True
+
+    async def add_participant(self, call_id, user_id):
+        active = await self.get(call_id)
+        if active is None:
+            return False
+        if user_id not in active.participants:
+            active.participants.add(user_id)
+            with self._lock:
+                self._pending_participants[active.call_id] = sorted(active.participants)
+            self._schedule_flush(self.flush_interval)
+        return True
+
+    def _schedule_flush(self, delay):
+        loop = asyncio.get_running_loop()
+        task = self._flush_task
+        if task is not None and not task.done() and task.get_loop() is loop:
+            if delay == 0:
+                task.cancel()
+            else:
+                return
+        self._flush_task = loop.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Persist every queued transition in one trip to the database thread pool"""
+        with self._lock:
+            statuses, self._pending = self._pending, {}
+            participants, self._pending_participants = self._pending_participants, {}
+        if statuses or participants:
+            await database_sync_to_async(self._persist)(statuses, participants)
+
+    def _persist(self, statuses, participants):
+        from .message_models import Call
+        for call_id in set(statuses) | set(participants):
+            try:
+                with transaction.atomic():
+                    self._persist_call(Call, call_id, statuses.get(call_id, ()), participants.get(call_id))
+            except Call.DoesNotExist:
+                logger.error(f"Call {call_id} vanished before its state could be persisted")
+            except Exception as e:
+                logger.error(f"Error persisting state for call {call_id}: {e}")
+
+    def _persist_call(self, Call, call_id, statuses, participants):
+        """Apply one call's queued writes on top of what other workers already stored.
+
+        A status queued here may arrive after another worker flushed a final
+        one, so status updates never leave a terminal status, and participant
+        lists are merged rather than replaced.
+        """
+        call = Call.objects.select_for_update().get(call_id=call_id)
+        fields = {}
+        status = call.status
+        for queued, timestamp in statuses:
+            if status in TERMINAL_STATUSES:
+                break
+            status = fields['status'] = queued
+            if queued == 'answered' and not call.answered_at:
+                call.answered_at = fields['answered_at'] = timestamp
+            elif queued in ['ended', 'declined', 'rejected'] and not call.ended_at:
+                fields['ended_at'] = timestamp
+                if queued == 'ended' and call.answered_at:
+                    fields['duration'] = int((timestamp - call.answered_at).total_seconds())
+        if fields:
+            Call.objects.filter(pk=call.pk).exclude(status__in=TERMINAL_STATUSES).update(**fields)
+
+        if participants:
+            stored = list(call.participants or [])
+            merged = stored + sorted(set(participants) - set(stored))
+            if len(merged) > len(stored):
+                Call.objects.filter(pk=call.pk).update(participants=merged)
+            with self._lock:
+                active = self._calls.get(call_id)
+                if active is not None:
+                    active.participants.update(merged)
+
+
+# Global instance
+call_registry = CallRegistry()
@@ -1,118 +1,258 @@
 """
 Call State Management Service
 Handles call state sync, reconnection, and prevents stuck states
+
+Disconnect bookkeeping lives in a pluggable store (shared cache in
+production) so a reconnect handled by another worker is seen by the
+worker that owns the timeout. Timeouts run on one asyncio timer wheel per
+worker instead of a thread per disconnect.
 """
 
-import json
 import asyncio
+import threading
+import time
 import logging
+import weakref
+from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from django.utils.module_loading import import_string
 from .message_models import Call
+from .timer_wheel import HashedTimerWheel
 
 logger = logging.getLogger(__name__)
 
-class CallStateManager:
+DEFAULT_RECONNECT_TIMEOUT = 30  # seconds a participant may stay disconnected
+
+
+class InMemoryCallStateStore:
+    """Process-local disconnect registry, used in tests and single-worker setups"""
+
     def __init__(self):
-        self.channel_layer = get_channel_layer()
-        self.active_calls = {}  # call_id -> {'disconnected_users': set(), 'last_activity': timestamp}
-        
+        self._disconnected = {}  # (call_id, user_id) -> deadline (epoch seconds)
+        self._lock = threading.Lock()
+
+    def mark_disconnected(self, call_id, user_id, deadline):
+        with self._lock:
+            self._disconnected[(call_id, user_id)] = deadline
+
+    def mark_reconnected(self, call_id, user_id):
+        """Returns True if the user was waiting to reconnect"""
+        with self._lock:
+            return self._disconnected.pop((call_id, user_id), None) is not None
+
+    def claim_timeout(self, call_id, user_id, now):
+        """Atomically take ownership of an expired disconnect; False if the user came back"""
+        with self._lock:
+            deadline = self._disconnected.get((call_id, user_id))
+            if deadline is None or deadline > now:
+                return False
+            del self._disconnected[(call_id, user_id)]
+            return True
+
+    def disconnected_users(self, call_id):
+        with self._lock:
+            return {user_id for (cid, user_id) in self._disconnected if cid == call_id}
+
+    async def amark_disconnected(self, call_id, user_id, deadline):
+        self.mark_disconnected(call_id, user_id, deadline)
+
+    async def amark_reconnected(self, call_id, user_id):
+        return self.mark_reconnected(call_id, user_id)
+
+    async def aclaim_timeout(self, call_id, user_id, now):
+        return self.claim_timeout(call_id, user_id, now)
+
+
+class CacheCallStateStore:
+    """Disconnect registry on the Django cache (Redis in production), shared by all workers"""
+
+    # Keep entries a little longer than the deadline so a late timer can still claim them
+    grace_seconds = 60
+
+    def _key(self, call_id, user_id):
+        return f"call_disconnect_{call_id}_{user_id}"
+
+    def _timeout(self, deadline):
+        return max(1, int(deadline - time.time()) + self.grace_seconds)
+
+    def mark_disconnected(self, call_id, user_id, deadline):
+        cache.set(self._key(call_id, user_id), deadline, timeout=self._timeout(deadline))
+
+    def mark_reconnected(self, call_id, user_id):
+        return cache.delete(self._key(call_id, user_id))
+
+    def claim_timeout(self, call_id, user_id, now):
+        key = self._key(call_id, user_id)
+        deadline = cache.get(key)
+        if deadline is None or deadline > now:
+            return False
+        # delete() reports whether this worker removed the key, so only one claimer wins
+        return cache.delete(key)
+
+    async def amark_disconnected(self, call_id, user_id, deadline):
+        await cache.aset(self._key(call_id, user_id), deadline, timeout=self._timeout(deadline))
+
+    async def amark_reconnected(self, call_id, user_id):
+        return await cache.adelete(self._key(call_id, user_id))
+
+    async def aclaim_timeout(self, call_id, user_id, now):
+        key = self._key(call_id, user_id)
+        deadline = await cache.aget(key)
+        if deadline is None or deadline > now:
+            return False
+        return await cache.adelete(key)
+
+
+class CallStateManager:
+    def __init__(self, store=None, reconnect_timeout=None):
+        self._store = store
+        self._reconnect_timeout = reconnect_timeout
+        self._wheels = weakref.WeakKeyDictionary()  # event loop -> HashedTimerWheel
+        self._timers = {}  # (call_id, user_id) -> TimerHandle scheduled by this worker
+
+    @property
+    def channel_layer(self):
+        return get_channel_layer()
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = getattr(settings, 'CALL_STATE_BACKEND', 'accounts.call_state_manager.CacheCallStateStore')
+            self._store = import_string(backend)()
+        return self._store
+
+    @property
+    def reconnect_timeout(self):
+        if self._reconnect_timeout is None:
+            return getattr(settings, 'CALL_RECONNECT_TIMEOUT', DEFAULT_RECONNECT_TIMEOUT)
+        return self._reconnect_timeout
+
+    def timer_wheel(self):
+        """The timer wheel of the running event loop (one per worker)"""
+        loop = asyncio.get_running_loop()
+        wheel = self._wheels.get(loop)
+        if wheel is None:
+            wheel = HashedTimerWheel(tick=getattr(settings, 'CALL_TIMER_TICK_SECONDS', 0.5))
+            self._wheels[loop] = wheel
+        return wheel
+
     def sync_call_state(self, call_id, user_id, status):
         """Sync call state across all participants"""
+        result = self._update_call_status(call_id, status)
+        if result:
+            for participant_id, event in self._state_sync_events(call_id, user_id, status, *result):
+                async_to_sync(self.channel_layer.group_send)(f"call_user_{participant_id}", event)
+
+    async def async_call_state(self, call_id, user_id, status):
+        """Async variant of sync_call_state for consumers and timers"""
+        result = await database_sync_to_async(self._update_call_status)(call_id, status)
+        if result:
+            await asyncio.gather(*(
+                self.channel_layer.group_send(f"call_user_{participant_id}", event)
+                for participant_id, event in self._state_sync_events(call_id, user_id, status, *result)
+            ))
+
+    def _update_call_status(self, call_id, status):
+        """Persist the new status; returns (old_status, participant_ids) or None"""
         try:
             call = Call.objects.get(call_id=call_id)
-            
+
             # Update call status
             old_status = call.status
             call.status = status
-            
+
             if status == 'answered' and not call.answered_at:
                 call.answered_at = timezone.now()
             elif status == 'ended' and not call.ended_at:
                 call.ended_at = timezone.now()
                 if call.answered_at:
                     call.duration = (timezone.now() - call.answered_at).total_seconds()
-                    
+
             call.save()
-            
-            # Only broadcast if status actually changed
-            if old_status != status:
-                participants = [call.caller.id]
-                if call.receiver:
-                    participants.append(call.receiver.id)
-                    
-                for participant_id in participants:
-                    async_to_sync(self.channel_layer.group_send)(
-                        f"call_user_{participant_id}",
-                        {
-                            'type': 'call_state_sync',
-                            'call_id': call_id,
-                            'status': status,
-                            'updated_by': user_id,
-                            'timestamp': timezone.now().isoformat()
-                        }
-                    )
-                    
+
+            participants = [call.caller_id]
+            if call.receiver_id:
+                participants.append(call.receiver_id)
+            return old_status, participants
+
         except Call.DoesNotExist:
             logger.error(f"Call {call_id} not found for state sync")
         except Exception as e:
             logger.error(f"Error syncing call state: {e}")
-    
-    def handle_disconnect(self, call_id, user_id):
+        return None
+
+    def _state_sync_events(self, call_id, user_id, status, old_status, participants):
+        # Only broadcast if status actually changed
+        if old_status == status:
+            return []
+        event = {
+            'type': 'call_state_sync',
+            'call_id': call_id,
+            'status': status,
+            'updated_by': user_id,
+            'timestamp': timezone.now().isoformat()
+        }
+        return [(participant_id, event) for participant_id in participants]
+
+    async def handle_disconnect(self, call_id, user_id):
         """Handle user disconnect - start reconnect timer"""
-        if call_id not in self.active_calls:
-            self.active_calls[call_id] = {
-                'disconnected_users': set(),
-                'last_activity': timezone.now()
-            }
-            
-        self.active_calls[call_id]['disconnected_users'].add(user_id)
-        
-        # Start reconnect timer in background
-        import threading
-        timer = threading.Timer(30.0, self._handle_reconnect_timeout, [call_id, user_id])
-        timer.start()
-    
-    def _handle_reconnect_timeout(self, call_id, user_id):
+        timeout = self.reconnect_timeout
+        await self.store.amark_disconnected(call_id, user_id, time.time() + timeout)
+
+        key = (call_id, user_id)
+        previous = self._timers.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        self._timers[key] = self.timer_wheel().schedule(timeout, self._handle_reconnect_timeout, call_id, user_id)
+
+    async def _handle_reconnect_timeout(self, call_id, user_id):
         """Handle reconnect timeout - end call if user didn't reconnect"""
-        if (call_id in self.active_calls and 
-            user_id in self.active_calls[call_id]['disconnected_users']):
-            
-            # User didn't reconnect - end call
-            self.sync_call_state(call_id, user_id, 'ended')
-            
-            # Clean up
-            if call_id in self.active_calls:
-                del self.active_calls[call_id]
-    
-    def handle_reconnect(self, call_id, user_id):
+        self._timers.pop((call_id, user_id), None)
+        # The store is shared, so a reconnect on any worker makes the claim fail
+        if await self.store.aclaim_timeout(call_id, user_id, time.time()):
+            await self.async_call_state(call_id, user_id, 'ended')
+
+    async def handle_reconnect(self, call_id, user_id):
         """Handle user reconnection"""
-        if call_id in self.active_calls:
-            self.active_calls[call_id]['disconnected_users'].discard(user_id)
-            self.active_calls[call_id]['last_activity'] = timezone.now()
-            
-            # Send current call state
-            try:
-                call = Call.objects.get(call_id=call_id)
-                participants = [call.caller.id]
-                if call.receiver:
-                    participants.append(call.receiver.id)
-                    
-                async_to_sync(self.channel_layer.group_send)(
-                    f"call_user_{user_id}",
-                    {
-                        'type': 'call_state_restore',
-                        'call_id': call_id,
-                        'status': call.status,
-                        'participants': participants,
-                        'duration': call.duration or 0
-                    }
-                )
-            except Call.DoesNotExist:
-                logger.error(f"Call {call_id} not found for reconnect")
-            except Exception as e:
-                logger.error(f"Error handling reconnect: {e}")
+        timer = self._timers.pop((call_id, user_id), None)
+        if timer is not None:
+            timer.cancel()
+
+        if not await self.store.amark_reconnected(call_id, user_id):
+            return
+
+        # Send current call state
+        call_state = await database_sync_to_async(self._get_call_state)(call_id)
+        if call_state:
+            await self.channel_layer.group_send(
+                f"call_user_{user_id}",
+                {
+                    'type': 'call_state_restore',
+                    'call_id': call_id,
+                    **call_state
+                }
+            )
+
+    def _get_call_state(self, call_id):
+        try:
+            call = Call.objects.get(call_id=call_id)
+            participants = [call.caller_id]
+            if call.receiver_id:
+                participants.append(call.receiver_id)
+            return {
+                'status': call.status,
+                'participants': participants,
+                'duration': call.duration or 0
+            }
+        except Call.DoesNotExist:
+            logger.error(f"Call {call_id} not found for reconnect")
+        except Exception as e:
+            logger.error(f"Error handling reconnect: {e}")
+        return None
 
 # Global instance
-call_state_manager = CallStateManager()
\ No newline at end of file
+call_state_manager = CallStateManager()
@@ -8,6 +8,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.utils import timezone
+from asgiref.sync import async_to_sync
 from .message_models import Call
 from .call_state_manager import call_state_manager
 import logging
@@ -74,7 +75,7 @@ def sync_call_status_api(request, call_id):
 def reconnect_call_api(request, call_id):
     """Handle call reconnection"""
     try:
-        call_state_manager.handle_reconnect(call_id, request.user.id)
+        async_to_sync(call_state_manager.handle_reconnect)(call_id, request.user.id)
         
         return Response({
             'success': True,
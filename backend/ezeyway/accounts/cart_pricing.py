@@ -0,0 +1,219 @@
+"""
+Cart Pricing
+Prices a cart in one pass: its items, products and vendors are loaded with
+a single query and subtotal, per-vendor split, delivery fee and item
+availability are computed together into a CartQuote.
+
+Quotes are cached in the shared cache under a per-cart version that model
+signals bump (after commit) whenever the cart's items, one of its products
+or one of their vendors change. Changes made with queryset.update() send
+no signals, so quotes also expire after CART_QUOTE_TIMEOUT seconds.
+
+The delivery fee rule (delivery_fee_for) is the one orders use as well,
+see calculate_delivery_fee in order_views.py. Vendors are open or closed by
+the same rule as search (vendor_schedule.state_at); a quote is not cached
+past the next time one of its vendors opens or closes.
+"""
+
+import math
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from .vendor_schedule import is_open, state_at
+
+DEFAULT_TIMEOUT = 300
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+# Reasons an item cannot be ordered right now
+VENDOR_OFFLINE = 'vendor_offline'
+PRODUCT_INACTIVE = 'product_inactive'
+OUT_OF_STOCK = 'out_of_stock'
+
+
+def delivery_fee_for(vendor, products):
+    """Delivery fee of one vendor's share of a cart or order.
+
+    Free if any product ships free, else the highest custom product fee,
+    else the vendor's default fee.
+    """
+    custom_fee = Decimal('0')
+    for product in products:
+        if product.free_delivery:
+            return Decimal('0')
+        if product.custom_delivery_fee_enabled and product.custom_delivery_fee:
+            custom_fee = max(custom_fee, product.custom_delivery_fee)
+    if custom_fee > 0:
+        return custom_fee
+    return Decimal(vendor.delivery_fee or 0)
+
+
+def unavailable_reason(item, now=None):
+    product = item.product
+    if not is_open(product.vendor, now):
+        return VENDOR_OFFLINE
+    if product.status != 'active':
+        return PRODUCT_INACTIVE
+    if product.quantity < item.quantity:
+        return OUT_OF_STOCK
+    return None
+
+
+class CartQuote:
+    """Totals of one cart; plain data so it can be cached"""
+
+    def __init__(self, cart_id, total_items=0, subtotal=Decimal('0'), delivery_fee=Decimal('0'),
+                 vendors=None, unavailable=None, changes_at=None):
+        self.cart_id = cart_id
+        self.total_items = total_items
+        self.subtotal = subtotal
+        self.delivery_fee = delivery_fee
+        self.vendors = vendors or []
+        self.unavailable = unavailable or {}  # item id -> reason
+        self.changes_at = changes_at  # Timestamp of the next vendor opening or closing, None if none
+
+    @property
+    def total(self):
+        return self.subtotal + self.delivery_fee
+
+    @property
+    def is_orderable(self):
+        return bool(self.vendors) and not self.unavailable
+
+    def item_ids(self, reason):
+        return [item_id for item_id, item_reason in self.unavailable.items() if item_reason == reason]
+
+    def to_dict(self):
+        return {
+            'cart_id': self.cart_id,
+            'total_items': self.total_items,
+            'subtotal': self.subtotal,
+            'delivery_fee': self.delivery_fee,
+            'vendors': self.vendors,
+            'unavailable': self.unavailable,
+            'changes_at': self.changes_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def as_response(self):
+        """Serializable summary for API responses"""
+        return {
+            'total_items': self.total_items,
+            'subtotal': str(self.subtotal),
+            'delivery_fee': str(self.delivery_fee),
+            'total': str(self.total),
+            'vendors': [{
+                **vendor,
+                'subtotal': str(vendor['subtotal']),
+                'delivery_fee': str(vendor['delivery_fee']),
+                'total': str(vendor['subtotal'] + vendor['delivery_fee']),
+            } for vendor in self.vendors],
+            'unavailable_items': {str(item_id): reason for item_id, reason in self.unavailable.items()},
+        }
+
+
+def price_items(cart_id, items, now=None):
+    """Quote for loaded cart items (product and vendor already joined)"""
+    now = now or timezone.now()
+    quote = CartQuote(cart_id)
+    by_vendor = {}
+    for item in items:
+        product = item.product
+        vendor = product.vendor
+        line_total = product.price * item.quantity
+        quote.total_items += item.quantity
+        quote.subtotal += line_total
+
+        reason = unavailable_reason(item, now)
+        if reason:
+            quote.unavailable[item.id] = reason
+
+        share = by_vendor.get(vendor.id)
+        if share is None:
+            share = by_vendor[vendor.id] = {'vendor': vendor, 'products': [], 'item_ids': [], 'subtotal': Decimal('0'),
+                                            'state': state_at(vendor, now)}
+        share['products'].append(product)
+        share['item_ids'].append(item.id)
+        share['subtotal'] += line_total
+
+    for vendor_id, share in by_vendor.items():
+        vendor = share['vendor']
+        fee = delivery_fee_for(vendor, share['products'])
+        quote.delivery_fee += fee
+        is_vendor_open, next_at = share['state']
+        if next_at is not None and (quote.changes_at is None or next_at.timestamp() < quote.changes_at):
+            quote.changes_at = next_at.timestamp()
+        quote.vendors.append({
+            'vendor_id': vendor_id,
+            'business_name': vendor.business_name,
+            'item_ids': share['item_ids'],
+            'subtotal': share['subtotal'],
+            'delivery_fee': fee,
+            'min_order_amount': vendor.min_order_amount,
+            'is_active': is_vendor_open,
+        })
+    return quote
+
+
+class CartPricingEngine:
+    def __init__(self, timeout=None):
+        self._timeout = timeout
+
+    @property
+    def timeout(self):
+        return self._timeout or getattr(settings, 'CART_QUOTE_TIMEOUT', DEFAULT_TIMEOUT)
+
+    def version_key(self, cart_id):
+        return f"cart_quote_version:{cart_id}"
+
+    def version(self, cart_id):
+        version = cache.get(self.version_key(cart_id))
+        if version is None:
+            # Start from the clock so a flushed cache never serves an older quote
+            cache.add(self.version_key(cart_id), int(time.time() * 1000), VERSION_TIMEOUT)
+            version = cache.get(self.version_key(cart_id))
+        return version
+
+    def key(self, cart_id):
+        return f"cart_quote:{cart_id}:{self.version(cart_id)}"
+
+    def invalidate(self, cart_ids):
+        for cart_id in set(cart_ids):
+            try:
+                cache.incr(self.version_key(cart_id))
+            except ValueError:
+                self.version(cart_id)
+
+    def load_items(self, cart):
+        """Cart items with products and vendors (one query), kept on the cart for its serializer"""
+        from .models import CartItem
+        if 'items' not in getattr(cart, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([cart], Prefetch(
+                'items', queryset=CartItem.objects.select_related('product__vendor').order_by('id')
+            ))
+        return list(cart.items.all())
+
+    def quote(self, cart):
+        key = self.key(cart.pk)
+        cached = cache.get(key)
+        if cached is not None:
+            return CartQuote.from_dict(cached)
+        quote = price_items(cart.pk, self.load_items(cart))
+        timeout = self.timeout
+        if quote.changes_at is not None:
+            timeout = max(1, min(timeout, math.ceil(quote.changes_at - time.time())))
+        cache.set(key, quote.to_dict(), timeout)
+        return quote
+
+    def forget_items(self, cart):
+        """Drop the loaded items after the cart's items changed"""
+        getattr(cart, '_prefetched_objects_cache', {}).pop('items', None)
+
+# Global instance
+cart_pricing = CartPricingEngine()
@@ -0,0 +1,150 @@
+"""
+Catalog Cache
+Read-through cache for reference data the apps load on every launch
+(categories, subcategories, category parameters, featured packages,
+delivery radius, sliders). That data only changes when a superadmin edits
+it, so each data set has a version counter in the shared cache that model
+save/delete signals bump.
+
+Responses are kept as rendered JSON bytes in process memory, keyed by data
+set, request variant (host, URL arguments, query string) and version. The
+ETag is derived from the version and the variant alone, so a client
+revalidating with If-None-Match gets a 304 without the view, the database
+or even the cached body being touched.
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from .fast_json import FastJSONRenderer
+
+DEFAULT_MAX_ENTRIES = 512
+VERSION_TIMEOUT = None  # Versions must outlive every cached body
+
+# Data set -> models whose changes invalidate it (app_label.ModelName)
+DATASETS = {
+    'categories': ('accounts.Category',),
+    'subcategories': ('accounts.Category', 'accounts.SubCategory'),
+    'category_parameters': ('accounts.Category', 'accounts.SubCategory',
+                            'accounts.CategoryParameter', 'accounts.SubCategoryParameter'),
+    'featured_packages': ('accounts.FeaturedProductPackage',),
+    'delivery_radius': ('accounts.DeliveryRadius',),
+    'sliders': ('accounts.Slider',),
+}
+
+
+class CatalogCache:
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_entries(self):
+        return self._max_entries or getattr(settings, 'CATALOG_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+    def version_key(self, dataset):
+        return f"catalog_version:{dataset}"
+
+    def version(self, dataset):
+        version = cache.get(self.version_key(dataset))
+        if version is None:
+            # Start from the clock, not 1, so a flushed cache never reuses an old ETag
+            cache.add(self.version_key(dataset), int(time.time() * 1000), VERSION_TIMEOUT)
+            version = cache.get(self.version_key(dataset))
+        return version
+
+    def bump(self, dataset):
+        try:
+            cache.incr(self.version_key(dataset))
+        except ValueError:
+            self.version(dataset)
+
+    def bump_model(self, model):
+        label = model._meta.label
+        for dataset, labels in DATASETS.items():
+            if label in labels:
+                self.bump(dataset)
+
+    def etag(self, dataset, version, variant):
+        digest = hashlib.sha1(repr(variant).encode()).hexdigest()[:16]
+        return f'"{dataset}-{version}-{digest}"'
+
+    def get(self, dataset, variant, version):
+        with self._lock:
+            entry = self._entries.get((dataset, variant))
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end((dataset, variant))
+            return entry[1]
+
+    def set(self, dataset, variant, version, body):
+        with self._lock:
+            self._entries[(dataset, variant)] = (version, body)
+            self._entries.move_to_end((dataset, variant))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def request_variant(request, kwargs):
+    """Everything a catalog response may depend on: absolute URLs use scheme and host"""
+    return (
+        request.scheme,
+        request.get_host(),
+        tuple(sorted(kwargs.items())),
+        tuple(sorted(request.GET.lists())),
+    )
+
+
+def etag_matches(etag, if_none_match):
+    """Weak comparison, as If-None-Match requires: GZipMiddleware sends our ETag back as W/"..." """
+    tags = parse_etags(if_none_match)
+    return '*' in tags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in tags}
+
+
+def catalog_cached(dataset, variant=None):
+    """Serve a catalog view from the catalog cache.
+
+    Goes between @permission_classes and the view. `variant(request)` adds
+    request-dependent parts to the cache key (e.g. the user type for sliders).
+    Only 200 responses are cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request_variant(request, kwargs)
+            if variant is not None:
+                key += (variant(request),)
+            version = catalog_cache.version(dataset)
+            etag = catalog_cache.etag(dataset, version, key)
+
+            if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+            else:
+                body = catalog_cache.get(dataset, key, version)
+                if body is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    body = FastJSONRenderer().render(response.data)
+                    catalog_cache.set(dataset, key, version, body)
+                response = HttpResponse(body, content_type='application/json')
+            response['ETag'] = etag
+            # Clients keep the body but must revalidate, which costs them a 304
+            response['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+# Global instance
+catalog_cache = CatalogCache()
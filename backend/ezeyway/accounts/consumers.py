@@ -1,18 +1,49 @@
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
+import time
+import asyncio
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .message_models import Conversation, Message, Call
+from .order_models import OrderDelivery
 from .models import VendorProfile
 from channels.layers import get_channel_layer
 import logging
 from django.db import OperationalError
 from .call_state_manager import call_state_manager
+from .call_registry import call_registry
+from .presence import presence_service, get_contact_ids
+from .conversation_cache import aget_participant_ids
+from .event_log import EventReplayMixin, asend_user_event, event_log
+from .fast_json import JSONWebsocketConsumer
+from .rider_tracking import LocationFix, can_report_location, can_watch_delivery, rider_tracker, tracking_group_name
+from django.conf import settings
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
-class MessageConsumer(AsyncWebsocketConsumer):
+class TypingThrottle:
+    """Coalesces typing events per conversation for one socket.
+
+    A "started typing" event is forwarded at most once per interval; a
+    change of state (typing -> stopped) is always forwarded immediately.
+    """
+
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = getattr(settings, 'TYPING_THROTTLE_SECONDS', 3)
+        self.interval = interval
+        self._last_sent = {}  # conversation_id -> (is_typing, monotonic time)
+
+    def should_send(self, conversation_id, is_typing):
+        now = time.monotonic()
+        last = self._last_sent.get(conversation_id)
+        if last is not None and last[0] == is_typing and now - last[1] < self.interval:
+            return False
+        self._last_sent[conversation_id] = (is_typing, now)
+        return True
+
+
+class MessageConsumer(EventReplayMixin, JSONWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if self.user.is_anonymous:
@@ -32,15 +63,10 @@ class MessageConsumer(AsyncWebsocketConsumer):
         await self.accept()
         print(f"DEBUG: WebSocket accepted for user {self.user.id}")
         
-        # Send online status
-        await self.channel_layer.group_send(
-            f"user_status",
-            {
-                'type': 'user_status',
-                'user_id': self.user.id,
-                'status': 'online'
-            }
-        )
+        # Mark online; only contacts subscribed to our presence group hear about it
+        self.presence_contacts = []
+        self.typing_throttle = TypingThrottle()
+        await presence_service.connect(self.channel_layer, self.user.id)
 
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
@@ -49,19 +75,12 @@ class MessageConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             
-            # Send offline status
-            await self.channel_layer.group_send(
-                f"user_status",
-                {
-                    'type': 'user_status',
-                    'user_id': self.user.id,
-                    'status': 'offline'
-                }
-            )
+            await presence_service.unsubscribe(self.channel_layer, self.channel_name, self.presence_contacts)
+            await presence_service.disconnect(self.channel_layer, self.user.id)
 
     async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
+            data = await self.decode_json(text_data)
             message_type = data.get('type')
             
             if message_type == 'message':
@@ -70,11 +89,35 @@ class MessageConsumer(AsyncWebsocketConsumer):
                 await self.handle_typing(data)
             elif message_type == 'message_read':
                 await self.handle_message_read(data)
+            elif message_type == 'presence_subscribe':
+                await self.handle_presence_subscribe(data)
+            elif message_type == 'heartbeat':
+                await self.handle_heartbeat(data)
+            elif message_type == 'resume':
+                await self.handle_resume(data)
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'error': 'Invalid JSON'
-            }))
+            })
+
+    async def handle_presence_subscribe(self, data):
+        """Subscribe to presence of the user's contacts and send who is online now"""
+        await presence_service.unsubscribe(self.channel_layer, self.channel_name, self.presence_contacts)
+        self.presence_contacts = await self.get_contact_ids()
+        online = await presence_service.subscribe(self.channel_layer, self.channel_name, self.presence_contacts)
+        await self.send_json({
+            'type': 'presence_snapshot',
+            'online_user_ids': sorted(online)
+        })
+
+    async def handle_heartbeat(self, data):
+        """Refresh presence TTL"""
+        await presence_service.heartbeat(self.channel_layer, self.user.id)
+        await self.send_json({
+            'type': 'heartbeat_ack',
+            'timestamp': data.get('timestamp')
+        })
 
     async def handle_message(self, data):
         conversation_id = data.get('conversation_id')
@@ -83,31 +126,35 @@ class MessageConsumer(AsyncWebsocketConsumer):
         if not conversation_id or not content:
             return
         
+        # Membership check and fan-out list both come from the participants cache
+        participants = await self.get_conversation_participants(conversation_id)
+        if self.user.id not in participants:
+            return
+        
         # Save message to database
         message = await self.save_message(conversation_id, content)
         if not message:
             return
         
-        # Get conversation participants
-        participants = await self.get_conversation_participants(conversation_id)
+        event = {
+            'type': 'new_message',
+            'message': {
+                'id': message.id,
+                'conversation_id': conversation_id,
+                'sender_id': self.user.id,
+                'sender_name': self.user.username,
+                'content': content,
+                'created_at': message.created_at.isoformat(),
+                'message_type': 'text'
+            }
+        }
         
-        # Send message to all participants
-        for participant_id in participants:
-            await self.channel_layer.group_send(
-                f"user_{participant_id}",
-                {
-                    'type': 'new_message',
-                    'message': {
-                        'id': message.id,
-                        'conversation_id': conversation_id,
-                        'sender_id': self.user.id,
-                        'sender_name': self.user.username,
-                        'content': content,
-                        'created_at': message.created_at.isoformat(),
-                        'message_type': 'text'
-                    }
-                }
-            )
+        # Send message to all participants concurrently; each copy gets the
+        # recipient's own sequence number so it can be replayed on reconnect
+        await asyncio.gather(*(
+            asend_user_event(self.channel_layer, f"user_{participant_id}", participant_id, event)
+            for participant_id in participants
+        ))
 
     async def handle_typing(self, data):
         conversation_id = data.get('conversation_id')
@@ -116,21 +163,28 @@ class MessageConsumer(AsyncWebsocketConsumer):
         if not conversation_id:
             return
         
+        # Drop repeated keystroke events inside the throttle window
+        if not self.typing_throttle.should_send(conversation_id, is_typing):
+            return
+        
         participants = await self.get_conversation_participants(conversation_id)
+        if self.user.id not in participants:
+            return
+        
+        event = {
+            'type': 'typing_indicator',
+            'conversation_id': conversation_id,
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_typing': is_typing
+        }
         
         # Send typing indicator to other participants
-        for participant_id in participants:
-            if participant_id != self.user.id:
-                await self.channel_layer.group_send(
-                    f"user_{participant_id}",
-                    {
-                        'type': 'typing_indicator',
-                        'conversation_id': conversation_id,
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                        'is_typing': is_typing
-                    }
-                )
+        await asyncio.gather(*(
+            self.channel_layer.group_send(f"user_{participant_id}", event)
+            for participant_id in participants
+            if participant_id != self.user.id
+        ))
 
     async def handle_message_read(self, data):
         message_id = data.get('message_id')
@@ -155,73 +209,95 @@ class MessageConsumer(AsyncWebsocketConsumer):
 
     # WebSocket message handlers
     async def new_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'new_message',
-            'message': event['message']
-        }))
+            'message': event['message'],
+            'seq': event.get('seq')
+        })
+
+    async def message_updated(self, event):
+        await self.send_json({
+            'type': 'message_updated',
+            'message': event['message'],
+            'seq': event.get('seq')
+        })
 
     async def typing_indicator(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'typing_indicator',
             'conversation_id': event['conversation_id'],
             'user_id': event['user_id'],
             'username': event['username'],
             'is_typing': event['is_typing']
-        }))
+        })
 
     async def message_read_receipt(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'message_read_receipt',
             'message_id': event['message_id'],
             'read_by': event['read_by'],
             'read_by_name': event['read_by_name']
-        }))
+        })
 
     async def user_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_status',
             'user_id': event['user_id'],
             'status': event['status']
-        }))
+        })
 
     async def incoming_call(self, event):
         """Handle incoming call notifications"""
         print(f"DEBUG: Received incoming_call event for user {self.user.id}: {event}")
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'incoming_call',
-            'call': event['call']
-        }))
+            'call': event['call'],
+            'seq': event.get('seq')
+        })
         print(f"DEBUG: Sent incoming_call message to WebSocket for user {self.user.id}")
 
+    async def call_accepted(self, event):
+        """Handle call accepted notifications sent to the user group"""
+        await self.send_json({
+            'type': 'call_accepted',
+            'call_id': event['call_id'],
+            'accepter_name': event['accepter_name'],
+            'accepter_id': event['accepter_id'],
+            'seq': event.get('seq')
+        })
+
+    async def call_ended(self, event):
+        """Handle call ended notifications sent to the user group"""
+        await self.send_json({
+            'type': 'call_ended',
+            'call_id': event['call_id'],
+            'duration': event['duration'],
+            'ended_by': event['ended_by'],
+            'seq': event.get('seq')
+        })
+
     # Database operations
     @database_sync_to_async
     def save_message(self, conversation_id, content):
+        # Membership was already checked against the participants cache
         try:
-            conversation = Conversation.objects.get(
-                id=conversation_id,
-                participants=self.user
+            message = Message.objects.create(
+                conversation_id=conversation_id,
+                sender=self.user,
+                content=content,
+                message_type='text'
             )
-            try:
-                message = Message.objects.create(
-                    conversation=conversation,
-                    sender=self.user,
-                    content=content,
-                    message_type='text'
-                )
-                return message
-            except OperationalError as e:
-                logger.exception(f"Database error creating websocket message for user {self.user.id}: {e}")
-                return None
-        except Conversation.DoesNotExist:
+            return message
+        except OperationalError as e:
+            logger.exception(f"Database error creating websocket message for user {self.user.id}: {e}")
             return None
 
+    async def get_conversation_participants(self, conversation_id):
+        return await aget_participant_ids(conversation_id)
+
     @database_sync_to_async
-    def get_conversation_participants(self, conversation_id):
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            return list(conversation.participants.values_list('id', flat=True))
-        except Conversation.DoesNotExist:
-            return []
+    def get_contact_ids(self):
+        return get_contact_ids(self.user)
 
     @database_sync_to_async
     def mark_message_read(self, message_id):
@@ -242,7 +318,7 @@ class MessageConsumer(AsyncWebsocketConsumer):
             return None
 
 
-class CallConsumer(AsyncWebsocketConsumer):
+class CallConsumer(JSONWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if self.user.is_anonymous:
@@ -285,23 +361,23 @@ class CallConsumer(AsyncWebsocketConsumer):
             
         # Handle disconnect with reconnection logic
         if hasattr(self, 'call_id') and self.call_id:
-            call_state_manager.handle_disconnect(self.call_id, self.user.id)
+            await call_state_manager.handle_disconnect(self.call_id, self.user.id)
             
         logger.info(f"CallConsumer disconnected for user {self.user.id}")
 
     async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
+            data = await self.decode_json(text_data)
             signal_type = data.get('type')
             
             if signal_type == 'join_call':
                 await self.handle_join_call(data)
             elif signal_type in ['offer', 'answer', 'ice_candidate', 'toggle_media', 'call_status', 'call_accepted', 'call_ended']:
                 if not hasattr(self, 'call_group_name'):
-                    await self.send(text_data=json.dumps({
+                    await self.send_json({
                         'error': 'Must join_call first',
                         'type': 'error'
-                    }))
+                    })
                     return
                     
                 if signal_type == 'offer':
@@ -330,10 +406,10 @@ class CallConsumer(AsyncWebsocketConsumer):
                 await self.handle_heartbeat(data)
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'error': 'Invalid JSON',
                 'type': 'error'
-            }))
+            })
 
     async def handle_offer(self, data):
         # Forward offer to other participants
@@ -420,13 +496,22 @@ class CallConsumer(AsyncWebsocketConsumer):
         """Handle user joining an active call"""
         call_id = data.get('call_id')
         if not call_id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'error': 'Missing call_id in join_call',
                 'type': 'error'
-            }))
+            })
             return
             
+        # Authorize against the in-memory call registry (one DB load per call per worker)
         self.call_id = call_id
+        if not await self.verify_call_access():
+            self.call_id = None
+            await self.send_json({
+                'error': 'Call not found or access denied',
+                'type': 'error'
+            })
+            return
+            
         self.call_group_name = f"call_{call_id}"
         
         # Join call group
@@ -438,7 +523,7 @@ class CallConsumer(AsyncWebsocketConsumer):
         logger.info(f"User {self.user.id} joined call group: {self.call_group_name}")
         
         # Handle reconnection logic
-        call_state_manager.handle_reconnect(self.call_id, self.user.id)
+        await call_state_manager.handle_reconnect(self.call_id, self.user.id)
         
         # Notify others that user joined
         await self.channel_layer.group_send(
@@ -452,11 +537,11 @@ class CallConsumer(AsyncWebsocketConsumer):
         )
         
         # Send join confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'join_call_success',
             'call_id': call_id,
             'user_id': self.user.id
-        }))
+        })
 
     async def handle_leave_call(self, data):
         """Handle user leaving the call"""
@@ -505,25 +590,25 @@ class CallConsumer(AsyncWebsocketConsumer):
         token_data = await self.generate_agora_token(channel_name, uid)
         
         if token_data:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'agora_token',
                 'token': token_data['token'],
                 'channel_name': channel_name,
                 'uid': uid,
                 'app_id': token_data['app_id']
-            }))
+            })
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'error',
                 'message': 'Failed to generate Agora token'
-            }))
+            })
 
     async def handle_call_state_sync(self, data):
         """Handle call state synchronization request"""
         if hasattr(self, 'call_id') and self.call_id:
             status = data.get('status')
             if status:
-                call_state_manager.sync_call_state(self.call_id, self.user.id, status)
+                await call_state_manager.async_call_state(self.call_id, self.user.id, status)
 
     async def handle_call_accepted(self, data):
         """Handle call_accepted message from frontend"""
@@ -567,213 +652,166 @@ class CallConsumer(AsyncWebsocketConsumer):
 
     async def handle_heartbeat(self, data):
         """Handle heartbeat to maintain connection"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'heartbeat_ack',
             'timestamp': data.get('timestamp')
-        }))
+        })
 
     # WebSocket message handlers
     async def webrtc_offer(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'offer',
                 'offer': event['offer'],
                 'sender_id': event['sender_id'],
                 'sender_name': event['sender_name'],
                 'call_type': event.get('call_type', 'audio')
-            }))
+            })
 
     async def webrtc_answer(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'answer',
                 'answer': event['answer'],
                 'sender_id': event['sender_id'],
                 'sender_name': event['sender_name']
-            }))
+            })
 
     async def webrtc_ice_candidate(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'ice_candidate',
                 'candidate': event['candidate'],
                 'sender_id': event['sender_id']
-            }))
+            })
 
     async def call_status_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_status',
             'status': event['status'],
             'user_id': event['user_id'],
             'username': event.get('username', ''),
             'timestamp': event.get('timestamp')
-        }))
+        })
         
     async def call_quality_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_quality',
             'connection_quality': event['connection_quality'],
             'network_info': event['network_info'],
             'sender_id': event['sender_id']
-        }))
+        })
         
     async def user_joined_call(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_joined',
             'user_id': event['user_id'],
             'username': event['username'],
             'call_type': event.get('call_type', 'audio')
-        }))
+        })
         
     async def user_left_call(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'user_left',
             'user_id': event['user_id'],
             'username': event['username'],
             'reason': event.get('reason', 'normal')
-        }))
+        })
         
     async def media_toggle(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'media_toggle',
             'user_id': event['user_id'],
             'media_type': event['media_type'],
             'enabled': event['enabled'],
             'username': event['username']
-        }))
+        })
 
     async def call_state_sync(self, event):
         """Handle call state synchronization"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_state_sync',
             'call_id': event['call_id'],
             'status': event['status'],
             'updated_by': event['updated_by'],
             'timestamp': event['timestamp']
-        }))
+        })
 
     async def call_state_restore(self, event):
         """Handle call state restoration after reconnect"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_state_restore',
             'call_id': event['call_id'],
             'status': event['status'],
             'participants': event['participants'],
             'duration': event['duration']
-        }))
+        })
 
     # Call notification handlers for API-triggered events
     async def incoming_call(self, event):
         """Handle incoming call notifications - main handler"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'incoming_call',
             'call_id': event['call_id'],
             'caller_name': event['caller_name'],
             'caller_id': event['caller_id'],
             'call_type': event['call_type']
-        }))
+        })
         
     async def call_accepted(self, event):
         """Handle call accepted notifications"""
         logger.info(f"DEBUG: Sending call_accepted to user {self.user.id}: {event}")
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_accepted',
             'call_id': event['call_id'],
             'accepter_name': event['accepter_name'],
             'accepter_id': event['accepter_id']
-        }))
+        })
         logger.info(f"DEBUG: Sent call_accepted WebSocket message to user {self.user.id}")
         
     async def call_rejected(self, event):
         """Handle call rejected notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_rejected',
             'call_id': event['call_id'],
             'rejecter_id': event['rejecter_id'],
             'rejecter_name': event['rejecter_name']
-        }))
+        })
         
     async def call_notification(self, event):
         """Handle generic call notifications"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_notification',
             'call_id': event.get('call_id'),
             'message': event.get('message'),
             'notification_type': event.get('notification_type'),
             'data': event.get('data', {})
-        }))
+        })
         
     async def call_ended(self, event):
         """Handle call ended notifications"""
         logger.info(f"DEBUG: Sending call_ended to user {self.user.id}: {event}")
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'call_ended',
             'call_id': event['call_id'],
             'duration': event['duration'],
             'ended_by': event['ended_by']
-        }))
+        })
         logger.info(f"DEBUG: Sent call_ended WebSocket message to user {self.user.id}")
 
-    # Database operations
-    @database_sync_to_async
-    def get_call_object(self):
-        """Get call object from database"""
-        try:
-            # Try to find by call_id first
-            call = Call.objects.get(call_id=self.call_id)
-        except Call.DoesNotExist:
-            try:
-                # If not found, try to find by numeric id
-                call = Call.objects.get(id=int(self.call_id))
-            except (Call.DoesNotExist, ValueError):
-                return None
-        return call
+    # Call state operations (served by the active call registry, persisted write-behind)
+    async def get_call_object(self):
+        """Get the active call entry for this socket's call"""
+        return await call_registry.get(self.call_id)
 
-    @database_sync_to_async
-    def verify_call_access(self):
-        logger.info(f"DEBUG: Looking for call_id={self.call_id} for user={self.user.id}")
-        try:
-            # First try to find by call_id (string format)
-            call = Call.objects.get(call_id=self.call_id)
-            logger.info(f"DEBUG: Found call by call_id: {call.id}, caller={call.caller_id}, receiver={call.receiver_id}")
-        except Call.DoesNotExist:
-            logger.info(f"DEBUG: Call not found by call_id, trying numeric id")
-            try:
-                # If not found, try to find by numeric id
-                call = Call.objects.get(id=int(self.call_id))
-                logger.info(f"DEBUG: Found call by id: {call.id}, caller={call.caller_id}, receiver={call.receiver_id}")
-            except (Call.DoesNotExist, ValueError) as e:
-                logger.info(f"DEBUG: Call not found by id either: {e}")
-                return False
-    
-        # Check if user is caller, receiver, or participant
-        has_access = (call.caller == self.user or call.receiver == self.user or
-                     (call.participants and self.user.id in call.participants))
-        logger.info(f"DEBUG: Access check result: {has_access}")
+    async def verify_call_access(self):
+        active = await call_registry.get(self.call_id)
+        has_access = active is not None and active.has_access(self.user.id)
+        logger.debug(f"Call access check for call_id={self.call_id} user={self.user.id}: {has_access}")
         return has_access
 
-    @database_sync_to_async
-    def update_call_status(self, status):
-        try:
-            # First try to find by call_id (string format)
-            call = Call.objects.get(call_id=self.call_id)
-        except Call.DoesNotExist:
-            try:
-                # If not found, try to find by numeric id
-                call = Call.objects.get(id=int(self.call_id))
-            except (Call.DoesNotExist, ValueError):
-                return False
-        # ... rest of method
-        call.status = status
-        from django.utils import timezone
-        if status == 'answered' and not call.answered_at:
-            call.answered_at = timezone.now()
-        elif status in ['ended', 'declined', 'rejected'] and not call.ended_at:
-            call.ended_at = timezone.now()
-            if status in ['answered', 'ended'] and call.answered_at:
-                call.duration = (timezone.now() - call.answered_at).total_seconds()
-        call.save()
-        return True
+    async def update_call_status(self, status):
+        return await call_registry.set_status(self.call_id, status)
             
     @database_sync_to_async
     def update_call_quality(self, quality_data):
@@ -786,52 +824,31 @@ class CallConsumer(AsyncWebsocketConsumer):
         except Call.DoesNotExist:
             return False
             
-    @database_sync_to_async
-    def update_call_participants(self):
-        try:
-            call = Call.objects.get(call_id=self.call_id)
-            if call.participants:
-                if self.user.id not in call.participants:
-                    call.participants.append(self.user.id)
-                    call.save()
-            return True
-        except Call.DoesNotExist:
-            return False
-            
-    @database_sync_to_async
-    def check_call_termination(self):
-        try:
-            if not hasattr(self, 'call_id') or not self.call_id:
-                return False
-                
-            call = Call.objects.get(call_id=self.call_id)
-            
-            # For group calls, check if all users left
-            if call.participants and len(call.participants) > 1:
-                return True  # Don't auto-terminate group calls
+    async def update_call_participants(self):
+        return await call_registry.add_participant(self.call_id, self.user.id)
             
-            # For individual calls, terminate when user leaves
-            from django.utils import timezone
-            call.ended_at = timezone.now()
-            call.status = 'ended'
-            if call.answered_at:
-                call.duration = (timezone.now() - call.answered_at).total_seconds()
-            call.save()
-            return True
-        except Call.DoesNotExist:
+    async def check_call_termination(self):
+        if not getattr(self, 'call_id', None):
             return False
-        except Exception as e:
-            logger.error(f"Error in check_call_termination: {e}")
+        active = await call_registry.get(self.call_id)
+        if active is None:
             return False
+        
+        # Group calls (anyone beyond caller and receiver joined) are not ended by one user leaving
+        if active.participants - {active.caller_id, active.receiver_id}:
+            return True
+        
+        # For individual calls, terminate when user leaves
+        return await call_registry.set_status(self.call_id, 'ended')
     
     async def send_call_state(self):
         """Send current call state to connecting user"""
         call_data = await self.get_call_data()
         if call_data:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'call_state',
                 'call': call_data
-            }))
+            })
     
     @database_sync_to_async
     def get_call_data(self):
@@ -917,7 +934,7 @@ class CallConsumer(AsyncWebsocketConsumer):
             return None
 
 
-class UserConsumer(AsyncWebsocketConsumer):
+class UserConsumer(JSONWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if self.user.is_anonymous:
@@ -940,13 +957,13 @@ class UserConsumer(AsyncWebsocketConsumer):
             )
 
     async def incoming_call(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'incoming_call',
             'call': event['call']
-        }))
+        })
 
 
-class CallRoomConsumer(AsyncWebsocketConsumer):
+class CallRoomConsumer(JSONWebsocketConsumer):
     """Dedicated consumer for call room connections"""
     
     async def connect(self):
@@ -980,11 +997,11 @@ class CallRoomConsumer(AsyncWebsocketConsumer):
         logger.info(f"CallRoomConsumer connected for user {self.user.id} in call {self.call_id}")
         
         # Send join confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'joined_call_room',
             'call_id': self.call_id,
             'user_id': self.user.id
-        }))
+        })
 
     async def disconnect(self, close_code):
         if hasattr(self, 'call_group_name'):
@@ -996,7 +1013,7 @@ class CallRoomConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
+            data = await self.decode_json(text_data)
             signal_type = data.get('type')
             
             if signal_type in ['offer', 'answer', 'ice_candidate', 'call_status']:
@@ -1012,52 +1029,39 @@ class CallRoomConsumer(AsyncWebsocketConsumer):
                 )
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'error': 'Invalid JSON',
                 'type': 'error'
-            }))
+            })
 
     # WebRTC signaling handlers
     async def webrtc_offer(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps(event['data']))
+            await self.send_json(event['data'])
 
     async def webrtc_answer(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps(event['data']))
+            await self.send_json(event['data'])
 
     async def webrtc_ice_candidate(self, event):
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps(event['data']))
+            await self.send_json(event['data'])
 
     async def webrtc_call_status(self, event):
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send_json(event['data'])
 
-    @database_sync_to_async
-    def verify_call_access(self):
+    async def verify_call_access(self):
         """Verify user has access to this call"""
-        try:
-            from .message_models import Call
-            logger.info(f"Looking for call: {self.call_id} for user: {self.user.id}")
-            
-            # Try to find by call_id (string format)
-            call = Call.objects.get(call_id=self.call_id)
-            logger.info(f"Found call: {call.id}, caller: {call.caller_id}, receiver: {call.receiver_id}")
-            
-            # Check if user is caller or receiver
-            has_access = call.caller == self.user or call.receiver == self.user
-            logger.info(f"Access granted: {has_access} for user {self.user.id}")
-            return has_access
-            
-        except Call.DoesNotExist:
-            logger.error(f"Call not found in database: {self.call_id}")
-            return False
-        except Exception as e:
-            logger.error(f"Database error in verify_call_access: {e}")
+        active = await call_registry.get(self.call_id)
+        if active is None:
+            logger.error(f"Call not found: {self.call_id}")
             return False
+        has_access = active.has_access(self.user.id)
+        logger.info(f"Access granted: {has_access} for user {self.user.id}")
+        return has_access
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(EventReplayMixin, JSONWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         if self.user.is_anonymous:
@@ -1081,11 +1085,11 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'connection_established',
             'message': 'Connected to notification service',
             'user_type': 'vendor' if is_vendor else 'customer'
-        }))
+        })
 
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
@@ -1096,21 +1100,23 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         try:
-            data = json.loads(text_data)
+            data = await self.decode_json(text_data)
             message_type = data.get('type')
             
             if message_type == 'authenticate':
                 # Handle authentication if needed
                 pass
             elif message_type == 'ping':
-                await self.send(text_data=json.dumps({
+                await self.send_json({
                     'type': 'pong'
-                }))
+                })
+            elif message_type == 'resume':
+                await self.handle_resume(data)
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'error': 'Invalid JSON'
-            }))
+            })
 
     # Notification handlers
     async def order_notification(self, event):
@@ -1118,7 +1124,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         is_vendor = await self.is_vendor_user()
         action_url = '/vendor/orders' if is_vendor else '/orders'
         
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'order_notification',
             'notification': {
                 'id': event.get('notification_id'),
@@ -1127,15 +1133,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'message': event.get('message'),
                 'data': event.get('data', {}),
                 'action_url': event.get('action_url', action_url)
-            }
-        }))
+            },
+            'seq': event.get('seq')
+        })
 
     async def payment_notification(self, event):
         """Handle payment notifications"""
         is_vendor = await self.is_vendor_user()
         action_url = '/vendor/wallet' if is_vendor else '/orders'
         
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'notification',
             'notification': {
                 'id': event.get('notification_id'),
@@ -1144,15 +1151,16 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'message': event.get('message'),
                 'data': event.get('data', {}),
                 'action_url': event.get('action_url', action_url)
-            }
-        }))
+            },
+            'seq': event.get('seq')
+        })
 
     async def system_notification(self, event):
         """Handle system notifications"""
         is_vendor = await self.is_vendor_user()
         default_action_url = '/vendor/settings' if is_vendor else '/profile'
         
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'notification',
             'notification': {
                 'id': event.get('notification_id'),
@@ -1161,8 +1169,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'message': event.get('message'),
                 'data': event.get('data', {}),
                 'action_url': event.get('action_url', default_action_url)
-            }
-        }))
+            },
+            'seq': event.get('seq')
+        })
 
     # Database operations
     @database_sync_to_async
@@ -1175,6 +1184,80 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return False
 
 
+
+class RiderLocationConsumer(JSONWebsocketConsumer):
+    """Live position of one delivery: the rider streams fixes, the customer and vendor watch"""
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        if self.user.is_anonymous:
+            await self.close()
+            return
+
+        self.delivery_id = int(self.scope['url_route']['kwargs']['delivery_id'])
+        access = await self.get_access()
+        if access is None:
+            await self.close()
+            return
+        self.can_report, self.can_watch, self.rider_id = access
+
+        self.group_name = tracking_group_name(self.delivery_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        latest = await rider_tracker.alatest(self.delivery_id)
+        await self.send_json({
+            'type': 'location_snapshot',
+            'location': latest.to_dict() if latest else None
+        })
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            if self.can_report:
+                # Don't keep the rider's last stretch waiting for the next batch
+                await rider_tracker.flush()
+
+    async def receive(self, text_data):
+        try:
+            data = await self.decode_json(text_data)
+        except json.JSONDecodeError:
+            await self.send_json({'error': 'Invalid JSON'})
+            return
+
+        if data.get('type') != 'location':
+            return
+        if not self.can_report:
+            await self.send_json({'error': 'Only the rider can report this delivery\'s location'})
+            return
+        try:
+            fix = LocationFix(self.rider_id, self.delivery_id, data['latitude'], data['longitude'],
+                              heading=data.get('heading'), speed=data.get('speed'))
+        except (KeyError, TypeError, ValueError):
+            await self.send_json({'error': 'Latitude and longitude required'})
+            return
+        await rider_tracker.ingest(self.channel_layer, fix)
+
+    async def rider_location(self, event):
+        if self.can_watch:
+            await self.send_json({
+                'type': 'rider_location',
+                'location': event['location']
+            })
+
+    @database_sync_to_async
+    def get_access(self):
+        """(can report, can watch, rider id), or None without access"""
+        try:
+            delivery = OrderDelivery.objects.select_related('rider', 'order__vendor').get(id=self.delivery_id)
+        except OrderDelivery.DoesNotExist:
+            return None
+        can_report = can_report_location(self.user, delivery)
+        can_watch = can_watch_delivery(self.user, delivery)
+        if not (can_report or can_watch):
+            return None
+        return can_report, can_watch, delivery.rider_id
+
 # Utility function to send notifications to vendors
 def send_vendor_notification(vendor_user_id, notification_type, title, message, data=None, action_url=None):
     """Send notification to a specific vendor"""
@@ -1186,17 +1269,16 @@ def send_vendor_notification(vendor_user_id, notification_type, title, message,
     # Use time.time() instead of asyncio event loop time
     timestamp = int(time.time())
     
-    async_to_sync(channel_layer.group_send)(
-        f"vendor_notifications_{vendor_user_id}",
-        {
-            'type': f'{notification_type}_notification',
-            'notification_id': f"{notification_type}_{vendor_user_id}_{timestamp}",
-            'title': title,
-            'message': message,
-            'data': data or {},
-            'action_url': action_url
-        }
-    )
+    # Logged with a sequence number so a reconnecting client can replay it
+    event = event_log.record(vendor_user_id, {
+        'type': f'{notification_type}_notification',
+        'notification_id': f"{notification_type}_{vendor_user_id}_{timestamp}",
+        'title': title,
+        'message': message,
+        'data': data or {},
+        'action_url': action_url
+    })
+    async_to_sync(channel_layer.group_send)(f"vendor_notifications_{vendor_user_id}", event)
 
 # Utility function to send notifications to customers
 def send_customer_notification(customer_user_id, notification_type, title, message, data=None, action_url=None):
@@ -1209,14 +1291,13 @@ def send_customer_notification(customer_user_id, notification_type, title, messa
     # Use time.time() instead of asyncio event loop time
     timestamp = int(time.time())
     
-    async_to_sync(channel_layer.group_send)(
-        f"customer_notifications_{customer_user_id}",
-        {
-            'type': f'{notification_type}_notification',
-            'notification_id': f"{notification_type}_{customer_user_id}_{timestamp}",
-            'title': title,
-            'message': message,
-            'data': data or {},
-            'action_url': action_url
-        }
-    )
\ No newline at end of file
+    # Logged with a sequence number so a reconnecting client can replay it
+    event = event_log.record(customer_user_id, {
+        'type': f'{notification_type}_notification',
+        'notification_id': f"{notification_type}_{customer_user_id}_{timestamp}",
+        'title': title,
+        'message': message,
+        'data': data or {},
+        'action_url': action_url
+    })
+    async_to_sync(channel_layer.group_send)(f"customer_notifications_{customer_user_id}", event)
\ No newline at end of file
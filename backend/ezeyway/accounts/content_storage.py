@@ -0,0 +1,277 @@
+"""
+Content-Addressed Media Storage
+Default storage for user uploads. Every upload is hashed while it streams to
+disk and stored once under its SHA-256:
+
+    blobs/<d[:2]>/<d[2:4]>/<digest><ext>
+
+The name passed to save() is only used for its extension, so the same product
+photo uploaded for ten variants (or the same document sent twice) is one file
+and one stable URL that never changes content and can be cached forever.
+MediaBlob rows count the references handed out; delete() drops one reference
+and the file goes away with the last one.
+
+Uploads whose requested name starts with one of PROTECTED_UPLOAD_PREFIXES
+(verification documents, refund documents, message files) are stored the
+same way under protected/ in PROTECTED_MEDIA_ROOT, which lies outside
+MEDIA_ROOT and has no public URL; they are only downloaded through the
+access-checked views in protected_media, and url() returns the view URL of
+the record that references the file.
+
+Paths listed in CONTENT_STORAGE_PASSTHROUGH are already content-hashed by
+their writer (responsive variants) and are stored under the given name.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs/'
+PROTECTED_PREFIX = 'protected/'
+DEFAULT_BACKEND = 'django.core.files.storage.FileSystemStorage'
+DEFAULT_PASSTHROUGH = ('variants/',)
+DEFAULT_PROTECTED_UPLOADS = ('documents/', 'business_license/', 'refund_documents/', 'messages/')
+MAX_EXTENSION_LENGTH = 10
+
+
+def blob_name(digest, extension='', prefix=BLOB_PREFIX):
+    return f"{prefix}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_blob(name):
+    return str(name or '').startswith((BLOB_PREFIX, PROTECTED_PREFIX))
+
+
+def is_protected(name):
+    return str(name or '').startswith(PROTECTED_PREFIX)
+
+
+def content_extension(name):
+    extension = os.path.splitext(str(name or ''))[1].lower()
+    return extension if len(extension) <= MAX_EXTENSION_LENGTH else ''
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    """Wraps the real storage (CONTENT_STORAGE_BACKEND) with hashing, dedupe and refcounts"""
+
+    def __init__(self, backend=None, passthrough=None, protected_backend=None):
+        self._backend = backend
+        self._passthrough = passthrough
+        self._protected_backend = protected_backend
+        if protected_backend is None:
+            setting_changed.connect(self._protected_setting_changed)
+
+    def _protected_setting_changed(self, setting, **kwargs):
+        if setting in ('PROTECTED_MEDIA_ROOT', 'PROTECTED_STORAGE_BACKEND'):
+            self._protected_backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = import_string(getattr(settings, 'CONTENT_STORAGE_BACKEND', DEFAULT_BACKEND))()
+        return self._backend
+
+    @property
+    def protected_backend(self):
+        """Storage outside the public media tree for protected/ blobs"""
+        if self._protected_backend is None:
+            backend = import_string(getattr(settings, 'PROTECTED_STORAGE_BACKEND', DEFAULT_BACKEND))
+            self._protected_backend = backend(location=settings.PROTECTED_MEDIA_ROOT)
+        return self._protected_backend
+
+    def backend_for(self, name):
+        return self.protected_backend if is_protected(name) else self.backend
+
+    def is_protected_upload(self, name):
+        prefixes = getattr(settings, 'PROTECTED_UPLOAD_PREFIXES', DEFAULT_PROTECTED_UPLOADS)
+        return str(name).startswith(tuple(prefixes))
+
+    @property
+    def passthrough(self):
+        if self._passthrough is None:
+            return tuple(getattr(settings, 'CONTENT_STORAGE_PASSTHROUGH', DEFAULT_PASSTHROUGH))
+        return self._passthrough
+
+    def is_passthrough(self, name):
+        return str(name).startswith(self.passthrough)
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content, not from the requested name
+        return name
+
+    def _save(self, name, content):
+        if self.is_passthrough(name):
+            return self.backend.save(name, content)
+
+        prefix = PROTECTED_PREFIX if self.is_protected_upload(name) else BLOB_PREFIX
+        return self._save_blob(content, content_extension(name), prefix)
+
+    def protect(self, name, release=True):
+        """Move one reference of a public blob into protected storage; returns the protected name.
+
+        With release=False the public reference is kept, for callers that
+        recount references afterwards (dedupe_media).
+        """
+        if not str(name).startswith(BLOB_PREFIX):
+            return name
+        with self.backend.open(name, 'rb') as source:
+            protected = self._save_blob(source, content_extension(name), PROTECTED_PREFIX)
+        if release:
+            self.delete(name)
+        return protected
+
+    def _save_blob(self, content, extension, prefix):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        backend = self.backend_for(prefix)
+        staged, digest, size = self._stage(content, backend, prefix)
+        try:
+            return self._store(staged, digest, size, extension, prefix)
+        finally:
+            if isinstance(staged, str):
+                if os.path.exists(staged):
+                    os.unlink(staged)
+            else:
+                staged.close()
+
+    def _local_root(self, backend):
+        try:
+            return backend.path('')
+        except NotImplementedError:
+            return None
+
+    def _stage(self, content, backend, prefix):
+        """Copy the upload chunk by chunk while hashing it.
+
+        On local disk it goes to a temporary file next to the blobs so placing
+        it is a rename; remote backends get a spooled copy to upload from.
+        Returns (temp path or file object, digest, size).
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        root = self._local_root(backend)
+        if root is not None:
+            incoming = os.path.join(root, prefix, '.incoming')
+            os.makedirs(incoming, exist_ok=True)
+            staged = tempfile.NamedTemporaryFile(dir=incoming, delete=False)
+        else:
+            staged = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                sha256.update(chunk)
+                size += len(chunk)
+                staged.write(chunk)
+        except Exception:
+            staged.close()
+            if root is not None:
+                os.unlink(staged.name)
+            raise
+        if root is not None:
+            staged.close()
+            return staged.name, sha256.hexdigest(), size
+        staged.seek(0)
+        return staged, sha256.hexdigest(), size
+
+    def _store(self, staged, digest, size, extension, prefix):
+        """Add a reference to the blob for `digest` under `prefix`, placing the staged file if it is new"""
+        from .models import MediaBlob
+
+        backend = self.backend_for(prefix)
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    blob = (MediaBlob.objects.select_for_update()
+                            .filter(digest=digest, name__startswith=prefix).first())
+                    if blob is None:
+                        blob = MediaBlob.objects.create(digest=digest, name=blob_name(digest, extension, prefix),
+                                                        size=size, refcount=1)
+                    else:
+                        MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+                    # Placed under the row lock so a concurrent last delete() cannot remove it again
+                    if not backend.exists(blob.name):
+                        self._place(staged, blob.name, backend)
+                    return blob.name
+            except IntegrityError:
+                # Another upload of the same content created the row first: add to it
+                continue
+        raise IntegrityError(f"Could not register media blob {digest}")
+
+    def _place(self, staged, name, backend):
+        if isinstance(staged, str):
+            path = backend.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if backend.directory_permissions_mode is not None:
+                os.chmod(os.path.dirname(path), backend.directory_permissions_mode)
+            os.replace(staged, path)
+            os.chmod(path, backend.file_permissions_mode or 0o644)
+        else:
+            staged.seek(0)
+            backend.save(name, File(staged, name))
+
+    def delete(self, name):
+        """Drop one reference; the file is removed with the last one"""
+        if not is_blob(name):
+            return self.backend.delete(name)
+
+        from .models import MediaBlob
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                logger.warning(f"Deleting untracked media blob {name}")
+            elif blob.refcount > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return
+            else:
+                blob.delete()
+            self.backend_for(name).delete(name)
+
+    # Reads go straight to the wrapped storage
+
+    def _open(self, name, mode='rb'):
+        return self.backend_for(name).open(name, mode)
+
+    def exists(self, name):
+        return self.backend_for(name).exists(name)
+
+    def url(self, name):
+        if is_protected(name):
+            # Link to the access-checked download view of the record holding the file
+            from .protected_media import protected_file_url
+
+            url = protected_file_url(name)
+            if url is None:
+                raise ValueError(f"{name} is protected media and no record references it")
+            return url
+        return self.backend.url(name)
+
+    def size(self, name):
+        return self.backend_for(name).size(name)
+
+    def path(self, name):
+        return self.backend_for(name).path(name)
+
+    def listdir(self, path):
+        return self.backend_for(path).listdir(path)
+
+    def get_accessed_time(self, name):
+        return self.backend_for(name).get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend_for(name).get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend_for(name).get_modified_time(name)
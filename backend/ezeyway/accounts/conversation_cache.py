@@ -0,0 +1,55 @@
+"""
+Conversation Membership Cache
+Keeps participant id lists per conversation in the shared cache so the
+chat socket path does not query the database for every message
+"""
+
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTICIPANTS_CACHE_TIMEOUT = 60 * 60
+
+
+def participants_cache_key(conversation_id):
+    return f"conversation_participants_{conversation_id}"
+
+
+def _timeout():
+    return getattr(settings, 'CONVERSATION_PARTICIPANTS_CACHE_TIMEOUT', DEFAULT_PARTICIPANTS_CACHE_TIMEOUT)
+
+
+def load_participant_ids(conversation_id):
+    from .message_models import Conversation
+    return list(
+        Conversation.participants.through.objects
+        .filter(conversation_id=conversation_id)
+        .values_list('customuser_id', flat=True)
+    )
+
+
+def get_participant_ids(conversation_id):
+    """Participant ids of a conversation, served from cache when possible"""
+    key = participants_cache_key(conversation_id)
+    participant_ids = cache.get(key)
+    if participant_ids is None:
+        participant_ids = load_participant_ids(conversation_id)
+        cache.set(key, participant_ids, _timeout())
+    return participant_ids
+
+
+async def aget_participant_ids(conversation_id):
+    """Async variant for consumers; only a cache miss goes to the DB thread pool"""
+    key = participants_cache_key(conversation_id)
+    participant_ids = await cache.aget(key)
+    if participant_ids is None:
+        participant_ids = await database_sync_to_async(load_participant_ids)(conversation_id)
+        await cache.aset(key, participant_ids, _timeout())
+    return participant_ids
+
+
+def invalidate_participants(conversation_id):
+    cache.delete(participants_cache_key(conversation_id))
@@ -0,0 +1,137 @@
+"""
+Dynamic Fields
+Sparse fieldsets for DRF endpoints:
+
+    GET /api/orders/?fields=id,status,total_amount
+    GET /api/vendor-profiles/?expand=shop_images
+
+Serializers using DynamicFieldsMixin accept `fields`, `expand` and
+`profile` arguments; unrequested fields are dropped before serialization,
+so their SerializerMethodField and nested serializer work never runs. A
+serializer may declare in Meta:
+
+    lite_fields              default field set of list endpoints
+    select_related_fields    {field: (select_related lookups it needs)}
+    prefetch_related_fields  {field: (prefetch_related lookups it needs)}
+
+Views using DynamicFieldsViewMixin read the query parameters on GET,
+serve list endpoints with the lite profile unless `fields` is given (or
+`?profile=full`), and load only the relations the selected fields use.
+"""
+
+from django.db.models import Prefetch
+
+FULL_PROFILE = 'full'
+LITE_PROFILE = 'lite'
+
+
+def parse_field_list(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def selected_fields(serializer_class, fields=None, expand=None, profile=None):
+    """Set of field names to serialize, or None for every field"""
+    meta = getattr(serializer_class, 'Meta', None)
+    if fields:
+        selection = set(fields) | {'id'}
+    elif profile == LITE_PROFILE and getattr(meta, 'lite_fields', None):
+        selection = set(meta.lite_fields)
+    else:
+        return None
+    return selection | set(expand or ())
+
+
+def _lookup_root(lookup):
+    lookup = lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup
+    return lookup.split('__')[0]
+
+
+def _select_related_lookups(select_related, prefix=''):
+    """Flatten Query.select_related ({'vendor': {'user': {}}}) into lookups"""
+    for name, children in select_related.items():
+        if children:
+            yield from _select_related_lookups(children, f"{prefix}{name}__")
+        else:
+            yield f"{prefix}{name}"
+
+
+def optimize_queryset(queryset, serializer_class, selection):
+    """Load the relations of selected fields and drop those only unselected fields use"""
+    meta = getattr(serializer_class, 'Meta', None)
+    select_map = getattr(meta, 'select_related_fields', {})
+    prefetch_map = getattr(meta, 'prefetch_related_fields', {})
+
+    def wanted(name):
+        return selection is None or name in selection
+
+    roots_needed = {_lookup_root(lookup) for mapping in (select_map, prefetch_map)
+                    for name, lookups in mapping.items() if wanted(name) for lookup in lookups}
+    roots_unused = {_lookup_root(lookup) for mapping in (select_map, prefetch_map)
+                    for name, lookups in mapping.items() if not wanted(name) for lookup in lookups} - roots_needed
+
+    if roots_unused and queryset._prefetch_related_lookups:
+        kept = [lookup for lookup in queryset._prefetch_related_lookups if _lookup_root(lookup) not in roots_unused]
+        queryset = queryset.prefetch_related(None).prefetch_related(*kept)
+    if roots_unused and isinstance(queryset.query.select_related, dict):
+        kept = [lookup for lookup in _select_related_lookups(queryset.query.select_related)
+                if _lookup_root(lookup) not in roots_unused]
+        queryset = queryset.select_related(None)
+        if kept:
+            queryset = queryset.select_related(*kept)
+
+    select = [lookup for name, lookups in select_map.items() if wanted(name) for lookup in lookups]
+    prefetch = [lookup for name, lookups in prefetch_map.items() if wanted(name) for lookup in lookups
+                if lookup not in queryset._prefetch_related_lookups]
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class DynamicFieldsMixin:
+    """ModelSerializer mixin: serialize only the selected fields"""
+
+    def __init__(self, *args, fields=None, expand=None, profile=None, **kwargs):
+        self._selection = selected_fields(type(self), fields, expand, profile)
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self._selection is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in self._selection}
+
+
+class DynamicFieldsViewMixin:
+    """Generic view mixin: field selection from ?fields=, ?expand= and ?profile="""
+
+    lite_list = True
+
+    def get_field_selection(self, many=False):
+        if self.request.method not in ('GET', 'HEAD'):
+            # Writes validate and return the full representation
+            return {}
+        params = self.request.query_params
+        profile = params.get('profile') or (LITE_PROFILE if many and self.lite_list else FULL_PROFILE)
+        return {
+            'fields': parse_field_list(params.get('fields')),
+            'expand': parse_field_list(params.get('expand')),
+            'profile': profile,
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_field_selection(kwargs.get('many', False)))
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not hasattr(queryset, 'query'):
+            return queryset
+        # get_object() goes through here too; only lists use the lite profile
+        many = (self.lookup_url_kwarg or self.lookup_field) not in self.kwargs
+        selection_args = self.get_field_selection(many)
+        if not selection_args:
+            return queryset
+        serializer_class = self.get_serializer_class()
+        return optimize_queryset(queryset, serializer_class, selected_fields(serializer_class, **selection_args))
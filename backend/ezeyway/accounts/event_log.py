@@ -0,0 +1,180 @@
+"""
+Per-User Event Log
+Every event pushed to a user gets a monotonically increasing sequence
+number and is kept in a bounded ring buffer, so a client that reconnects
+can ask for what it missed instead of re-fetching everything
+"""
+
+import threading
+import logging
+from collections import deque
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENT_LOG_CAPACITY = 200
+DEFAULT_EVENT_LOG_TIMEOUT = 60 * 60 * 24
+
+
+class InMemoryEventLogStore:
+    """Process-local ring buffers, used in tests and single-worker setups"""
+
+    def __init__(self, capacity=DEFAULT_EVENT_LOG_CAPACITY):
+        self.capacity = capacity
+        self._buffers = {}  # user_id -> deque of (seq, event)
+        self._heads = {}  # user_id -> last assigned seq
+        self._lock = threading.Lock()
+
+    def append(self, user_id, event):
+        with self._lock:
+            seq = self._heads.get(user_id, 0) + 1
+            self._heads[user_id] = seq
+            buffer = self._buffers.setdefault(user_id, deque(maxlen=self.capacity))
+            buffer.append((seq, {**event, 'seq': seq}))
+            return seq
+
+    def since(self, user_id, last_seq):
+        """Return (events after last_seq, resync_required, head_seq)"""
+        with self._lock:
+            head = self._heads.get(user_id, 0)
+            if last_seq > head:
+                # Client is ahead of us: the log was lost, start over
+                return [], True, head
+            buffer = self._buffers.get(user_id, ())
+            oldest = buffer[0][0] if buffer else head + 1
+            if last_seq + 1 < oldest:
+                return [], True, head
+            return [event for seq, event in buffer if seq > last_seq], False, head
+
+
+class CacheEventLogStore:
+    """Ring buffer in the Django cache (Redis in production), shared by all workers.
+
+    The head sequence lives in one counter key and event ``seq`` is stored in
+    slot ``seq % capacity``, so old events are overwritten in place.
+    """
+
+    def __init__(self, capacity=DEFAULT_EVENT_LOG_CAPACITY, timeout=DEFAULT_EVENT_LOG_TIMEOUT):
+        self.capacity = capacity
+        self.timeout = timeout
+
+    def _head_key(self, user_id):
+        return f"event_log_head_{user_id}"
+
+    def _slot_key(self, user_id, seq):
+        return f"event_log_{user_id}_{seq % self.capacity}"
+
+    def append(self, user_id, event):
+        head_key = self._head_key(user_id)
+        cache.add(head_key, 0, timeout=None)
+        seq = cache.incr(head_key)
+        cache.set(self._slot_key(user_id, seq), (seq, {**event, 'seq': seq}), timeout=self.timeout)
+        return seq
+
+    def since(self, user_id, last_seq):
+        head = cache.get(self._head_key(user_id), 0)
+        if last_seq > head or head - last_seq > self.capacity:
+            return [], True, head
+        if last_seq == head:
+            return [], False, head
+
+        wanted = range(last_seq + 1, head + 1)
+        slots = cache.get_many([self._slot_key(user_id, seq) for seq in wanted])
+        events = []
+        for seq in wanted:
+            entry = slots.get(self._slot_key(user_id, seq))
+            if entry is None or entry[0] != seq:
+                if seq == head:
+                    # Newest slot may still be in flight; it is delivered live
+                    break
+                return [], True, head
+            events.append(entry[1])
+        return events, False, head
+
+
+class EventLog:
+    def __init__(self, store=None):
+        self._store = store
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = getattr(settings, 'EVENT_LOG_BACKEND', 'accounts.event_log.CacheEventLogStore')
+            capacity = getattr(settings, 'EVENT_LOG_CAPACITY', DEFAULT_EVENT_LOG_CAPACITY)
+            self._store = import_string(backend)(capacity=capacity)
+        return self._store
+
+    def record(self, user_id, event):
+        """Append an event to the user's log and return a copy stamped with its seq"""
+        try:
+            seq = self.store.append(user_id, event)
+        except Exception as e:
+            # Logging must never block delivery
+            logger.error(f"Error appending to event log for user {user_id}: {e}")
+            return dict(event)
+        return {**event, 'seq': seq}
+
+    def since(self, user_id, last_seq):
+        return self.store.since(user_id, last_seq)
+
+    async def arecord(self, user_id, event):
+        return await _run_sync(self.record, user_id, event)
+
+    async def asince(self, user_id, last_seq):
+        return await _run_sync(self.since, user_id, last_seq)
+
+
+async def _run_sync(func, *args):
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+def send_user_event(group_name, user_id, event):
+    """Log an event for a user and push it to one of their channel groups (sync callers)"""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(group_name, event_log.record(user_id, event))
+
+
+async def asend_user_event(channel_layer, group_name, user_id, event):
+    """Async variant of send_user_event for consumers"""
+    await channel_layer.group_send(group_name, await event_log.arecord(user_id, event))
+
+
+class EventReplayMixin:
+    """JSONWebsocketConsumer mixin: handles {'type': 'resume', 'last_seq': N} from the client.
+
+    Missed events are replayed through the consumer's own handlers; events
+    this socket has no handler for are skipped. If the buffer no longer
+    covers last_seq the client is told to do a full resync instead.
+    """
+
+    async def handle_resume(self, data):
+        try:
+            last_seq = int(data.get('last_seq', 0))
+        except (TypeError, ValueError):
+            last_seq = 0
+
+        events, resync_required, head = await event_log.asince(self.user.id, last_seq)
+        if resync_required:
+            await self.send_json({
+                'type': 'resync_required',
+                'seq': head
+            })
+            return
+
+        for event in events:
+            handler = getattr(self, event['type'], None)
+            if handler is not None:
+                await handler(event)
+
+        await self.send_json({
+            'type': 'resume_complete',
+            'seq': head,
+            'replayed': len(events)
+        })
+
+# Global instance
+event_log = EventLog()
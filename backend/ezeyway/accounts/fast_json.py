@@ -0,0 +1,109 @@
+"""
+Fast JSON
+One JSON encoding for REST responses, request bodies and WebSocket frames,
+backed by orjson when it is installed and by the standard library otherwise.
+
+Output matches DRF's JSONRenderer: Decimal becomes a number, datetimes use
+DRF's ISO 8601 form (milliseconds, "Z" for UTC), UUIDs, dates, times,
+timedeltas, querysets and lazy strings are handled by DRF's encoder.
+
+    REST_FRAMEWORK = {
+        'DEFAULT_RENDERER_CLASSES': ['accounts.fast_json.FastJSONRenderer'],
+        'DEFAULT_PARSER_CLASSES': ['accounts.fast_json.FastJSONParser', ...],
+    }
+
+Consumers subclass JSONWebsocketConsumer and call send_json(payload).
+"""
+
+import codecs
+import json
+from django.conf import settings
+from channels.generic.websocket import AsyncWebsocketConsumer
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import InstrumentedConsumerMixin
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+_encoder = JSONEncoder()
+
+if ORJSON_AVAILABLE:
+    # Datetimes go through DRF's encoder so both backends produce the same text
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def use_orjson():
+    return ORJSON_AVAILABLE and getattr(settings, 'FAST_JSON_BACKEND', 'orjson') == 'orjson'
+
+
+def dumps(data):
+    """Encode to compact UTF-8 JSON bytes"""
+    if use_orjson():
+        try:
+            return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Integers beyond 64 bits and other values orjson rejects
+            pass
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_str(data):
+    return dumps(data).decode('utf-8')
+
+
+def loads(data):
+    if use_orjson():
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer producing the same output through dumps()"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            # Indented output is for browsing, not worth a second code path
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, keep \u2028 and \u2029 escaped for JavaScript
+        return dumps(data).replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read() if stream is not None else b''
+            if codecs.lookup(encoding).name != 'utf-8':
+                body = body.decode(encoding).encode('utf-8')
+            return loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class JSONWebsocketConsumer(InstrumentedConsumerMixin, AsyncWebsocketConsumer):
+    """AsyncWebsocketConsumer that sends text frames encoded with dumps(); sampled events are instrumented"""
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return dumps_str(content)
+
+    async def send_json(self, content, close=False):
+        await self.send(text_data=await self.encode_json(content), close=close)
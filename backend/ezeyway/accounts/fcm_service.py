@@ -221,23 +221,13 @@ class FCMService:
                 logger.warning("No tokens for bulk send")
                 return False
 
-            message = messaging.MulticastMessage(
-                notification=messaging.Notification(title=title, body=body),
-                data=data or {},
-                android=messaging.AndroidConfig(
-                    priority='high',
-                    notification=messaging.AndroidNotification(
-                        channel_id='order_alerts',
-                        priority=AndroidNotificationPriority.HIGH,
-                        sound='default'
-                    )
-                ),
-                tokens=fcm_tokens
+            from .push_sender import push_sender
+            result = push_sender.send_to_tokens(
+                fcm_tokens,
+                push_sender.build_message(title, body, data, channel_id='order_alerts')
             )
-
-            response = messaging.send_multicast(message)
-            logger.info(f"Bulk sent: {response.success_count}/{len(fcm_tokens)}")
-            return response.success_count > 0
+            logger.info(f"Bulk sent: {result.success_count}/{len(fcm_tokens)}")
+            return result.success_count > 0
 
         except Exception as e:
             logger.error(f"Bulk FCM failed: {e}")
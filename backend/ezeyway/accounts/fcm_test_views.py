@@ -4,7 +4,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .fcm_service import fcm_service
-from .models import VendorProfile
+from .models import FCMToken, VendorProfile
 import json
 import logging
 
@@ -85,9 +85,8 @@ def update_fcm_token(request):
         if not fcm_token:
             return Response({'error': 'fcm_token required'}, status=400)
         
-        vendor_profile, created = VendorProfile.objects.get_or_create(user=request.user)
-        vendor_profile.fcm_token = fcm_token
-        vendor_profile.save()
+        FCMToken.register(request.user, fcm_token, request.data.get('platform', 'android'))
+        VendorProfile.objects.filter(user=request.user).update(fcm_token=fcm_token)
         
         return Response({
             'message': 'FCM token updated successfully',
@@ -1,88 +1,197 @@
-from PIL import Image
+from PIL import Image, ImageOps
 import os
+import logging
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
 import uuid
 
+logger = logging.getLogger(__name__)
+
+
+def render_image_variants(data, sizes, webp_quality=80, jpeg_quality=85, width_only=False):
+    """Decode an image once and encode it as WebP and JPEG at each size.
+
+    Runs in a worker process, so it only takes and returns plain bytes.
+    `sizes` are longest-edge limits in pixels (widths with `width_only`);
+    returns (width, height, {size: {'webp': bytes, 'jpeg': bytes}}) where
+    width and height are those of the largest variant.
+    """
+    with Image.open(BytesIO(data)) as img:
+        largest = max(sizes)
+        if img.format == 'JPEG':
+            # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+            img.draft('RGB', (largest, max(1, img.height * largest // img.width)) if width_only else (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        variants = {}
+        current = img
+        width = height = None
+        # Shrink step by step from the largest size so each resize starts from a smaller image
+        for size in sorted(sizes, reverse=True):
+            box = (size, current.height) if width_only else (size, size)
+            if current.width > box[0] or current.height > box[1]:
+                current = current.copy()
+                current.thumbnail(box, Image.Resampling.LANCZOS)
+            if width is None:
+                width, height = current.size
+
+            webp = BytesIO()
+            current.save(webp, format='WEBP', quality=webp_quality, method=4)
+            jpeg = BytesIO()
+            current.save(jpeg, format='JPEG', quality=jpeg_quality, optimize=True, progressive=True)
+            variants[size] = {'webp': webp.getvalue(), 'jpeg': jpeg.getvalue()}
+        return width, height, variants
+
+
 class ImageProcessor:
     """Utility class for processing images in vendor messages"""
-    
+
     ALLOWED_FORMATS = ['JPEG', 'PNG', 'GIF', 'WEBP']
     MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
     MAX_DIMENSIONS = (1920, 1920)
     THUMBNAIL_SIZE = (300, 300)
-    
+    VARIANT_SIZES = (1920, 960, 300)  # Longest edge of each stored rendition
+
+    _process_pool = None
+    _finish_pool = None
+
     @classmethod
     def validate_image(cls, uploaded_file):
-        """Validate image file size and format"""
+        """Validate image file size and format (reads the header only, no decoding)"""
         # Check file size
         if uploaded_file.size > cls.MAX_FILE_SIZE:
             raise ValueError(f"Image size must be less than {cls.MAX_FILE_SIZE // (1024*1024)}MB")
-        
+
         # Check if it's a valid image
         try:
             with Image.open(uploaded_file) as img:
-                if img.format not in cls.ALLOWED_FORMATS:
-                    raise ValueError(f"Unsupported format. Allowed: {', '.join(cls.ALLOWED_FORMATS)}")
-                return True
+                image_format = img.format
         except Exception:
             raise ValueError("Invalid image file")
-    
+        finally:
+            uploaded_file.seek(0)
+        if image_format not in cls.ALLOWED_FORMATS:
+            raise ValueError(f"Unsupported format. Allowed: {', '.join(cls.ALLOWED_FORMATS)}")
+        return True
+
     @classmethod
     def process_message_image(cls, uploaded_file, conversation_id, user_id):
-        """Process and save message image with optimization"""
+        """Process and save message image with optimization (blocking)"""
+        cls.validate_image(uploaded_file)
+        base_name = cls._base_name(conversation_id, user_id)
+        width, height, variants = render_image_variants(uploaded_file.read(), cls.VARIANT_SIZES)
+        return {
+            'file_name': uploaded_file.name,
+            **cls._save_variants(base_name, width, height, variants)
+        }
+
+    @classmethod
+    def queue_message_image(cls, uploaded_file, conversation_id, user_id):
+        """Validate and store the original upload; returns placeholder fields and a job.
+
+        The message is created with the placeholder fields (status 'sending',
+        file_url pointing at the original) and `job.start(message_id)` hands
+        the rendering to the worker pool once the row exists.
+        """
         cls.validate_image(uploaded_file)
-        
-        # Generate unique filename
-        file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = f"messages/{conversation_id}_{user_id}_{unique_filename}"
-        
-        # Open and process image
-        with Image.open(uploaded_file) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # Resize if too large
-            if img.size[0] > cls.MAX_DIMENSIONS[0] or img.size[1] > cls.MAX_DIMENSIONS[1]:
-                img.thumbnail(cls.MAX_DIMENSIONS, Image.Resampling.LANCZOS)
-            
-            # Save optimized image
-            from io import BytesIO
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=85, optimize=True)
-            output.seek(0)
-            
-            # Save to storage
-            saved_path = default_storage.save(file_path, output)
-            
-            # Create thumbnail
-            thumbnail_path = cls.create_thumbnail(img, conversation_id, user_id, unique_filename)
-            
-            width, height = img.size
-            return {
-                'file_url': saved_path,
-                'file_name': uploaded_file.name,
-                'thumbnail_url': thumbnail_path,
-                'file_size': output.getvalue().__len__(),
-                'image_width': width,
-                'image_height': height
-            }
-    
+        base_name = cls._base_name(conversation_id, user_id)
+        data = uploaded_file.read()
+        extension = os.path.splitext(uploaded_file.name)[1].lower()
+        original_path = default_storage.save(f"messages/originals/{base_name}{extension}", ContentFile(data))
+        placeholder = {
+            'file_url': original_path,
+            'file_name': uploaded_file.name,
+            'file_size': len(data),
+            'status': 'sending',
+        }
+        return placeholder, MessageImageJob(data, base_name)
+
+    @classmethod
+    def process_pool(cls):
+        if cls._process_pool is None:
+            workers = getattr(settings, 'MESSAGE_IMAGE_WORKERS', 2)
+            # spawn, not fork: the web server process is multi-threaded
+            cls._process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            # Saving renditions and notifying sockets is I/O; keep it off the pool's result thread
+            cls._finish_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='message-image')
+        return cls._process_pool
+
     @classmethod
-    def create_thumbnail(cls, img, conversation_id, user_id, filename):
-        """Create thumbnail for message image"""
-        thumbnail_name = f"thumb_{filename}"
-        thumbnail_path = f"messages/thumbnails/{conversation_id}_{user_id}_{thumbnail_name}"
-        
-        # Create thumbnail
-        img_copy = img.copy()
-        img_copy.thumbnail(cls.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-        
-        from io import BytesIO
-        output = BytesIO()
-        img_copy.save(output, format='JPEG', quality=70, optimize=True)
-        output.seek(0)
-        
-        return default_storage.save(thumbnail_path, output)
\ No newline at end of file
+    def _base_name(cls, conversation_id, user_id):
+        return f"{conversation_id}_{user_id}_{uuid.uuid4()}"
+
+    @classmethod
+    def _save_variants(cls, base_name, width, height, variants):
+        """Store every rendition; the largest JPEG is the main file, the smallest the thumbnail"""
+        image_variants = {'webp': {}, 'jpeg': {}}
+        for size, encoded in variants.items():
+            folder = 'messages/thumbnails' if size == min(variants) else 'messages'
+            for image_format, extension in (('webp', 'webp'), ('jpeg', 'jpg')):
+                path = default_storage.save(f"{folder}/{base_name}_{size}.{extension}", ContentFile(encoded[image_format]))
+                image_variants[image_format][str(size)] = path
+        largest, smallest = str(max(variants)), str(min(variants))
+        return {
+            'file_url': image_variants['jpeg'][largest],
+            'thumbnail_url': image_variants['jpeg'][smallest],
+            'file_size': len(variants[max(variants)]['jpeg']),
+            'image_width': width,
+            'image_height': height,
+            'image_variants': image_variants,
+        }
+
+
+class MessageImageJob:
+    """Renders a queued message image off the request path and publishes the result"""
+
+    def __init__(self, data, base_name):
+        self.data = data
+        self.base_name = base_name
+
+    def start(self, message_id):
+        if not getattr(settings, 'MESSAGE_IMAGE_WORKERS', 2):
+            # No pool configured (tests, single-process setups): render inline
+            self.finish(message_id, *render_image_variants(self.data, ImageProcessor.VARIANT_SIZES))
+            return
+        future = ImageProcessor.process_pool().submit(render_image_variants, self.data, ImageProcessor.VARIANT_SIZES)
+        self.data = None
+        future.add_done_callback(lambda done: ImageProcessor._finish_pool.submit(self._finished, message_id, done))
+
+    def _finished(self, message_id, future):
+        try:
+            self.finish(message_id, *future.result())
+        except Exception as e:
+            logger.error(f"Processing image for message {message_id} failed: {e}")
+            from .message_models import Message
+            # Keep the original upload as the image rather than leaving the message pending
+            Message.objects.filter(id=message_id).update(status='sent')
+        finally:
+            close_old_connections()
+
+    def finish(self, message_id, width, height, variants):
+        from .message_models import Message
+        from .conversation_cache import get_participant_ids
+        from .event_log import send_user_event
+        from .protected_media import message_file_urls
+
+        fields = ImageProcessor._save_variants(self.base_name, width, height, variants)
+        updated = Message.objects.filter(id=message_id).update(status='sent', updated_at=timezone.now(), **fields)
+        if not updated:
+            return
+
+        message = Message.objects.only('id', 'conversation_id').get(id=message_id)
+        urls = message_file_urls(None, message.id, fields['file_url'], fields['thumbnail_url'], fields['image_variants'])
+        payload = {'id': message.id, 'conversation_id': message.conversation_id, 'status': 'sent',
+                   **fields, **urls, 'download_url': urls['file_url']}
+        for participant_id in get_participant_ids(message.conversation_id):
+            send_user_event(f"user_{participant_id}", participant_id, {
+                'type': 'message_updated',
+                'message': payload
+            })
@@ -0,0 +1,288 @@
+"""
+Instrumentation
+Per-request and per-event measurements aggregated into in-process
+histograms, one set per route, and rendered in the Prometheus text format
+on /metrics/.
+
+A sampled HTTP request (ezeyway.middleware.InstrumentationMiddleware, WSGI
+or ASGI) or socket event (InstrumentedConsumerMixin, part of every
+JSONWebsocketConsumer) records:
+
+    wall time            time spent in the rest of the stack
+    db queries, db time  through a connection execute wrapper
+    cache hits/misses    get(), get_many() and what is built on them
+    http time            outbound requests made with `requests`
+
+The hooks are installed only when INSTRUMENTATION_SAMPLE_RATE is above 0
+and record nothing outside a sampled request, so with sampling off the
+middleware is not loaded and a socket event costs one settings lookup.
+Histograms live in each worker process; scrape every worker or run one
+per host.
+"""
+
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Upper bounds of the histogram buckets; +Inf is implied
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+UNMATCHED_ROUTE = '<unmatched>'
+METRIC_PREFIX = 'ezeyway'
+
+# Metric name, help text, buckets, Sample attribute
+HISTOGRAMS = (
+    ('duration_seconds', 'Wall time of the request or event', SECONDS_BUCKETS, 'duration'),
+    ('db_queries', 'Database queries per request or event', QUERY_BUCKETS, 'db_queries'),
+    ('db_seconds', 'Time spent in database queries', SECONDS_BUCKETS, 'db_time'),
+    ('http_seconds', 'Time spent in outbound HTTP requests', SECONDS_BUCKETS, 'http_time'),
+)
+COUNTERS = (
+    ('cache_hits_total', 'Cache lookups that found a value', 'cache_hits'),
+    ('cache_misses_total', 'Cache lookups that found nothing', 'cache_misses'),
+    ('http_requests_total', 'Outbound HTTP requests', 'http_requests'),
+)
+
+_current = ContextVar('instrumentation_sample', default=None)
+_MISSING = object()
+
+
+class Sample:
+    """What one request or event spent, filled in by the hooks while it is current"""
+
+    __slots__ = ('started', 'duration', 'db_queries', 'db_time', 'cache_hits', 'cache_misses',
+                 'http_requests', 'http_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.http_requests = 0
+        self.http_time = 0.0
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+        yield '+Inf', self.count
+
+
+class RouteMetrics:
+    __slots__ = ('histograms', 'counters')
+
+    def __init__(self):
+        self.histograms = {name: Histogram(buckets) for name, _, buckets, _ in HISTOGRAMS}
+        self.counters = dict.fromkeys((name for name, _, _ in COUNTERS), 0)
+
+    def add(self, sample):
+        for name, _, _, attribute in HISTOGRAMS:
+            self.histograms[name].observe(getattr(sample, attribute))
+        for name, _, attribute in COUNTERS:
+            self.counters[name] += getattr(sample, attribute)
+
+
+# Hooks: each one passes straight through unless a sample is current
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db_time += time.perf_counter() - started
+        sample.db_queries += 1
+
+
+def _add_query_wrapper(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _wrap_cache_get(get):
+    def instrumented_get(self, key, default=None, version=None):
+        sample = _current.get()
+        if sample is None:
+            return get(self, key, default, version)
+        value = get(self, key, _MISSING, version)
+        if value is _MISSING:
+            sample.cache_misses += 1
+            return default
+        sample.cache_hits += 1
+        return value
+    instrumented_get.instrumented = True
+    return instrumented_get
+
+
+def _wrap_cache_get_many(get_many):
+    def instrumented_get_many(self, keys, version=None):
+        sample = _current.get()
+        if sample is None:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        # Backends without a native get_many loop over get(); count each key once
+        token = _current.set(None)
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            _current.reset(token)
+        sample.cache_hits += len(found)
+        sample.cache_misses += len(keys) - len(found)
+        return found
+    instrumented_get_many.instrumented = True
+    return instrumented_get_many
+
+
+def _wrap_http_send(send):
+    def instrumented_send(self, request, **kwargs):
+        sample = _current.get()
+        if sample is None:
+            return send(self, request, **kwargs)
+        started = time.perf_counter()
+        try:
+            return send(self, request, **kwargs)
+        finally:
+            sample.http_time += time.perf_counter() - started
+            sample.http_requests += 1
+    instrumented_send.instrumented = True
+    return instrumented_send
+
+
+class Instrumentation:
+    def __init__(self):
+        self._routes = {}  # (protocol, route, method) -> RouteMetrics
+        self._lock = threading.Lock()
+        self._installed = False
+
+    @property
+    def sample_rate(self):
+        return getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 0) or 0
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def install(self):
+        """Hook database connections, cache backends and requests.Session (once per process)"""
+        with self._lock:
+            if self._installed:
+                return
+            connection_created.connect(_add_query_wrapper, dispatch_uid='instrumentation_query_wrapper')
+            for connection in connections.all(initialized_only=True):
+                _add_query_wrapper(connection)
+
+            for alias in settings.CACHES:
+                backend = type(caches[alias])
+                if not getattr(backend.get, 'instrumented', False):
+                    backend.get = _wrap_cache_get(backend.get)
+                if not getattr(backend.get_many, 'instrumented', False):
+                    backend.get_many = _wrap_cache_get_many(backend.get_many)
+
+            import requests
+            if not getattr(requests.Session.send, 'instrumented', False):
+                requests.Session.send = _wrap_http_send(requests.Session.send)
+            self._installed = True
+
+    def start(self):
+        """A new Sample for a request or event picked by the sample rate, otherwise None"""
+        rate = self.sample_rate
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        if not self._installed:
+            self.install()
+        return Sample()
+
+    def activate(self, sample):
+        return _current.set(sample)
+
+    def finish(self, token, sample, protocol, route, method):
+        _current.reset(token)
+        sample.duration = time.perf_counter() - sample.started
+        key = (protocol, route or UNMATCHED_ROUTE, method)
+        with self._lock:
+            metrics = self._routes.get(key)
+            if metrics is None:
+                metrics = self._routes[key] = RouteMetrics()
+            metrics.add(sample)
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def render(self):
+        """Every route's metrics in the Prometheus text exposition format"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+            for name, help_text, _, _ in HISTOGRAMS:
+                metric = f'{METRIC_PREFIX}_{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for key, metrics in routes:
+                    labels = _labels(*key)
+                    histogram = metrics.histograms[name]
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+            for name, help_text, _ in COUNTERS:
+                metric = f'{METRIC_PREFIX}_{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for key, metrics in routes:
+                    lines.append(f'{metric}{{{_labels(*key)}}} {metrics.counters[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(protocol, route, method):
+    return f'protocol="{_escape(protocol)}",route="{_escape(route)}",method="{_escape(method)}"'
+
+
+class InstrumentedConsumerMixin:
+    """Consumer mixin: measures every sampled message it handles, per consumer class and message type"""
+
+    async def dispatch(self, message):
+        sample = instrumentation.start()
+        if sample is None:
+            return await super().dispatch(message)
+        token = instrumentation.activate(sample)
+        try:
+            return await super().dispatch(message)
+        finally:
+            instrumentation.finish(token, sample, 'websocket', type(self).__name__, message.get('type', ''))
+
+# Global instance
+instrumentation = Instrumentation()
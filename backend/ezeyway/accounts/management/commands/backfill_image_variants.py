@@ -0,0 +1,72 @@
+"""
+Renders responsive WebP/JPEG variants for images uploaded before variants
+existed (or for every image with --force, e.g. after changing
+RESPONSIVE_IMAGE_WIDTHS).
+
+    python manage.py backfill_image_variants --model product --workers 4
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.image_utils import ImageProcessor
+from accounts.models import Category, ProductImage, Slider, VendorShopImage
+from accounts.responsive_images import _render_in_pool, generate_variants, needs_variants, responsive_fields
+
+MODELS = {
+    'product': ProductImage,
+    'shop': VendorShopImage,
+    'slider': Slider,
+    'category': Category,
+}
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive image variants for existing media'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append', help='Limit to these models (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=1, help='Images rendered in parallel on the image worker pool')
+        parser.add_argument('--force', action='store_true', help='Re-render images that already have variants')
+
+    def handle(self, *args, **options):
+        render = _render_in_pool if options['workers'] > 1 else None
+        for key in options['model'] or sorted(MODELS):
+            model = MODELS[key]
+            image_field, manifest_field = responsive_fields()[model]
+            queryset = model.objects.exclude(**{image_field: ''}).exclude(**{f"{image_field}__isnull": True})
+            if not options['force']:
+                queryset = queryset.filter(**{f"{manifest_field}__isnull": True})
+
+            done = skipped = 0
+            batch = []
+            for instance in queryset.order_by('pk').iterator(chunk_size=options['batch_size']):
+                if options['force']:
+                    setattr(instance, manifest_field, None)
+                if not needs_variants(instance):
+                    skipped += 1
+                    continue
+                batch.append(instance)
+                if len(batch) >= options['batch_size']:
+                    done += self._render(batch, render, options['workers'])
+                    batch = []
+            if batch:
+                done += self._render(batch, render, options['workers'])
+            self.stdout.write(f"{key}: {done} rendered, {skipped} skipped")
+
+    def _render(self, instances, render, workers):
+        if workers <= 1:
+            return sum(1 for instance in instances if generate_variants(instance))
+
+        ImageProcessor.process_pool()
+
+        def run(instance):
+            try:
+                return generate_variants(instance, render=render)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(1 for manifest in executor.map(run, instances) if manifest)
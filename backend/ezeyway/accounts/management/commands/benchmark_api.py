@@ -0,0 +1,62 @@
+"""
+API query-count and latency regression benchmark (accounts/api_benchmarks.py).
+
+Seeds a marketplace into the configured database (SQLite or MySQL), calls
+the key list endpoints and compares queries and p50/p95 latency with the
+JSON baseline; exits with an error on a regression.
+
+    python manage.py benchmark_api --rounds 20 --tolerance 0.25
+    python manage.py benchmark_api --update-baseline
+"""
+
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import api_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Check API endpoints against query budgets and a latency baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'api_benchmark_baseline.json'))
+        parser.add_argument('--update-baseline', action='store_true', help='Record this run as the new baseline')
+        parser.add_argument('--rounds', type=int, default=api_benchmarks.DEFAULT_ROUNDS)
+        parser.add_argument('--tolerance', type=float, default=api_benchmarks.DEFAULT_TOLERANCE,
+                            help='Allowed latency growth over the baseline (0.25 = 25%%)')
+        parser.add_argument('--endpoint', action='append', help='Only this endpoint (repeatable)')
+        parser.add_argument('--seed', type=int, default=0)
+        for name, default in api_benchmarks.DEFAULT_SCALE.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in api_benchmarks.DEFAULT_SCALE}
+        baseline = api_benchmarks.load_baseline(options['baseline'])
+        if baseline and baseline.get('scale') != scale and not options['update_baseline']:
+            self.stderr.write(f"Baseline was recorded at scale {baseline.get('scale')}, latencies may not compare")
+
+        prefix = f"bench_{uuid.uuid4().hex[:8]}"
+        self.stdout.write(f"Seeding {scale} ...")
+        try:
+            users = api_benchmarks.seed(scale, options['seed'], prefix)
+            results = api_benchmarks.run(users, options['rounds'], options['endpoint'])
+        finally:
+            api_benchmarks.cleanup(prefix)
+
+        previous = (baseline or {}).get('endpoints', {})
+        for name, result in results.items():
+            before = previous.get(name)
+            change = f" (baseline {before['queries']} queries, p50 {before['p50_ms']}ms)" if before else ''
+            self.stdout.write(f"{name}: {result['queries']} queries, p50 {result['p50_ms']}ms, "
+                              f"p95 {result['p95_ms']}ms{change}")
+
+        if options['update_baseline']:
+            api_benchmarks.save_baseline(options['baseline'], results, scale, options['rounds'])
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        problems = api_benchmarks.compare(results, previous, options['tolerance'])
+        if problems:
+            raise CommandError('API regressions:\n  ' + '\n  '.join(problems))
+        self.stdout.write('No regressions')
@@ -0,0 +1,101 @@
+"""
+Scripted two-party WebRTC signaling benchmark for CallConsumer.
+
+Each round creates a call, connects caller and callee sockets, joins the
+call, exchanges offer/answer and a burst of ICE candidates, and records
+the setup latency from the first join to the last candidate delivered.
+
+    python manage.py benchmark_call_signaling --calls 50 --candidates 10
+"""
+
+import statistics
+import time
+import uuid
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from accounts.call_registry import call_registry
+from accounts.message_models import Call
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Measure call setup latency over CallConsumer signaling on the in-memory channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=50, help='Calls set up per mode')
+        parser.add_argument('--candidates', type=int, default=10, help='ICE candidates sent by each party')
+
+    def handle(self, *args, **options):
+        in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        with override_settings(CHANNEL_LAYERS=in_memory, CALL_STATE_BACKEND='accounts.call_state_manager.InMemoryCallStateStore'):
+            prefix = f"bench_{uuid.uuid4().hex[:8]}"
+            caller = CustomUser.objects.create(username=f"{prefix}_caller")
+            callee = CustomUser.objects.create(username=f"{prefix}_callee")
+            try:
+                for label, warm in (('cold registry', False), ('warm registry', True)):
+                    latencies = async_to_sync(self._run)(caller, callee, options['calls'], options['candidates'], warm)
+                    latencies.sort()
+                    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+                    self.stdout.write(
+                        f"{label}: {len(latencies)} calls, setup p50 {statistics.median(latencies) * 1000:.1f}ms, "
+                        f"p95 {p95 * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+                    )
+            finally:
+                Call.objects.filter(caller=caller).delete()
+                CustomUser.objects.filter(id__in=[caller.id, callee.id]).delete()
+
+    async def _run(self, caller, callee, call_count, candidate_count, warm):
+        from accounts.routing import websocket_urlpatterns
+        application = URLRouter(websocket_urlpatterns)
+        latencies = []
+
+        for _ in range(call_count):
+            call = await database_sync_to_async(Call.objects.create)(
+                call_id=f"call_{uuid.uuid4().hex[:16]}", caller=caller, receiver=callee
+            )
+            if not warm:
+                # Simulate a worker that has never seen the call
+                call_registry.forget(call.call_id)
+
+            sockets = []
+            for user in (caller, callee):
+                communicator = WebsocketCommunicator(application, f"ws/calls/{user.id}/")
+                communicator.scope['user'] = user
+                await communicator.connect()
+                sockets.append(communicator)
+            caller_socket, callee_socket = sockets
+
+            started = time.perf_counter()
+            for communicator in sockets:
+                await communicator.send_json_to({'type': 'join_call', 'call_id': call.call_id})
+                await self._wait_for(communicator, 'join_call_success')
+
+            await caller_socket.send_json_to({'type': 'offer', 'offer': {'sdp': 'v=0'}, 'call_type': 'audio'})
+            await self._wait_for(callee_socket, 'offer')
+            await callee_socket.send_json_to({'type': 'answer', 'answer': {'sdp': 'v=0'}})
+            await self._wait_for(caller_socket, 'answer')
+
+            for i in range(candidate_count):
+                candidate = {'candidate': f"candidate:{i}", 'sdpMLineIndex': 0}
+                await caller_socket.send_json_to({'type': 'ice_candidate', 'candidate': candidate})
+                await callee_socket.send_json_to({'type': 'ice_candidate', 'candidate': candidate})
+            for communicator in sockets:
+                for _ in range(candidate_count):
+                    await self._wait_for(communicator, 'ice_candidate')
+            latencies.append(time.perf_counter() - started)
+
+            for communicator in sockets:
+                await communicator.disconnect()
+        await call_registry.flush()
+        return latencies
+
+    async def _wait_for(self, communicator, frame_type):
+        while True:
+            frame = await communicator.receive_json_from(timeout=10)
+            if frame.get('type') == frame_type:
+                return frame
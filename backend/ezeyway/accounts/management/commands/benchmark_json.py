@@ -0,0 +1,121 @@
+"""
+JSON encoding benchmark: DRF's standard library JSONRenderer against
+accounts.fast_json on the order-list and product search payloads, and
+json.dumps against send_json's encoder on chat frames.
+
+Seeds a vendor, products and orders, serializes them once, then times
+encoding only. Also reports the payload size and its gzip size.
+
+    python manage.py benchmark_json --orders 50 --products 50 --rounds 200
+"""
+
+import datetime
+import gzip
+import json
+import statistics
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from accounts.fast_json import ORJSON_AVAILABLE, FastJSONRenderer, dumps_str, use_orjson
+from accounts.models import CustomUser, Product, VendorProfile
+from accounts.order_models import Order, OrderItem
+from accounts.order_serializers import OrderSerializer
+from accounts.serializers import CustomerProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare standard library and fast JSON encoding on API and socket payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50, help='Orders in the order-list payload')
+        parser.add_argument('--products', type=int, default=50, help='Products in the search payload')
+        parser.add_argument('--rounds', type=int, default=200, help='Encodings timed per payload and encoder')
+
+    def handle(self, *args, **options):
+        if not use_orjson():
+            self.stdout.write(self.style.WARNING(
+                'orjson is not in use (not installed or FAST_JSON_BACKEND is not "orjson"); '
+                'both columns measure the standard library'
+            ))
+
+        prefix = f"bench_{uuid.uuid4().hex[:8]}"
+        customer = CustomUser.objects.create(username=f"{prefix}_customer", user_type='customer')
+        vendor_user = CustomUser.objects.create(username=prefix, user_type='vendor')
+        vendor = VendorProfile.objects.create(
+            user=vendor_user, business_name=prefix, business_email=f"{prefix}@example.com",
+            business_phone='9800000000', business_address='New Road, Kathmandu', state='Bagmati',
+            latitude=27.7041, longitude=85.3145
+        )
+        try:
+            products = Product.objects.bulk_create([
+                Product(vendor=vendor, name=f"Product {i}", category='Groceries', price=Decimal('99.50') + i,
+                        quantity=50, description='Benchmark product', tags=['bench'])
+                for i in range(options['products'])
+            ])
+            orders = Order.objects.bulk_create([
+                Order(order_number=f"{prefix}-{i}", customer=customer, vendor=vendor, delivery_name='Customer',
+                      delivery_phone='9800000000', delivery_address='Lakeside, Pokhara', delivery_latitude=28.2096,
+                      delivery_longitude=83.9856, delivery_distance=Decimal('3.25'), subtotal=Decimal('450.00'),
+                      delivery_fee=Decimal('50.00'), total_amount=Decimal('500.00'), payment_method='cash_on_delivery')
+                for i in range(options['orders'])
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=products[n % len(products)], quantity=2, unit_price=Decimal('225.00'),
+                          total_price=Decimal('450.00'), product_name='Rice', vendor_name=prefix)
+                for n, order in enumerate(orders)
+            ] if products else [])
+
+            request = RequestFactory().get('/api/orders/', HTTP_HOST='ezeyway.com')
+            context = {'request': request}
+            order_list = {'count': len(orders), 'next': None, 'previous': None,
+                          'results': OrderSerializer(Order.objects.filter(vendor=vendor), many=True, context=context).data}
+            search = {'count': len(products), 'next': None, 'previous': None,
+                      'results': CustomerProductSerializer(Product.objects.filter(vendor=vendor), many=True,
+                                                           context=context).data}
+            frame = {
+                'type': 'new_message',
+                'message': {'id': 1, 'conversation_id': 7, 'content': 'Namaste! Is the order ready?',
+                            'created_at': timezone.now(), 'sender': {'id': customer.id, 'username': customer.username}},
+                'seq': 42,
+                'amount': Decimal('500.00'),
+                'expires_in': datetime.timedelta(minutes=5),
+            }
+
+            stdlib_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+            cases = (
+                ('order list', order_list, stdlib_renderer.render, fast_renderer.render),
+                ('product search', search, stdlib_renderer.render, fast_renderer.render),
+                ('chat frame', frame,
+                 lambda data: json.dumps(data, cls=stdlib_renderer.encoder_class), dumps_str),
+            )
+            for label, payload, standard, fast in cases:
+                assert json.loads(standard(payload)) == json.loads(fast(payload)), label
+                body = fast(payload)
+                body = body if isinstance(body, bytes) else body.encode()
+                standard_time = self.time(standard, payload, options['rounds'])
+                fast_time = self.time(fast, payload, options['rounds'])
+                self.stdout.write(
+                    f"{label}: {len(body)} bytes ({len(gzip.compress(body))} gzipped), "
+                    f"stdlib p50 {standard_time * 1e6:.0f}us, fast p50 {fast_time * 1e6:.0f}us, "
+                    f"{standard_time / fast_time:.1f}x"
+                )
+            self.stdout.write(f"orjson available: {ORJSON_AVAILABLE}")
+        finally:
+            Order.objects.filter(vendor=vendor).delete()
+            Product.objects.filter(vendor=vendor).delete()
+            vendor.delete()
+            vendor_user.delete()
+            customer.delete()
+
+    def time(self, encode, payload, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            encode(payload)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
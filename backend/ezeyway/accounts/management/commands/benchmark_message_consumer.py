@@ -0,0 +1,116 @@
+"""
+Benchmark MessageConsumer chat and typing throughput against the
+in-memory channel layer.
+
+    python manage.py benchmark_message_consumer --users 10 --messages 200
+"""
+
+import time
+import uuid
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from accounts.conversation_cache import participants_cache_key
+from accounts.message_models import Conversation
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Measure MessageConsumer message/typing throughput on the in-memory channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Participants in the benchmark conversation')
+        parser.add_argument('--messages', type=int, default=200, help='Chat messages sent per phase')
+        parser.add_argument('--typing', type=int, default=1000, help='Typing events sent')
+
+    def handle(self, *args, **options):
+        in_memory = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        with override_settings(CHANNEL_LAYERS=in_memory, PRESENCE_BACKEND='accounts.presence.InMemoryPresenceStore'):
+            users, conversation = self._seed(options['users'])
+            try:
+                async_to_sync(self._run)(users, conversation, options['messages'], options['typing'])
+            finally:
+                conversation.delete()
+                CustomUser.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def _seed(self, count):
+        prefix = f"bench_{uuid.uuid4().hex[:8]}"
+        users = [CustomUser.objects.create(username=f"{prefix}_{i}") for i in range(count)]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*users)
+        return users, conversation
+
+    async def _run(self, users, conversation, message_count, typing_count):
+        from accounts.routing import websocket_urlpatterns
+        application = URLRouter(websocket_urlpatterns)
+
+        communicators = []
+        for user in users:
+            communicator = WebsocketCommunicator(application, 'ws/messages/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError(f"Could not connect socket for user {user.id}")
+            communicators.append(communicator)
+        sender = communicators[0]
+
+        try:
+            for label, cached in (('uncached participants', False), ('cached participants', True)):
+                elapsed = await self._send_messages(sender, communicators, conversation.id, message_count, cached)
+                deliveries = message_count * len(communicators)
+                self.stdout.write(
+                    f"{label}: {message_count} messages in {elapsed:.3f}s "
+                    f"({message_count / elapsed:.0f} msg/s, {deliveries / elapsed:.0f} deliveries/s)"
+                )
+
+            started = time.perf_counter()
+            for _ in range(typing_count):
+                await sender.send_json_to({'type': 'typing', 'conversation_id': conversation.id, 'is_typing': True})
+            await sender.send_json_to({'type': 'typing', 'conversation_id': conversation.id, 'is_typing': False})
+            # Frames are handled in order, so the heartbeat ack marks the end of the typing burst
+            await sender.send_json_to({'type': 'heartbeat'})
+            await self._wait_for(sender, 'heartbeat_ack')
+            elapsed = time.perf_counter() - started
+            forwarded = await self._drain(communicators[1:], 'typing_indicator')
+            self.stdout.write(
+                f"typing: {typing_count + 1} events in {elapsed:.3f}s ({(typing_count + 1) / elapsed:.0f} events/s), "
+                f"{forwarded} indicators delivered to {len(communicators) - 1} receivers"
+            )
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+
+    async def _send_messages(self, sender, communicators, conversation_id, count, cached):
+        key = participants_cache_key(conversation_id)
+        started = time.perf_counter()
+        for i in range(count):
+            if not cached:
+                await cache.adelete(key)
+            await sender.send_json_to({'type': 'message', 'conversation_id': conversation_id, 'content': f"benchmark {i}"})
+        for communicator in communicators:
+            received = 0
+            while received < count:
+                frame = await communicator.receive_json_from(timeout=10)
+                if frame.get('type') == 'new_message':
+                    received += 1
+        return time.perf_counter() - started
+
+    async def _wait_for(self, communicator, frame_type):
+        while True:
+            frame = await communicator.receive_json_from(timeout=10)
+            if frame.get('type') == frame_type:
+                return frame
+
+    async def _drain(self, communicators, frame_type):
+        """Count queued frames of one type without tearing the sockets down"""
+        total = 0
+        for communicator in communicators:
+            while not await communicator.receive_nothing(timeout=0.2):
+                frame = await communicator.receive_json_from()
+                if frame.get('type') == frame_type:
+                    total += 1
+        return total
@@ -0,0 +1,101 @@
+"""
+Product card serialization benchmark on a search-sized page.
+
+Seeds a vendor with products (three images each), then serializes one page
+the way CustomerProductSearchView does: without the fragment cache, with a
+cold cache (every product just changed) and with a warm cache. Reports
+time per page, queries per page and the fragment hit rate.
+
+    python manage.py benchmark_product_cards --products 50 --rounds 20
+"""
+
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+
+from accounts.models import CustomUser, Product, ProductImage, VendorProfile
+from accounts.product_fragments import product_fragment_cache, touch_products
+from accounts.serializers import CustomerProductSerializer
+
+
+class UncachedProductSerializer(CustomerProductSerializer):
+    """CustomerProductSerializer as it was before the fragment cache"""
+
+    class Meta(CustomerProductSerializer.Meta):
+        list_serializer_class = serializers.ListSerializer
+
+    def to_representation(self, instance):
+        data = super(CustomerProductSerializer, self).to_representation(instance)
+        data['total_sold'] = instance.total_sold
+        return data
+
+
+class Command(BaseCommand):
+    help = 'Measure product card serialization with and without the fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50, help='Products on the page')
+        parser.add_argument('--rounds', type=int, default=20, help='Pages serialized per mode')
+
+    def handle(self, *args, **options):
+        prefix = f"bench_{uuid.uuid4().hex[:8]}"
+        user = CustomUser.objects.create(username=prefix, user_type='vendor')
+        vendor = VendorProfile.objects.create(
+            user=user, business_name=prefix, business_email=f"{prefix}@example.com",
+            business_phone='9800000000', business_address='New Road, Kathmandu', state='Bagmati',
+            latitude=27.7041, longitude=85.3145
+        )
+        try:
+            products = Product.objects.bulk_create([
+                Product(vendor=vendor, name=f"Product {i}", category='Groceries', price=100 + i,
+                        quantity=50, description='Benchmark product', tags=['bench'])
+                for i in range(options['products'])
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=f"products/{prefix}_{product.id}_{n}.jpg", is_primary=n == 0)
+                for product in products for n in range(3)
+            ])
+            product_ids = [product.id for product in products]
+            request = RequestFactory().get('/api/search/products/', HTTP_HOST='ezeyway.com')
+
+            def page(images):
+                queryset = Product.objects.filter(id__in=product_ids).select_related('vendor')
+                # With the fragment cache, images are only loaded for misses
+                return queryset.prefetch_related('images') if images else queryset
+
+            modes = (
+                ('uncached', UncachedProductSerializer, None),
+                ('cold cache', CustomerProductSerializer, lambda: touch_products(product_ids)),
+                ('warm cache', CustomerProductSerializer, None),
+            )
+            for label, serializer_class, before_round in modes:
+                uncached = serializer_class is UncachedProductSerializer
+                stats_before = product_fragment_cache.stats()
+                timings, queries = [], []
+                for _ in range(options['rounds']):
+                    if before_round:
+                        before_round()
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        data = serializer_class(page(uncached), many=True, context={'request': request}).data
+                        timings.append(time.perf_counter() - started)
+                    queries.append(len(captured))
+                assert len(data) == len(product_ids)
+
+                stats_after = product_fragment_cache.stats()
+                hits = stats_after['hits'] - stats_before['hits']
+                misses = stats_after['misses'] - stats_before['misses']
+                hit_rate = f"{hits / (hits + misses):.0%}" if hits + misses else 'n/a'
+                self.stdout.write(
+                    f"{label}: {len(product_ids)} products, p50 {statistics.median(timings) * 1000:.1f}ms/page, "
+                    f"{statistics.median(queries):.0f} queries/page, hit rate {hit_rate}"
+                )
+        finally:
+            Product.objects.filter(vendor=vendor).delete()
+            vendor.delete()
+            user.delete()
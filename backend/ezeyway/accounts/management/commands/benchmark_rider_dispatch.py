@@ -0,0 +1,86 @@
+"""
+Rider dispatch benchmark: k-nearest queries on accounts.rider_dispatch's grid
+index against a scan of every rider, and batch assignment of pending orders.
+
+Riders are simulated in memory around Kathmandu valley (no database rows),
+queries are random pickup points in the same area. Every grid answer is
+checked against the scan.
+
+    python manage.py benchmark_rider_dispatch --riders 10000 --queries 1000 --k 5 --orders 200
+"""
+
+import heapq
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+
+from accounts.rider_dispatch import RiderDispatcher
+from accounts.rider_tracking import distance_m
+
+CENTER = (27.7041, 85.3145)
+SPREAD = 0.15  # degrees, about the valley
+
+
+class Command(BaseCommand):
+    help = 'Compare grid and brute-force nearest-rider lookups on simulated riders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--riders', type=int, default=10000, help='Simulated available riders')
+        parser.add_argument('--queries', type=int, default=1000, help='Nearest-rider lookups timed')
+        parser.add_argument('--k', type=int, default=5, help='Riders per lookup')
+        parser.add_argument('--orders', type=int, default=200, help='Orders in the batch assignment')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        k = options['k']
+
+        def point():
+            return CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD)
+
+        positions = {rider_id: point() for rider_id in range(1, options['riders'] + 1)}
+        dispatcher = RiderDispatcher()
+        started = time.perf_counter()
+        dispatcher.load(positions)
+        self.stdout.write(f"{len(positions)} riders indexed in {(time.perf_counter() - started) * 1e3:.1f}ms")
+
+        queries = [point() for _ in range(options['queries'])]
+        grid_times, scan_times = [], []
+        for lat, lon in queries:
+            started = time.perf_counter()
+            found = dispatcher.nearest(lat, lon, k)
+            grid_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            expected = heapq.nsmallest(k, ((distance_m(lat, lon, *position), rider_id)
+                                           for rider_id, position in positions.items()))
+            scan_times.append(time.perf_counter() - started)
+            assert found == expected, (lat, lon)
+
+        self.report('grid', grid_times)
+        self.report('scan', scan_times)
+        self.stdout.write(f"grid speedup (p50): {statistics.median(scan_times) / statistics.median(grid_times):.0f}x")
+
+        # Riders move: one ping each, as the location socket would deliver them
+        started = time.perf_counter()
+        for rider_id in positions:
+            dispatcher.record_position(rider_id, *point())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"position updates: {elapsed / len(positions) * 1e6:.1f}us each")
+
+        pickups = {order_id: point() for order_id in range(options['orders'])}
+        started = time.perf_counter()
+        assigned = dispatcher.assign_batch(pickups, candidates=k)
+        elapsed = time.perf_counter() - started
+        distances = [distance for _, distance in assigned.values()]
+        self.stdout.write(
+            f"batch assignment: {len(assigned)}/{len(pickups)} orders in {elapsed * 1e3:.1f}ms, "
+            f"mean pickup distance {statistics.mean(distances):.0f}m" if distances else
+            f"batch assignment: no riders for {len(pickups)} orders"
+        )
+
+    def report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        self.stdout.write(f"{label}: p50 {statistics.median(timings) * 1e6:.0f}us, p95 {p95 * 1e6:.0f}us")
@@ -0,0 +1,104 @@
+"""
+WebSocket load test (accounts/socket_load.py): N users chatting, typing,
+calling and receiving notifications, with connection memory, throughput and
+end-to-end latency percentiles per phase.
+
+By default the consumers run in this process through WebsocketCommunicator
+on the in-memory channel layer; --layer configured uses CHANNEL_LAYERS from
+settings (e.g. a local Redis). --mode socket drives a running Daphne worker
+over real sockets; it needs the `websockets` package and the same database.
+
+    python manage.py benchmark_sockets --users 500 --messages 20
+    python manage.py benchmark_sockets --mode socket --url ws://127.0.0.1:8000 --server-pid 1234 --json
+"""
+
+import contextlib
+import io
+import json
+import uuid
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from accounts import socket_load
+
+
+class Command(BaseCommand):
+    help = 'Load-test the chat, call and notification sockets and report memory, throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('communicator', 'socket'), default='communicator')
+        parser.add_argument('--url', default='ws://127.0.0.1:8000', help='Server for --mode socket')
+        parser.add_argument('--server-pid', type=int, help='Daphne process whose memory is measured (socket mode)')
+        parser.add_argument('--layer', choices=('memory', 'configured'), default='memory',
+                            help='Channel layer for communicator mode')
+        parser.add_argument('--users', type=int, default=socket_load.DEFAULT_USERS)
+        parser.add_argument('--connect-concurrency', type=int, default=socket_load.DEFAULT_CONNECT_CONCURRENCY,
+                            help='Socket handshakes in flight at once while connecting')
+        parser.add_argument('--group-size', type=int, default=socket_load.DEFAULT_GROUP_SIZE,
+                            help='Participants per conversation')
+        parser.add_argument('--messages', type=int, default=10, help='Chat messages per conversation')
+        parser.add_argument('--typing', type=int, default=10, help='Typing events per user')
+        parser.add_argument('--calls', type=int, default=10, help='Concurrent calls between pairs of users')
+        parser.add_argument('--candidates', type=int, default=5, help='ICE candidates sent by each party')
+        parser.add_argument('--notifications', type=int, default=10, help='Notifications per user')
+        parser.add_argument('--interval', type=float, default=0.0,
+                            help='Seconds between one user\'s events (0 sends as fast as possible)')
+        parser.add_argument('--timeout', type=float, default=socket_load.DEFAULT_TIMEOUT,
+                            help='Seconds to wait for outstanding deliveries per phase')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'socket':
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError('--mode socket needs the websockets package (pip install websockets)')
+            layer = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+            if options['notifications'] and layer.endswith('InMemoryChannelLayer'):
+                self.stderr.write('Skipping notifications: the server cannot see an in-memory channel layer')
+                options['notifications'] = 0
+        overrides = socket_load.IN_MEMORY_SETTINGS if (
+            options['mode'] == 'communicator' and options['layer'] == 'memory') else {}
+
+        prefix = f"load_{uuid.uuid4().hex[:8]}"
+        with override_settings(**overrides):
+            users, conversations, tokens = socket_load.seed(options['users'], options['group_size'], prefix)
+            harness = socket_load.SocketLoadHarness(
+                users, conversations, tokens, mode=options['mode'], url=options['url'],
+                timeout=options['timeout'], server_pid=options['server_pid'],
+                connect_concurrency=options['connect_concurrency'],
+            )
+            try:
+                # Consumers still print debugging output per connection
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results = async_to_sync(harness.run)(
+                        messages=options['messages'], typing=options['typing'], calls=options['calls'],
+                        candidates=options['candidates'], notifications=options['notifications'],
+                        interval=options['interval'],
+                    )
+            finally:
+                socket_load.cleanup(prefix)
+
+        if not results['connect']['connected']:
+            raise CommandError(f"No socket could connect ({options['mode']} mode)")
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        connect = results.pop('connect')
+        memory = ', '.join(f"{key.replace('_bytes_per_socket', '')} {connect[key] / 1024:.1f} KiB/socket"
+                           for key in ('traced_bytes_per_socket', 'rss_bytes_per_socket') if key in connect)
+        self.stdout.write(f"connect: {connect['connected']}/{connect['sockets']} sockets in {connect['seconds']}s "
+                          f"({connect['connects_per_second']}/s){', ' + memory if memory else ''}")
+        for name, phase in results.items():
+            latency = (f", latency p50 {phase['p50_ms']}ms p95 {phase['p95_ms']}ms p99 {phase['p99_ms']}ms"
+                       if 'p50_ms' in phase else '')
+            setup = f", setup p50 {phase['setup_p50_ms']}ms" if 'setup_p50_ms' in phase else ''
+            self.stdout.write(
+                f"{name}: {phase['sent']} sent, {phase['received']}/{phase['expected']} delivered in "
+                f"{phase['seconds']}s ({phase['sent_per_second']} sent/s, "
+                f"{phase['deliveries_per_second']} deliveries/s){latency}{setup}"
+            )
+            if phase['lost']:
+                self.stderr.write(f"{name}: {phase['lost']} deliveries did not arrive within {options['timeout']}s")
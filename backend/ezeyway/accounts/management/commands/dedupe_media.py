@@ -0,0 +1,230 @@
+"""
+Moves the existing media/ tree into content-addressed blobs: every file is
+hashed and stored once, database references are rewritten to the blob
+paths, the original files are removed and blob refcounts are recomputed
+from the references.
+
+Files of protected fields (verification documents, refund documents,
+message files) end up in protected storage outside MEDIA_ROOT, including
+ones an earlier run had placed in the public blobs/ tree; public copies
+left without references are deleted.
+
+    python manage.py dedupe_media --dry-run
+    python manage.py dedupe_media
+"""
+
+import hashlib
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from accounts.content_storage import BLOB_PREFIX, PROTECTED_PREFIX, ContentAddressedStorage, is_blob
+from accounts.message_models import Message
+from accounts.models import (
+    Category, CustomUser, MediaBlob, ProductImage, Slider, SubCategory,
+    VendorDocument, VendorProfile, VendorShopImage,
+)
+from accounts.order_models import OrderRefund
+
+# Fields holding a storage path
+PATH_FIELDS = [
+    (CustomUser, 'profile_picture'),
+    (VendorProfile, 'business_license_file'),
+    (VendorProfile, 'gst_certificate'),
+    (VendorProfile, 'fssai_license'),
+    (VendorProfile, 'bank_document'),
+    (VendorDocument, 'document'),
+    (VendorShopImage, 'image'),
+    (ProductImage, 'image'),
+    (Category, 'icon'),
+    (SubCategory, 'icon'),
+    (Slider, 'image'),
+    (Message, 'file_url'),
+    (Message, 'thumbnail_url'),
+]
+# Responsive manifests remember their source path
+MANIFEST_FIELDS = [
+    (VendorShopImage, 'image_variants'),
+    (ProductImage, 'image_variants'),
+    (Category, 'icon_variants'),
+    (Slider, 'image_variants'),
+]
+# Message renditions: {'webp': {size: path}, 'jpeg': {size: path}}
+RENDITION_FIELDS = [
+    (Message, 'image_variants'),
+]
+# Refund documents: [{'file_path': ..., 'file_url': ...}]
+DOCUMENT_FIELDS = [
+    (OrderRefund, 'evidence_photos'),
+    (OrderRefund, 'vendor_supporting_docs'),
+]
+# Fields whose files are only downloaded through protected_media
+PROTECTED_FIELDS = {
+    (VendorProfile, 'business_license_file'),
+    (VendorProfile, 'gst_certificate'),
+    (VendorProfile, 'fssai_license'),
+    (VendorProfile, 'bank_document'),
+    (VendorDocument, 'document'),
+    (Message, 'file_url'),
+    (Message, 'thumbnail_url'),
+    (Message, 'image_variants'),
+    (OrderRefund, 'evidence_photos'),
+    (OrderRefund, 'vendor_supporting_docs'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Deduplicate existing media files into content-addressed storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how much would be saved')
+        parser.add_argument('--keep-originals', action='store_true', help='Leave the original files in place')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not accounts.content_storage.ContentAddressedStorage')
+
+        files = [name for name in self._walk(storage.backend, '') if not storage.is_passthrough(name)]
+        if options['dry_run']:
+            self._report(storage, files)
+            return
+
+        mapping = {}
+        for name in files:
+            with storage.backend.open(name, 'rb') as source:
+                mapping[name] = storage.save(name, source)
+        self.stdout.write(f"{len(files)} files stored as {len(set(mapping.values()))} blobs")
+
+        protected = {}  # public blob -> its protected copy
+        rewritten = self._rewrite(storage, mapping, protected, options['batch_size'])
+        self.stdout.write(f"{rewritten} rows rewritten, {len(protected)} public blobs moved to protected storage")
+
+        if not options['keep_originals']:
+            for name in files:
+                storage.backend.delete(name)
+
+        unreferenced = self._recount()
+        self.stdout.write(f"Refcounts recomputed, {unreferenced} blobs without references")
+        if not options['keep_originals']:
+            for blob in MediaBlob.objects.filter(name__in=list(protected), refcount=0):
+                storage.backend.delete(blob.name)
+                blob.delete()
+
+    def _walk(self, backend, path):
+        directories, files = backend.listdir(path)
+        for directory in directories:
+            child = f"{path}{directory}/"
+            if child in (BLOB_PREFIX, PROTECTED_PREFIX):
+                continue
+            yield from self._walk(backend, child)
+        for name in files:
+            yield f"{path}{name}"
+
+    def _report(self, storage, files):
+        seen = {}
+        total = duplicate = 0
+        for name in files:
+            sha256 = hashlib.sha256()
+            with storage.backend.open(name, 'rb') as source:
+                for chunk in source.chunks():
+                    sha256.update(chunk)
+            size = storage.backend.size(name)
+            total += size
+            if sha256.hexdigest() in seen:
+                duplicate += size
+            seen.setdefault(sha256.hexdigest(), name)
+        self.stdout.write(f"{len(files)} files ({total} bytes), {len(seen)} unique; "
+                          f"{duplicate} bytes would be freed")
+
+    def _rewrite(self, storage, mapping, protected, batch_size):
+        def public_path(value):
+            return mapping.get(str(value), value) if value else value
+
+        def protected_path(value):
+            value = public_path(value)
+            if value and str(value).startswith(BLOB_PREFIX):
+                if value not in protected:
+                    protected[value] = storage.protect(value, release=False)
+                return protected[value]
+            return value
+
+        def manifest(value, path):
+            if value and value.get('source') in mapping:
+                return {**value, 'source': mapping[value['source']]}
+            return value
+
+        def renditions(value, path):
+            if not value:
+                return value
+            return {image_format: {size: path(name) for size, name in sizes.items()}
+                    for image_format, sizes in value.items()}
+
+        def documents(value, path):
+            result = []
+            for document in value or []:
+                name = document.get('file_path') if isinstance(document, dict) else None
+                if name and path(name) != name:
+                    # The stored file is downloaded through protected_media, not a public URL
+                    document = {key: item for key, item in document.items() if key != 'file_url'}
+                    document['file_path'] = path(name)
+                result.append(document)
+            return result
+
+        def plain(value, path):
+            return path(value)
+
+        rewritten = 0
+        for fields, convert in ((PATH_FIELDS, plain), (MANIFEST_FIELDS, manifest),
+                                (RENDITION_FIELDS, renditions), (DOCUMENT_FIELDS, documents)):
+            for model, field in fields:
+                path = protected_path if (model, field) in PROTECTED_FIELDS else public_path
+                changed = []
+                for instance in model.objects.exclude(**{f"{field}__isnull": True}).only('pk', field).iterator(chunk_size=batch_size):
+                    value = getattr(instance, field)
+                    value = value.name if hasattr(value, 'name') else value
+                    new_value = convert(value, path)
+                    if new_value != value:
+                        setattr(instance, field, new_value)
+                        changed.append(instance)
+                    if len(changed) >= batch_size:
+                        model.objects.bulk_update(changed, [field])
+                        rewritten += len(changed)
+                        changed = []
+                if changed:
+                    model.objects.bulk_update(changed, [field])
+                    rewritten += len(changed)
+        return rewritten
+
+    def _recount(self):
+        """refcount = number of references to each blob across every media field"""
+        counts = {}
+
+        def add(name):
+            if is_blob(name):
+                counts[str(name)] = counts.get(str(name), 0) + 1
+
+        for model, field in PATH_FIELDS:
+            for prefix in (BLOB_PREFIX, PROTECTED_PREFIX):
+                for name, references in (model.objects.filter(**{f"{field}__startswith": prefix})
+                                         .values_list(field).annotate(references=Count('pk')).order_by()):
+                    counts[name] = counts.get(name, 0) + references
+        for model, field in RENDITION_FIELDS:
+            for value in model.objects.exclude(**{f"{field}__isnull": True}).values_list(field, flat=True).iterator():
+                for sizes in (value or {}).values():
+                    for name in sizes.values():
+                        add(name)
+        for model, field in DOCUMENT_FIELDS:
+            for value in model.objects.values_list(field, flat=True).iterator():
+                for document in value or []:
+                    if isinstance(document, dict):
+                        add(document.get('file_path'))
+
+        unreferenced = 0
+        for blob in MediaBlob.objects.all().iterator():
+            refcount = counts.get(blob.name, 0)
+            unreferenced += refcount == 0
+            if blob.refcount != refcount:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=refcount)
+        return unreferenced
@@ -0,0 +1,31 @@
+"""
+Sends scheduled PushNotification campaigns once they are due, and resumes
+campaigns whose dispatcher stopped mid-send. Run it from cron, or keep it
+running with --loop.
+
+    python manage.py dispatch_push_campaigns --loop --interval 30
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from accounts.push_campaigns import campaign_engine
+
+
+class Command(BaseCommand):
+    help = 'Dispatch due push notification campaigns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for due campaigns')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            dispatched = campaign_engine.run_due()
+            if dispatched:
+                self.stdout.write(f"Dispatched {dispatched} campaign(s)")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
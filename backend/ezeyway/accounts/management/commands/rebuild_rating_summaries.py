@@ -0,0 +1,26 @@
+"""
+Recomputes the product and vendor rating summaries from the reviews of
+delivered orders, e.g. after reviews were edited in the admin or reviewed
+orders were returned or refunded.
+
+    python manage.py rebuild_rating_summaries --batch-size 1000
+"""
+
+import time
+from django.core.management.base import BaseCommand
+
+from accounts.rating_summaries import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product and vendor rating summaries from reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        products, vendors = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"{products} product and {vendors} vendor summaries rebuilt in {time.perf_counter() - started:.1f}s"
+        )
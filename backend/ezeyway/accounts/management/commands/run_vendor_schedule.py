@@ -0,0 +1,29 @@
+"""
+Opens and closes vendors at their opening-hours transitions by flipping
+VendorProfile.is_open_now (see accounts.vendor_schedule). Run it once from
+cron, or keep it running with --loop; --rebuild recompiles every vendor's
+schedule first (needed once for vendors saved before schedules existed).
+
+    python manage.py run_vendor_schedule --rebuild --loop
+"""
+
+from django.core.management.base import BaseCommand
+
+from accounts.vendor_schedule import vendor_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Flip vendors open or closed at their opening-hours transitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, waking at each transition')
+        parser.add_argument('--rebuild', action='store_true', help='Recompile every vendor schedule first')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f"Recompiled {vendor_scheduler.rebuild()} vendor schedule(s)")
+        if options['loop']:
+            vendor_scheduler.run()
+        else:
+            flipped = vendor_scheduler.apply_due()
+            self.stdout.write(f"{flipped} vendor(s) opened or closed")
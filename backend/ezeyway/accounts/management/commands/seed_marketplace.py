@@ -0,0 +1,66 @@
+"""
+Synthetic marketplace data (accounts/marketplace_seed.py) for load tests.
+
+Counts default to a few hundred thousand rows; --scale multiplies all of
+them and each count can be set on its own. The same --seed gives the same
+data. Seeded users log in with --password.
+
+    python manage.py seed_marketplace --seed 7 --scale 2
+    python manage.py seed_marketplace --vendors 5000 --orders 500000 --page-views 0
+    python manage.py seed_marketplace --clear
+"""
+
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import marketplace_seed
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load a synthetic marketplace (vendors, products, carts, orders, chats, page views)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies every default count')
+        for name in marketplace_seed.DEFAULT_SCALE:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, help='Overrides the scaled default')
+        parser.add_argument('--prefix', default='seed', help='Usernames, order numbers and sessions start with it')
+        parser.add_argument('--batch-size', type=int, default=marketplace_seed.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--days', type=int, default=marketplace_seed.DEFAULT_DAYS,
+                            help='Orders, messages and page views are spread over this many past days')
+        parser.add_argument('--password', default=marketplace_seed.DEFAULT_PASSWORD)
+        parser.add_argument('--replace', action='store_true', help='Delete data seeded with this prefix first')
+        parser.add_argument('--clear', action='store_true', help='Only delete data seeded with this prefix')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['clear'] or options['replace']:
+            self.stdout.write(f"Deleted {marketplace_seed.clear(prefix)} rows seeded with prefix '{prefix}'")
+            if options['clear']:
+                return
+        else:
+            from accounts.models import CustomUser
+            if CustomUser.objects.filter(username__startswith=f'{prefix}_').exists():
+                raise CommandError(f"Data with prefix '{prefix}' exists; use --replace or another --prefix")
+
+        scale = {}
+        for name, default in marketplace_seed.DEFAULT_SCALE.items():
+            value = options[name]
+            if value is None:
+                # Per-vendor and per-conversation counts describe shape, not volume
+                per_parent = name.endswith(('_per_vendor', '_per_conversation'))
+                value = default if per_parent else round(default * options['scale'])
+            scale[name] = value
+
+        seeder = marketplace_seed.MarketplaceSeeder(
+            scale, seed=options['seed'], prefix=prefix, batch_size=options['batch_size'], days=options['days'],
+            password=options['password'], log=self.stdout.write,
+        )
+        self.stdout.write(f"Seeding {scale} ...")
+        started = time.perf_counter()
+        counts = seeder.run()
+        elapsed = time.perf_counter() - started
+        for label, rows in counts.items():
+            self.stdout.write(f"  {label}: {rows}")
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f"{total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)"))
@@ -0,0 +1,520 @@
+"""
+Marketplace Seed
+Synthetic marketplace data for load tests of search, checkout and messaging:
+vendors with coordinates and delivery radii around Nepali cities, their
+products (tags and dynamic_fields), carts, orders in every status,
+conversations and analytics page views.
+
+The same seed and scale give the same data (names, places, amounts, who
+ordered what); only timestamps move with the clock. Rows are written with
+bulk_create in batches inside one transaction, and the per-row post_save
+work (create_auth_token, create_vendor_wallet) is done in bulk instead:
+
+    python manage.py seed_marketplace --seed 7 --scale 2
+"""
+
+import datetime
+import random
+import string
+import time
+import logging
+from contextlib import contextmanager
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .rider_tracking import distance_m
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCALE = {
+    'vendors': 2000,
+    'products_per_vendor': 25,
+    'customers': 20000,
+    'carts': 6000,
+    'orders': 100000,
+    'conversations': 5000,
+    'messages_per_conversation': 10,
+    'visitors': 20000,
+    'page_views': 200000,
+}
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_DAYS = 90
+DEFAULT_PASSWORD = 'marketplace'
+
+# Name, latitude, longitude, province, weight (roughly by population)
+CITIES = (
+    ('Kathmandu', 27.7172, 85.3240, 'Bagmati', 30),
+    ('Lalitpur', 27.6588, 85.3247, 'Bagmati', 10),
+    ('Bhaktapur', 27.6710, 85.4298, 'Bagmati', 5),
+    ('Pokhara', 28.2096, 83.9856, 'Gandaki', 10),
+    ('Bharatpur', 27.6833, 84.4333, 'Bagmati', 6),
+    ('Biratnagar', 26.4525, 87.2718, 'Koshi', 7),
+    ('Dharan', 26.8125, 87.2836, 'Koshi', 4),
+    ('Itahari', 26.6646, 87.2718, 'Koshi', 3),
+    ('Birgunj', 27.0104, 84.8770, 'Madhesh', 6),
+    ('Janakpur', 26.7288, 85.9263, 'Madhesh', 4),
+    ('Hetauda', 27.4280, 85.0322, 'Bagmati', 3),
+    ('Butwal', 27.7006, 83.4484, 'Lumbini', 5),
+    ('Nepalgunj', 28.0500, 81.6167, 'Lumbini', 4),
+    ('Dhangadhi', 28.6833, 80.6000, 'Sudurpashchim', 3),
+)
+CITY_SPREAD = 0.02  # Standard deviation in degrees, about 2km
+DELIVERY_RADII = (2, 3, 5, 5, 8, 10)
+
+# Category: business type, price range, product names, tags, dynamic field choices
+CATALOG = {
+    'Groceries': ('grocery', (40, 3000),
+                  ('Basmati Rice', 'Masoor Dal', 'Mustard Oil', 'Wheat Flour', 'Chiura', 'Sugar', 'Ghee', 'Tea'),
+                  ('staples', 'local', 'organic', 'bulk', 'daily'),
+                  {'brand': ('Gyan', 'Sarbottam', 'Nebico', 'Local'), 'weight': ('500g', '1kg', '5kg', '25kg')}),
+    'Bakery': ('bakery', (30, 1500),
+               ('Sel Roti', 'Milk Bread', 'Chocolate Cake', 'Croissant', 'Cookies', 'Cream Roll'),
+               ('fresh', 'sweet', 'eggless', 'party'),
+               {'weight': ('250g', '500g', '1kg'), 'eggless': (True, False)}),
+    'Food': ('restaurant', (100, 1200),
+             ('Chicken Momo', 'Veg Momo', 'Chowmein', 'Dal Bhat Set', 'Thukpa', 'Sekuwa', 'Samay Baji'),
+             ('newari', 'spicy', 'veg', 'non-veg', 'combo'),
+             {'spice_level': ('mild', 'medium', 'hot'), 'portion': ('half', 'full')}),
+    'Pharmacy': ('pharmacy', (20, 2500),
+                 ('Paracetamol 500mg', 'Jeevan Jal ORS', 'Vitamin C', 'Hand Sanitizer', 'Face Masks', 'Bandages'),
+                 ('otc', 'health', 'first-aid'),
+                 {'pack_size': (10, 20, 50), 'prescription_required': (False, False, True)}),
+    'Electronics': ('electronics', (300, 60000),
+                    ('Phone Charger', 'Earphones', 'LED Bulb', 'Power Bank', 'Bluetooth Speaker', 'Extension Board'),
+                    ('gadgets', 'warranty', 'imported'),
+                    {'brand': ('Samsung', 'Xiaomi', 'Philips', 'Realme'), 'warranty_months': (6, 12, 24)}),
+    'Clothing': ('clothing', (250, 9000),
+                 ('Dhaka Topi', 'Kurta Suruwal', 'Pashmina Shawl', 'T-Shirt', 'Down Jacket', 'Sari'),
+                 ('handmade', 'traditional', 'winter', 'festival'),
+                 {'size': ('S', 'M', 'L', 'XL'), 'color': ('red', 'black', 'white', 'maroon', 'blue')}),
+}
+
+# Status, weight; delivered orders dominate a real order table
+ORDER_STATUSES = (
+    ('pending', 6), ('confirmed', 5), ('preparing', 4), ('ready_for_pickup', 2), ('out_for_delivery', 3),
+    ('delivered', 65), ('cancelled', 10), ('returned', 3), ('refunded', 2),
+)
+PAYMENT_METHODS = ('cash_on_delivery', 'esewa', 'khalti')
+
+CHAT_LINES = (
+    'Namaste, is this available today?', 'Yes, we have it in stock.', 'Can you deliver to Baneshwor?',
+    'Delivery takes about 40 minutes.', 'Can I pay by eSewa?', 'Sure, eSewa and Khalti both work.',
+    'Please send the bigger size.', 'Order is on the way.', 'Dhanyabad!', 'Is there any discount?',
+)
+PAGES = ('/', '/search', '/categories', '/cart', '/checkout', '/orders', '/messages', '/profile')
+USER_AGENTS = (
+    ('Mozilla/5.0 (Linux; Android 13; SM-A546E) Chrome/120.0 Mobile Safari/537.36', 'mobile', 'Chrome', 'Android'),
+    ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) Version/17.1 Mobile Safari/604.1',
+     'mobile', 'Safari', 'iOS'),
+    ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36', 'desktop', 'Chrome', 'Windows'),
+    ('Mozilla/5.0 (Macintosh; Intel Mac OS X 14_1) Version/17.1 Safari/605.1.15', 'desktop', 'Safari', 'macOS'),
+    ('Mozilla/5.0 (Linux; Android 13; SM-X200) Chrome/120.0 Safari/537.36', 'tablet', 'Chrome', 'Android'),
+)
+
+
+@contextmanager
+def muted_signals():
+    """Disconnect the per-row post_save receivers whose work the seeder does in bulk"""
+    from .models import CustomUser, VendorProfile, create_auth_token, create_vendor_wallet
+    receivers = ((create_auth_token, CustomUser), (create_vendor_wallet, VendorProfile))
+    for receiver, sender in receivers:
+        post_save.disconnect(receiver, sender=sender)
+    try:
+        yield
+    finally:
+        for receiver, sender in receivers:
+            post_save.connect(receiver, sender=sender)
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create write the given auto_now/auto_now_add fields, for history spread over past days"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _batches(objects, size):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class MarketplaceSeeder:
+    def __init__(self, scale=None, seed=0, prefix='seed', batch_size=DEFAULT_BATCH_SIZE, days=DEFAULT_DAYS,
+                 password=DEFAULT_PASSWORD, log=None):
+        self.scale = {**DEFAULT_SCALE, **(scale or {})}
+        self.seed = seed
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.days = days
+        self.password = password
+        self.log = log or logger.info
+        self.counts = {}
+
+    def run(self, now=None):
+        """Write the whole marketplace; returns {model label: rows created}"""
+        from analytics.models import PageView, Visitor
+        from .message_models import Conversation, Message
+        from .order_models import Order
+        self.rng = random.Random(self.seed)
+        self.now = now or timezone.now()
+        self.counts = {}
+        timestamps = (Order._meta.get_field('created_at'), Conversation._meta.get_field('created_at'),
+                      Conversation._meta.get_field('updated_at'),
+                      Message._meta.get_field('created_at'), Visitor._meta.get_field('first_visit'),
+                      Visitor._meta.get_field('last_visit'), PageView._meta.get_field('timestamp'))
+        with muted_signals(), explicit_timestamps(*timestamps), transaction.atomic():
+            for step in (self.seed_users, self.seed_vendors, self.seed_products, self.seed_carts,
+                         self.seed_orders, self.seed_conversations, self.seed_page_views):
+                started = time.perf_counter()
+                step()
+                self.log(f"{step.__name__[5:]}: {time.perf_counter() - started:.1f}s")
+        return self.counts
+
+    def insert(self, model, objects, keep=True):
+        """bulk_create any iterable of unsaved objects in batches; the saved rows if keep"""
+        saved = []
+        for batch in _batches(objects, self.batch_size):
+            if keep and not connection.features.can_return_rows_from_bulk_insert:
+                # MySQL does not hand back primary keys; read the batch back in insertion order
+                last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+                model.objects.bulk_create(batch)
+                batch = list(model.objects.filter(pk__gt=last).order_by('pk'))
+            else:
+                model.objects.bulk_create(batch)
+            if keep:
+                saved.extend(batch)
+            label = model._meta.label
+            self.counts[label] = self.counts.get(label, 0) + len(batch)
+        return saved
+
+    def moment(self):
+        """A time in the last `days` days"""
+        return self.now - datetime.timedelta(seconds=self.rng.uniform(0, self.days * 86400))
+
+    def place(self, city):
+        return (round(self.rng.gauss(city[1], CITY_SPREAD), 6), round(self.rng.gauss(city[2], CITY_SPREAD), 6))
+
+    def pick_city(self):
+        return self.rng.choices(CITIES, cum_weights=self.city_weights)[0]
+
+    def phone(self):
+        return f"98{self.rng.randrange(10 ** 8):08d}"
+
+    def seed_users(self):
+        from rest_framework.authtoken.models import Token
+        from .models import CustomUser
+        rng, prefix = self.rng, self.prefix
+        self.city_weights = []
+        total = 0
+        for city in CITIES:
+            total += city[4]
+            self.city_weights.append(total)
+        password = make_password(self.password)  # Hashed once, shared by every seeded user
+
+        taken = set(CustomUser.objects.exclude(referral_code=None).values_list('referral_code', flat=True))
+
+        def referral_code():
+            while True:
+                code = ''.join(rng.choices(string.ascii_uppercase + string.digits, k=8))
+                if code not in taken:
+                    taken.add(code)
+                    return code
+
+        self.vendor_users = self.insert(CustomUser, (
+            CustomUser(username=f'{prefix}_vendor_{n}', email=f'{prefix}_vendor_{n}@example.com', password=password,
+                       user_type='vendor', is_vendor=True, phone_number=self.phone(), referral_code=referral_code(),
+                       is_verified=True, email_verified=True)
+            for n in range(self.scale['vendors'])
+        ))
+        customers = self.insert(CustomUser, (
+            CustomUser(username=f'{prefix}_customer_{n}', email=f'{prefix}_customer_{n}@example.com',
+                       password=password, first_name=f'Customer {n}', phone_number=self.phone(),
+                       privacy_policy_agreed=True)
+            for n in range(self.scale['customers'])
+        ))
+        # Each customer lives in one city and shops there
+        self.customers = [(user.id, user.first_name, self.pick_city()) for user in customers]
+
+        users = self.vendor_users + customers
+        self.insert(Token, (Token(key='%040x' % rng.getrandbits(160), user=user) for user in users), keep=False)
+
+    def seed_vendors(self):
+        from .models import InitialWalletPoints, VendorProfile, VendorWallet, WalletTransaction
+        from .vendor_schedule import refresh
+        rng = self.rng
+        categories = list(CATALOG)
+
+        def vendor(n, user):
+            city = self.pick_city()
+            category = rng.choice(categories)
+            latitude, longitude = self.place(city)
+            fields = dict(
+                user=user, business_name=f'{city[0]} {category} {n}', owner_name=f'Owner {n}',
+                business_email=user.email, business_phone=user.phone_number,
+                business_address=f'Ward {rng.randint(1, 32)}, {city[0]}', city=city[0], state=city[3],
+                pincode=f'{rng.randint(10000, 99999)}', latitude=latitude, longitude=longitude,
+                business_type=CATALOG[category][0], categories=[category], delivery_radius=rng.choice(DELIVERY_RADII),
+                min_order_amount=Decimal(rng.choice((0, 100, 200, 500))),
+                delivery_fee=Decimal(rng.choice((0, 50, 80, 100))), free_delivery_above=Decimal(1000),
+                estimated_delivery_time=rng.choice(('20-30 min', '30-45 min', '45-60 min')),
+                is_approved=rng.random() < 0.95, is_active=True, business_license_status='verified',
+            )
+            fields.update(self.opening_hours(category))
+            profile = VendorProfile(**fields)
+            refresh(profile, self.now)
+            return profile
+
+        vendors = self.insert(VendorProfile, (vendor(n, user) for n, user in enumerate(self.vendor_users)))
+        self.vendors = [(profile.id, profile.business_name, profile.categories[0], profile.city,
+                         profile.latitude, profile.longitude, profile.delivery_fee) for profile in vendors]
+        self.vendors_by_city = {}
+        for index, profile in enumerate(self.vendors):
+            self.vendors_by_city.setdefault(profile[3], []).append(index)
+
+        initial_points = InitialWalletPoints.objects.first()
+        balance = initial_points.points if initial_points else 0
+        wallets = self.insert(VendorWallet, (VendorWallet(vendor=profile, balance=balance, total_earned=balance)
+                                             for profile in vendors), keep=balance > 0)
+        if balance > 0:
+            self.insert(WalletTransaction, (
+                WalletTransaction(wallet=wallet, transaction_type='credit', amount=balance,
+                                  description='Initial wallet points from admin', status='completed')
+                for wallet in wallets
+            ), keep=False)
+
+    def opening_hours(self, category):
+        rng = self.rng
+        hours = {}
+        pattern = rng.random()
+        if pattern < 0.05:
+            opens, closes, closed_day = datetime.time(0), datetime.time(0), None  # Around the clock
+        elif category == 'Food':
+            opens, closes, closed_day = datetime.time(10), datetime.time(rng.choice((22, 23, 1))), None
+        else:
+            opens = datetime.time(rng.choice((7, 8, 9)))
+            closes = datetime.time(rng.choice((19, 20, 21)))
+            closed_day = 'saturday' if pattern < 0.4 else None
+        for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'):
+            hours.update({f'{day}_open': opens, f'{day}_close': closes, f'{day}_closed': day == closed_day})
+        return hours
+
+    def seed_products(self):
+        from .models import Product
+        rng = self.rng
+
+        def products():
+            for index, (vendor_id, _, category, *_) in enumerate(self.vendors):
+                business_type, (low, high), names, tags, choices = CATALOG[category]
+                for n in range(self.scale['products_per_vendor']):
+                    fields = {key: rng.choice(values) for key, values in choices.items()}
+                    name = rng.choice(names)
+                    if 'brand' in fields:
+                        name = f"{fields['brand']} {name}"
+                    price = Decimal(rng.randint(low, high))
+                    yield Product(
+                        vendor_id=vendor_id, name=name, category=category, price=price,
+                        cost_price=(price * Decimal('0.8')).quantize(Decimal('0.01')),
+                        sku=f'{self.prefix}-{index}-{n}', quantity=rng.choice((0, 5, 20, 50, 100, 500)),
+                        low_stock_threshold=5, description=f'{name} from a {business_type} in the seeded marketplace',
+                        tags=rng.sample(tags, rng.randint(1, min(3, len(tags)))),
+                        status=rng.choices(('active', 'draft', 'archived'), weights=(90, 6, 4))[0],
+                        featured=rng.random() < 0.05, free_delivery=rng.random() < 0.1, dynamic_fields=fields,
+                    )
+
+        # Only what carts and orders need is kept per vendor
+        self.products = {}
+        for product in self.insert(Product, products()):
+            if product.status == 'active':
+                self.products.setdefault(product.vendor_id, []).append((product.id, product.name, product.price))
+
+    def nearby_vendor(self, city):
+        """Index into self.vendors of a vendor in the city (one with products), any vendor if it has none"""
+        candidates = self.vendors_by_city.get(city[0]) or range(len(self.vendors))
+        # A few popular shops get most of the traffic
+        index = candidates[min(int(self.rng.paretovariate(1.2)) - 1, len(candidates) - 1)]
+        return index if self.vendors[index][0] in self.products else None
+
+    def seed_carts(self):
+        from .models import Cart, CartItem
+        rng = self.rng
+        owners = rng.sample(self.customers, min(self.scale['carts'], len(self.customers)))
+        carts = self.insert(Cart, (Cart(user_id=customer_id) for customer_id, _, _ in owners))
+
+        def items():
+            for cart, (_, _, city) in zip(carts, owners):
+                vendor = self.nearby_vendor(city)
+                if vendor is None:
+                    continue
+                products = self.products[self.vendors[vendor][0]]
+                for product_id, _, _ in rng.sample(products, min(rng.randint(1, 5), len(products))):
+                    yield CartItem(cart=cart, product_id=product_id, quantity=rng.randint(1, 3))
+
+        self.insert(CartItem, items(), keep=False)
+
+    def seed_orders(self):
+        from .order_models import Order, OrderItem
+        rng = self.rng
+        statuses = [status for status, _ in ORDER_STATUSES]
+        weights = [weight for _, weight in ORDER_STATUSES]
+        code = self.prefix[:8].upper()
+        if not self.products:
+            return
+
+        def orders():
+            n = 0
+            while n < self.scale['orders']:
+                customer_id, name, city = rng.choice(self.customers)
+                vendor = self.nearby_vendor(city)
+                if vendor is None:
+                    continue
+                vendor_id, business_name, _, _, latitude, longitude, delivery_fee = self.vendors[vendor]
+                products = self.products[vendor_id]
+                lines = [(product, rng.randint(1, 3))
+                         for product in rng.sample(products, min(rng.randint(1, 4), len(products)))]
+                yield self.order(f'{code}-{n:09d}', customer_id, name, vendor_id, latitude, longitude, delivery_fee,
+                                 rng.choices(statuses, weights)[0], lines), business_name, lines
+                n += 1
+
+        def items(batch, orders):
+            for (_, business_name, lines), order in zip(batch, orders):
+                for (product_id, product_name, price), quantity in lines:
+                    yield OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=price,
+                                    total_price=price * quantity, product_name=product_name,
+                                    vendor_name=business_name)
+
+        # Items need their order's id, so each batch of orders is written before its items
+        for batch in _batches(orders(), self.batch_size):
+            saved = self.insert(Order, (order for order, _, _ in batch))
+            self.insert(OrderItem, items(batch, saved), keep=False)
+
+    def order(self, number, customer_id, name, vendor_id, latitude, longitude, delivery_fee, status, lines):
+        from .order_models import Order
+        rng = self.rng
+        delivery_latitude = latitude + rng.uniform(-0.02, 0.02)
+        delivery_longitude = longitude + rng.uniform(-0.02, 0.02)
+        subtotal = sum(price * quantity for (_, _, price), quantity in lines)
+        fee = Decimal(0) if subtotal >= 1000 else delivery_fee
+        created = self.moment()
+        order = Order(
+            order_number=number, customer_id=customer_id, vendor_id=vendor_id, status=status,
+            payment_method=rng.choice(PAYMENT_METHODS), delivery_name=name, delivery_phone=self.phone(),
+            delivery_address=f'House {rng.randint(1, 400)}, Ward {rng.randint(1, 32)}',
+            delivery_latitude=round(delivery_latitude, 6), delivery_longitude=round(delivery_longitude, 6),
+            delivery_distance=round(distance_m(latitude, longitude, delivery_latitude, delivery_longitude) / 1000, 2),
+            subtotal=subtotal, delivery_fee=fee, total_amount=subtotal + fee, created_at=created,
+            estimated_preparation_time=rng.choice((10, 15, 20, 30)),
+            estimated_delivery_time=rng.choice((20, 30, 45, 60)),
+        )
+        # Timestamps and payment follow the status the order reached
+        steps = ('confirmed_at', 'prepared_at', 'out_for_delivery_at', 'delivered_at')
+        reached = {'confirmed': 1, 'preparing': 1, 'ready_for_pickup': 2, 'out_for_delivery': 3,
+                   'delivered': 4, 'returned': 4, 'refunded': 4}.get(status, 0)
+        moment = created
+        for step in steps[:reached]:
+            moment += datetime.timedelta(minutes=rng.randint(3, 25))
+            setattr(order, step, moment)
+        if status == 'cancelled':
+            order.cancelled_at = created + datetime.timedelta(minutes=rng.randint(1, 30))
+            order.cancellation_reason = rng.choice(('Ordered by mistake', 'Vendor unavailable', 'Took too long'))
+        if status in ('delivered', 'returned') or (reached and order.payment_method != 'cash_on_delivery'):
+            order.payment_status, order.paid_amount = 'paid', order.total_amount
+        if status == 'refunded':
+            order.payment_status = 'refunded'
+        return order
+
+    def seed_conversations(self):
+        from .message_models import Conversation, Message
+        rng = self.rng
+        Participants = Conversation.participants.through
+
+        pairs = []
+        for _ in range(self.scale['conversations']):
+            customer_id, _, city = rng.choice(self.customers)
+            vendor = self.nearby_vendor(city)
+            if vendor is not None:
+                pairs.append((customer_id, self.vendor_users[vendor].id, self.moment()))
+        # Sender alternates starting with the customer; messages are minutes apart after the first
+        per_conversation = self.scale['messages_per_conversation']
+        times = [[started + datetime.timedelta(minutes=n * rng.randint(1, 10)) for n in range(per_conversation)]
+                 for _, _, started in pairs]
+        conversations = self.insert(Conversation, (
+            Conversation(created_at=started, updated_at=sent[-1] if sent else started) for (_, _, started), sent in zip(pairs, times)
+        ))
+        self.insert(Participants, (
+            Participants(conversation_id=conversation.id, customuser_id=user_id)
+            for conversation, (customer_id, vendor_user_id, _) in zip(conversations, pairs)
+            for user_id in (customer_id, vendor_user_id)
+        ), keep=False)
+        self.insert(Message, (
+            Message(conversation=conversation, sender_id=(customer_id, vendor_user_id)[n % 2],
+                    content=rng.choice(CHAT_LINES), status='read' if n < per_conversation - 2 else 'delivered',
+                    created_at=created)
+            for conversation, (customer_id, vendor_user_id, _), sent in zip(conversations, pairs, times)
+            for n, created in enumerate(sent)
+        ), keep=False)
+
+    def seed_page_views(self):
+        from analytics.models import PageView, Visitor
+        rng = self.rng
+
+        def visitor(n):
+            user_agent, device, browser, os_name = rng.choice(USER_AGENTS)
+            customer = rng.choice(self.customers) if rng.random() < 0.4 else None
+            first = self.moment()
+            return Visitor(
+                session_id=f'{self.prefix}-{n}', ip_address=f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}',
+                user_agent=user_agent, referrer=rng.choice((None, 'https://www.google.com/', 'https://facebook.com/')),
+                country='Nepal', city=(customer[2] if customer else self.pick_city())[0], device_type=device,
+                browser=browser, os=os_name, first_visit=first, last_visit=first, visit_count=rng.randint(1, 20),
+                is_known_user=customer is not None, user_id=customer[0] if customer else None,
+            )
+
+        visitors = self.insert(Visitor, (visitor(n) for n in range(self.scale['visitors'])))
+        if not visitors:
+            return
+        vendor_ids = [vendor[0] for vendor in self.vendors]
+        product_ids = [product[0] for products in self.products.values() for product in products]
+
+        def page_url():
+            kind = rng.random()
+            if kind < 0.3 and product_ids:
+                return f'https://ezeyway.com/product/{rng.choice(product_ids)}'
+            if kind < 0.5 and vendor_ids:
+                return f'https://ezeyway.com/vendor/{rng.choice(vendor_ids)}'
+            return f'https://ezeyway.com{rng.choice(PAGES)}'
+
+        def page_views():
+            for _ in range(self.scale['page_views']):
+                visitor = rng.choice(visitors)
+                yield PageView(visitor_id=visitor.id, page_url=page_url(), timestamp=self.moment(),
+                               time_on_page=int(rng.expovariate(1 / 40)), exit_page=rng.random() < 0.3)
+
+        self.insert(PageView, page_views(), keep=False)
+
+
+def clear(prefix):
+    """Delete what a seeder with this prefix created"""
+    from analytics.models import Visitor
+    from .message_models import Conversation
+    from .models import CustomUser
+    users = CustomUser.objects.filter(username__startswith=f'{prefix}_')
+    with transaction.atomic():
+        return (Conversation.objects.filter(participants__in=users).delete()[0]
+                + Visitor.objects.filter(session_id__startswith=f'{prefix}-').delete()[0]
+                + users.delete()[0])
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from .models import CustomUser
 
@@ -16,8 +18,30 @@ class Conversation(models.Model):
     
     @property
     def last_message(self):
+        # Conversation lists prefetch only the newest message into latest_messages
+        if hasattr(self, 'latest_messages'):
+            return self.latest_messages[0] if self.latest_messages else None
         return self.messages.first()
 
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_conversation_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    from .conversation_cache import invalidate_participants
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_participants(instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        # user.conversations.add(...): pk_set holds conversation ids
+        for conversation_id in pk_set:
+            invalidate_participants(conversation_id)
+    elif action == 'pre_clear':
+        for conversation_id in instance.conversations.values_list('id', flat=True):
+            invalidate_participants(conversation_id)
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_deleted_conversation(sender, instance, **kwargs):
+    from .conversation_cache import invalidate_participants
+    invalidate_participants(instance.pk)
+
 class Message(models.Model):
     MESSAGE_TYPES = [
         ('text', 'Text'),
@@ -44,6 +68,7 @@ class Message(models.Model):
     file_size = models.IntegerField(blank=True, null=True)
     image_width = models.IntegerField(blank=True, null=True)
     image_height = models.IntegerField(blank=True, null=True)
+    image_variants = models.JSONField(blank=True, null=True)  # {'webp': {size: path}, 'jpeg': {size: path}}
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='sent')
     is_pinned = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -150,4 +175,9 @@ class Call(models.Model):
     
     @property
     def can_be_answered(self):
-        return self.status in ['initiated', 'ringing'] and not self.ended_at
\ No newline at end of file
+        return self.status in ['initiated', 'ringing'] and not self.ended_at
+
+@receiver(post_save, sender=Call)
+def refresh_active_call(sender, instance, created, **kwargs):
+    from .call_registry import call_registry
+    call_registry.sync_from_model(instance, created)
@@ -1,25 +1,70 @@
 from rest_framework import serializers
+from django.db.models import Count, Prefetch
+from .dynamic_fields import DynamicFieldsMixin
 from .message_models import Conversation, Message, MessageRead, Call
+from .protected_media import message_file_urls, protected_media_url
 from .serializers import UserSerializer
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     is_read = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'sender', 'message_type', 'content', 'file_url', 'file_name', 
-                 'thumbnail_url', 'file_size', 'image_width', 'image_height',
-                 'status', 'is_pinned', 'created_at', 'is_read']
+                 'thumbnail_url', 'file_size', 'image_width', 'image_height', 'image_variants',
+                 'download_url', 'status', 'is_pinned', 'created_at', 'is_read']
         read_only_fields = ['id', 'sender', 'created_at']
     
     def get_is_read(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if 'read_by' in getattr(obj, '_prefetched_objects_cache', {}):
+                return any(read.user_id == request.user.id for read in obj.read_by.all())
             return MessageRead.objects.filter(message=obj, user=request.user).exists()
         return False
 
-class ConversationSerializer(serializers.ModelSerializer):
+    def get_download_url(self, obj):
+        if not obj.file_url:
+            return None
+        return protected_media_url(self.context.get('request'), 'protected_message_file', obj.id)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Files are only reachable through the access-checked media view, never by storage path
+        data.update(message_file_urls(self.context.get('request'), instance.id, instance.file_url,
+                                      instance.thumbnail_url, instance.image_variants))
+        return data
+
+# Conversation lists only need the newest message of each conversation
+LATEST_MESSAGE_PREFETCH = Prefetch('messages', queryset=Message.objects.select_related('sender__vendor_profile')[:1],
+                                   to_attr='latest_messages')
+
+
+UNREAD_COUNTS_CONTEXT_KEY = '_unread_counts'
+
+
+def unread_counts(conversation_ids, user):
+    """conversation id -> messages from others the user has not read, for many conversations in one query"""
+    rows = (Message.objects.filter(conversation_id__in=conversation_ids)
+            .exclude(sender=user).exclude(read_by__user=user)
+            .values('conversation_id').annotate(unread=Count('id')).order_by())
+    return {row['conversation_id']: row['unread'] for row in rows}
+
+
+class ConversationListSerializer(serializers.ListSerializer):
+    """Conversation lists count unread messages of the whole page at once"""
+
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if 'unread_count' in self.child.fields and request and request.user.is_authenticated:
+            self.context[UNREAD_COUNTS_CONTEXT_KEY] = unread_counts([c.id for c in conversations], request.user)
+        return super().to_representation(conversations)
+
+
+class ConversationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     last_message = MessageSerializer(read_only=True)
     unread_count = serializers.SerializerMethodField()
@@ -29,10 +74,21 @@ class ConversationSerializer(serializers.ModelSerializer):
         model = Conversation
         fields = ['id', 'participants', 'last_message', 'unread_count', 'other_participant', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        lite_fields = ['id', 'other_participant', 'last_message', 'unread_count', 'updated_at']
+        prefetch_related_fields = {
+            # UserSerializer shows vendors by business name
+            'participants': ('participants__vendor_profile',),
+            'other_participant': ('participants__vendor_profile',),
+            'last_message': (LATEST_MESSAGE_PREFETCH, 'latest_messages__read_by'),
+        }
+        list_serializer_class = ConversationListSerializer
     
     def get_unread_count(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            counts = self.context.get(UNREAD_COUNTS_CONTEXT_KEY)
+            if counts is not None:
+                return counts.get(obj.id, 0)
             return obj.messages.exclude(
                 read_by__user=request.user
             ).exclude(sender=request.user).count()
@@ -44,39 +100,44 @@ class ConversationSerializer(serializers.ModelSerializer):
             return None
 
         current_user = request.user
-        other_participants = obj.participants.exclude(id=current_user.id)
+        # Works on the prefetched participants; ordered by id like queryset.first()
+        other_participants = sorted(
+            (user for user in obj.participants.all() if user.id != current_user.id),
+            key=lambda user: user.id
+        )
 
-        if not other_participants.exists():
+        if not other_participants:
             return None
 
         # Handle 1-on-1 chats directly (most common)
-        if other_participants.count() == 1:
-            return UserSerializer(other_participants.first()).data
+        if len(other_participants) == 1:
+            return UserSerializer(other_participants[0]).data
 
         # For group/multi-participant chats: filter out system/admin users first
         # Adjust 'admin', 'ezeyway', 'superadmin' based on your actual user_type values
-        preferred_participants = other_participants.exclude(
-            user_type__in=['admin', 'ezeyway', 'superadmin']
-        )
+        preferred_participants = [
+            user for user in other_participants
+            if user.user_type not in ('admin', 'ezeyway', 'superadmin')
+        ]
 
-        if preferred_participants.exists():
+        if preferred_participants:
             other_participants = preferred_participants
 
         # Role-based priority
         if current_user.user_type == 'vendor':
             # Vendor: always prefer a real customer
-            customers = other_participants.filter(user_type='customer')
-            if customers.exists():
-                return UserSerializer(customers.first()).data
+            customers = [user for user in other_participants if user.user_type == 'customer']
+            if customers:
+                return UserSerializer(customers[0]).data
 
         elif current_user.user_type == 'customer':
             # Customer: prefer the vendor they're talking to
-            vendors = other_participants.filter(user_type='vendor')
-            if vendors.exists():
-                return UserSerializer(vendors.first()).data
+            vendors = [user for user in other_participants if user.user_type == 'vendor']
+            if vendors:
+                return UserSerializer(vendors[0]).data
 
         # Safe fallback: first remaining participant (never None)
-        return UserSerializer(other_participants.first()).data
+        return UserSerializer(other_participants[0]).data
     
 class CallSerializer(serializers.ModelSerializer):
     caller = UserSerializer(read_only=True)
@@ -1,6 +1,7 @@
 from django.urls import path
 from . import message_views
 from . import fcm_test_views
+from . import presence_api
 
 urlpatterns = [
     # Conversation APIs
@@ -10,6 +11,9 @@ urlpatterns = [
     path('conversations/<int:conversation_id>/messages/', message_views.MessageListView.as_view(), name='message_list'),
     path('conversations/user/<int:user_id>/', message_views.get_or_create_conversation_api, name='get_or_create_conversation'),
     
+    # Presence API
+    path('presence/', presence_api.online_status_api, name='online_status'),
+    
     # Message APIs
     path('messages/send/', message_views.send_message_api, name='send_message'),
     path('messages/<int:message_id>/read/', message_views.mark_message_read_api, name='mark_message_read'),
@@ -7,27 +7,25 @@
     from django.utils import timezone
     import os
     import logging
-    from django.db import OperationalError
+    from django.db import OperationalError, transaction
     logger = logging.getLogger(__name__)
     from .models import CustomUser
+    from .dynamic_fields import DynamicFieldsViewMixin
     from .message_models import Conversation, Message, MessageRead, Call
     from .message_serializers import (
         ConversationSerializer, MessageSerializer, CallSerializer,
         SendMessageSerializer, InitiateCallSerializer
     )
+    from .protected_media import message_file_urls
 
-    class ConversationListView(generics.ListAPIView):
+    class ConversationListView(DynamicFieldsViewMixin, generics.ListAPIView):
         serializer_class = ConversationSerializer
         permission_classes = [permissions.IsAuthenticated]
         
         def get_queryset(self):
+            # Relations are loaded per requested field, see ConversationSerializer.Meta
             return Conversation.objects.filter(
                 participants=self.request.user
-            ).prefetch_related(
-                'participants',
-                'messages',
-                'messages__sender',
-                'messages__read_by__user'
             ).order_by('-updated_at')  # Latest chats on top
 
     class ConversationDetailView(generics.RetrieveAPIView):
@@ -134,17 +132,19 @@
         
         # Handle file upload
         file_data = {}
+        image_job = None
         if data.get('file'):
             uploaded_file = data['file']
             
             if data['message_type'] == 'image':
-                # Use image processor for images
+                # Images are rendered by the worker pool; the message starts as a pending
+                # placeholder and the final URLs are pushed as a message_updated event
                 from .image_utils import ImageProcessor
                 try:
-                    processed_data = ImageProcessor.process_message_image(
+                    placeholder, image_job = ImageProcessor.queue_message_image(
                         uploaded_file, conversation.id, request.user.id
                     )
-                    file_data.update(processed_data)
+                    file_data.update(placeholder)
                 except ValueError as e:
                     return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             else:
@@ -179,6 +179,9 @@
         # Update conversation timestamp
         conversation.save()
         
+        if image_job:
+            transaction.on_commit(lambda: image_job.start(message.id))
+        
         return Response({
             'message': MessageSerializer(message, context={'request': request}).data,
             'conversation': ConversationSerializer(conversation, context={'request': request}).data
@@ -283,8 +286,10 @@
 
         channel_layer = get_channel_layer()
         if channel_layer:
-            async_to_sync(channel_layer.group_send)(
+            from .event_log import send_user_event
+            send_user_event(
                 f"user_{recipient.id}",
+                recipient.id,
                 {
                     'type': 'incoming_call',
                     'call': {
@@ -502,10 +507,12 @@
         if not message.conversation.participants.filter(id=request.user.id).exists():
             return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Return image URLs
+        # Return image URLs (the access-checked media view, never storage paths)
+        urls = message_file_urls(request, message.id, message.file_url, message.thumbnail_url, message.image_variants)
         return Response({
-            'image_url': message.file_url,
-            'thumbnail_url': message.thumbnail_url,
+            'image_url': urls['file_url'],
+            'thumbnail_url': urls['thumbnail_url'],
+            'image_variants': urls['image_variants'],
             'file_name': message.file_name,
             'file_size': message.file_size,
             'dimensions': {
@@ -0,0 +1,44 @@
+"""
+Migration Operations
+Some tables (PushNotification, Slider, Category, VendorShopImage, ...) were
+created before their models had migrations, so they are missing from the
+migration state and AddField cannot target them. add_untracked_columns()
+adds new fields of such a model with the current model definition, skipping
+columns that already exist and tables that do not (those get the column
+when their model is finally migrated).
+"""
+
+from django.db import migrations
+
+
+def _columns(schema_editor, model):
+    """Column names of the model's table, None if there is no table"""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if model._meta.db_table not in connection.introspection.table_names(cursor):
+            return None
+        description = connection.introspection.get_table_description(cursor, model._meta.db_table)
+    return {column.name for column in description}
+
+
+def add_untracked_columns(model_name, field_names):
+    from django.apps import apps as current_apps
+
+    def forwards(apps, schema_editor):
+        model = current_apps.get_model('accounts', model_name)
+        for name in field_names:
+            # Looked up again each time: rebuilding a table (SQLite) may add the other new columns too
+            columns = _columns(schema_editor, model)
+            field = model._meta.get_field(name)
+            if columns is not None and field.column not in columns:
+                schema_editor.add_field(model, field)
+
+    def backwards(apps, schema_editor):
+        model = current_apps.get_model('accounts', model_name)
+        for name in field_names:
+            columns = _columns(schema_editor, model)
+            field = model._meta.get_field(name)
+            if columns is not None and field.column in columns:
+                schema_editor.remove_field(model, field)
+
+    return migrations.RunPython(forwards, backwards)
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_orderrefund_appeal_at_orderrefund_bank_account_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryrider',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rider_profile', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+def compile_schedules(apps, schema_editor):
+    """Compile the hours of existing vendors; is_open_now would otherwise stay False until they save"""
+    from accounts.vendor_schedule import DERIVED_FIELDS, refresh
+
+    VendorProfile = apps.get_model('accounts', 'VendorProfile')
+    batch = []
+    for vendor in VendorProfile.objects.iterator(chunk_size=500):
+        refresh(vendor)
+        batch.append(vendor)
+        if len(batch) >= 500:
+            VendorProfile.objects.bulk_update(batch, DERIVED_FIELDS)
+            batch = []
+    if batch:
+        VendorProfile.objects.bulk_update(batch, DERIVED_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_deliveryrider_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendorprofile',
+            name='opening_schedule',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='vendorprofile',
+            name='is_open_now',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='vendorprofile',
+            name='next_transition_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(compile_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations
+
+from accounts.migration_operations import add_untracked_columns
+
+
+class Migration(migrations.Migration):
+    """Resumable campaign batches; PushNotification predates its migrations (see migration_operations)"""
+
+    dependencies = [
+        ('accounts', '0018_fcmtoken'),
+    ]
+
+    operations = [
+        add_untracked_columns('PushNotification', ['failed_count', 'last_user_id', 'locked_until']),
+    ]
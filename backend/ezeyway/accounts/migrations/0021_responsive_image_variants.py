@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+from accounts.migration_operations import add_untracked_columns
+
+
+class Migration(migrations.Migration):
+    """Responsive renditions; VendorShopImage, Category and Slider predate their migrations (see migration_operations)"""
+
+    dependencies = [
+        ('accounts', '0020_message_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        add_untracked_columns('VendorShopImage', ['image_variants']),
+        add_untracked_columns('Category', ['icon_variants']),
+        add_untracked_columns('Slider', ['image_variants']),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """The same content may be stored twice (public and protected), so the digest is no longer the key"""
+
+    dependencies = [
+        ('accounts', '0022_mediablob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediablob',
+            name='digest',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='mediablob',
+            name='id',
+            field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+            preserve_default=False,
+        ),
+    ]
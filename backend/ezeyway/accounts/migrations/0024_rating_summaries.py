@@ -0,0 +1,59 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    """Summaries of the reviews written so far; later reviews update them incrementally"""
+    from accounts.rating_summaries import rebuild
+    rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0023_mediablob_protected'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingSummary',
+            fields=[
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('overall_sum', models.PositiveIntegerField(default=0)),
+                ('food_quality_sum', models.PositiveIntegerField(default=0)),
+                ('food_quality_count', models.PositiveIntegerField(default=0)),
+                ('delivery_sum', models.PositiveIntegerField(default=0)),
+                ('delivery_count', models.PositiveIntegerField(default=0)),
+                ('vendor_sum', models.PositiveIntegerField(default=0)),
+                ('vendor_count', models.PositiveIntegerField(default=0)),
+                ('rating_1_count', models.PositiveIntegerField(default=0)),
+                ('rating_2_count', models.PositiveIntegerField(default=0)),
+                ('rating_3_count', models.PositiveIntegerField(default=0)),
+                ('rating_4_count', models.PositiveIntegerField(default=0)),
+                ('rating_5_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='accounts.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VendorRatingSummary',
+            fields=[
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('overall_sum', models.PositiveIntegerField(default=0)),
+                ('food_quality_sum', models.PositiveIntegerField(default=0)),
+                ('food_quality_count', models.PositiveIntegerField(default=0)),
+                ('delivery_sum', models.PositiveIntegerField(default=0)),
+                ('delivery_count', models.PositiveIntegerField(default=0)),
+                ('vendor_sum', models.PositiveIntegerField(default=0)),
+                ('vendor_count', models.PositiveIntegerField(default=0)),
+                ('rating_1_count', models.PositiveIntegerField(default=0)),
+                ('rating_2_count', models.PositiveIntegerField(default=0)),
+                ('rating_3_count', models.PositiveIntegerField(default=0)),
+                ('rating_4_count', models.PositiveIntegerField(default=0)),
+                ('rating_5_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='accounts.vendorprofile')),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
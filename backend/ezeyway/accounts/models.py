@@ -1,7 +1,7 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 import random
@@ -214,6 +214,11 @@ class VendorProfile(models.Model):
     status_override = models.BooleanField(default=False)  # Indicates if status is manually overridden
     status_override_date = models.DateField(blank=True, null=True)  # Date of the override
     
+    # Compiled from the hours and status above on save, see vendor_schedule.py
+    opening_schedule = models.JSONField(default=list, blank=True)  # [[open, close], ...] minutes of the week
+    is_open_now = models.BooleanField(default=False, db_index=True)  # Flipped by the schedule runner
+    next_transition_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    
     # FCM Token for push notifications
     fcm_token = models.TextField(blank=True, null=True)  # Firebase Cloud Messaging token
     fcm_updated_at = models.DateTimeField(blank=True, null=True)  # When FCM token was last updated
@@ -225,6 +230,15 @@ class VendorProfile(models.Model):
     def __str__(self):
         return f"{self.business_name} - {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        from .vendor_schedule import DERIVED_FIELDS, SOURCE_FIELDS, refresh
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or SOURCE_FIELDS.intersection(update_fields):
+            refresh(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(DERIVED_FIELDS)
+        super().save(*args, **kwargs)
+
 class VendorDocument(models.Model):
     vendor_profile = models.ForeignKey(VendorProfile, on_delete=models.CASCADE, related_name='additional_docs')
     document = models.CharField(max_length=500)
@@ -236,6 +250,7 @@ class VendorDocument(models.Model):
 class VendorShopImage(models.Model):
     vendor_profile = models.ForeignKey(VendorProfile, on_delete=models.CASCADE, related_name='shop_images')
     image = models.CharField(max_length=500)
+    image_variants = models.JSONField(blank=True, null=True)  # Responsive renditions, see responsive_images
     is_primary = models.BooleanField(default=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
@@ -329,6 +344,7 @@ def product_image_upload_path(instance, filename):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=product_image_upload_path)
+    image_variants = models.JSONField(blank=True, null=True)  # Responsive renditions, see responsive_images
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -535,6 +551,7 @@ def category_icon_upload_path(instance, filename):
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     icon = models.ImageField(upload_to=category_icon_upload_path, blank=True, null=True, help_text="Upload category icon")
+    icon_variants = models.JSONField(blank=True, null=True)  # Responsive renditions, see responsive_images
     description = models.TextField(blank=True, null=True, help_text="Optional category description")
     is_active = models.BooleanField(default=True)
     display_order = models.PositiveIntegerField(default=0, help_text="Display order (0 = first)")
@@ -666,6 +683,7 @@ class Slider(models.Model):
     title = models.CharField(max_length=200, help_text="Slider title")
     description = models.TextField(blank=True, null=True, help_text="Optional slider description")
     image = models.ImageField(upload_to=slider_upload_path, help_text="Upload slider image (GIF, PNG, SVG, JPEG)")
+    image_variants = models.JSONField(blank=True, null=True)  # Responsive renditions, see responsive_images
     link_url = models.URLField(blank=True, null=True, help_text="Optional link when slider is clicked")
     visibility = models.CharField(max_length=20, choices=VISIBILITY_CHOICES, default='both')
     display_order = models.PositiveIntegerField(default=0, help_text="Display order (0 = first, higher numbers = later)")
@@ -708,6 +726,7 @@ class PushNotification(models.Model):
         ('draft', 'Draft'),
         ('sent', 'Sent'),
         ('scheduled', 'Scheduled'),
+        ('sending', 'Sending'),
     ]
     
     title = models.CharField(max_length=100, help_text="Notification title")
@@ -715,17 +734,73 @@ class PushNotification(models.Model):
     recipient_type = models.CharField(max_length=20, choices=RECIPIENT_CHOICES, default='both')
     scheduled_time = models.DateTimeField(blank=True, null=True, help_text="Send immediately if empty")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
-    sent_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)  # Devices the push was delivered to
+    failed_count = models.PositiveIntegerField(default=0)
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(blank=True, null=True)
     
+    # Dispatch progress, so a campaign interrupted mid-send resumes where it stopped
+    last_user_id = models.PositiveIntegerField(default=0)  # Recipients are processed in id order
+    locked_until = models.DateTimeField(blank=True, null=True)  # Lease held by the dispatching worker
+    
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return f"{self.title} - {self.get_recipient_type_display()}"
 
+class FCMToken(models.Model):
+    """One row per device registered for push notifications"""
+    PLATFORM_CHOICES = [
+        ('android', 'Android'),
+        ('ios', 'iOS'),
+        ('web', 'Web'),
+    ]
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='fcm_tokens')
+    token = models.CharField(max_length=512, unique=True)
+    platform = models.CharField(max_length=20, choices=PLATFORM_CHOICES, default='android')
+    is_active = models.BooleanField(default=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-last_seen']
+        indexes = [
+            models.Index(fields=['user', 'is_active']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.platform} ({self.token[:12]}...)"
+    
+    @classmethod
+    def register(cls, user, token, platform='android'):
+        """Create or refresh a device token; a token that moved to another account follows the new user"""
+        if platform not in dict(cls.PLATFORM_CHOICES):
+            platform = 'android'
+        fcm_token, _ = cls.objects.update_or_create(
+            token=token,
+            defaults={
+                'user': user,
+                'platform': platform,
+                'is_active': True,
+                'last_seen': timezone.now(),
+            }
+        )
+        return fcm_token
+
+class MediaBlob(models.Model):
+    """One stored file per unique upload content and area (public or protected); refcount counts the paths handed out for it"""
+    digest = models.CharField(max_length=64, db_index=True)  # SHA-256 of the content
+    name = models.CharField(max_length=255, unique=True)  # Storage path under blobs/ or protected/
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
 class ProductFeaturedPurchase(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='featured_purchases')
     vendor = models.ForeignKey(VendorProfile, on_delete=models.CASCADE, related_name='featured_purchases')
@@ -742,6 +817,72 @@ class ProductFeaturedPurchase(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.package.name} ({self.start_date} to {self.end_date})"
 
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=VendorShopImage)
+@receiver(post_save, sender=Slider)
+@receiver(post_save, sender=Category)
+def render_responsive_variants(sender, instance, **kwargs):
+    """Render width variants whenever a new image is uploaded"""
+    from .responsive_images import schedule_variants
+    schedule_variants(instance)
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_fragment(sender, instance, **kwargs):
+    """Images are part of the cached product card, which is keyed by the product's updated_at"""
+    from .product_fragments import touch_products
+    touch_products([instance.product_id])
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+@receiver(post_save, sender='accounts.CategoryParameter')
+@receiver(post_delete, sender='accounts.CategoryParameter')
+@receiver(post_save, sender='accounts.SubCategoryParameter')
+@receiver(post_delete, sender='accounts.SubCategoryParameter')
+@receiver(post_save, sender=FeaturedProductPackage)
+@receiver(post_delete, sender=FeaturedProductPackage)
+@receiver(post_save, sender=DeliveryRadius)
+@receiver(post_delete, sender=DeliveryRadius)
+@receiver(post_save, sender=Slider)
+@receiver(post_delete, sender=Slider)
+def invalidate_catalog_cache(sender, **kwargs):
+    """Bump the catalog cache version of every data set built from this model"""
+    from .catalog_cache import catalog_cache
+    # After commit, so no request can cache the old rows under the new version
+    transaction.on_commit(lambda: catalog_cache.bump_model(sender))
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_quote(sender, instance, **kwargs):
+    from .cart_pricing import cart_pricing
+    transaction.on_commit(lambda: cart_pricing.invalidate([instance.cart_id]))
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=VendorProfile)
+def invalidate_cart_quotes_of(sender, instance, **kwargs):
+    """Price, stock, status and delivery settings are part of every quote of a cart holding the product"""
+    from .cart_pricing import cart_pricing
+    lookup = 'product_id' if sender is Product else 'product__vendor_id'
+
+    def invalidate():
+        cart_ids = CartItem.objects.filter(**{lookup: instance.pk}).values_list('cart_id', flat=True).distinct()
+        cart_pricing.invalidate(cart_ids)
+    transaction.on_commit(invalidate)
+
+@receiver(post_save, sender='accounts.OrderDelivery')
+@receiver(post_save, sender='accounts.DeliveryRider')
+def update_rider_dispatch(sender, instance, **kwargs):
+    """Keep this worker's dispatch index in step with assignments and riders switching on or off"""
+    from .rider_dispatch import OPEN_DELIVERY_STATUSES, rider_dispatcher
+    rider = instance.rider if sender._meta.model_name == 'orderdelivery' else instance
+
+    def update():
+        available = rider.is_active and not rider.deliveries.filter(status__in=OPEN_DELIVERY_STATUSES).exists()
+        rider_dispatcher.set_available(rider.pk, available)
+    transaction.on_commit(update)
+
 # Import message models
 from .message_models import *
 
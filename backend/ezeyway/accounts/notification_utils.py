@@ -131,65 +131,53 @@ def send_order_status_notifications(order, new_status, old_status=None):
             send_realtime=True
         )
 
-        # Send FCM auto-open message
+        # Send FCM auto-open message to every device of the vendor
         print(f"NOTIFICATION_UTILS: Processing new order {order.id}")
         print(f"Vendor: {order.vendor.business_name}")
-        print(f"Has FCM token: {hasattr(order.vendor, 'fcm_token')}")
-        if hasattr(order.vendor, 'fcm_token'):
-            print(f"FCM token exists: {bool(order.vendor.fcm_token)}")
-            if order.vendor.fcm_token:
-                print(f"FCM token: {order.vendor.fcm_token[:30]}...")
 
         try:
-            if hasattr(order.vendor, 'fcm_token') and order.vendor.fcm_token:
-                print(f"SENDING AUTO-OPEN FCM for order {order.id}")
-                from .firebase_init import send_data_only_message
+            print(f"SENDING AUTO-OPEN FCM for order {order.id}")
 
-                try:
-                    # Get order items safely
-                    order_items = ", ".join([f"{item.quantity}x {item.product.name}" for item in order.orderitem_set.all()[:3]])
-                    if order.orderitem_set.count() > 3:
-                        order_items += "..."
-                except:
-                    order_items = "Order items"
+            try:
+                # Get order items safely
+                order_items = ", ".join([f"{item.quantity}x {item.product.name}" for item in order.orderitem_set.all()[:3]])
+                if order.orderitem_set.count() > 3:
+                    order_items += "..."
+            except:
+                order_items = "Order items"
 
-                try:
-                    customer_name = order.customer.get_full_name() or order.customer.username
-                except:
-                    customer_name = "Customer"
+            try:
+                customer_name = order.customer.get_full_name() or order.customer.username
+            except:
+                customer_name = "Customer"
 
-                fcm_data = {
-                    "autoOpen": "true",
-                    "orderId": str(order.id),
-                    "orderNumber": order.order_number,
-                    "customerName": customer_name,
-                    "amount": str(order.total_amount),
-                    "items": order_items,
-                    "address": "Delivery address",
-                    "action": "autoOpenOrder",
-                    "forceOpen": "true"
-                }
+            fcm_data = {
+                "autoOpen": "true",
+                "orderId": str(order.id),
+                "orderNumber": order.order_number,
+                "customerName": customer_name,
+                "amount": str(order.total_amount),
+                "items": order_items,
+                "address": "Delivery address",
+                "action": "autoOpenOrder",
+                "forceOpen": "true"
+            }
+            print(f"FCM Data: {fcm_data}")
 
-                notification_data = {
-                    "title": f"🔥 NEW ORDER #{order.order_number}",
-                    "body": f"{customer_name} • ${order.total_amount} • {order_items}"
-                }
-                print(f"FCM Data: {fcm_data}")
+            from .push_sender import push_sender
 
-                from .firebase_init import send_fcm_message
+            result = push_sender.send_to_user(
+                order.vendor.user,
+                title=f"🔥 NEW ORDER #{order.order_number}",
+                body=f"{customer_name} • ${order.total_amount} • {order_items}",
+                data=fcm_data,
+                channel_id='order_notifications'
+            )
 
-                success = send_fcm_message(
-                    token=order.vendor.fcm_token,
-                    data=fcm_data,
-                    notification=notification_data
-                )
-
-                if success:
-                    print(f"SUCCESS: Auto-open FCM sent for order {order.id}")
-                else:
-                    print(f"FAILED: Auto-open FCM failed for order {order.id}")
+            if result:
+                print(f"SUCCESS: Auto-open FCM sent for order {order.id}: {result}")
             else:
-                print(f"ERROR: No FCM token for vendor {order.vendor.business_name}")
+                print(f"FAILED: Auto-open FCM failed for order {order.id}: {result}")
         except Exception as e:
             print(f"EXCEPTION sending auto-open FCM: {e}")
             import traceback
@@ -201,11 +189,6 @@ def send_fcm_notification_to_customer(order, status):
     Send FCM notification to customer for order acceptance/rejection
     """
     try:
-        # Check if customer has FCM token
-        if not hasattr(order.customer, 'fcm_token') or not order.customer.fcm_token:
-            print(f"No FCM token for customer {order.customer.username}")
-            return
-
         print(f"SENDING FCM TO CUSTOMER: Order {order.id}, Status: {status}")
 
         if status == 'confirmed':
@@ -228,23 +211,20 @@ def send_fcm_notification_to_customer(order, status):
             "click_action": "FLUTTER_NOTIFICATION_CLICK"
         }
 
-        notification_data = {
-            "title": title,
-            "body": body
-        }
-
-        from .firebase_init import send_fcm_message
+        from .push_sender import push_sender
 
-        success = send_fcm_message(
-            token=order.customer.fcm_token,
+        result = push_sender.send_to_user(
+            order.customer,
+            title=title,
+            body=body,
             data=fcm_data,
-            notification=notification_data
+            channel_id='order_notifications'
         )
 
-        if success:
-            print(f"SUCCESS: FCM sent to customer for order {order.id} status {status}")
+        if result:
+            print(f"SUCCESS: FCM sent to customer for order {order.id} status {status}: {result}")
         else:
-            print(f"FAILED: FCM failed to customer for order {order.id}")
+            print(f"FAILED: FCM failed to customer for order {order.id}: {result}")
 
     except Exception as e:
         print(f"EXCEPTION sending FCM to customer: {e}")
@@ -137,6 +137,8 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
 
 class DeliveryRider(models.Model):
+    # The rider's own login; only this account (besides the vendor and admins) may report its position
+    user = models.OneToOneField(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='rider_profile')
     name = models.CharField(max_length=200)
     phone = models.CharField(max_length=15)
     vehicle_type = models.CharField(max_length=50, choices=[
@@ -277,6 +279,66 @@ class OrderReview(models.Model):
     def __str__(self):
         return f"Review for Order #{self.order.order_number} - {self.overall_rating}★"
 
+class RatingSummary(models.Model):
+    """Running totals of the reviews of one product or vendor (see rating_summaries.py)"""
+    review_count = models.PositiveIntegerField(default=0)
+
+    # Sums per rating dimension; the optional ones keep their own count
+    overall_sum = models.PositiveIntegerField(default=0)
+    food_quality_sum = models.PositiveIntegerField(default=0)
+    food_quality_count = models.PositiveIntegerField(default=0)
+    delivery_sum = models.PositiveIntegerField(default=0)
+    delivery_count = models.PositiveIntegerField(default=0)
+    vendor_sum = models.PositiveIntegerField(default=0)
+    vendor_count = models.PositiveIntegerField(default=0)
+
+    # Histogram of overall ratings
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def _average(total, count):
+        return round(total / count, 2) if count else 0.0
+
+    @property
+    def average_rating(self):
+        return self._average(self.overall_sum, self.review_count)
+
+    @property
+    def histogram(self):
+        return {str(stars): getattr(self, f'rating_{stars}_count') for stars in range(1, 6)}
+
+    def as_aggregate(self):
+        """Same shape as the review endpoints' 'aggregate'"""
+        return {
+            'average_rating': self.average_rating,
+            'total_reviews': self.review_count,
+            'average_quality': self._average(self.food_quality_sum, self.food_quality_count),
+            'average_value': self._average(self.delivery_sum, self.delivery_count),
+            'average_service': self._average(self.vendor_sum, self.vendor_count),
+            'histogram': self.histogram,
+        }
+
+class ProductRatingSummary(RatingSummary):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average_rating}★ ({self.review_count})"
+
+class VendorRatingSummary(RatingSummary):
+    vendor = models.OneToOneField(VendorProfile, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+
+    def __str__(self):
+        return f"{self.vendor_id}: {self.average_rating}★ ({self.review_count})"
+
 class OrderRefund(models.Model):
     REFUND_STATUS_CHOICES = [
         ('requested', 'Requested'),
@@ -4,8 +4,11 @@ from .order_models import (
     Order, OrderItem, DeliveryRider, OrderDelivery, OrderStatusHistory,
     PaymentTransaction, OrderReview, OrderRefund, OrderNotification
 )
+from .dynamic_fields import DynamicFieldsMixin
 from .models import Product, CustomUser, VendorProfile
-from .serializers import CustomerProductSerializer, UserSerializer
+from .protected_media import REFUND_DOCUMENT_FIELDS, refund_documents
+from .product_fragments import product_fragment_cache
+from .serializers import CustomerProductSerializer, ProductFragmentListSerializer, UserSerializer
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product_details = CustomerProductSerializer(source='product', read_only=True)
@@ -18,12 +21,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
             'vendor_name', 'product_selections'
         ]
         read_only_fields = ['id', 'total_price', 'product_name', 'product_description', 'vendor_name']
+        list_serializer_class = ProductFragmentListSerializer
 
 class DeliveryRiderSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeliveryRider
         fields = [
-            'id', 'name', 'phone', 'vehicle_type', 'vehicle_number', 
+            'id', 'user', 'name', 'phone', 'vehicle_type', 'vehicle_number', 
             'rating', 'total_deliveries', 'current_latitude', 'current_longitude'
         ]
         read_only_fields = ['id', 'rating', 'total_deliveries']
@@ -96,6 +100,13 @@ class OrderRefundSerializer(serializers.ModelSerializer):
             'completed_at', 'appeal_at', 'processed_by', 'customer_received_at', 'support_contacted_at'
         ]
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Documents are downloaded through the access-checked media view, never by storage path
+        for field in REFUND_DOCUMENT_FIELDS:
+            data[field] = refund_documents(self.context.get('request'), instance.pk, field, data.get(field))
+        return data
+
 
 class OrderNotificationSerializer(serializers.ModelSerializer):
     role = serializers.SerializerMethodField()
@@ -145,7 +156,19 @@ class OrderNotificationSerializer(serializers.ModelSerializer):
         # Fallback (should rarely happen)
         return 'unknown'
     
-class OrderSerializer(serializers.ModelSerializer):
+class OrderListSerializer(serializers.ListSerializer):
+    """Order pages load the product cards of all their items at once"""
+
+    def to_representation(self, data):
+        orders = list(data.all() if hasattr(data, 'all') else data)
+        if 'items' in self.child.fields:
+            products = [item.product for order in orders for item in order.items.all()]
+            product_fragment_cache.prefetch(products, self.context)
+        representation = super().to_representation(orders)
+        product_fragment_cache.flush(self.context)
+        return representation
+
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     customer_details = UserSerializer(source='customer', read_only=True)
     vendor_details = serializers.SerializerMethodField()
@@ -179,6 +202,32 @@ class OrderSerializer(serializers.ModelSerializer):
             'id', 'order_number', 'created_at', 'confirmed_at', 'prepared_at',
             'out_for_delivery_at', 'delivered_at', 'cancelled_at'
         ]
+        # Order lists leave out the vendor profile and the order's audit trail
+        lite_fields = [
+            'id', 'order_number', 'customer', 'customer_details', 'vendor',
+            'status', 'payment_status', 'payment_method', 'delivery_name', 'delivery_phone',
+            'delivery_address', 'delivery_latitude', 'delivery_longitude', 'delivery_instructions',
+            'delivery_distance', 'subtotal', 'delivery_fee', 'tax_amount', 'discount_amount',
+            'total_amount', 'created_at', 'confirmed_at', 'prepared_at', 'out_for_delivery_at',
+            'delivered_at', 'cancelled_at', 'estimated_preparation_time', 'estimated_delivery_time',
+            'delivery_boy_phone', 'vehicle_number', 'vehicle_color', 'cancellation_reason', 'notes',
+            'items', 'delivery', 'review', 'can_be_cancelled', 'can_be_reviewed'
+        ]
+        select_related_fields = {
+            'customer_details': ('customer',),
+            'vendor_details': ('vendor__user', 'vendor__rating_summary'),
+            'delivery': ('delivery__rider',),
+            'review': ('review__customer',),
+            'notifications': ('customer', 'vendor__user'),
+        }
+        prefetch_related_fields = {
+            'items': ('items__product__vendor',),
+            'status_history': ('status_history__changed_by',),
+            'transactions': ('transactions',),
+            'refunds': ('refunds__customer', 'refunds__processed_by'),
+            'notifications': ('notifications',),
+        }
+        list_serializer_class = OrderListSerializer
     
     def get_vendor_details(self, obj):
         from .serializers import VendorProfileSerializer
@@ -245,8 +294,9 @@ class CreateOrderSerializer(serializers.Serializer):
         
         # Group items by vendor
         vendor_items = {}
+        products = Product.objects.select_related('vendor').in_bulk([int(item['product_id']) for item in items_data])
         for item_data in items_data:
-            product = Product.objects.get(id=item_data['product_id'])
+            product = products[int(item_data['product_id'])]
             vendor_id = product.vendor.id
             
             if vendor_id not in vendor_items:
@@ -63,7 +63,10 @@ urlpatterns = [
     
     # Delivery URLs
     path('delivery/riders/', order_views.DeliveryRiderListView.as_view(), name='delivery_riders'),
+    path('delivery/riders/me/location/', order_views.update_rider_location_api, name='update_rider_location'),
     path('delivery/<int:delivery_id>/location/', order_views.update_delivery_location_api, name='update_delivery_location'),
+    path('delivery/orders/<int:order_id>/nearest-riders/', order_views.nearest_riders_api, name='nearest_riders'),
+    path('delivery/dispatch/', order_views.dispatch_orders_api, name='dispatch_orders'),
 
     # Ship order endpoint
     path('vendor/orders/<int:order_id>/ship/', order_views.update_order_status_api, name='ship_order'),
@@ -2,10 +2,13 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import PermissionDenied
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q, Count, Sum, Avg, F
 from django.shortcuts import get_object_or_404
 from datetime import datetime, timedelta
+from channels.layers import get_channel_layer
 from .order_models import (
     Order, OrderItem, DeliveryRider, OrderDelivery, OrderStatusHistory,
     PaymentTransaction, OrderReview, OrderRefund, OrderNotification
@@ -16,36 +19,24 @@ from .order_serializers import (
     OrderDeliverySerializer
 )
 from .models import CustomUser, VendorProfile
+from .cart_pricing import delivery_fee_for
+from .dynamic_fields import DynamicFieldsViewMixin
+from .protected_media import refund_documents
+from .rider_tracking import LocationFix, can_report_location, rider_tracker
+from .rider_dispatch import OPEN_DELIVERY_STATUSES, rider_dispatcher
+from .rating_summaries import apply_review, empty_aggregate, ratings_of, summary_of
 from .consumers import send_vendor_notification
 from .notification_utils import send_order_status_notifications, send_payment_notification, send_refund_notification
 
 def calculate_delivery_fee(order):
     """Calculate delivery fee for an order based on product settings"""
-    calculated_fee = 0
-    has_free_delivery = False
-    
-    for item in order.items.all():
-        product = item.product
-        
-        # Check if any item has free delivery
-        if product.free_delivery:
-            has_free_delivery = True
-            break
-        
-        # Check if product has custom delivery fee
-        if product.custom_delivery_fee_enabled and product.custom_delivery_fee:
-            calculated_fee = max(calculated_fee, float(product.custom_delivery_fee))
-    
-    if has_free_delivery:
-        return 0
-    elif calculated_fee > 0:
-        return calculated_fee
-    else:
-        # Use vendor's default delivery fee or 0
-        return float(order.vendor.delivery_fee or 0)
+    products = [item.product for item in order.items.select_related('product')]
+    # Same rule as cart quotes
+    calculated_fee = delivery_fee_for(order.vendor, products)
+    return float(calculated_fee) if calculated_fee else 0
 
 # Customer Order Views
-class CustomerOrderListView(generics.ListAPIView):
+class CustomerOrderListView(DynamicFieldsViewMixin, generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = PageNumberPagination
@@ -184,7 +175,7 @@ def cancel_order_api(request, order_id):
         return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
 # Vendor Order Views
-class VendorOrderListView(generics.ListAPIView):
+class VendorOrderListView(DynamicFieldsViewMixin, generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = None  # Disable pagination to return all orders
@@ -199,10 +190,6 @@ class VendorOrderListView(generics.ListAPIView):
                 vendor=vendor_profile
             )
 
-            print(f"🔥 Orders RECEIVED by vendor {vendor_profile.id}: {queryset.count()} orders")
-            for order in queryset[:5]:  # Log first 5 orders
-                print(f"🔥 Order {order.id}: Vendor={order.vendor.business_name} (ID={order.vendor.id}), Customer={order.customer.username}")
-
             # Filter by status
             status_filter = self.request.query_params.get('status')
             if status_filter:
@@ -224,7 +211,7 @@ class VendorOrderListView(generics.ListAPIView):
     def list(self, request, *args, **kwargs):
         try:
             # Override to return all orders without pagination
-            queryset = self.get_queryset()
+            queryset = self.filter_queryset(self.get_queryset())
             serializer = self.get_serializer(queryset, many=True)
             print(f"🔥 VendorOrderListView returning {len(serializer.data)} orders RECEIVED by vendor")
             for order in serializer.data[:3]:  # Log first 3 orders
@@ -383,7 +370,9 @@ def create_review_api(request, order_id):
             # Update existing review
             serializer = OrderReviewSerializer(existing_review, data=request.data, partial=True)
             if serializer.is_valid():
+                before = ratings_of(existing_review)
                 review = serializer.save()
+                apply_review(review, before)
                 return Response({
                     'message': 'Review updated successfully',
                     'review': OrderReviewSerializer(review).data
@@ -393,6 +382,7 @@ def create_review_api(request, order_id):
             serializer = OrderReviewSerializer(data=request.data)
             if serializer.is_valid():
                 review = serializer.save(order=order, customer=request.user)
+                apply_review(review)
                 return Response({
                     'message': 'Review created successfully',
                     'review': OrderReviewSerializer(review).data
@@ -548,7 +538,7 @@ def admin_order_stats_api(request):
     
     return Response(stats)
 
-class AdminOrderListView(generics.ListAPIView):
+class AdminOrderListView(DynamicFieldsViewMixin, generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -683,8 +673,9 @@ def vendor_process_refund_api(request, refund_id):
                 'bank_account_name': refund.bank_account_name,
                 'bank_account_number': refund.bank_account_number,
                 'bank_branch': refund.bank_branch,
-                'evidence_photos': refund.evidence_photos,
-                'vendor_supporting_docs': refund.vendor_supporting_docs,
+                'evidence_photos': refund_documents(request, refund.id, 'evidence_photos', refund.evidence_photos),
+                'vendor_supporting_docs': refund_documents(request, refund.id, 'vendor_supporting_docs',
+                                                           refund.vendor_supporting_docs),
                 'requested_at': refund.requested_at,
                 'approved_at': refund.approved_at,
                 'processed_at': refund.processed_at,
@@ -713,9 +704,16 @@ def vendor_process_refund_api(request, refund_id):
     approved_amount = request.data.get('approved_amount')
     vendor_supporting_docs = request.data.get('vendor_supporting_docs')
 
-    # Update vendor documents if provided
+    # Update vendor documents if provided. Uploaded files can be kept or dropped but never re-pointed:
+    # entries are matched to the stored ones by saved_filename and client-sent paths are ignored
     if vendor_supporting_docs is not None:
-        refund.vendor_supporting_docs = vendor_supporting_docs
+        stored = {document.get('saved_filename'): document for document in refund.vendor_supporting_docs or []
+                  if isinstance(document, dict) and document.get('saved_filename')}
+        refund.vendor_supporting_docs = [
+            stored.get(document.get('saved_filename')) or
+            {key: value for key, value in document.items() if key not in ('file_path', 'file_url', 'download_url')}
+            for document in vendor_supporting_docs if isinstance(document, dict)
+        ]
         # Don't save yet, will be saved in specific action blocks or general save
 
     if action == 'approved':
@@ -800,15 +798,21 @@ class DeliveryRiderListView(generics.ListCreateAPIView):
             return DeliveryRider.objects.none()
         return DeliveryRider.objects.all().order_by('name')
 
+    def perform_create(self, serializer):
+        # The linked account may report the rider's position, so only admins register riders
+        if not self.request.user.is_superuser:
+            raise PermissionDenied('Only admins can register riders')
+        serializer.save()
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def update_delivery_location_api(request, delivery_id):
-    """Update delivery rider location"""
+    """Update delivery rider location (HTTP fallback of ws/deliveries/<id>/location/)"""
     try:
-        delivery = OrderDelivery.objects.get(id=delivery_id)
+        delivery = OrderDelivery.objects.select_related('rider', 'order__vendor').get(id=delivery_id)
         
-        # Only rider or admin can update location
-        if not (request.user.is_superuser or request.user == delivery.rider.user):
+        # Only the rider, the vendor or admin can update location
+        if not can_report_location(request.user, delivery):
             return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
         
         latitude = request.data.get('latitude')
@@ -817,15 +821,16 @@ def update_delivery_location_api(request, delivery_id):
         if not latitude or not longitude:
             return Response({'error': 'Latitude and longitude required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        delivery.current_latitude = latitude
-        delivery.current_longitude = longitude
-        delivery.save()
+        try:
+            fix = LocationFix(delivery.rider_id, delivery.id, latitude, longitude)
+        except (TypeError, ValueError):
+            return Response({'error': 'Latitude and longitude must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Update rider's current location
-        delivery.rider.current_latitude = latitude
-        delivery.rider.current_longitude = longitude
-        delivery.rider.last_location_update = timezone.now()
-        delivery.rider.save()
+        # Latest position store, fan-out to the customer and a narrow update instead of two full saves
+        rider_tracker.ingest_sync(get_channel_layer(), fix)
+        latest = rider_tracker.latest(delivery.id) or fix
+        delivery.current_latitude = latest.latitude
+        delivery.current_longitude = latest.longitude
         
         return Response({
             'message': 'Location updated successfully',
@@ -835,6 +840,116 @@ def update_delivery_location_api(request, delivery_id):
     except OrderDelivery.DoesNotExist:
         return Response({'error': 'Delivery not found'}, status=status.HTTP_404_NOT_FOUND)
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def update_rider_location_api(request):
+    """Position of the signed-in rider between deliveries, so dispatch can find them"""
+    rider = DeliveryRider.objects.filter(user=request.user).only('id', 'is_active').first()
+    if rider is None:
+        return Response({'error': 'No rider linked to this account'}, status=status.HTTP_403_FORBIDDEN)
+    if not rider.is_active:
+        return Response({'error': 'Rider is switched off'}, status=status.HTTP_409_CONFLICT)
+    
+    latitude = request.data.get('latitude')
+    longitude = request.data.get('longitude')
+    
+    if not latitude or not longitude:
+        return Response({'error': 'Latitude and longitude required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        fix = LocationFix(rider.id, None, latitude, longitude)
+    except (TypeError, ValueError):
+        return Response({'error': 'Latitude and longitude must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Updates the dispatch index here and last_location_update for the other workers' rebuilds
+    accepted = rider_tracker.ingest_sync(get_channel_layer(), fix)
+    return Response({'message': 'Location updated successfully', 'accepted': accepted})
+
+DISPATCHABLE_ORDER_STATUSES = ('confirmed', 'preparing', 'ready_for_pickup')
+MAX_NEAREST_RIDERS = 20
+
+def riders_with_distance(matches):
+    """Serialized riders of [(distance, rider_id)] in the same order"""
+    riders = DeliveryRider.objects.in_bulk([rider_id for _, rider_id in matches])
+    return [
+        {**DeliveryRiderSerializer(riders[rider_id]).data, 'distance_m': round(distance)}
+        for distance, rider_id in matches if rider_id in riders
+    ]
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def nearest_riders_api(request, order_id):
+    """Closest available riders to the order's vendor (vendor or admin)"""
+    try:
+        order = Order.objects.select_related('vendor').get(id=order_id)
+    except Order.DoesNotExist:
+        return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not request.user.is_superuser and order.vendor.user_id != request.user.id:
+        return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
+
+    if order.vendor.latitude is None or order.vendor.longitude is None:
+        return Response({'error': 'Vendor location is not set'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        k = min(max(int(request.GET.get('k', 5)), 1), MAX_NEAREST_RIDERS)
+    except ValueError:
+        return Response({'error': 'k must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+    matches = rider_dispatcher.nearest(float(order.vendor.latitude), float(order.vendor.longitude), k)
+    return Response({
+        'order_id': order.id,
+        'pickup': {'latitude': order.vendor.latitude, 'longitude': order.vendor.longitude},
+        'riders': riders_with_distance(matches),
+    })
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def dispatch_orders_api(request):
+    """Assign riders to several orders at once (admin only).
+
+    Takes order_ids, or every confirmed/preparing/ready order without a rider.
+    """
+    if not request.user.is_superuser:
+        return Response({'error': 'Access denied'}, status=status.HTTP_403_FORBIDDEN)
+
+    orders = Order.objects.filter(status__in=DISPATCHABLE_ORDER_STATUSES, delivery__isnull=True,
+                                  vendor__latitude__isnull=False, vendor__longitude__isnull=False)
+    order_ids = request.data.get('order_ids')
+    if order_ids is not None:
+        if not isinstance(order_ids, list):
+            return Response({'error': 'order_ids must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        orders = orders.filter(id__in=order_ids)
+    orders = {order.id: order for order in orders.select_related('vendor')}
+
+    assigned = rider_dispatcher.assign_batch({
+        order.id: (float(order.vendor.latitude), float(order.vendor.longitude)) for order in orders.values()
+    })
+
+    # Another worker's index may have handed out the same rider meanwhile
+    busy = set(OrderDelivery.objects.filter(
+        rider_id__in=[rider_id for rider_id, _ in assigned.values()], status__in=OPEN_DELIVERY_STATUSES
+    ).values_list('rider_id', flat=True))
+
+    deliveries = []
+    with transaction.atomic():
+        for order_id, (rider_id, distance) in assigned.items():
+            if rider_id in busy:
+                continue
+            order = orders[order_id]
+            delivery = OrderDelivery.objects.create(
+                order=order, rider_id=rider_id,
+                pickup_latitude=order.vendor.latitude, pickup_longitude=order.vendor.longitude,
+            )
+            deliveries.append({'order_id': order_id, 'delivery_id': delivery.id, 'rider_id': rider_id,
+                               'distance_m': round(distance)})
+
+    dispatched = {delivery['order_id'] for delivery in deliveries}
+    return Response({
+        'assigned': deliveries,
+        'unassigned': [order_id for order_id in orders if order_id not in dispatched],
+    })
+
 # Vendor-specific order endpoints
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -1031,9 +1146,8 @@ def upload_refund_document_api(request, refund_id):
             unique_filename = f"{uuid.uuid4()}{file_extension}"
             file_path = os.path.join(upload_dir, unique_filename)
             
-            # Save file
+            # Save file (protected storage; clients get the download URL from the serializer)
             saved_path = default_storage.save(file_path, file)
-            file_url = default_storage.url(saved_path)
             
             # Determine target field based on user role
             if request.user == refund.customer:
@@ -1050,7 +1164,6 @@ def upload_refund_document_api(request, refund_id):
                 'filename': file.name,
                 'saved_filename': unique_filename,
                 'file_path': saved_path,
-                'file_url': file_url,
                 'uploaded_by': request.user.username,
                 'uploaded_at': timezone.now().isoformat(),
                 'type': doc_type
@@ -1065,7 +1178,7 @@ def upload_refund_document_api(request, refund_id):
             
             return Response({
                 'message': 'Document uploaded successfully',
-                'refund': OrderRefundSerializer(refund).data
+                'refund': OrderRefundSerializer(refund, context={'request': request}).data
             })
         
         return Response({'error': 'No document provided'}, status=status.HTTP_400_BAD_REQUEST)
@@ -1079,7 +1192,7 @@ def get_calculated_delivery_fee_api(request, order_id):
     """Get calculated delivery fee for an order"""
     try:
         vendor_profile = VendorProfile.objects.get(user=request.user)
-        order = Order.objects.get(id=order_id, vendor=vendor_profile)
+        order = Order.objects.select_related('vendor').get(id=order_id, vendor=vendor_profile)
         
         calculated_fee = calculate_delivery_fee(order)
         
@@ -1136,25 +1249,18 @@ def get_product_reviews_api(request, product_id):
     """Get aggregate reviews for a specific product"""
     try:
         from .models import Product, OrderItem
-        from django.db.models import Avg, Count
         
         # Get the product
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.select_related('rating_summary'), id=product_id)
         
         # Get all orders containing this product that have reviews
         reviews = OrderReview.objects.filter(
             order__items__product=product,
             order__status='delivered'
-        ).select_related('order', 'customer')
+        ).select_related('order', 'customer').distinct()
         
-        # Calculate aggregate metrics using actual OrderReview fields
-        aggregate_data = reviews.aggregate(
-            avg_rating=Avg('overall_rating'),
-            total_reviews=Count('id'),
-            avg_quality=Avg('food_quality_rating'),
-            avg_value=Avg('delivery_rating'),
-            avg_service=Avg('vendor_rating')
-        )
+        # Running totals instead of aggregating every review
+        summary = summary_of(product)
 
         # Get recent reviews
         recent_reviews = reviews.order_by('-created_at')[:5]
@@ -1163,13 +1269,7 @@ def get_product_reviews_api(request, product_id):
         response_data = {
             'product_id': product_id,
             'product_name': product.name,
-            'aggregate': {
-                'average_rating': float(aggregate_data['avg_rating'] or 0),
-                'total_reviews': aggregate_data['total_reviews'] or 0,
-                'average_quality': float(aggregate_data['avg_quality'] or 0),
-                'average_value': float(aggregate_data['avg_value'] or 0),
-                'average_service': float(aggregate_data['avg_service'] or 0)
-            },
+            'aggregate': summary.as_aggregate() if summary else empty_aggregate(),
             'recent_reviews': [{
                 'rating': getattr(review, 'overall_rating', None),
                 'comment': getattr(review, 'review_text', ''),
@@ -1263,8 +1363,7 @@ def get_order_reviews_api(request, order_id):
 def get_vendor_reviews_api(request, vendor_id):
     """Get aggregate reviews for a vendor's products"""
     try:
-        from django.db.models import Avg, Count
-        vendor_profile = get_object_or_404(VendorProfile, id=vendor_id)
+        vendor_profile = get_object_or_404(VendorProfile.objects.select_related('rating_summary'), id=vendor_id)
         
         # Get all reviews for this vendor's products
         reviews = OrderReview.objects.filter(
@@ -1272,14 +1371,8 @@ def get_vendor_reviews_api(request, vendor_id):
             order__status='delivered'
         ).select_related('order', 'customer')
         
-        # Calculate aggregate metrics using actual OrderReview fields
-        aggregate_data = reviews.aggregate(
-            avg_rating=Avg('overall_rating'),
-            total_reviews=Count('id'),
-            avg_quality=Avg('food_quality_rating'),
-            avg_value=Avg('delivery_rating'),
-            avg_service=Avg('vendor_rating')
-        )
+        # Running totals instead of aggregating every review
+        summary = summary_of(vendor_profile)
 
         # Get recent reviews
         recent_reviews = reviews.order_by('-created_at')[:5]
@@ -1288,13 +1381,7 @@ def get_vendor_reviews_api(request, vendor_id):
         response_data = {
             'vendor_id': vendor_id,
             'vendor_name': vendor_profile.business_name,
-            'aggregate': {
-                'average_rating': float(aggregate_data['avg_rating'] or 0),
-                'total_reviews': aggregate_data['total_reviews'] or 0,
-                'average_quality': float(aggregate_data['avg_quality'] or 0),
-                'average_value': float(aggregate_data['avg_value'] or 0),
-                'average_service': float(aggregate_data['avg_service'] or 0)
-            },
+            'aggregate': summary.as_aggregate() if summary else empty_aggregate(),
             'recent_reviews': [{
                 'rating': getattr(review, 'overall_rating', None),
                 'comment': getattr(review, 'review_text', ''),
@@ -0,0 +1,333 @@
+"""
+Presence Service
+Tracks which users are online with heartbeat-refreshed TTL entries and
+publishes online/offline changes only to the user's own contacts. Open
+sockets are counted per user, so closing one tab or device does not take a
+user offline while another is still connected.
+
+A socket dropped without a disconnect lets the entry lapse. The worker that
+served it checks the entry on its timer wheel one tick after the TTL and
+announces the user offline. If that worker died, no one announces it: after
+a lapse only the store is authoritative, as read by the presence snapshot
+(presence_subscribe) and the presence API.
+"""
+
+import asyncio
+import threading
+import time
+import logging
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .timer_wheel import HashedTimerWheel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRESENCE_TTL = 60  # seconds without a heartbeat before a user counts as offline
+DEFAULT_TIMER_TICK = 1  # seconds, resolution of the lapse checks
+
+
+def presence_group_name(user_id):
+    """Channel layer group that receives presence changes for one user"""
+    return f"presence_{user_id}"
+
+
+class InMemoryPresenceStore:
+    """Process-local presence registry, used in tests and single-worker setups"""
+
+    def __init__(self):
+        self._expires_at = {}  # user_id -> monotonic expiry time
+        self._connections = {}  # user_id -> open sockets
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, ttl):
+        """Refresh a user's entry. Returns True if the user was offline before."""
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._expires_at.get(user_id)
+            self._expires_at[user_id] = now + ttl
+            return expires_at is None or expires_at <= now
+
+    def attach(self, user_id, ttl):
+        """Count a new socket and refresh the entry. Returns True if the user was offline before."""
+        came_online = self.touch(user_id, ttl)
+        with self._lock:
+            self._connections[user_id] = self._connections.get(user_id, 0) + 1
+        return came_online
+
+    def detach(self, user_id):
+        """Uncount a socket. Returns True, after removing the entry, if it was the user's last one."""
+        with self._lock:
+            remaining = self._connections.get(user_id, 0) - 1
+            if remaining > 0:
+                self._connections[user_id] = remaining
+                return False
+            self._connections.pop(user_id, None)
+        self.remove(user_id)
+        return True
+
+    def remove(self, user_id):
+        with self._lock:
+            self._expires_at.pop(user_id, None)
+
+    def online_among(self, user_ids):
+        """Return the subset of user_ids that are currently online"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                user_id for user_id in user_ids
+                if self._expires_at.get(user_id, 0) > now
+            }
+
+    def lapsed(self, user_id):
+        """True, after dropping the entry and its socket count, if the user's entry expired"""
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._expires_at.get(user_id)
+            if expires_at is None or expires_at > now:
+                return False
+            del self._expires_at[user_id]
+            self._connections.pop(user_id, None)
+            return True
+
+    async def atouch(self, user_id, ttl):
+        return self.touch(user_id, ttl)
+
+    async def aattach(self, user_id, ttl):
+        return self.attach(user_id, ttl)
+
+    async def adetach(self, user_id):
+        return self.detach(user_id)
+
+    async def aremove(self, user_id):
+        self.remove(user_id)
+
+    async def aonline_among(self, user_ids):
+        return self.online_among(user_ids)
+
+    async def alapsed(self, user_id):
+        return self.lapsed(user_id)
+
+
+class CachePresenceStore:
+    """Presence registry on the Django cache, shared by all workers (Redis in production)"""
+
+    key_prefix = 'presence_'
+    connections_prefix = 'presence_connections_'
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def _connections_key(self, user_id):
+        return f"{self.connections_prefix}{user_id}"
+
+    def touch(self, user_id, ttl):
+        key = self._key(user_id)
+        # The socket counter lives as long as the entry, so sockets of a dead worker are forgotten too
+        if not cache.touch(self._connections_key(user_id), timeout=ttl):
+            cache.add(self._connections_key(user_id), 1, timeout=ttl)
+        # add() only succeeds when the key is missing, i.e. the user was offline
+        if cache.add(key, 1, timeout=ttl):
+            return True
+        cache.touch(key, timeout=ttl)
+        return False
+
+    def attach(self, user_id, ttl):
+        key = self._connections_key(user_id)
+        if not cache.add(key, 1, timeout=ttl):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, 1, timeout=ttl)
+        return self.touch(user_id, ttl)
+
+    def detach(self, user_id):
+        try:
+            remaining = cache.decr(self._connections_key(user_id))
+        except ValueError:
+            remaining = 0
+        if remaining > 0:
+            return False
+        cache.delete_many([self._key(user_id), self._connections_key(user_id)])
+        return True
+
+    def remove(self, user_id):
+        cache.delete_many([self._key(user_id), self._connections_key(user_id)])
+
+    def online_among(self, user_ids):
+        keys = {self._key(user_id): user_id for user_id in user_ids}
+        found = cache.get_many(list(keys))
+        return {keys[key] for key in found}
+
+    def lapsed(self, user_id):
+        # Expired entries (and their socket counters) are gone from the cache, as after the last detach
+        return not cache.has_key(self._key(user_id))
+
+    async def atouch(self, user_id, ttl):
+        key = self._key(user_id)
+        if not await cache.atouch(self._connections_key(user_id), timeout=ttl):
+            await cache.aadd(self._connections_key(user_id), 1, timeout=ttl)
+        if await cache.aadd(key, 1, timeout=ttl):
+            return True
+        await cache.atouch(key, timeout=ttl)
+        return False
+
+    async def aattach(self, user_id, ttl):
+        key = self._connections_key(user_id)
+        if not await cache.aadd(key, 1, timeout=ttl):
+            try:
+                await cache.aincr(key)
+            except ValueError:
+                await cache.aadd(key, 1, timeout=ttl)
+        return await self.atouch(user_id, ttl)
+
+    async def adetach(self, user_id):
+        try:
+            remaining = await cache.adecr(self._connections_key(user_id))
+        except ValueError:
+            remaining = 0
+        if remaining > 0:
+            return False
+        await cache.adelete_many([self._key(user_id), self._connections_key(user_id)])
+        return True
+
+    async def aremove(self, user_id):
+        await cache.adelete_many([self._key(user_id), self._connections_key(user_id)])
+
+    async def aonline_among(self, user_ids):
+        keys = {self._key(user_id): user_id for user_id in user_ids}
+        found = await cache.aget_many(list(keys))
+        return {keys[key] for key in found}
+
+    async def alapsed(self, user_id):
+        return not await cache.ahas_key(self._key(user_id))
+
+
+class PresenceService:
+    """Heartbeat-driven presence with fan-out limited to subscribed contacts"""
+
+    def __init__(self, store=None, ttl=None, tick=None):
+        self._store = store
+        self._ttl = ttl
+        self._tick = tick
+        self._wheels = weakref.WeakKeyDictionary()  # event loop -> HashedTimerWheel
+        self._watches = {}  # user_id -> lapse check scheduled by this worker
+        self._sockets = {}  # user_id -> sockets open on this worker
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = getattr(settings, 'PRESENCE_BACKEND', 'accounts.presence.CachePresenceStore')
+            self._store = import_string(backend)()
+        return self._store
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return getattr(settings, 'PRESENCE_TTL_SECONDS', DEFAULT_PRESENCE_TTL)
+        return self._ttl
+
+    @property
+    def tick(self):
+        if self._tick is None:
+            return getattr(settings, 'PRESENCE_TIMER_TICK_SECONDS', DEFAULT_TIMER_TICK)
+        return self._tick
+
+    def timer_wheel(self):
+        """The timer wheel of the running event loop (one per worker)"""
+        loop = asyncio.get_running_loop()
+        wheel = self._wheels.get(loop)
+        if wheel is None:
+            wheel = self._wheels[loop] = HashedTimerWheel(tick=self.tick)
+        return wheel
+
+    async def connect(self, channel_layer, user_id):
+        """Count one more socket for the user and tell their subscribers if they just came online"""
+        self._sockets[user_id] = self._sockets.get(user_id, 0) + 1
+        came_online = await self.store.aattach(user_id, self.ttl)
+        self._watch(channel_layer, user_id)
+        if came_online:
+            await self._publish(channel_layer, user_id, 'online')
+
+    async def heartbeat(self, channel_layer, user_id):
+        """Refresh the user's TTL; re-announces them if the entry had already expired"""
+        came_online = await self.store.atouch(user_id, self.ttl)
+        self._watch(channel_layer, user_id)
+        if came_online:
+            await self._publish(channel_layer, user_id, 'online')
+
+    async def disconnect(self, channel_layer, user_id):
+        """Uncount one socket; the user goes offline only when their last socket closes"""
+        remaining = self._sockets.pop(user_id, 0) - 1
+        if remaining > 0:
+            self._sockets[user_id] = remaining
+        else:
+            # Sockets on other workers watch the entry themselves
+            self._unwatch(user_id)
+        if await self.store.adetach(user_id):
+            await self._publish(channel_layer, user_id, 'offline')
+
+    def _watch(self, channel_layer, user_id):
+        """Check the user's entry a tick after it would lapse; each heartbeat moves the check"""
+        self._unwatch(user_id)
+        self._watches[user_id] = self.timer_wheel().schedule(
+            self.ttl + self.tick, self._check_lapsed, channel_layer, user_id
+        )
+
+    def _unwatch(self, user_id):
+        handle = self._watches.pop(user_id, None)
+        if handle is not None:
+            handle.cancel()
+
+    async def _check_lapsed(self, channel_layer, user_id):
+        self._watches.pop(user_id, None)
+        if await self.store.alapsed(user_id):
+            self._sockets.pop(user_id, None)
+            await self._publish(channel_layer, user_id, 'offline')
+
+    async def subscribe(self, channel_layer, channel_name, contact_ids):
+        """Join the presence groups of the given contacts and return who is online now"""
+        for contact_id in contact_ids:
+            await channel_layer.group_add(presence_group_name(contact_id), channel_name)
+        return await self.store.aonline_among(contact_ids)
+
+    async def unsubscribe(self, channel_layer, channel_name, contact_ids):
+        for contact_id in contact_ids:
+            await channel_layer.group_discard(presence_group_name(contact_id), channel_name)
+
+    async def aonline_users(self, user_ids):
+        return await self.store.aonline_among(user_ids)
+
+    def online_users(self, user_ids):
+        """Batch "who of these users is online" lookup for sync views"""
+        return self.store.online_among(user_ids)
+
+    async def _publish(self, channel_layer, user_id, status):
+        try:
+            await channel_layer.group_send(
+                presence_group_name(user_id),
+                {
+                    'type': 'user_status',
+                    'user_id': user_id,
+                    'status': status
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error publishing presence for user {user_id}: {e}")
+
+
+def get_contact_ids(user):
+    """Ids of everyone who shares a conversation with the user"""
+    from .models import CustomUser
+    return list(
+        CustomUser.objects.filter(conversations__participants=user)
+        .exclude(id=user.id)
+        .values_list('id', flat=True)
+        .distinct()
+    )
+
+
+# Global instance
+presence_service = PresenceService()
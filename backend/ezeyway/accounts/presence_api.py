@@ -0,0 +1,33 @@
+"""
+Presence API
+Batch online-status lookup for the conversation list
+"""
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+from .presence import presence_service, get_contact_ids
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def online_status_api(request):
+    """Return which of the requested users (default: all contacts) are online"""
+    contact_ids = set(get_contact_ids(request.user))
+
+    user_ids_param = request.query_params.get('user_ids')
+    if user_ids_param:
+        try:
+            requested = {int(user_id) for user_id in user_ids_param.split(',') if user_id.strip()}
+        except ValueError:
+            return Response({'error': 'user_ids must be a comma separated list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+        # Presence is only visible between users who share a conversation
+        user_ids = requested & contact_ids
+    else:
+        user_ids = contact_ids
+
+    online = presence_service.online_users(user_ids)
+    return Response({
+        'online_user_ids': sorted(online),
+        'offline_user_ids': sorted(user_ids - online)
+    })
@@ -0,0 +1,156 @@
+"""
+Product Fragment Cache
+Product cards (CustomerProductSerializer) appear in search results,
+favorites, carts and vendor pages. Their serialized form is cached per
+product under a key that contains the product's and its vendor's
+updated_at, so any save produces a new key and stale fragments simply
+expire. Image changes and new reviews (the card's rating) touch the product
+(see touch_products).
+
+List serializers fetch all fragments of a page with one cache multi-get,
+serialize only the misses (loading their images in one query) and write
+them back with one multi-set. total_sold changes with every order, so it
+is not cached: it is aggregated for the whole page in a single query.
+
+Hits and misses are counted in the shared cache; stats() reports the
+hit rate.
+"""
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, prefetch_related_objects
+from django.utils import timezone
+
+DEFAULT_TIMEOUT = 3600
+BATCH_CONTEXT_KEY = '_product_fragments'
+SOLD_STATUSES = ('confirmed', 'delivered')  # Same as Product.total_sold
+STATS_KEYS = {'hits': 'product_fragments:hits', 'misses': 'product_fragments:misses'}
+
+
+class FragmentBatch:
+    """Fragments of one list being serialized, shared through the serializer context"""
+
+    def __init__(self):
+        self.keys = {}
+        self.fragments = {}
+        self.sold = {}
+        self.pending = {}
+
+
+class ProductFragmentCache:
+    def __init__(self, timeout=None):
+        self._timeout = timeout
+
+    @property
+    def timeout(self):
+        return self._timeout or getattr(settings, 'PRODUCT_FRAGMENT_TIMEOUT', DEFAULT_TIMEOUT)
+
+    def key(self, product, request=None):
+        # Image URLs are absolute, so the fragment depends on the host it is served for
+        origin = f"{request.scheme}://{request.get_host()}" if request else ''
+        origin_hash = hashlib.sha1(origin.encode()).hexdigest()[:8]
+        return (f"product_fragment:{origin_hash}:{product.pk}:"
+                f"{product.updated_at.timestamp():.6f}:{product.vendor.updated_at.timestamp():.6f}")
+
+    def prefetch(self, products, context):
+        """Load the fragments of a page of products into the serializer context"""
+        products = [product for product in products if product is not None]
+        batch = FragmentBatch()
+        context[BATCH_CONTEXT_KEY] = batch
+        if not products:
+            return batch
+
+        prefetch_related_objects([p for p in products if not type(p).vendor.is_cached(p)], 'vendor')
+        request = context.get('request')
+        batch.keys = {product.pk: self.key(product, request) for product in products}
+        cached = cache.get_many(list(batch.keys.values()))
+        batch.fragments = {pk: cached[key] for pk, key in batch.keys.items() if key in cached}
+
+        missed = [p for p in products if p.pk not in batch.fragments
+                  and 'images' not in getattr(p, '_prefetched_objects_cache', {})]
+        prefetch_related_objects(missed, 'images', 'rating_summary')
+        batch.sold = total_sold_for(list(batch.keys))
+        self.record(len(batch.fragments), len(batch.keys) - len(batch.fragments))
+        return batch
+
+    def covers(self, products, context):
+        """Whether the fragments of these products were already loaded, e.g. for a whole page of orders"""
+        batch = context.get(BATCH_CONTEXT_KEY)
+        return batch is not None and all(product.pk in batch.keys for product in products if product is not None)
+
+    def represent(self, product, context, serialize):
+        """Cached fragment of one product, serializing (and queueing it for storage) on a miss"""
+        batch = context.get(BATCH_CONTEXT_KEY)
+        if batch is not None and product.pk in batch.fragments:
+            data = dict(batch.fragments[product.pk])
+        elif batch is not None and product.pk in batch.keys:
+            data = serialize(product)
+            batch.pending[batch.keys[product.pk]] = data
+            batch.fragments[product.pk] = data
+            data = dict(data)
+        else:
+            key = self.key(product, context.get('request'))
+            cached = cache.get(key)
+            self.record(int(cached is not None), int(cached is None))
+            if cached is not None:
+                data = dict(cached)
+            else:
+                data = serialize(product)
+                cache.set(key, data, self.timeout)
+                data = dict(data)
+
+        if batch is not None and product.pk in batch.keys:
+            data['total_sold'] = batch.sold.get(product.pk, 0)
+        else:
+            data['total_sold'] = product.total_sold
+        return data
+
+    def flush(self, context):
+        batch = context.get(BATCH_CONTEXT_KEY)
+        if batch is not None and batch.pending:
+            cache.set_many(batch.pending, self.timeout)
+            batch.pending = {}
+
+    def record(self, hits, misses):
+        for name, count in (('hits', hits), ('misses', misses)):
+            if not count:
+                continue
+            try:
+                cache.incr(STATS_KEYS[name], count)
+            except ValueError:
+                if not cache.add(STATS_KEYS[name], count, None):
+                    cache.incr(STATS_KEYS[name], count)
+
+    def stats(self):
+        values = cache.get_many(list(STATS_KEYS.values()))
+        hits = values.get(STATS_KEYS['hits'], 0)
+        misses = values.get(STATS_KEYS['misses'], 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+    def reset_stats(self):
+        cache.delete_many(list(STATS_KEYS.values()))
+
+
+def total_sold_for(product_ids):
+    """product id -> units sold, for many products in one query"""
+    from .order_models import OrderItem
+    rows = (OrderItem.objects
+            .filter(product_id__in=product_ids, order__status__in=SOLD_STATUSES)
+            .values('product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by())
+    return {row['product_id']: row['total'] or 0 for row in rows}
+
+
+def touch_products(product_ids):
+    """Move updated_at so cached fragments of these products are no longer used"""
+    from .models import Product
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+# Global instance
+product_fragment_cache = ProductFragmentCache()
@@ -0,0 +1,314 @@
+"""
+Protected Media
+Download views for files that must not be public: vendor verification
+documents, refund documents and message attachments. They are stored under
+protected/ in PROTECTED_MEDIA_ROOT (see content_storage), and the API only
+hands out the URLs of these views, never storage paths. Django only checks
+access; the bytes are sent by the front web server:
+
+    PROTECTED_MEDIA_SERVER = 'x-accel'     nginx, X-Accel-Redirect to an internal
+                                           location aliased to PROTECTED_MEDIA_ROOT
+    PROTECTED_MEDIA_SERVER = 'x-sendfile'  Apache mod_xsendfile / lighttpd
+    PROTECTED_MEDIA_SERVER = None          FileResponse streamed by Django (development)
+
+nginx:
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/protected_media/;
+    }
+
+Files uploaded before protected storage existed stay in MEDIA_ROOT until
+`manage.py dedupe_media` moves them. The same views stream them after the
+same access check; with x-accel the internal redirect points at the
+MEDIA_URL location instead.
+
+Every response carries ETag/Last-Modified and a private Cache-Control, so
+repeat downloads are answered with 304 before touching the file. The web
+server handles Range requests itself; the Django fallback serves single
+byte ranges.
+"""
+
+import os
+import mimetypes
+from urllib.parse import quote, urlencode, urlparse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from .content_storage import is_blob, is_protected
+
+DEFAULT_MAX_AGE = 3600
+IMMUTABLE_MAX_AGE = 31536000
+RANGE_CHUNK_SIZE = 64 * 1024
+
+VENDOR_FILE_FIELDS = ('business_license_file', 'gst_certificate', 'fssai_license', 'bank_document')
+REFUND_DOCUMENT_FIELDS = ('evidence_photos', 'vendor_supporting_docs')
+
+
+def protected_media_url(request, viewname, *args, query=None):
+    """Download URL for serializers (absolute when a request is available)"""
+    url = reverse(viewname, args=args)
+    if query:
+        url = f"{url}?{urlencode(query)}"
+    if not request:
+        return url
+    if 'ngrok-free.app' in request.get_host():
+        return f'https://{request.get_host()}{url}'
+    return request.build_absolute_uri(url)
+
+
+def message_file_urls(request, message_id, file_url, thumbnail_url=None, image_variants=None):
+    """Download URLs standing in for a message's stored file, thumbnail and rendition paths"""
+    def url(**query):
+        return protected_media_url(request, 'protected_message_file', message_id, query=query)
+
+    return {
+        'file_url': url() if file_url else None,
+        'thumbnail_url': url(thumbnail=1) if thumbnail_url else None,
+        'image_variants': {
+            image_format: {size: url(format=image_format, size=size) for size in sizes}
+            for image_format, sizes in image_variants.items()
+        } if image_variants else image_variants,
+    }
+
+
+def protected_file_url(name):
+    """Download view URL for a protected storage name, from the record that references it.
+
+    Used by ContentAddressedStorage.url(); returns None when nothing does.
+    """
+    from django.db.models import Q
+    from .message_models import Message
+    from .models import VendorDocument, VendorProfile
+
+    document_id = VendorDocument.objects.filter(document=name).values_list('id', flat=True).first()
+    if document_id:
+        return reverse('protected_vendor_document', args=[document_id])
+
+    condition = Q()
+    for field in VENDOR_FILE_FIELDS:
+        condition |= Q(**{field: name})
+    profile = VendorProfile.objects.filter(condition).values('id', *VENDOR_FILE_FIELDS).first()
+    if profile:
+        field = next(field for field in VENDOR_FILE_FIELDS if profile[field] == name)
+        return reverse('protected_vendor_profile_file', args=[profile['id'], field])
+
+    message = Message.objects.filter(Q(file_url=name) | Q(thumbnail_url=name)).values('id', 'file_url').first()
+    if message:
+        return protected_media_url(None, 'protected_message_file', message['id'],
+                                   query=None if message['file_url'] == name else {'thumbnail': 1})
+    return None
+
+
+def refund_documents(request, refund_id, field, documents):
+    """Refund document entries with their storage path replaced by a download URL"""
+    result = []
+    for index, document in enumerate(documents or []):
+        if isinstance(document, dict) and document.get('file_path'):
+            document = {key: value for key, value in document.items() if key != 'file_path'}
+            document['file_url'] = document['download_url'] = protected_media_url(
+                request, 'protected_refund_document', refund_id, field, index
+            )
+        result.append(document)
+    return result
+
+
+def serve_protected(request, name, download_name=None, as_attachment=False):
+    """Response for an already authorized storage path"""
+    if not name or not default_storage.exists(name):
+        raise Http404('File not found')
+
+    size = default_storage.size(name)
+    last_modified = default_storage.get_modified_time(name).timestamp()
+    if is_blob(name):
+        # Content-addressed: the digest in the name is the strongest possible validator
+        etag = f'"{os.path.splitext(os.path.basename(name))[0]}"'
+        max_age = f"max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        etag = f'"{size:x}-{int(last_modified):x}"'
+        max_age = f"max-age={getattr(settings, 'PROTECTED_MEDIA_MAX_AGE', DEFAULT_MAX_AGE)}"
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        response = _transfer(request, name, size, etag)
+        response['Content-Disposition'] = content_disposition_header(
+            as_attachment, download_name or os.path.basename(name)
+        )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = f"private, {max_age}"
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _transfer(request, name, size, etag):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    server = getattr(settings, 'PROTECTED_MEDIA_SERVER', None)
+
+    if server == 'x-accel':
+        response = HttpResponse(content_type=content_type)
+        if is_protected(name):
+            internal_url = getattr(settings, 'PROTECTED_MEDIA_INTERNAL_URL', '/protected-media/')
+        else:
+            internal_url = urlparse(settings.MEDIA_URL).path
+        response['X-Accel-Redirect'] = f"{internal_url.rstrip('/')}/{quote(name)}"
+        return response
+    if server == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(name)
+        return response
+
+    byte_range = _requested_range(request, size, etag)
+    if byte_range is False:
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    source = default_storage.open(name, 'rb')
+    if byte_range is None:
+        return FileResponse(source, content_type=content_type)
+
+    start, end = byte_range
+    source.seek(start)
+    response = StreamingHttpResponse(
+        _read_range(source, end - start + 1),
+        status=status.HTTP_206_PARTIAL_CONTENT,
+        content_type=content_type
+    )
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def _requested_range(request, size, etag):
+    """(start, end) of a single satisfiable byte range, None for the whole file, False if unsatisfiable"""
+    header = request.META.get('HTTP_RANGE', '')
+    if not header.startswith('bytes=') or ',' in header:
+        # Multipart ranges are rare for downloads; send the whole file instead
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return False
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(source, length):
+    try:
+        while length > 0:
+            chunk = source.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        source.close()
+
+
+def _is_admin(user):
+    return user.is_superuser or user.is_staff
+
+
+def _forbidden():
+    return Response({'error': 'You do not have access to this file'}, status=status.HTTP_403_FORBIDDEN)
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([permissions.IsAuthenticated])
+def vendor_profile_file_api(request, pk, field):
+    """Verification files stored on the vendor profile (license, GST, FSSAI, bank document)"""
+    from .models import VendorProfile
+
+    if field not in VENDOR_FILE_FIELDS:
+        raise Http404('Unknown document')
+    profile = get_object_or_404(VendorProfile.objects.only('id', 'user_id', field), pk=pk)
+    if profile.user_id != request.user.id and not _is_admin(request.user):
+        return _forbidden()
+    return serve_protected(request, getattr(profile, field))
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([permissions.IsAuthenticated])
+def vendor_document_api(request, pk):
+    from .models import VendorDocument
+
+    document = get_object_or_404(VendorDocument.objects.select_related('vendor_profile'), pk=pk)
+    if document.vendor_profile.user_id != request.user.id and not _is_admin(request.user):
+        return _forbidden()
+    return serve_protected(request, document.document)
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([permissions.IsAuthenticated])
+def refund_document_api(request, refund_id, field, index):
+    """Refund evidence (customer) and supporting documents (vendor), visible to both sides"""
+    from .order_models import OrderRefund
+
+    if field not in REFUND_DOCUMENT_FIELDS:
+        raise Http404('Unknown document')
+    refund = get_object_or_404(OrderRefund.objects.select_related('order__vendor'), pk=refund_id)
+    if request.user.id not in (refund.customer_id, refund.order.vendor.user_id) and not _is_admin(request.user):
+        return _forbidden()
+
+    documents = getattr(refund, field) or []
+    if index >= len(documents) or not isinstance(documents[index], dict):
+        raise Http404('Document not found')
+    document = documents[index]
+    return serve_protected(request, document.get('file_path'), download_name=document.get('filename'))
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([permissions.IsAuthenticated])
+def message_file_api(request, message_id):
+    """Message attachment for conversation participants.
+
+    ?thumbnail=1 serves the image thumbnail, ?format=webp&size=320 one of the
+    rendered image variants.
+    """
+    from .conversation_cache import get_participant_ids
+    from .message_models import Message
+
+    message = get_object_or_404(
+        Message.objects.only('id', 'conversation_id', 'message_type', 'file_url', 'file_name', 'thumbnail_url',
+                             'image_variants'),
+        pk=message_id
+    )
+    if request.user.id not in get_participant_ids(message.conversation_id) and not _is_admin(request.user):
+        return _forbidden()
+
+    if request.query_params.get('thumbnail'):
+        return serve_protected(request, message.thumbnail_url)
+    if request.query_params.get('format'):
+        variants = (message.image_variants or {}).get(request.query_params['format']) or {}
+        name = variants.get(request.query_params.get('size', ''))
+        if not name:
+            raise Http404('Image variant not found')
+        return serve_protected(request, name)
+    return serve_protected(
+        request,
+        message.file_url,
+        download_name=message.file_name,
+        as_attachment=message.message_type == 'file'
+    )
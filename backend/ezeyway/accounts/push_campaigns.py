@@ -0,0 +1,177 @@
+"""
+Push Notification Campaigns
+Dispatches due PushNotification rows to every matching user: recipient ids
+are streamed from the database in chunks, their device tokens go out in
+batched FCM sends and online sockets get a Channels group event.
+
+Progress (delivered/failed counts and the last processed user id) is
+written after every chunk under a lease, so a campaign interrupted by a
+crash is picked up again by the next dispatcher run. At most the chunk in
+flight is sent twice.
+"""
+
+import asyncio
+import time
+import logging
+from datetime import timedelta
+from itertools import islice
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import CustomUser, PushNotification, VendorProfile
+from .push_sender import push_sender, tokens_for_users
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CONCURRENCY = 50
+DEFAULT_RATE = 5000  # FCM messages per second, 0 disables pacing
+DEFAULT_LEASE_SECONDS = 120
+
+
+class RateLimiter:
+    """Paces work so that no more than `rate` units are started per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._started_at = time.monotonic()
+        self._count = 0
+
+    def wait(self, count):
+        if not self.rate:
+            return
+        self._count += count
+        ahead = self._count / self.rate - (time.monotonic() - self._started_at)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class CampaignEngine:
+    def __init__(self, sender=None, chunk_size=None, concurrency=None, rate=None, lease_seconds=None):
+        self.sender = sender or push_sender
+        self.chunk_size = chunk_size or getattr(settings, 'PUSH_CAMPAIGN_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+        self.concurrency = concurrency or getattr(settings, 'PUSH_CAMPAIGN_CONCURRENCY', DEFAULT_CONCURRENCY)
+        self.rate = rate if rate is not None else getattr(settings, 'PUSH_CAMPAIGN_RATE', DEFAULT_RATE)
+        self.lease = timedelta(seconds=lease_seconds or getattr(settings, 'PUSH_CAMPAIGN_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+
+    def due_campaigns(self, now=None):
+        """Scheduled campaigns whose time has come, plus campaigns whose dispatcher died"""
+        now = now or timezone.now()
+        return PushNotification.objects.filter(
+            Q(status='scheduled', scheduled_time__lte=now) |
+            Q(status='scheduled', scheduled_time__isnull=True) |
+            Q(status='sending', locked_until__lt=now)
+        ).order_by('scheduled_time', 'id')
+
+    def run_due(self):
+        """Dispatch every due campaign this worker manages to claim; returns how many ran"""
+        dispatched = 0
+        for campaign_id in list(self.due_campaigns().values_list('id', flat=True)):
+            if not self.claim(campaign_id):
+                continue
+            try:
+                self.dispatch(PushNotification.objects.get(id=campaign_id))
+                dispatched += 1
+            except Exception as e:
+                # The lease runs out and the next run resumes from the last saved chunk
+                logger.error(f"Push campaign {campaign_id} failed mid-send: {e}")
+        return dispatched
+
+    def claim(self, campaign_id):
+        now = timezone.now()
+        return self.due_campaigns(now).filter(id=campaign_id).update(
+            status='sending',
+            locked_until=now + self.lease
+        ) == 1
+
+    def recipients(self, campaign):
+        users = CustomUser.objects.filter(is_active=True)
+        if campaign.recipient_type == 'customer':
+            users = users.filter(user_type='customer')
+        elif campaign.recipient_type == 'vendor':
+            users = users.filter(user_type='vendor')
+        else:
+            users = users.exclude(user_type='superuser')
+        return users
+
+    def dispatch(self, campaign):
+        """Send a claimed campaign, resuming after campaign.last_user_id"""
+        message = self.sender.build_message(
+            campaign.title,
+            campaign.message,
+            {'type': 'push_campaign', 'campaignId': campaign.id},
+            channel_id='general_notifications'
+        )
+        limiter = RateLimiter(self.rate)
+        user_ids = (
+            self.recipients(campaign)
+            .filter(id__gt=campaign.last_user_id)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .iterator(chunk_size=self.chunk_size)
+        )
+
+        while True:
+            chunk = list(islice(user_ids, self.chunk_size))
+            if not chunk:
+                break
+
+            tokens = tokens_for_users(chunk)
+            delivered = failed = 0
+            for start in range(0, len(tokens), self.sender.batch_size):
+                batch = tokens[start:start + self.sender.batch_size]
+                limiter.wait(len(batch))
+                result = self.sender.send_to_tokens(batch, message)
+                delivered += result.success_count
+                failed += result.failure_count
+
+            vendor_ids = set(VendorProfile.objects.filter(user_id__in=chunk).values_list('user_id', flat=True))
+            async_to_sync(self._broadcast)(campaign, chunk, vendor_ids)
+
+            updated = PushNotification.objects.filter(id=campaign.id, status='sending').update(
+                sent_count=F('sent_count') + delivered,
+                failed_count=F('failed_count') + failed,
+                last_user_id=chunk[-1],
+                locked_until=timezone.now() + self.lease
+            )
+            if not updated:
+                logger.warning(f"Push campaign {campaign.id} was removed mid-send, stopping")
+                return
+
+        PushNotification.objects.filter(id=campaign.id).update(
+            status='sent',
+            sent_at=timezone.now(),
+            locked_until=None
+        )
+        campaign.refresh_from_db()
+        logger.info(f"Push campaign {campaign.id} done: {campaign.sent_count} delivered, {campaign.failed_count} failed")
+
+    async def _broadcast(self, campaign, user_ids, vendor_ids):
+        """Live in-app notification for connected sockets, at most `concurrency` sends in flight"""
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        event = {
+            'type': 'system_notification',
+            'notification_id': f"campaign_{campaign.id}",
+            'title': campaign.title,
+            'message': campaign.message,
+            'data': {'campaign_id': campaign.id},
+        }
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id):
+            prefix = 'vendor' if user_id in vendor_ids else 'customer'
+            async with semaphore:
+                try:
+                    await channel_layer.group_send(f"{prefix}_notifications_{user_id}", event)
+                except Exception as e:
+                    logger.warning(f"Campaign socket send to user {user_id} failed: {e}")
+
+        await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+# Global instance
+campaign_engine = CampaignEngine()
@@ -0,0 +1,192 @@
+"""
+Push Notification Sender
+Fans one notification out to every registered device of one or many
+users. Tokens go out in batches of up to 500 (the FCM multicast limit)
+over a pooled keep-alive session, and tokens FCM reports as unregistered
+or invalid are pruned from the registry.
+"""
+
+import threading
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+FCM_BATCH_SIZE = 500
+FCM_SCOPES = ['https://www.googleapis.com/auth/firebase.messaging']
+FCM_SEND_URL = 'https://fcm.googleapis.com/v1/projects/{0}/messages:send'
+DEFAULT_PUSH_MAX_WORKERS = 32
+
+# FCM error codes that mean the token will never work again
+DEAD_TOKEN_ERRORS = ('UNREGISTERED', 'SENDER_ID_MISMATCH')
+
+
+class PushResult:
+    def __init__(self, success_count=0, failure_count=0, pruned_count=0):
+        self.success_count = success_count
+        self.failure_count = failure_count
+        self.pruned_count = pruned_count
+
+    def __bool__(self):
+        return self.success_count > 0
+
+    def __repr__(self):
+        return (f"PushResult(success={self.success_count}, failure={self.failure_count}, "
+                f"pruned={self.pruned_count})")
+
+    def merge(self, other):
+        self.success_count += other.success_count
+        self.failure_count += other.failure_count
+        self.pruned_count += other.pruned_count
+        return self
+
+
+class FCMTransport:
+    """Sends FCM HTTP v1 messages, one request per token, on a bounded thread pool.
+
+    The endpoint defaults to the real FCM API of the initialized Firebase app;
+    set FCM_ENDPOINT_URL to point it at a local fake server (no auth is sent then).
+    """
+
+    def __init__(self, endpoint=None, max_workers=None, timeout=10):
+        self.endpoint = endpoint or getattr(settings, 'FCM_ENDPOINT_URL', None)
+        self.max_workers = max_workers or getattr(settings, 'PUSH_MAX_WORKERS', DEFAULT_PUSH_MAX_WORKERS)
+        self.timeout = timeout
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _setup(self):
+        with self._lock:
+            if self._session is not None:
+                return
+            if self.endpoint:
+                session = requests.Session()
+            else:
+                import firebase_admin
+                from google.auth.transport.requests import AuthorizedSession
+                from .fcm_service import fcm_service  # initializes the default app
+                app = firebase_admin.get_app()
+                session = AuthorizedSession(app.credential.get_credential().with_scopes(FCM_SCOPES))
+                self.endpoint = FCM_SEND_URL.format(app.project_id)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fcm')
+            self._session = session
+
+    def send_multicast(self, tokens, message):
+        """Send `message` (v1 message body without a target) to each token.
+
+        Returns a list of error codes aligned with `tokens`; None means delivered.
+        """
+        self._setup()
+        return list(self._executor.map(lambda token: self._send_one(token, message), tokens))
+
+    def _send_one(self, token, message):
+        try:
+            response = self._session.post(
+                self.endpoint,
+                json={'message': {**message, 'token': token}},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            logger.warning(f"FCM request failed: {e}")
+            return 'UNAVAILABLE'
+        if response.status_code == 200:
+            return None
+        return self._error_code(response)
+
+    def _error_code(self, response):
+        try:
+            error = response.json().get('error', {})
+        except ValueError:
+            return f"HTTP_{response.status_code}"
+        for detail in error.get('details', []):
+            if detail.get('errorCode'):
+                code = detail['errorCode']
+                break
+        else:
+            code = error.get('status') or f"HTTP_{response.status_code}"
+        if code == 'INVALID_ARGUMENT' and 'registration token' in error.get('message', ''):
+            # Only a malformed token counts as dead; a bad payload fails every token
+            return 'INVALID_TOKEN'
+        return code
+
+
+class PushSender:
+    def __init__(self, transport=None, batch_size=FCM_BATCH_SIZE):
+        self._transport = transport
+        self.batch_size = batch_size
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            backend = getattr(settings, 'PUSH_TRANSPORT', 'accounts.push_sender.FCMTransport')
+            self._transport = import_string(backend)()
+        return self._transport
+
+    def build_message(self, title=None, body=None, data=None, channel_id='order_alerts', priority='high'):
+        """FCM v1 message body; data values must be strings"""
+        message = {
+            'data': {key: str(value) for key, value in (data or {}).items()},
+            'android': {'priority': priority},
+        }
+        if title or body:
+            message['notification'] = {'title': title or '', 'body': body or ''}
+            message['android']['notification'] = {
+                'channel_id': channel_id,
+                'sound': 'default',
+                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
+            }
+            message['apns'] = {'payload': {'aps': {'sound': 'default'}}}
+        return message
+
+    def send_to_tokens(self, tokens, message):
+        """Send a built message to raw tokens in multicast-sized batches"""
+        tokens = list(dict.fromkeys(token for token in tokens if token))
+        result = PushResult()
+        for start in range(0, len(tokens), self.batch_size):
+            batch = tokens[start:start + self.batch_size]
+            errors = self.transport.send_multicast(batch, message)
+            dead = [token for token, error in zip(batch, errors)
+                    if error in DEAD_TOKEN_ERRORS or error == 'INVALID_TOKEN']
+            failed = sum(1 for error in errors if error is not None)
+            result.merge(PushResult(len(batch) - failed, failed, self.prune(dead)))
+        return result
+
+    def send_to_users(self, users, title=None, body=None, data=None, **options):
+        """Send to every active device of the given users (instances or ids)"""
+        user_ids = [getattr(user, 'id', user) for user in users]
+        tokens = tokens_for_users(user_ids)
+        if not tokens:
+            return PushResult()
+        return self.send_to_tokens(tokens, self.build_message(title, body, data, **options))
+
+    def send_to_user(self, user, title=None, body=None, data=None, **options):
+        return self.send_to_users([user], title, body, data, **options)
+
+    def prune(self, tokens):
+        if not tokens:
+            return 0
+        from .models import FCMToken, VendorProfile
+        deleted, _ = FCMToken.objects.filter(token__in=tokens).delete()
+        VendorProfile.objects.filter(fcm_token__in=tokens).update(fcm_token=None)
+        logger.info(f"Pruned {len(tokens)} dead FCM tokens")
+        return deleted
+
+
+def tokens_for_users(user_ids):
+    """Active device tokens for the users, plus legacy VendorProfile tokens not yet migrated"""
+    from .models import FCMToken, VendorProfile
+    active = FCMToken.objects.filter(user_id__in=user_ids, is_active=True).order_by()
+    tokens = list(active.values_list('token', flat=True))
+    legacy = VendorProfile.objects.filter(user_id__in=user_ids, fcm_token__isnull=False).exclude(fcm_token='')
+    tokens.extend(legacy.values_list('fcm_token', flat=True))
+    return list(dict.fromkeys(tokens))
+
+# Global instance
+push_sender = PushSender()
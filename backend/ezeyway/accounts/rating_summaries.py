@@ -0,0 +1,149 @@
+"""
+Rating Summaries
+Review totals per product and per vendor (ProductRatingSummary,
+VendorRatingSummary): review count, the sum of every rating dimension and a
+histogram of overall ratings, so averages are read from one row instead of
+aggregating OrderReview joined through orders and order items.
+
+create_review_api applies each new or edited review as a delta with F()
+expressions; a review counts once for its vendor and once for every
+product of its order. Rows can drift when reviews are changed elsewhere
+(admin, shell) or a reviewed order leaves 'delivered', which the review
+endpoints exclude:
+
+    python manage.py rebuild_rating_summaries
+
+Product cards carry the rating in their cached fragment, so applying a
+review touches the order's products.
+"""
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
+from django.db.models import F
+
+REVIEWED_ORDER_STATUS = 'delivered'
+
+# Summary field prefix -> OrderReview field; overall_rating is required, the others are optional
+DIMENSIONS = (
+    ('overall', 'overall_rating'),
+    ('food_quality', 'food_quality_rating'),
+    ('delivery', 'delivery_rating'),
+    ('vendor', 'vendor_rating'),
+)
+COUNTED_FIELDS = ('review_count', 'overall_sum', 'food_quality_sum', 'food_quality_count', 'delivery_sum',
+                  'delivery_count', 'vendor_sum', 'vendor_count') + tuple(f'rating_{n}_count' for n in range(1, 6))
+
+
+def ratings_of(review):
+    """Ratings of a review, taken before it is edited"""
+    return {field: getattr(review, field) for _, field in DIMENSIONS}
+
+
+def contribution(ratings):
+    """Summary field -> amount one review with these ratings adds"""
+    if not ratings or not ratings.get('overall_rating'):
+        return {}
+    counts = {'review_count': 1, f"rating_{ratings['overall_rating']}_count": 1}
+    for prefix, field in DIMENSIONS:
+        value = ratings.get(field)
+        if value:
+            counts[f'{prefix}_sum'] = value
+            if prefix != 'overall':
+                counts[f'{prefix}_count'] = 1
+    return counts
+
+
+def delta(before, after):
+    """Summary field -> change when a review goes from ratings before to after (either may be None)"""
+    removed, added = contribution(before), contribution(after)
+    changes = {field: added.get(field, 0) - removed.get(field, 0) for field in set(removed) | set(added)}
+    return {field: change for field, change in changes.items() if change}
+
+
+def _apply(model, key, ids, changes):
+    ids = list(ids)
+    model.objects.bulk_create([model(**{key: object_id}) for object_id in ids], ignore_conflicts=True)
+    model.objects.filter(**{f'{key}__in': ids}).update(
+        **{field: F(field) + change for field, change in changes.items()}
+    )
+
+
+def apply_review(review, before=None):
+    """Fold a created (before=None) or edited review into its product and vendor summaries"""
+    from .order_models import OrderItem, ProductRatingSummary, VendorRatingSummary
+    from .product_fragments import touch_products
+    changes = delta(before, ratings_of(review))
+    if not changes:
+        return
+    order = review.order
+    product_ids = set(OrderItem.objects.filter(order_id=order.pk)
+                      .values_list('product_id', flat=True))
+    with transaction.atomic():
+        _apply(VendorRatingSummary, 'vendor_id', [order.vendor_id], changes)
+        if product_ids:
+            _apply(ProductRatingSummary, 'product_id', product_ids, changes)
+            touch_products(product_ids)
+
+
+def rebuild(batch_size=1000):
+    """Recompute every summary from the reviews of delivered orders; returns (products, vendors)"""
+    from .order_models import OrderItem, OrderReview, ProductRatingSummary, VendorRatingSummary
+    from .product_fragments import touch_products
+    vendors, products = {}, {}
+
+    def add(totals, object_id, counts):
+        row = totals.setdefault(object_id, dict.fromkeys(COUNTED_FIELDS, 0))
+        for field, value in counts.items():
+            row[field] += value
+
+    reviews = (OrderReview.objects.filter(order__status=REVIEWED_ORDER_STATUS)
+               .values('order_id', 'order__vendor_id', *[field for _, field in DIMENSIONS]))
+    by_order = {}
+    for row in reviews.iterator(chunk_size=batch_size):
+        counts = contribution(row)
+        if counts:
+            by_order[row['order_id']] = counts
+            add(vendors, row['order__vendor_id'], counts)
+    order_products = (OrderItem.objects.filter(order__status=REVIEWED_ORDER_STATUS, order__review__isnull=False)
+                      .values_list('order_id', 'product_id').distinct())
+    for order_id, product_id in order_products.iterator(chunk_size=batch_size):
+        if order_id in by_order:
+            add(products, product_id, by_order[order_id])
+
+    target_conflicts = connection.features.supports_update_conflicts_with_target
+    with transaction.atomic():
+        for model, key, totals in ((VendorRatingSummary, 'vendor_id', vendors),
+                                   (ProductRatingSummary, 'product_id', products)):
+            stale = set(model.objects.values_list(key, flat=True)) - set(totals)
+            model.objects.filter(**{f'{key}__in': stale}).delete()
+            model.objects.bulk_create(
+                [model(**{key: object_id}, **counts) for object_id, counts in totals.items()],
+                batch_size=batch_size, update_conflicts=True,
+                # MySQL upserts on any unique key (here the primary key) and rejects naming it
+                unique_fields=[key] if target_conflicts else None,
+                update_fields=COUNTED_FIELDS + ('updated_at',),
+            )
+            if model is ProductRatingSummary:
+                touch_products(list(stale | set(totals)))
+    return len(products), len(vendors)
+
+
+def summary_of(obj):
+    """Rating summary of a product or vendor, None before its first review"""
+    try:
+        return obj.rating_summary
+    except ObjectDoesNotExist:
+        return None
+
+
+def rating_card(obj):
+    """Short rating of a product or vendor for cards and lists"""
+    summary = summary_of(obj)
+    if summary is None:
+        return {'average_rating': 0.0, 'total_reviews': 0}
+    return {'average_rating': summary.average_rating, 'total_reviews': summary.review_count}
+
+
+def empty_aggregate():
+    from .order_models import VendorRatingSummary
+    return VendorRatingSummary().as_aggregate()
@@ -0,0 +1,295 @@
+"""
+Request Profiler
+Profiles single requests on demand in production: a stack sampler records
+where the request's thread spends its time (a call tree, also kept as
+collapsed stacks for flame graph tools) and every SQL statement is timed
+through a connection execute wrapper. Profiles go to a bounded ring buffer
+browsed at /accounts/superadmin/profiles/.
+
+A request is profiled when it carries
+
+    X-Profile: <REQUEST_PROFILER_TOKEN>      any client, e.g. with a vendor's token
+    ?_profile=1                              superusers (session or API token)
+
+or is picked by REQUEST_PROFILER_SAMPLE_RATE. The response names the
+stored profile in an X-Profile-Id header.
+"""
+
+import random
+import sys
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FLAG = '_profile'
+DEFAULT_CAPACITY = 50
+DEFAULT_TIMEOUT = 60 * 60 * 24
+DEFAULT_INTERVAL = 0.005
+DEFAULT_MAX_QUERIES = 500
+MAX_SQL_LENGTH = 2000
+MAX_STACK_DEPTH = 128
+MAX_TREE_NODES = 400
+MIN_NODE_SHARE = 0.005  # Call tree branches below half a percent of samples are dropped
+
+
+class StackSampler:
+    """Samples the stack of one thread every `interval` seconds from a background thread"""
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}  # (frame label, ...) root first -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+                frame = frame.f_back
+            del frame
+            key = tuple(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+
+class QueryRecorder:
+    """connection.execute_wrapper callable keeping the first max_queries statements with timings"""
+
+    def __init__(self, max_queries=DEFAULT_MAX_QUERIES):
+        self.max_queries = max_queries
+        self.queries = []
+        self.count = 0
+        self.total_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.total_ms += elapsed
+            if len(self.queries) < self.max_queries:
+                self.queries.append({
+                    'sql': sql[:MAX_SQL_LENGTH],
+                    'ms': round(elapsed, 3),
+                    'many': many,
+                    'alias': context['connection'].alias,
+                })
+
+
+def call_tree(stacks, max_nodes=MAX_TREE_NODES, min_share=MIN_NODE_SHARE):
+    """Depth-first rows of {'depth', 'function', 'samples', 'self', 'percent'}, heaviest branch first"""
+    root = {'samples': 0, 'self': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['samples'] += count
+        node = root
+        for label in stack:
+            node = node['children'].setdefault(label, {'samples': 0, 'self': 0, 'children': {}})
+            node['samples'] += count
+        node['self'] += count
+
+    total = root['samples']
+    rows = []
+    pending = [(0, label, node) for label, node in
+               sorted(root['children'].items(), key=lambda item: item[1]['samples'])]
+    while pending and len(rows) < max_nodes:
+        depth, label, node = pending.pop()
+        if node['samples'] < total * min_share:
+            continue
+        rows.append({
+            'depth': depth,
+            'function': label,
+            'samples': node['samples'],
+            'self': node['self'],
+            'percent': round(100 * node['samples'] / total, 1),
+        })
+        pending.extend((depth + 1, child_label, child) for child_label, child in
+                       sorted(node['children'].items(), key=lambda item: item[1]['samples']))
+    return rows
+
+
+def collapsed_stacks(stacks):
+    """Brendan Gregg's collapsed format ("a;b;c 12" per line), read by flamegraph.pl and speedscope"""
+    return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in
+                     sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+def summary(profile):
+    return {key: value for key, value in profile.items() if key not in ('queries', 'tree', 'collapsed')}
+
+
+class InMemoryProfileStore:
+    """Process-local ring buffer, used in tests and single-worker setups"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._profiles = deque(maxlen=capacity)
+        self._head = 0
+        self._lock = threading.Lock()
+
+    def append(self, profile):
+        with self._lock:
+            self._head += 1
+            self._profiles.append({**profile, 'id': self._head})
+            return self._head
+
+    def recent(self):
+        with self._lock:
+            return [summary(profile) for profile in reversed(self._profiles)]
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile['id'] == profile_id), None)
+
+
+class CacheProfileStore:
+    """Ring buffer in the Django cache shared by all workers; profile N lives in slot N % capacity"""
+
+    HEAD_KEY = 'request_profile_head'
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, timeout=DEFAULT_TIMEOUT):
+        self.capacity = capacity
+        self.timeout = timeout
+
+    def _slot_key(self, profile_id):
+        return f"request_profile_{profile_id % self.capacity}"
+
+    def append(self, profile):
+        cache.add(self.HEAD_KEY, 0, timeout=None)
+        profile_id = cache.incr(self.HEAD_KEY)
+        cache.set(self._slot_key(profile_id), {**profile, 'id': profile_id}, timeout=self.timeout)
+        return profile_id
+
+    def recent(self):
+        head = cache.get(self.HEAD_KEY, 0)
+        wanted = range(head, max(head - self.capacity, 0), -1)
+        slots = cache.get_many([self._slot_key(profile_id) for profile_id in wanted])
+        profiles = []
+        for profile_id in wanted:
+            profile = slots.get(self._slot_key(profile_id))
+            if profile is not None and profile['id'] == profile_id:
+                profiles.append(summary(profile))
+        return profiles
+
+    def get(self, profile_id):
+        profile = cache.get(self._slot_key(profile_id))
+        if profile is None or profile['id'] != profile_id:
+            return None
+        return profile
+
+
+class RequestProfiler:
+    def __init__(self, store=None):
+        self._store = store
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = getattr(settings, 'REQUEST_PROFILER_BACKEND', 'accounts.request_profiler.CacheProfileStore')
+            capacity = getattr(settings, 'REQUEST_PROFILER_CAPACITY', DEFAULT_CAPACITY)
+            self._store = import_string(backend)(capacity=capacity)
+        return self._store
+
+    def trigger(self, request):
+        """Why this request should be profiled ('header', 'flag' or 'sample'), None if it should not"""
+        token = getattr(settings, 'REQUEST_PROFILER_TOKEN', None)
+        header = request.headers.get(PROFILE_HEADER)
+        if header and token and constant_time_compare(header, token):
+            return 'header'
+        if request.GET.get(PROFILE_FLAG) and _is_superuser(request):
+            return 'flag'
+        rate = getattr(settings, 'REQUEST_PROFILER_SAMPLE_RATE', 0)
+        if rate and random.random() < rate:
+            return 'sample'
+        return None
+
+    def profile(self, request, get_response, trigger):
+        """Run get_response(request) under the sampler and SQL recorder, store the profile"""
+        recorder = QueryRecorder(getattr(settings, 'REQUEST_PROFILER_MAX_QUERIES', DEFAULT_MAX_QUERIES))
+        sampler = StackSampler(threading.get_ident(),
+                               getattr(settings, 'REQUEST_PROFILER_INTERVAL', DEFAULT_INTERVAL))
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            sampler.start()
+            try:
+                response = get_response(request)
+            finally:
+                sampler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        user = getattr(request, 'user', None)
+        profile = {
+            'created_at': timezone.now().isoformat(),
+            'trigger': trigger,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'route': match.route if match else None,
+            'view': match._func_path if match else None,
+            'status': response.status_code,
+            'user': user.username if user is not None and user.is_authenticated else None,
+            'duration_ms': round(duration_ms, 1),
+            'query_count': recorder.count,
+            'query_ms': round(recorder.total_ms, 1),
+            'samples': sampler.samples,
+            'interval_ms': sampler.interval * 1000,
+            'queries': recorder.queries,
+            'tree': call_tree(sampler.stacks),
+            'collapsed': collapsed_stacks(sampler.stacks),
+        }
+        try:
+            response[f'{PROFILE_HEADER}-Id'] = self.store.append(profile)
+        except Exception as e:
+            # Profiling must never break the request it observes
+            logger.error(f"Error storing request profile for {request.path}: {e}")
+        return response
+
+    def recent(self):
+        return self.store.recent()
+
+    def get(self, profile_id):
+        return self.store.get(profile_id)
+
+
+def _is_superuser(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_superuser
+    # API clients authenticate inside the view; look their token up here
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != 'Token' or not key:
+        return False
+    from rest_framework.authtoken.models import Token
+    return Token.objects.filter(key=key.strip(), user__is_superuser=True, user__is_active=True).exists()
+
+# Global instance
+request_profiler = RequestProfiler()
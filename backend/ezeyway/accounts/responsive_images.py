@@ -0,0 +1,172 @@
+"""
+Responsive Image Variants
+Renders catalog images (product images, shop images, sliders, category
+icons) at fixed widths in WebP and JPEG so list screens can download an
+image sized for the slot instead of the original upload.
+
+Variant files are named after the SHA-256 of the source bytes, so they are
+immutable (safe to cache forever) and an image uploaded twice is rendered
+once. Each model keeps a manifest of its variants in a JSON field:
+
+    {'source': <original path>, 'hash': <sha256>, 'width': 1280, 'height': 960,
+     'webp': {'320': <path>, ...}, 'jpeg': {'320': <path>, ...}}
+"""
+
+import hashlib
+import logging
+from io import BytesIO
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+from .image_utils import ImageProcessor, render_image_variants
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640, 1280)
+VARIANT_FORMATS = (('webp', 'webp'), ('jpeg', 'jpg'))
+RENDERABLE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+def responsive_fields():
+    """model -> (image field, manifest field) for every model with variants"""
+    from .models import Category, ProductImage, Slider, VendorShopImage
+    return {
+        ProductImage: ('image', 'image_variants'),
+        VendorShopImage: ('image', 'image_variants'),
+        Slider: ('image', 'image_variants'),
+        Category: ('icon', 'icon_variants'),
+    }
+
+
+def variant_widths():
+    return tuple(sorted(getattr(settings, 'RESPONSIVE_IMAGE_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def variant_path(digest, width, extension):
+    return f"variants/{digest[:2]}/{digest[:16]}_{width}w.{extension}"
+
+
+def source_name(instance, image_field):
+    """Storage path of the original (ImageField or the plain path CharField of shop images)"""
+    value = getattr(instance, image_field)
+    return str(value.name if hasattr(value, 'name') else value or '')
+
+
+def needs_variants(instance):
+    image_field, manifest_field = responsive_fields()[type(instance)]
+    name = source_name(instance, image_field)
+    manifest = getattr(instance, manifest_field) or {}
+    return bool(name) and manifest.get('source') != name
+
+
+def plan_variants(data):
+    """Widths to render for this image, or None if it cannot or should not be rendered"""
+    try:
+        with Image.open(BytesIO(data)) as img:
+            if img.format not in RENDERABLE_FORMATS or getattr(img, 'is_animated', False):
+                # SVG and animated images are served as uploaded
+                return None
+            original_width = img.width
+    except Exception:
+        return None
+    widths = [width for width in variant_widths() if width < original_width]
+    if original_width <= variant_widths()[-1]:
+        # Largest rendition is the full-size image, re-encoded
+        widths.append(original_width)
+    return widths
+
+
+def build_manifest(name, data, render=render_image_variants):
+    """Render (or reuse) the variants of one source file; None if not renderable"""
+    widths = plan_variants(data)
+    if not widths:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    manifest = {'source': name, 'hash': digest, 'webp': {}, 'jpeg': {}}
+    paths = {(width, image_format): variant_path(digest, width, extension)
+             for width in widths for image_format, extension in VARIANT_FORMATS}
+
+    if all(default_storage.exists(path) for path in paths.values()):
+        # Same bytes were rendered before: reuse the files
+        with Image.open(BytesIO(data)) as img:
+            manifest['width'], manifest['height'] = img.size
+    else:
+        width, height, variants = render(data, widths, width_only=True)
+        manifest['width'], manifest['height'] = width, height
+        for size, encoded in variants.items():
+            for image_format, _ in VARIANT_FORMATS:
+                path = paths[(size, image_format)]
+                if not default_storage.exists(path):
+                    # Content-hashed names never change, so an existing file is already right
+                    default_storage.save(path, ContentFile(encoded[image_format]))
+
+    for (width, image_format), path in paths.items():
+        manifest[image_format][str(width)] = path
+    return manifest
+
+
+def generate_variants(instance, render=render_image_variants):
+    """Render variants for a saved instance and store its manifest"""
+    image_field, manifest_field = responsive_fields()[type(instance)]
+    name = source_name(instance, image_field)
+    if not name:
+        return None
+    try:
+        with default_storage.open(name, 'rb') as source:
+            data = source.read()
+        manifest = build_manifest(name, data, render) or {'source': name}
+    except Exception as e:
+        logger.error(f"Rendering variants for {type(instance).__name__} {instance.pk} failed: {e}")
+        return None
+    # Only store the manifest if the image was not replaced meanwhile
+    type(instance).objects.filter(pk=instance.pk, **{image_field: name}).update(**{manifest_field: manifest})
+    setattr(instance, manifest_field, manifest)
+    # The update bypasses post_save; cached catalog responses embed the variant URLs
+    from .catalog_cache import catalog_cache
+    catalog_cache.bump_model(type(instance))
+    if hasattr(instance, 'product_id'):
+        from .product_fragments import touch_products
+        touch_products([instance.product_id])
+    return manifest
+
+
+def schedule_variants(instance):
+    """post_save hook: render new uploads on the image worker pool (inline without workers)"""
+    if not needs_variants(instance):
+        return
+    if not getattr(settings, 'MESSAGE_IMAGE_WORKERS', 2):
+        generate_variants(instance)
+        return
+    ImageProcessor.process_pool()
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: ImageProcessor._finish_pool.submit(_generate_in_background, model, pk))
+
+
+def _render_in_pool(*args, **kwargs):
+    return ImageProcessor.process_pool().submit(render_image_variants, *args, **kwargs).result()
+
+
+def _generate_in_background(model, pk):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None and needs_variants(instance):
+            generate_variants(instance, render=_render_in_pool)
+    finally:
+        close_old_connections()
+
+
+def variant_urls(manifest, request=None):
+    """Serializer helper: absolute URLs per format and width plus srcset strings"""
+    if not manifest or not manifest.get('jpeg'):
+        return None
+    build = request.build_absolute_uri if request else (lambda url: url)
+    result = {'width': manifest.get('width'), 'height': manifest.get('height'), 'srcset': {}}
+    for image_format, _ in VARIANT_FORMATS:
+        urls = {width: build(default_storage.url(path))
+                for width, path in sorted(manifest.get(image_format, {}).items(), key=lambda item: int(item[0]))}
+        result[image_format] = urls
+        result['srcset'][image_format] = ', '.join(f"{url} {width}w" for width, url in urls.items())
+    return result
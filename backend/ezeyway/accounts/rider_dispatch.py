@@ -0,0 +1,255 @@
+"""
+Rider Dispatch
+Spatial index of available delivery riders for dispatch.
+
+Riders are bucketed into a uniform latitude/longitude grid
+(RIDER_DISPATCH_CELL_DEGREES, ~1km at Nepal's latitudes). A k-nearest query
+scans rings of cells around the pickup point and stops once no unscanned
+cell can hold a rider closer than the k-th found, so it touches a handful of
+cells instead of every rider.
+
+A rider is available while active, not on an open delivery and with a
+position reported in the last RIDER_DISPATCH_STALE_AFTER seconds. The index
+is per worker: location pings handled by this worker update it directly
+(see rider_tracking) and it is rebuilt from the database every
+RIDER_DISPATCH_REFRESH_INTERVAL seconds to pick up everything else.
+
+assign_batch() matches several pending orders to riders at once: the
+candidate pairs of all orders are ranked by distance and taken greedily,
+each rider and order used once.
+"""
+
+import math
+import threading
+import time
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+
+from .rider_tracking import distance_m
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CELL_DEGREES = 0.01
+DEFAULT_STALE_AFTER = 60 * 5
+DEFAULT_REFRESH_INTERVAL = 15
+DEFAULT_CANDIDATES = 5
+OPEN_DELIVERY_STATUSES = ('assigned', 'picked_up', 'in_transit')
+METRES_PER_DEGREE = 111320
+
+
+class RiderGridIndex:
+    """Riders bucketed by grid cell; not thread-safe on its own (RiderDispatcher locks)"""
+
+    def __init__(self, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells = {}  # (row, col) -> {rider_id: (lat, lon)}
+        self._positions = {}  # rider_id -> (lat, lon, cell)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, rider_id):
+        return rider_id in self._positions
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def update(self, rider_id, lat, lon):
+        cell = self._cell(lat, lon)
+        previous = self._positions.get(rider_id)
+        if previous is not None and previous[2] != cell:
+            self._discard_from_cell(rider_id, previous[2])
+        self._cells.setdefault(cell, {})[rider_id] = (lat, lon)
+        self._positions[rider_id] = (lat, lon, cell)
+
+    def remove(self, rider_id):
+        previous = self._positions.pop(rider_id, None)
+        if previous is not None:
+            self._discard_from_cell(rider_id, previous[2])
+
+    def _discard_from_cell(self, rider_id, cell):
+        riders = self._cells.get(cell)
+        if riders is not None:
+            riders.pop(rider_id, None)
+            if not riders:
+                del self._cells[cell]
+
+    def position(self, rider_id):
+        found = self._positions.get(rider_id)
+        return found[:2] if found else None
+
+    def nearest(self, lat, lon, k=1, max_distance=None, exclude=()):
+        """[(distance in metres, rider_id)] of the k closest riders, closest first"""
+        if not self._positions:
+            return []
+        row, col = self._cell(lat, lon)
+        # Narrowest side of a cell around here (east-west shrinks with latitude)
+        cell_m = self.cell_degrees * METRES_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + 1, 89))), 0.01)
+        max_ring = int(math.ceil(max_distance / cell_m)) + 1 if max_distance is not None else None
+        found = []
+        scanned = 0
+        ring = 0
+        while True:
+            if 8 * ring > len(self._cells):
+                # Sparse index: cheaper to visit every occupied cell outside the square than the ring
+                cells = [cell for cell in self._cells
+                         if max(abs(cell[0] - row), abs(cell[1] - col)) >= ring]
+                ring = None
+            else:
+                cells = self._ring_cells(row, col, ring)
+            for cell in cells:
+                riders = self._cells.get(cell)
+                if not riders:
+                    continue
+                scanned += len(riders)
+                for rider_id, (rider_lat, rider_lon) in riders.items():
+                    if rider_id in exclude:
+                        continue
+                    distance = distance_m(lat, lon, rider_lat, rider_lon)
+                    if max_distance is None or distance <= max_distance:
+                        found.append((distance, rider_id))
+            if ring is None or scanned >= len(self._positions) or (max_ring is not None and ring >= max_ring):
+                break
+            # Everything beyond this ring is at least ring * cell_m away
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= ring * cell_m:
+                    break
+            ring += 1
+        found.sort()
+        return found[:k]
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, col - ring
+            yield r, col + ring
+
+
+class RiderDispatcher:
+    def __init__(self, cell_degrees=None, refresh_interval=None):
+        self._cell_degrees = cell_degrees
+        self._refresh_interval = refresh_interval
+        self._index = None
+        self._unavailable = set()  # riders on an open delivery or switched off
+        self._last_seen = {}  # rider id -> (lat, lon, time) of every ping, to re-enter riders freed up
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+
+    @property
+    def cell_degrees(self):
+        return self._cell_degrees or getattr(settings, 'RIDER_DISPATCH_CELL_DEGREES', DEFAULT_CELL_DEGREES)
+
+    @property
+    def refresh_interval(self):
+        if self._refresh_interval is None:
+            return getattr(settings, 'RIDER_DISPATCH_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        return self._refresh_interval
+
+    @property
+    def index(self):
+        if self._index is None or self._refreshed_at is None or \
+                time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.rebuild()
+        return self._index
+
+    def rebuild(self):
+        """Reload available riders from the database"""
+        from .order_models import DeliveryRider, OrderDelivery
+        fresh_since = timezone.now() - timedelta(
+            seconds=getattr(settings, 'RIDER_DISPATCH_STALE_AFTER', DEFAULT_STALE_AFTER))
+        busy = set(OrderDelivery.objects.filter(status__in=OPEN_DELIVERY_STATUSES).values_list('rider_id', flat=True))
+        inactive = set(DeliveryRider.objects.filter(is_active=False).values_list('id', flat=True))
+        riders = (DeliveryRider.objects
+                  .filter(is_active=True, last_location_update__gte=fresh_since,
+                          current_latitude__isnull=False, current_longitude__isnull=False)
+                  .values_list('id', 'current_latitude', 'current_longitude'))
+        index = RiderGridIndex(self.cell_degrees)
+        for rider_id, lat, lon in riders.iterator(chunk_size=2000):
+            if rider_id not in busy:
+                index.update(rider_id, float(lat), float(lon))
+        with self._lock:
+            self._index = index
+            self._unavailable = busy | inactive
+            self._refreshed_at = time.monotonic()
+        return index
+
+    def load(self, positions, unavailable=()):
+        """Replace the index with given {rider_id: (lat, lon)} positions, no database involved (benchmarks)"""
+        index = RiderGridIndex(self.cell_degrees)
+        for rider_id, (lat, lon) in positions.items():
+            if rider_id not in unavailable:
+                index.update(rider_id, lat, lon)
+        with self._lock:
+            self._index = index
+            self._unavailable = set(unavailable)
+            self._refreshed_at = math.inf
+
+    def reset(self):
+        with self._lock:
+            self._index = None
+            self._unavailable = set()
+            self._last_seen = {}
+            self._refreshed_at = None
+
+    def record_position(self, rider_id, lat, lon):
+        """Location ping: move the rider if they are available"""
+        with self._lock:
+            self._last_seen[rider_id] = (float(lat), float(lon), time.monotonic())
+            if self._index is not None and rider_id not in self._unavailable:
+                self._index.update(rider_id, float(lat), float(lon))
+
+    def set_available(self, rider_id, available):
+        """Delivery finished or rider switched on, or the reverse"""
+        stale_after = getattr(settings, 'RIDER_DISPATCH_STALE_AFTER', DEFAULT_STALE_AFTER)
+        with self._lock:
+            if available:
+                self._unavailable.discard(rider_id)
+                seen = self._last_seen.get(rider_id)
+                if self._index is not None and seen and time.monotonic() - seen[2] < stale_after:
+                    self._index.update(rider_id, seen[0], seen[1])
+                # Otherwise back with their next ping or the next rebuild
+            else:
+                self._unavailable.add(rider_id)
+                if self._index is not None:
+                    self._index.remove(rider_id)
+
+    def nearest(self, lat, lon, k=1, max_distance=None, exclude=()):
+        index = self.index
+        with self._lock:
+            return index.nearest(lat, lon, k, max_distance, exclude)
+
+    def assign_batch(self, pickups, candidates=None, max_distance=None):
+        """Match pickups {key: (lat, lon)} to distinct riders; returns {key: (rider_id, distance)}"""
+        candidates = candidates or getattr(settings, 'RIDER_DISPATCH_CANDIDATES', DEFAULT_CANDIDATES)
+        index = self.index
+        assigned, taken = {}, set()
+        pending = dict(pickups)
+        with self._lock:
+            while pending:
+                pairs = []
+                for key, (lat, lon) in pending.items():
+                    for distance, rider_id in index.nearest(lat, lon, candidates, max_distance, taken):
+                        pairs.append((distance, key, rider_id))
+                if not pairs:
+                    break
+                pairs.sort(key=lambda pair: pair[0])
+                for distance, key, rider_id in pairs:
+                    if key in assigned or rider_id in taken:
+                        continue
+                    assigned[key] = (rider_id, distance)
+                    taken.add(rider_id)
+                    del pending[key]
+                # Orders that lost all their candidates ask again without the taken riders
+        return assigned
+
+# Global instance
+rider_dispatcher = RiderDispatcher()
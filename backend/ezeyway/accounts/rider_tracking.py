@@ -0,0 +1,267 @@
+"""
+Rider Tracking
+Live rider positions streamed over WebSocket (RiderLocationConsumer).
+
+The latest position of every rider and delivery lives in a location store
+(the shared cache in production) and each accepted fix is fanned out to the
+delivery's tracking group, which the customer's socket has joined. Fixes
+closer than RIDER_LOCATION_MIN_DISTANCE metres to the last accepted one are
+dropped unless RIDER_LOCATION_MAX_SILENCE seconds have passed.
+
+The database only sees a down-sampled trail: the newest fix per rider and
+per delivery is kept in memory and written every
+RIDER_LOCATION_PERSIST_INTERVAL seconds with two bulk updates.
+
+Idle riders report without a delivery (delivery_id None, through
+update_rider_location_api): their fixes only move the rider, which keeps
+them in the dispatch index.
+"""
+
+import asyncio
+import datetime
+import math
+import threading
+import time
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCATION_TTL = 60 * 30
+DEFAULT_MIN_DISTANCE = 10  # metres
+DEFAULT_MAX_SILENCE = 30  # seconds between fixes forwarded to watchers, even when standing still
+DEFAULT_PERSIST_INTERVAL = 15  # seconds
+EARTH_RADIUS_M = 6371000
+
+
+def tracking_group_name(delivery_id):
+    """Channel layer group of everyone watching one delivery"""
+    return f"delivery_tracking_{delivery_id}"
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class LocationFix:
+    __slots__ = ('rider_id', 'delivery_id', 'latitude', 'longitude', 'heading', 'speed', 'recorded_at')
+
+    def __init__(self, rider_id, delivery_id, latitude, longitude, heading=None, speed=None, recorded_at=None):
+        self.rider_id = rider_id
+        self.delivery_id = delivery_id
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.heading = heading
+        self.speed = speed
+        self.recorded_at = recorded_at or time.time()
+
+    def to_dict(self):
+        return {
+            'rider_id': self.rider_id,
+            'delivery_id': self.delivery_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'heading': self.heading,
+            'speed': self.speed,
+            'recorded_at': self.recorded_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class InMemoryLocationStore:
+    """Process-local latest positions, used in tests and single-worker setups"""
+
+    def __init__(self):
+        self._fixes = {}
+        self._lock = threading.Lock()
+
+    def set(self, fix, ttl):
+        with self._lock:
+            self._fixes[('rider', fix.rider_id)] = fix.to_dict()
+            if fix.delivery_id is not None:
+                self._fixes[('delivery', fix.delivery_id)] = fix.to_dict()
+
+    def get(self, kind, object_id):
+        with self._lock:
+            data = self._fixes.get((kind, object_id))
+        return LocationFix.from_dict(data) if data else None
+
+    async def aset(self, fix, ttl):
+        self.set(fix, ttl)
+
+    async def aget(self, kind, object_id):
+        return self.get(kind, object_id)
+
+
+class CacheLocationStore:
+    """Latest positions on the Django cache, shared by all workers (Redis in production)"""
+
+    key_prefix = 'rider_location'
+
+    def _key(self, kind, object_id):
+        return f"{self.key_prefix}:{kind}:{object_id}"
+
+    def _entries(self, fix):
+        data = fix.to_dict()
+        entries = {self._key('rider', fix.rider_id): data}
+        if fix.delivery_id is not None:
+            entries[self._key('delivery', fix.delivery_id)] = data
+        return entries
+
+    def set(self, fix, ttl):
+        cache.set_many(self._entries(fix), ttl)
+
+    def get(self, kind, object_id):
+        data = cache.get(self._key(kind, object_id))
+        return LocationFix.from_dict(data) if data else None
+
+    async def aset(self, fix, ttl):
+        await cache.aset_many(self._entries(fix), ttl)
+
+    async def aget(self, kind, object_id):
+        data = await cache.aget(self._key(kind, object_id))
+        return LocationFix.from_dict(data) if data else None
+
+
+class RiderTracker:
+    def __init__(self, store=None, persist_interval=None):
+        self._store = store
+        self._persist_interval = persist_interval
+        self._pending_riders = {}  # rider id -> newest fix not yet written
+        self._pending_deliveries = {}  # delivery id -> newest fix not yet written
+        self._lock = threading.Lock()
+        self._flush_task = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            backend = getattr(settings, 'RIDER_LOCATION_BACKEND', 'accounts.rider_tracking.CacheLocationStore')
+            self._store = import_string(backend)()
+        return self._store
+
+    @property
+    def persist_interval(self):
+        if self._persist_interval is None:
+            return getattr(settings, 'RIDER_LOCATION_PERSIST_INTERVAL', DEFAULT_PERSIST_INTERVAL)
+        return self._persist_interval
+
+    def is_redundant(self, fix, previous):
+        """Too close to the last accepted fix, and that one is recent enough"""
+        if previous is None:
+            return False
+        if fix.recorded_at - previous.recorded_at >= getattr(settings, 'RIDER_LOCATION_MAX_SILENCE', DEFAULT_MAX_SILENCE):
+            return False
+        moved = distance_m(previous.latitude, previous.longitude, fix.latitude, fix.longitude)
+        return moved < getattr(settings, 'RIDER_LOCATION_MIN_DISTANCE', DEFAULT_MIN_DISTANCE)
+
+    @staticmethod
+    def _previous_key(fix):
+        """Store entry a fix is compared with: its delivery's, or the rider's for an idle rider"""
+        if fix.delivery_id is None:
+            return 'rider', fix.rider_id
+        return 'delivery', fix.delivery_id
+
+    def _queue(self, fix):
+        from .rider_dispatch import rider_dispatcher
+        rider_dispatcher.record_position(fix.rider_id, fix.latitude, fix.longitude)
+        with self._lock:
+            self._pending_riders[fix.rider_id] = fix
+            if fix.delivery_id is not None:
+                self._pending_deliveries[fix.delivery_id] = fix
+
+    async def ingest(self, channel_layer, fix):
+        """Store, fan out and queue one fix. Returns False if it was dropped as redundant."""
+        if self.is_redundant(fix, await self.store.aget(*self._previous_key(fix))):
+            return False
+        await self.store.aset(fix, getattr(settings, 'RIDER_LOCATION_TTL', DEFAULT_LOCATION_TTL))
+        if fix.delivery_id is not None:
+            await channel_layer.group_send(tracking_group_name(fix.delivery_id), {
+                'type': 'rider_location',
+                'location': fix.to_dict(),
+            })
+        self._queue(fix)
+        self._schedule_flush()
+        return True
+
+    def ingest_sync(self, channel_layer, fix):
+        """Same as ingest() for HTTP views; there is no event loop to batch on, so writes are immediate"""
+        from asgiref.sync import async_to_sync
+        from .rider_dispatch import rider_dispatcher
+        if self.is_redundant(fix, self.store.get(*self._previous_key(fix))):
+            return False
+        self.store.set(fix, getattr(settings, 'RIDER_LOCATION_TTL', DEFAULT_LOCATION_TTL))
+        if fix.delivery_id is not None:
+            async_to_sync(channel_layer.group_send)(tracking_group_name(fix.delivery_id), {
+                'type': 'rider_location',
+                'location': fix.to_dict(),
+            })
+        rider_dispatcher.record_position(fix.rider_id, fix.latitude, fix.longitude)
+        self._persist({fix.rider_id: fix}, {fix.delivery_id: fix} if fix.delivery_id is not None else {})
+        return True
+
+    def latest(self, delivery_id):
+        return self.store.get('delivery', delivery_id)
+
+    async def alatest(self, delivery_id):
+        return await self.store.aget('delivery', delivery_id)
+
+    def _schedule_flush(self):
+        loop = asyncio.get_running_loop()
+        task = self._flush_task
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        self._flush_task = loop.create_task(self._flush_later(self.persist_interval))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write the newest queued fix of every rider and delivery"""
+        with self._lock:
+            riders, self._pending_riders = self._pending_riders, {}
+            deliveries, self._pending_deliveries = self._pending_deliveries, {}
+        if riders or deliveries:
+            await database_sync_to_async(self._persist)(riders, deliveries)
+
+    def _persist(self, riders, deliveries):
+        from .order_models import DeliveryRider, OrderDelivery
+        try:
+            DeliveryRider.objects.bulk_update([
+                DeliveryRider(pk=rider_id, current_latitude=fix.latitude, current_longitude=fix.longitude,
+                              last_location_update=datetime.datetime.fromtimestamp(fix.recorded_at, tz=datetime.timezone.utc))
+                for rider_id, fix in riders.items()
+            ], ['current_latitude', 'current_longitude', 'last_location_update'])
+            OrderDelivery.objects.bulk_update([
+                OrderDelivery(pk=delivery_id, current_latitude=fix.latitude, current_longitude=fix.longitude)
+                for delivery_id, fix in deliveries.items()
+            ], ['current_latitude', 'current_longitude'])
+        except Exception as e:
+            logger.error(f"Error persisting {len(riders)} rider locations: {e}")
+
+
+def can_report_location(user, delivery):
+    """The rider's linked account, the vendor handling the order or an admin may report its position"""
+    if user.is_superuser:
+        return True
+    if delivery.rider.user_id is not None and delivery.rider.user_id == user.id:
+        return True
+    return user.id == delivery.order.vendor.user_id
+
+
+def can_watch_delivery(user, delivery):
+    return user.is_superuser or user.id in (delivery.order.customer_id, delivery.order.vendor.user_id)
+
+# Global instance
+rider_tracker = RiderTracker()
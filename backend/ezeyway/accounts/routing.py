@@ -7,4 +7,5 @@ websocket_urlpatterns = [
     re_path(r'ws/calls/(?P<user_id>[\w_]+)/$', consumers.CallConsumer.as_asgi()),
     re_path(r'ws/call/(?P<call_id>[\w_]+)/$', consumers.CallRoomConsumer.as_asgi()),
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
+    re_path(r'ws/deliveries/(?P<delivery_id>\d+)/location/$', consumers.RiderLocationConsumer.as_asgi()),
 ]
\ No newline at end of file
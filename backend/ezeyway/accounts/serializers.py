@@ -1,9 +1,17 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.db.models import Q
+from django.db.models.manager import BaseManager
 from django.utils import timezone
 from datetime import time
+from .cart_pricing import cart_pricing
+from .dynamic_fields import DynamicFieldsMixin
 from .models import CustomUser, VendorProfile, VendorDocument, VendorShopImage, Product, ProductImage, VendorWallet, WalletTransaction, UserFavorite, Cart, CartItem, Category
+from .product_fragments import product_fragment_cache
+from .protected_media import protected_media_url
+from .rating_summaries import rating_card
+from .vendor_schedule import is_open
+from .responsive_images import variant_urls
 
 class UserSerializer(serializers.ModelSerializer):
     display_name = serializers.SerializerMethodField()
@@ -144,7 +152,7 @@ class OTPSerializer(serializers.Serializer):
     email = serializers.EmailField()
     otp = serializers.CharField(max_length=6, min_length=6)
 
-class VendorProfileSerializer(serializers.ModelSerializer):
+class VendorProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     categories = serializers.JSONField()
     business_name = serializers.CharField(required=False)
     business_email = serializers.EmailField(required=False)
@@ -164,6 +172,7 @@ class VendorProfileSerializer(serializers.ModelSerializer):
     is_active = serializers.SerializerMethodField()
     documents = serializers.SerializerMethodField()
     shop_images = serializers.SerializerMethodField()
+    rating = serializers.SerializerMethodField()
     referral_code = serializers.CharField(required=False, allow_blank=True)
 
     class Meta:
@@ -189,9 +198,23 @@ class VendorProfileSerializer(serializers.ModelSerializer):
             'saturday_open', 'saturday_close', 'saturday_closed',
             'sunday_open', 'sunday_close', 'sunday_closed',
             'is_active', 'status_override', 'status_override_date',
-            'documents', 'shop_images', 'referral_code', 'created_at', 'updated_at'
+            'documents', 'shop_images', 'rating', 'referral_code', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'user', 'is_approved', 'approval_date', 'is_rejected', 'rejection_reason', 'rejection_date', 'is_active', 'created_at', 'updated_at']
+        # Vendor lists and search results; the rest is available through ?expand= or ?profile=full
+        lite_fields = [
+            'id', 'user', 'business_name', 'business_type', 'categories', 'description',
+            'business_address', 'location_address', 'city', 'state', 'latitude', 'longitude',
+            'delivery_radius', 'min_order_amount', 'delivery_fee', 'free_delivery_above',
+            'estimated_delivery_time', 'home_delivery', 'pickup_service',
+            'is_approved', 'is_active', 'rating', 'updated_at', 'user_info'
+        ]
+        select_related_fields = {'user_info': ('user',), 'rating': ('rating_summary',)}
+        prefetch_related_fields = {
+            'additional_docs': ('additional_docs',),
+            'documents': ('additional_docs',),
+            'shop_images': ('shop_images',),
+        }
     
     def update(self, instance, validated_data):
         # Reset rejection status when vendor updates profile
@@ -211,7 +234,7 @@ class VendorProfileSerializer(serializers.ModelSerializer):
         docs = obj.additional_docs.all()
         return [{
             'id': doc.id,
-            'document': request.build_absolute_uri(f'/media/{doc.document}') if doc.document and request else f'/media/{doc.document}' if doc.document else None,
+            'document': protected_media_url(request, 'protected_vendor_document', doc.id) if doc.document else None,
             'uploaded_at': doc.uploaded_at
         } for doc in docs]
 
@@ -237,64 +260,33 @@ class VendorProfileSerializer(serializers.ModelSerializer):
             'referral_code': obj.user.referral_code
         }
 
-    def get_business_license_file_url(self, obj):
-        request = self.context.get('request')
-        if not obj.business_license_file:
+    def _protected_file_url(self, obj, field):
+        if not getattr(obj, field):
             return None
-        if not request:
-            return f'/media/{obj.business_license_file}'
-        if 'ngrok-free.app' in request.get_host():
-            return f'https://{request.get_host()}/media/{obj.business_license_file}'
-        return request.build_absolute_uri(f'/media/{obj.business_license_file}')
+        return protected_media_url(self.context.get('request'), 'protected_vendor_profile_file', obj.pk, field)
+
+    def get_business_license_file_url(self, obj):
+        return self._protected_file_url(obj, 'business_license_file')
 
     def get_gst_certificate_url(self, obj):
-        request = self.context.get('request')
-        if not obj.gst_certificate:
-            return None
-        if not request:
-            return f'/media/{obj.gst_certificate}'
-        return request.build_absolute_uri(f'/media/{obj.gst_certificate}')
+        return self._protected_file_url(obj, 'gst_certificate')
 
     def get_fssai_license_url(self, obj):
-        request = self.context.get('request')
-        if not obj.fssai_license:
-            return None
-        if not request:
-            return f'/media/{obj.fssai_license}'
-        return request.build_absolute_uri(f'/media/{obj.fssai_license}')
+        return self._protected_file_url(obj, 'fssai_license')
 
     def get_bank_document_url(self, obj):
-        request = self.context.get('request')
-        if not obj.bank_document:
-            return None
-        if not request:
-            return f'/media/{obj.bank_document}'
-        return request.build_absolute_uri(f'/media/{obj.bank_document}')
+        return self._protected_file_url(obj, 'bank_document')
 
     def get_is_active(self, obj):
-        # If status is overridden and the override is for today, return the stored is_active
-        if obj.status_override and obj.status_override_date == timezone.now().date():
-            return obj.is_active
-
-        # Otherwise, compute is_active based on the current time and schedule
-        current_time = timezone.now().time()
-        current_day = timezone.now().strftime('%A').lower()
-
-        day_open = getattr(obj, f'{current_day}_open')
-        day_close = getattr(obj, f'{current_day}_close')
-        day_closed = getattr(obj, f'{current_day}_closed')
-
-        if day_closed or not day_open or not day_close:
-            return False
-
-        return day_open <= current_time < day_close
+        # Switched off, switched on for today, else the compiled opening hours (see vendor_schedule)
+        return is_open(obj)
     
     def get_documents(self, obj):
         import logging
         logger = logging.getLogger(__name__)
         request = self.context.get('request')
-        documents = VendorDocument.objects.filter(vendor_profile=obj)
-        logger.debug(f"get_documents for profile {obj.id}: found {documents.count()} documents")
+        documents = obj.additional_docs.all()
+        logger.debug(f"get_documents for profile {obj.id}: found {len(documents)} documents")
         serialized_data = VendorDocumentSerializer(documents, many=True, context={'request': request}).data
         logger.debug(f"Serialized documents data: {len(serialized_data)} items")
         return serialized_data
@@ -303,12 +295,15 @@ class VendorProfileSerializer(serializers.ModelSerializer):
         import logging
         logger = logging.getLogger(__name__)
         request = self.context.get('request')
-        images = VendorShopImage.objects.filter(vendor_profile=obj).order_by('-is_primary', 'uploaded_at')
-        logger.debug(f"get_shop_images for profile {obj.id}: found {images.count()} images")
+        images = obj.shop_images.all()  # Meta.ordering: primary first, then oldest
+        logger.debug(f"get_shop_images for profile {obj.id}: found {len(images)} images")
         serialized_data = VendorShopImageSerializer(images, many=True, context={'request': request}).data
         logger.debug(f"Serialized shop images data: {len(serialized_data)} items")
         return serialized_data
 
+    def get_rating(self, obj):
+        return rating_card(obj)
+
     def validate(self, attrs):
         request = self.context.get('request')
         
@@ -400,28 +395,18 @@ class VendorDocumentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'uploaded_at', 'document_url']
     
     def get_document_url(self, obj):
-        import logging
-        logger = logging.getLogger(__name__)
-        request = self.context.get('request')
-        logger.debug(f"get_document_url for document {obj.id}: document={obj.document}")
-        if obj.document:
-            if request:
-                url = request.build_absolute_uri(f'/media/{obj.document}')
-                logger.debug(f"Generated document URL: {url}")
-                return url
-            url = f'/media/{obj.document}'
-            logger.debug(f"Generated document URL (no request): {url}")
-            return url
-        logger.debug("No document file found")
-        return None
+        if not obj.document:
+            return None
+        return protected_media_url(self.context.get('request'), 'protected_vendor_document', obj.id)
 
 class VendorShopImageSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(write_only=True)
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = VendorShopImage
-        fields = ['id', 'vendor_profile', 'image', 'image_url', 'is_primary', 'uploaded_at']
+        fields = ['id', 'vendor_profile', 'image', 'image_url', 'image_variants', 'is_primary', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at']
     
     def get_image_url(self, obj):
@@ -439,6 +424,9 @@ class VendorShopImageSerializer(serializers.ModelSerializer):
             return url
         logger.debug("No image file found")
         return None
+    
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants, self.context.get('request'))
 
 class AdminUserCreateSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
@@ -488,10 +476,11 @@ class AdminUserUpdateSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'image_url', 'is_primary']
+        fields = ['id', 'image', 'image_url', 'image_variants', 'is_primary']
         read_only_fields = ['id']
     
     def get_image_url(self, obj):
@@ -501,6 +490,9 @@ class ProductImageSerializer(serializers.ModelSerializer):
         elif obj.image:
             return obj.image.url
         return None
+    
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants, self.context.get('request'))
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
@@ -617,12 +609,25 @@ class AddMoneySerializer(serializers.Serializer):
     payment_method = serializers.CharField(max_length=50)
     reference_id = serializers.CharField(max_length=100, required=False)
 
+class ProductFragmentListSerializer(serializers.ListSerializer):
+    """Lists of products (or of rows with a .product) assembled from the fragment cache"""
+
+    def to_representation(self, data):
+        iterable = list(data.all() if isinstance(data, BaseManager) else data)
+        products = [getattr(item, 'product', item) for item in iterable]
+        if not product_fragment_cache.covers(products, self.context):
+            product_fragment_cache.prefetch(products, self.context)
+        representation = [self.child.to_representation(item) for item in iterable]
+        product_fragment_cache.flush(self.context)
+        return representation
+
 class CustomerProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     vendor_name = serializers.CharField(source='vendor.business_name', read_only=True)
     vendor_id = serializers.IntegerField(source='vendor.id', read_only=True)
     vendor_latitude = serializers.FloatField(source='vendor.latitude', read_only=True)
     vendor_longitude = serializers.FloatField(source='vendor.longitude', read_only=True)
+    rating = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
@@ -630,12 +635,18 @@ class CustomerProductSerializer(serializers.ModelSerializer):
             'id', 'name', 'category', 'subcategory', 'price', 'quantity',
             'description', 'short_description', 'tags', 'featured', 'free_delivery',
             'custom_delivery_fee_enabled', 'custom_delivery_fee', 'dynamic_fields', 'images',
-            'vendor_name', 'vendor_id', 'vendor_latitude', 'vendor_longitude', 'created_at'
+            'vendor_name', 'vendor_id', 'vendor_latitude', 'vendor_longitude', 'rating', 'created_at'
         ]
-        # Include total_sold (computed property on Product) so customer-facing
-        # product list/search endpoints return the sold count used by the frontend.
-        fields.append('total_sold')
-        read_only_fields = ['id', 'created_at', 'total_sold']
+        read_only_fields = ['id', 'created_at']
+        list_serializer_class = ProductFragmentListSerializer
+
+    def get_rating(self, obj):
+        return rating_card(obj)
+
+    def to_representation(self, instance):
+        # Customer-facing product list/search endpoints also return total_sold (the sold
+        # count used by the frontend); it is added fresh on top of the cached fragment.
+        return product_fragment_cache.represent(instance, self.context, super().to_representation)
 
 class UserFavoriteSerializer(serializers.ModelSerializer):
     product = CustomerProductSerializer(read_only=True)
@@ -644,6 +655,7 @@ class UserFavoriteSerializer(serializers.ModelSerializer):
         model = UserFavorite
         fields = ['id', 'product', 'created_at']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = ProductFragmentListSerializer
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = CustomerProductSerializer(read_only=True)
@@ -654,6 +666,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id', 'product', 'product_id', 'quantity', 'total_price', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = ProductFragmentListSerializer
     
     def validate_product_id(self, value):
         try:
@@ -671,27 +684,41 @@ class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    quote = serializers.SerializerMethodField()
     
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total_items', 'subtotal', 'created_at', 'updated_at']
+        fields = ['id', 'items', 'total_items', 'subtotal', 'quote', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def to_representation(self, instance):
+        # Items, products and vendors in one query; total_items and subtotal reuse them
+        cart_pricing.load_items(instance)
+        return super().to_representation(instance)
+
+    def get_quote(self, obj):
+        quote = self.context.get('cart_quote') or cart_pricing.quote(obj)
+        return quote.as_response()
+
 # Import order serializers
 from .order_serializers import *
 
 class CategorySerializer(serializers.ModelSerializer):
     icon_url = serializers.SerializerMethodField()
+    icon_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'icon', 'icon_url', 'description', 'is_active', 'display_order']
+        fields = ['id', 'name', 'icon', 'icon_url', 'icon_variants', 'description', 'is_active', 'display_order']
         read_only_fields = ['id']
     
     def get_icon_url(self, obj):
         if obj.icon:
             return obj.icon.url
         return None
+    
+    def get_icon_variants(self, obj):
+        return variant_urls(obj.icon_variants, self.context.get('request'))
 
 # Import message serializers
 from .message_serializers import *
\ No newline at end of file
@@ -0,0 +1,493 @@
+"""
+Socket Load
+Load harness for the WebSocket consumers: N simulated users hold a
+MessageConsumer and a NotificationConsumer socket each, then run, phase by
+phase:
+
+    chat           messages into their conversations (fan-out to every participant)
+    typing         typing started/stopped events (fan-out to the others)
+    calls          CallConsumer signaling between pairs: join, offer, answer, ICE
+    notifications  order notifications published through the channel layer
+
+Every frame carries a token the receiving client looks up to compute
+end-to-end latency. Each phase reports throughput, latency percentiles and
+frames that never arrived; the connect phase reports memory per socket.
+
+Two transports:
+
+    communicator   channels.testing.WebsocketCommunicator in this process,
+                   on the in-memory channel layer or the configured one
+    socket         real sockets to a running Daphne worker (needs the
+                   `websockets` package); notifications are published on
+                   the configured channel layer, so it must be shared (Redis)
+
+    python manage.py benchmark_sockets --users 500
+    python manage.py benchmark_sockets --mode socket --url ws://127.0.0.1:8000 --server-pid 1234
+"""
+
+import asyncio
+import itertools
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+DEFAULT_USERS = 100
+DEFAULT_GROUP_SIZE = 2
+DEFAULT_TIMEOUT = 30
+CONNECT_TIMEOUT = 30
+DEFAULT_CONNECT_CONCURRENCY = 50  # Handshakes in flight; a burst beyond the listen backlog gets reset
+IN_MEMORY_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'PRESENCE_BACKEND': 'accounts.presence.InMemoryPresenceStore',
+    'CALL_STATE_BACKEND': 'accounts.call_state_manager.InMemoryCallStateStore',
+    'EVENT_LOG_BACKEND': 'accounts.event_log.InMemoryEventLogStore',
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def rss_bytes(pid='self'):
+    """Resident set size of a process from /proc, None where there is no /proc"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class CommunicatorClient:
+    """A socket to the ASGI application running in this process"""
+
+    def __init__(self, application, path):
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=CONNECT_TIMEOUT)
+        return connected
+
+    async def send(self, payload):
+        await self.communicator.send_json_to(payload)
+
+    async def receive(self):
+        """Next JSON frame, None once the socket is closed"""
+        # No timeout: on a timeout the communicator would cancel the application
+        message = await self.communicator.receive_output(timeout=None)
+        if message['type'] != 'websocket.send':
+            return None
+        return json.loads(message['text'])
+
+    async def close(self):
+        await self.communicator.disconnect(timeout=CONNECT_TIMEOUT)
+
+
+class SocketClient:
+    """A real WebSocket to a running server"""
+
+    def __init__(self, url):
+        self.url = url
+        self.socket = None
+
+    async def connect(self):
+        import websockets
+        try:
+            self.socket = await websockets.connect(self.url, open_timeout=CONNECT_TIMEOUT, max_size=None)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+            return False
+        return True
+
+    async def send(self, payload):
+        await self.socket.send(json.dumps(payload))
+
+    async def receive(self):
+        import websockets
+        try:
+            return json.loads(await self.socket.recv())
+        except websockets.exceptions.ConnectionClosed:
+            return None
+
+    async def close(self):
+        await self.socket.close()
+
+
+class Phase:
+    """Deliveries expected and seen in one phase, with their latencies"""
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = 0
+        self.expected = 0
+        self.received = 0
+        self.latencies = []
+        self.started = time.perf_counter()
+        self.finished = None
+        self._done = asyncio.Event()
+
+    def expect(self, deliveries):
+        self.sent += 1
+        self.expected += deliveries
+
+    def record(self, latency):
+        self.received += 1
+        self.latencies.append(latency)
+        if self.received >= self.expected:
+            self._done.set()
+
+    async def wait(self, timeout):
+        """Until every expected delivery arrived or timeout seconds passed"""
+        if self.received < self.expected:
+            self._done.clear()
+            try:
+                await asyncio.wait_for(self._done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.finished = time.perf_counter()
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {
+            'sent': self.sent,
+            'expected': self.expected,
+            'received': self.received,
+            'lost': max(self.expected - self.received, 0),
+            'seconds': round(elapsed, 3),
+            'sent_per_second': round(self.sent / elapsed, 1) if elapsed else None,
+            'deliveries_per_second': round(self.received / elapsed, 1) if elapsed else None,
+        }
+        if self.latencies:
+            report.update({
+                f'{label}_ms': round(percentile(self.latencies, fraction) * 1000, 2)
+                for label, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+            })
+            report['max_ms'] = round(max(self.latencies) * 1000, 2)
+        return report
+
+
+class LoadClient:
+    """One simulated user's socket: a reader task feeding latencies back to the harness"""
+
+    def __init__(self, harness, user_id, transport):
+        self.harness = harness
+        self.user_id = user_id
+        self.transport = transport
+        self.waiters = {}  # frame type -> future resolved by the next such frame
+        self.counts = {}  # frame type -> frames received
+        self.reader = None
+
+    async def connect(self):
+        if not await self.transport.connect():
+            return False
+        self.reader = asyncio.create_task(self._read())
+        return True
+
+    async def send(self, payload):
+        await self.transport.send(payload)
+
+    def next_frame(self, frame_type):
+        future = self.waiters.get(frame_type)
+        if future is None or future.done():
+            future = self.waiters[frame_type] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def wait_for_count(self, frame_type, count, timeout):
+        while self.counts.get(frame_type, 0) < count:
+            await asyncio.wait_for(self.next_frame(frame_type), timeout)
+
+    async def _read(self):
+        while True:
+            frame = await self.transport.receive()
+            if frame is None:
+                return
+            self.harness.on_frame(self, frame)
+            kind = frame.get('type')
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            future = self.waiters.pop(kind, None)
+            if future is not None and not future.done():
+                future.set_result(frame)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+        await self.transport.close()
+
+
+class SocketLoadHarness:
+    def __init__(self, users, conversations, tokens, mode='communicator', url=None, timeout=DEFAULT_TIMEOUT,
+                 server_pid=None, connect_concurrency=DEFAULT_CONNECT_CONCURRENCY):
+        self.users = users  # user ids
+        self.conversations = conversations  # [(conversation id, [participant ids])]
+        self.tokens = tokens  # user id -> API token
+        self.mode = mode
+        self.url = (url or '').rstrip('/')
+        self.timeout = timeout
+        self.server_pid = server_pid
+        self.connect_concurrency = connect_concurrency
+        self.application = None
+        self.phase = None
+        self.sent_at = {}  # token -> perf_counter at send
+        self.typing_sent_at = {}  # (conversation id, user id, is typing) -> perf_counter at send
+        self._tokens = itertools.count(1)
+        self._handshakes = None
+
+    def client(self, user_id, path):
+        path = f'{path}?token={self.tokens[user_id]}'
+        if self.mode == 'socket':
+            transport = SocketClient(f'{self.url}/{path}')
+        else:
+            if self.application is None:
+                from .routing import websocket_urlpatterns
+                from .websocket_auth import TokenAuthMiddlewareStack
+                from channels.routing import URLRouter
+                self.application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+            transport = CommunicatorClient(self.application, path)
+        return LoadClient(self, user_id, transport)
+
+    def token(self):
+        token = next(self._tokens)
+        self.sent_at[token] = time.perf_counter()
+        return token
+
+    def on_frame(self, client, frame):
+        """Match a delivered frame to the send it came from"""
+        now = time.perf_counter()
+        kind = frame.get('type')
+        token = None
+        if kind == 'new_message':
+            content = frame['message'].get('content') or ''
+            if content.startswith('load:'):
+                token = int(content[5:])
+        elif kind == 'typing_indicator':
+            sent = self.typing_sent_at.get((frame['conversation_id'], frame['user_id'], frame['is_typing']))
+            if sent is not None and self.phase is not None:
+                self.phase.record(now - sent)
+            return
+        elif kind in ('offer', 'answer', 'ice_candidate'):
+            token = (frame.get(kind if kind != 'ice_candidate' else 'candidate') or {}).get('load')
+        elif kind == 'order_notification':
+            token = frame['notification']['data'].get('load')
+        if token is not None and token in self.sent_at and self.phase is not None:
+            self.phase.record(now - self.sent_at[token])
+
+    async def run(self, messages=10, typing=10, calls=10, candidates=5, notifications=10, interval=0.0):
+        """{phase: report} for the connect phase and every phase with a count above 0"""
+        results = {'connect': await self.connect_all()}
+        try:
+            if messages:
+                results['chat'] = await self.chat(messages, interval)
+            if typing:
+                results['typing'] = await self.typing(typing, interval)
+            if calls:
+                results['calls'] = await self.calls(calls, candidates)
+            if notifications:
+                results['notifications'] = await self.notifications(notifications)
+        finally:
+            await asyncio.gather(*(client.close() for client in self.message_sockets + self.notification_sockets))
+            from .call_registry import call_registry
+            await call_registry.flush()
+        return results
+
+    async def connect_all(self):
+        """A message and a notification socket per user; the memory they hold"""
+        rss_before = rss_bytes(self.server_pid or 'self')
+        tracing = self.mode == 'communicator' and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+
+        started = time.perf_counter()
+        self.message_sockets = [self.client(user_id, 'ws/messages/') for user_id in self.users]
+        self.notification_sockets = [self.client(user_id, 'ws/notifications/') for user_id in self.users]
+        sockets = self.message_sockets + self.notification_sockets
+        connected = await asyncio.gather(*(self.open(client) for client in sockets))
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'sockets': len(sockets),
+            'connected': sum(connected),
+            'seconds': round(elapsed, 3),
+            'connects_per_second': round(len(sockets) / elapsed, 1) if elapsed else None,
+        }
+        if tracing:
+            report['traced_bytes_per_socket'] = round((tracemalloc.get_traced_memory()[0] - traced_before)
+                                                      / max(sum(connected), 1))
+            tracemalloc.stop()
+        rss_after = rss_bytes(self.server_pid or 'self')
+        if rss_before is not None and rss_after is not None:
+            report['rss_bytes_per_socket'] = round((rss_after - rss_before) / max(sum(connected), 1))
+        if not all(connected):
+            # Keep only the sockets that are open so the phases do not write to closed ones
+            self.message_sockets = [c for c, ok in zip(self.message_sockets, connected[:len(self.users)]) if ok]
+            self.notification_sockets = [c for c, ok in zip(self.notification_sockets,
+                                                             connected[len(self.users):]) if ok]
+        return report
+
+    async def open(self, client):
+        if self._handshakes is None:
+            self._handshakes = asyncio.Semaphore(self.connect_concurrency)
+        async with self._handshakes:
+            return await client.connect()
+
+    def sockets_by_user(self):
+        return {client.user_id: client for client in self.message_sockets}
+
+    async def chat(self, messages, interval):
+        self.phase = phase = Phase('chat')
+        sockets = self.sockets_by_user()
+
+        async def talk(conversation_id, participants):
+            for n in range(messages):
+                client = sockets.get(participants[n % len(participants)])
+                if client is None:
+                    continue
+                phase.expect(sum(user_id in sockets for user_id in participants))
+                await client.send({'type': 'message', 'conversation_id': conversation_id,
+                                   'content': f'load:{self.token()}'})
+                if interval:
+                    await asyncio.sleep(interval)
+
+        await asyncio.gather(*(talk(*conversation) for conversation in self.conversations))
+        await phase.wait(self.timeout)
+        return phase.report()
+
+    async def typing(self, events, interval):
+        self.phase = phase = Phase('typing')
+        sockets = self.sockets_by_user()
+
+        async def type_in(conversation_id, participants, user_id):
+            client = sockets[user_id]
+            # Started and stopped alternate, so the server's throttle forwards every event
+            for n in range(events):
+                is_typing = n % 2 == 0
+                phase.expect(sum(other in sockets for other in participants if other != user_id))
+                self.typing_sent_at[(conversation_id, user_id, is_typing)] = time.perf_counter()
+                await client.send({'type': 'typing', 'conversation_id': conversation_id, 'is_typing': is_typing})
+                if interval:
+                    await asyncio.sleep(interval)
+
+        await asyncio.gather(*(type_in(conversation_id, participants, user_id)
+                               for conversation_id, participants in self.conversations
+                               for user_id in participants if user_id in sockets))
+        await phase.wait(self.timeout)
+        return phase.report()
+
+    async def calls(self, count, candidates):
+        """Caller and callee sockets per call: join, offer/answer, then ICE candidates both ways"""
+        self.phase = phase = Phase('calls')
+        pairs = list(zip(self.users[0::2], self.users[1::2]))[:count]
+        call_ids = await self.create_calls(pairs)
+        setups = []
+
+        async def signal(call_id, caller_id, callee_id):
+            caller = self.client(caller_id, f'ws/calls/{caller_id}/')
+            callee = self.client(callee_id, f'ws/calls/{callee_id}/')
+            try:
+                if not all(await asyncio.gather(self.open(caller), self.open(callee))):
+                    return
+                started = time.perf_counter()
+                for client in (caller, callee):
+                    joined = client.next_frame('join_call_success')
+                    await client.send({'type': 'join_call', 'call_id': call_id})
+                    await asyncio.wait_for(joined, self.timeout)
+
+                answered = caller.next_frame('answer')
+                phase.expect(1)
+                await caller.send({'type': 'offer', 'offer': {'sdp': 'v=0', 'load': self.token()},
+                                   'call_type': 'audio'})
+                phase.expect(1)
+                await callee.send({'type': 'answer', 'answer': {'sdp': 'v=0', 'load': self.token()}})
+                await asyncio.wait_for(answered, self.timeout)
+                setups.append(time.perf_counter() - started)
+
+                for n in range(candidates):
+                    for client in (caller, callee):
+                        phase.expect(1)
+                        await client.send({'type': 'ice_candidate',
+                                           'candidate': {'candidate': f'candidate:{n}', 'sdpMLineIndex': 0,
+                                                         'load': self.token()}})
+                for client in (caller, callee):
+                    await client.wait_for_count('ice_candidate', candidates, self.timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await asyncio.gather(caller.close(), callee.close(), return_exceptions=True)
+
+        await asyncio.gather(*(signal(call_id, *pair) for call_id, pair in zip(call_ids, pairs)))
+        await phase.wait(self.timeout)
+        report = phase.report()
+        if setups:
+            report['setup_p50_ms'] = round(statistics.median(setups) * 1000, 2)
+            report['setup_p95_ms'] = round(percentile(setups, 0.95) * 1000, 2)
+        return report
+
+    @database_sync_to_async
+    def create_calls(self, pairs):
+        from .message_models import Call
+        calls = [Call(call_id=f'load_{uuid.uuid4().hex[:16]}', caller_id=caller_id, receiver_id=callee_id)
+                 for caller_id, callee_id in pairs]
+        Call.objects.bulk_create(calls)
+        return [call.call_id for call in calls]
+
+    async def notifications(self, count):
+        """Order notifications to every user's notification socket, published as the order views do"""
+        from .event_log import event_log
+        self.phase = phase = Phase('notifications')
+        channel_layer = get_channel_layer()
+        connected = {client.user_id for client in self.notification_sockets}
+
+        async def publish(user_id):
+            for _ in range(count):
+                phase.expect(1 if user_id in connected else 0)
+                event = await event_log.arecord(user_id, {
+                    'type': 'order_notification',
+                    'notification_id': f'load_{user_id}',
+                    'title': 'Order Update',
+                    'message': 'Your order is on the way',
+                    'data': {'load': self.token()},
+                })
+                await channel_layer.group_send(f'customer_notifications_{user_id}', event)
+
+        await asyncio.gather(*(publish(user_id) for user_id in self.users))
+        await phase.wait(self.timeout)
+        return phase.report()
+
+
+def seed(users, group_size=DEFAULT_GROUP_SIZE, prefix='load'):
+    """Users with API tokens in conversations of group_size; (user ids, conversations, tokens)"""
+    from rest_framework.authtoken.models import Token
+    from .message_models import Conversation
+    from .models import CustomUser
+    created = [CustomUser.objects.create(username=f'{prefix}_{n}') for n in range(users)]
+    tokens = {token.user_id: token.key for token in Token.objects.filter(user__in=created)}
+    for user in created:
+        if user.id not in tokens:
+            tokens[user.id] = Token.objects.create(user=user).key
+
+    conversations = []
+    for start in range(0, len(created) - group_size + 1, group_size):
+        members = created[start:start + group_size]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*members)
+        conversations.append((conversation.id, [user.id for user in members]))
+    return [user.id for user in created], conversations, tokens
+
+
+def cleanup(prefix='load'):
+    from .message_models import Conversation
+    from .models import CustomUser
+    users = CustomUser.objects.filter(username__startswith=f'{prefix}_')
+    Conversation.objects.filter(participants__in=users).delete()
+    users.delete()
@@ -1,3 +1,1352 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import datetime
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+import uuid
+import zoneinfo
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from PIL import Image
+from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from django.test import TestCase, SimpleTestCase
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import ResolverMatch
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import api_benchmarks, socket_load
+from .api_views import CustomerVendorSearchView, VendorProfileListCreateView, get_cart_api, get_categories_api
+from .call_registry import CallRegistry, call_registry
+from .call_state_manager import CallStateManager, InMemoryCallStateStore
+from .cart_pricing import cart_pricing, price_items
+from .catalog_cache import catalog_cache
+from .consumers import CallConsumer, TypingThrottle
+from .content_storage import is_blob
+from .conversation_cache import get_participant_ids
+from .dynamic_fields import optimize_queryset, selected_fields
+from .event_log import CacheEventLogStore, InMemoryEventLogStore
+from .fast_json import FastJSONParser, FastJSONRenderer, JSONWebsocketConsumer
+from .image_utils import ImageProcessor
+from .instrumentation import instrumentation
+from .message_models import Call, Conversation, Message
+from .order_models import DeliveryRider, Order, OrderDelivery, OrderItem, OrderRefund, ProductRatingSummary, VendorRatingSummary
+from .order_views import (create_review_api, dispatch_orders_api, get_product_reviews_api, nearest_riders_api,
+                          update_rider_location_api)
+from .models import Cart, CartItem, Category, CustomUser, FCMToken, MediaBlob, Product, ProductImage, PushNotification, VendorDocument, VendorProfile
+from .push_campaigns import CampaignEngine
+from .responsive_images import variant_urls
+from .message_serializers import ConversationSerializer, MessageSerializer
+from .order_serializers import OrderRefundSerializer
+from .serializers import CustomerProductSerializer, VendorProfileSerializer
+from .push_sender import FCMTransport, PushSender
+from .request_profiler import InMemoryProfileStore, request_profiler
+from .rider_dispatch import RiderGridIndex, rider_dispatcher
+from .rider_tracking import (InMemoryLocationStore, LocationFix, RiderTracker, can_report_location, distance_m,
+                            tracking_group_name)
+from .product_fragments import product_fragment_cache
+from .presence import InMemoryPresenceStore, PresenceService, presence_group_name, presence_service
+from .protected_media import vendor_document_api
+from .timer_wheel import HashedTimerWheel
+from .vendor_schedule import filter_open, state_at, vendor_scheduler
+from ezeyway.middleware import CompressionMiddleware, InstrumentationMiddleware, RequestProfilerMiddleware
+
+
+class PresenceServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = InMemoryChannelLayer()
+        self.service = PresenceService(store=InMemoryPresenceStore(), ttl=60)
+
+    def test_batch_online_lookup(self):
+        async_to_sync(self.service.connect)(self.layer, 1)
+        async_to_sync(self.service.connect)(self.layer, 3)
+        self.assertEqual(self.service.online_users([1, 2, 3]), {1, 3})
+
+        async_to_sync(self.service.disconnect)(self.layer, 1)
+        self.assertEqual(self.service.online_users([1, 2, 3]), {3})
+
+    def test_lapsed_entries_are_announced_offline(self):
+        service = PresenceService(store=InMemoryPresenceStore(), ttl=0.1, tick=0.05)
+
+        async def scenario():
+            subscriber = await self.layer.new_channel()
+            await service.subscribe(self.layer, subscriber, [7])
+            # Two sockets dropped without a disconnect
+            await service.connect(self.layer, 7)
+            await service.connect(self.layer, 7)
+            self.assertEqual((await self.layer.receive(subscriber))['status'], 'online')
+            event = await asyncio.wait_for(self.layer.receive(subscriber), 1)
+            self.assertEqual(event, {'type': 'user_status', 'user_id': 7, 'status': 'offline'})
+            self.assertEqual(await service.aonline_users([7]), set())
+
+            # The dropped sockets are no longer counted
+            await service.connect(self.layer, 7)
+            await service.disconnect(self.layer, 7)
+            self.assertEqual([(await self.layer.receive(subscriber))['status'] for _ in range(2)], ['online', 'offline'])
+
+        async_to_sync(scenario)()
+
+    def test_changes_reach_only_subscribers(self):
+        async def scenario():
+            subscriber = await self.layer.new_channel()
+            bystander = await self.layer.new_channel()
+            await self.service.subscribe(self.layer, subscriber, [5])
+            await self.service.connect(self.layer, 5)
+            # A heartbeat from an already-online user is not re-broadcast
+            await self.service.heartbeat(self.layer, 5)
+            event = await self.layer.receive(subscriber)
+            self.assertEqual(event, {'type': 'user_status', 'user_id': 5, 'status': 'online'})
+            self.assertNotIn(presence_group_name(5), [
+                group for group, channels in self.layer.groups.items() if bystander in channels
+            ])
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.layer.receive(subscriber), 0.05)
+
+        async_to_sync(scenario)()
+
+
+class PresenceSocketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_user_stays_online_until_last_socket_closes(self):
+        from channels.routing import URLRouter
+        from .routing import websocket_urlpatterns
+        from .websocket_auth import TokenAuthMiddlewareStack
+        alice = CustomUser.objects.create(username='alice')
+        bob = CustomUser.objects.create(username='bob')
+        Conversation.objects.create().participants.add(alice, bob)
+        tokens = {user.id: Token.objects.get_or_create(user=user)[0].key for user in (alice, bob)}
+        application = TokenAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+        async def open_socket(user):
+            communicator = WebsocketCommunicator(application, f'ws/messages/?token={tokens[user.id]}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator
+
+        async def scenario():
+            watcher = await open_socket(bob)
+            await watcher.send_json_to({'type': 'presence_subscribe'})
+            self.assertEqual((await watcher.receive_json_from())['type'], 'presence_snapshot')
+            first, second = await open_socket(alice), await open_socket(alice)
+            self.assertEqual(await watcher.receive_json_from(),
+                             {'type': 'user_status', 'user_id': alice.id, 'status': 'online'})
+
+            await first.disconnect()
+            self.assertTrue(await watcher.receive_nothing(0.1))
+            self.assertEqual(await presence_service.aonline_users([alice.id]), {alice.id})
+
+            await second.disconnect()
+            self.assertEqual(await watcher.receive_json_from(),
+                             {'type': 'user_status', 'user_id': alice.id, 'status': 'offline'})
+            await watcher.disconnect()
+
+        with contextlib.redirect_stdout(StringIO()):
+            async_to_sync(scenario)()
+
+
+class ConversationParticipantsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_is_invalidated_on_participant_changes(self):
+        alice = CustomUser.objects.create(username='alice')
+        bob = CustomUser.objects.create(username='bob')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(alice)
+        self.assertEqual(get_participant_ids(conversation.id), [alice.id])
+
+        with self.assertNumQueries(0):
+            get_participant_ids(conversation.id)
+
+        bob.conversations.add(conversation)
+        self.assertCountEqual(get_participant_ids(conversation.id), [alice.id, bob.id])
+
+        conversation.participants.remove(alice)
+        self.assertEqual(get_participant_ids(conversation.id), [bob.id])
+
+
+class TypingThrottleTests(SimpleTestCase):
+    def test_repeated_typing_events_are_coalesced(self):
+        throttle = TypingThrottle(interval=60)
+        self.assertTrue(throttle.should_send(1, True))
+        self.assertFalse(throttle.should_send(1, True))
+        self.assertTrue(throttle.should_send(2, True))
+        self.assertTrue(throttle.should_send(1, False))
+        self.assertTrue(throttle.should_send(1, True))
+
+
+class EventLogStoreTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def check_store(self, store):
+        for i in range(5):
+            store.append(1, {'type': 'new_message', 'n': i})
+        store.append(2, {'type': 'new_message', 'n': 'other user'})
+
+        events, resync, head = store.since(1, 2)
+        self.assertFalse(resync)
+        self.assertEqual(head, 5)
+        self.assertEqual([event['seq'] for event in events], [3, 4, 5])
+        self.assertEqual([event['n'] for event in events], [2, 3, 4])
+
+        self.assertEqual(store.since(1, 5), ([], False, 5))
+
+        # Capacity is 3, so seq 1 and 2 were overwritten
+        self.assertEqual(store.since(1, 1), ([], True, 5))
+        # A client ahead of the server lost the log and must resync too
+        self.assertEqual(store.since(1, 9), ([], True, 5))
+
+    def test_in_memory_store(self):
+        self.check_store(InMemoryEventLogStore(capacity=3))
+
+    def test_cache_store(self):
+        self.check_store(CacheEventLogStore(capacity=3))
+
+
+class HashedTimerWheelTests(SimpleTestCase):
+    def test_timers_fire_in_order_across_rounds(self):
+        async def scenario():
+            wheel = HashedTimerWheel(tick=0.01, slots=4)
+            fired = []
+            started = time.monotonic()
+            for delay in (0.09, 0.02, 0.05):
+                wheel.schedule(delay, lambda d=delay: fired.append((d, time.monotonic() - started)))
+            wheel.schedule(0.03, fired.append, 'cancelled').cancel()
+            while len(wheel):
+                await asyncio.sleep(0.01)
+            self.assertEqual([delay for delay, _ in fired], [0.02, 0.05, 0.09])
+            for delay, elapsed in fired:
+                self.assertGreaterEqual(elapsed, delay)
+
+        async_to_sync(scenario)()
+
+
+class CallStateManagerTests(SimpleTestCase):
+    def make_manager(self, store):
+        manager = CallStateManager(store=store, reconnect_timeout=0.2)
+        manager.ended = []
+
+        async def record_end(call_id, user_id, status):
+            manager.ended.append((call_id, user_id))
+
+        manager.async_call_state = record_end
+        manager._get_call_state = lambda call_id: None
+        return manager
+
+    def test_thousands_of_simultaneous_disconnects(self):
+        manager = self.make_manager(InMemoryCallStateStore())
+
+        async def scenario():
+            threads_before = threading.active_count()
+            await asyncio.gather(*(manager.handle_disconnect(f"call_{i}", i) for i in range(5000)))
+            # One timer wheel task, not a thread per disconnect
+            self.assertEqual(threading.active_count(), threads_before)
+            self.assertEqual(len(manager.timer_wheel()), 5000)
+
+            await asyncio.gather(*(manager.handle_reconnect(f"call_{i}", i) for i in range(0, 5000, 2)))
+            while len(manager.timer_wheel()):
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.05)
+
+        with self.settings(CALL_TIMER_TICK_SECONDS=0.05):
+            async_to_sync(scenario)()
+        self.assertEqual(sorted(user_id for _, user_id in manager.ended), list(range(1, 5000, 2)))
+
+    def test_reconnect_on_another_worker_cancels_timeout(self):
+        store = InMemoryCallStateStore()
+        worker_a = self.make_manager(store)
+        worker_b = self.make_manager(store)
+
+        async def scenario():
+            await worker_a.handle_disconnect('call_1', 1)
+            await worker_b.handle_reconnect('call_1', 1)
+            await asyncio.sleep(0.4)
+
+        with self.settings(CALL_TIMER_TICK_SECONDS=0.05):
+            async_to_sync(scenario)()
+        self.assertEqual(worker_a.ended, [])
+
+
+class CallRegistryTests(TestCase):
+    def test_signaling_state_is_written_behind(self):
+        caller = CustomUser.objects.create(username='caller')
+        receiver = CustomUser.objects.create(username='receiver')
+        outsider = CustomUser.objects.create(username='outsider')
+        call = Call.objects.create(call_id='call_registry_1', caller=caller, receiver=receiver)
+        registry = CallRegistry(flush_interval=60)
+        registry.register(call)
+
+        active = registry.lookup(call.call_id)
+        self.assertTrue(active.has_access(receiver.id))
+        self.assertFalse(active.has_access(outsider.id))
+        self.assertIs(registry.lookup(str(call.pk)), active)
+
+        async def answer():
+            await registry.set_status(call.call_id, 'answered')
+            await registry.flush()
+
+        async_to_sync(answer)()
+        call.refresh_from_db()
+        self.assertEqual(call.status, 'answered')
+        self.assertIsNotNone(call.answered_at)
+
+        async def end():
+            await registry.set_status(call.call_id, 'ended')
+            await registry.flush()
+
+        async_to_sync(end)()
+        call.refresh_from_db()
+        self.assertEqual(call.status, 'ended')
+        self.assertIsNone(registry.lookup(call.call_id))
+
+    def test_late_batch_from_another_worker_does_not_reopen_call(self):
+        caller = CustomUser.objects.create(username='caller')
+        receiver = CustomUser.objects.create(username='receiver')
+        guest_a = CustomUser.objects.create(username='guest_a')
+        guest_b = CustomUser.objects.create(username='guest_b')
+        call = Call.objects.create(call_id='call_registry_2', caller=caller, receiver=receiver)
+        worker_a = CallRegistry(flush_interval=60)
+        worker_b = CallRegistry(flush_interval=60)
+
+        async def scenario():
+            await worker_a.set_status(call.call_id, 'answered')
+            await worker_a.add_participant(call.call_id, guest_a.id)
+            await worker_b.add_participant(call.call_id, guest_b.id)
+            await worker_b.set_status(call.call_id, 'ended')
+            await worker_b.flush()
+            # Worker A's batch window closes after B already ended the call
+            await worker_a.flush()
+
+        async_to_sync(scenario)()
+        call.refresh_from_db()
+        self.assertEqual(call.status, 'ended')
+        self.assertIsNone(call.answered_at)
+        self.assertTrue({caller.id, receiver.id, guest_a.id, guest_b.id} <= set(call.participants))
+
+    def test_leaving_a_one_to_one_call_ends_it(self):
+        caller = CustomUser.objects.create(username='caller')
+        receiver = CustomUser.objects.create(username='receiver')
+        guest = CustomUser.objects.create(username='guest')
+        calls = [Call.objects.create(call_id=f'call_registry_leave_{n}', caller=caller, receiver=receiver, status='answered')
+                 for n in range(2)]
+
+        async def leave(call, joined=()):
+            for user in joined:
+                await call_registry.add_participant(call.call_id, user.id)
+            consumer = CallConsumer()
+            consumer.call_id, consumer.user = call.call_id, receiver
+            await consumer.handle_leave_call({})
+            await call_registry.flush()
+
+        async_to_sync(leave)(calls[0])
+        async_to_sync(leave)(calls[1], joined=[guest])
+        statuses = [Call.objects.get(pk=call.pk).status for call in calls]
+        call_registry.forget(calls[1].call_id)
+        self.assertEqual(statuses, ['ended', 'answered'])
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    """Answers like the FCM v1 API: tokens starting with 'dead' are unregistered, 'bad' are malformed"""
+
+    def do_POST(self):
+        message = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['message']
+        self.server.received.append(message['token'])
+        if message['token'].startswith('dead'):
+            status, body = 404, {'error': {'status': 'NOT_FOUND', 'message': 'Requested entity was not found.',
+                                           'details': [{'errorCode': 'UNREGISTERED'}]}}
+        elif message['token'].startswith('bad'):
+            status, body = 400, {'error': {'status': 'INVALID_ARGUMENT',
+                                           'message': 'The registration token is not a valid FCM registration token'}}
+        else:
+            status, body = 200, {'name': 'projects/test/messages/1'}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class PushSenderTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFCMHandler)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        endpoint = f"http://127.0.0.1:{self.server.server_port}/v1/projects/test/messages:send"
+        self.sender = PushSender(transport=FCMTransport(endpoint=endpoint, max_workers=4), batch_size=2)
+
+    def test_multi_device_send_prunes_dead_tokens(self):
+        customer = CustomUser.objects.create(username='customer')
+        vendor = CustomUser.objects.create(username='vendor')
+        for token in ('phone', 'tablet', 'dead_old_phone'):
+            FCMToken.register(customer, f"{token}_token", 'android')
+        FCMToken.register(vendor, 'vendor_token', 'ios')
+        FCMToken.register(vendor, 'bad_token', 'web')
+
+        result = self.sender.send_to_users([customer, vendor.id], title='Hi', body='There', data={'orderId': 7})
+
+        self.assertEqual((result.success_count, result.failure_count, result.pruned_count), (3, 2, 2))
+        self.assertEqual(len(self.server.received), 5)
+        self.assertEqual(
+            sorted(FCMToken.objects.values_list('token', flat=True)),
+            ['phone_token', 'tablet_token', 'vendor_token']
+        )
+
+    def test_token_moves_to_new_account(self):
+        first = CustomUser.objects.create(username='first')
+        second = CustomUser.objects.create(username='second')
+        FCMToken.register(first, 'shared_device', 'android')
+        FCMToken.register(second, 'shared_device', 'android')
+        self.assertEqual(list(FCMToken.objects.values_list('user_id', flat=True)), [second.id])
+
+
+class PushCampaignTests(TestCase):
+    class FlakyTransport:
+        """Records sent tokens; fails the batch at index `fail_at` once"""
+
+        def __init__(self, fail_at):
+            self.fail_at = fail_at
+            self.batches = []
+
+        def send_multicast(self, tokens, message):
+            if len(self.batches) == self.fail_at:
+                self.fail_at = None
+                raise ConnectionError('worker died')
+            self.batches.append(list(tokens))
+            return ['UNREGISTERED' if token.startswith('dead') else None for token in tokens]
+
+    def test_campaign_resumes_after_crash(self):
+        admin = CustomUser.objects.create(username='admin', user_type='superuser')
+        CustomUser.objects.create(username='vendor', user_type='vendor')
+        for i in range(5):
+            customer = CustomUser.objects.create(username=f"customer{i}", user_type='customer')
+            FCMToken.register(customer, f"{'dead' if i == 3 else 'live'}_{i}")
+        campaign = PushNotification.objects.create(
+            title='Sale', message='Everything 10% off', recipient_type='customer',
+            status='scheduled', scheduled_time=timezone.now(), created_by=admin
+        )
+        transport = self.FlakyTransport(fail_at=1)
+        engine = CampaignEngine(sender=PushSender(transport=transport), chunk_size=2, rate=0)
+
+        self.assertEqual(engine.run_due(), 0)
+        campaign.refresh_from_db()
+        self.assertEqual((campaign.status, campaign.sent_count), ('sending', 2))
+        # A live lease keeps other dispatchers away
+        self.assertEqual(engine.run_due(), 0)
+
+        PushNotification.objects.filter(id=campaign.id).update(locked_until=timezone.now())
+        self.assertEqual(engine.run_due(), 1)
+        campaign.refresh_from_db()
+        self.assertEqual((campaign.status, campaign.sent_count, campaign.failed_count), ('sent', 4, 1))
+        self.assertEqual(sorted(token for batch in transport.batches for token in batch),
+                         ['dead_3', 'live_0', 'live_1', 'live_2', 'live_4'])
+        self.assertFalse(FCMToken.objects.filter(token='dead_3').exists())
+
+
+class MessageImagePipelineTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        protected_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, protected_root)
+        overrides = self.settings(MEDIA_ROOT=media_root, PROTECTED_MEDIA_ROOT=protected_root, MESSAGE_IMAGE_WORKERS=0,
+                                  EVENT_LOG_BACKEND='accounts.event_log.InMemoryEventLogStore')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def make_upload(self, size):
+        output = BytesIO()
+        Image.new('RGB', size, (200, 40, 40)).save(output, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg')
+
+    def test_placeholder_then_variants(self):
+        sender = CustomUser.objects.create(username='sender')
+        receiver = CustomUser.objects.create(username='receiver')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(sender, receiver)
+
+        placeholder, job = ImageProcessor.queue_message_image(self.make_upload((4000, 3000)), conversation.id, sender.id)
+        message = Message.objects.create(conversation=conversation, sender=sender, message_type='image', **placeholder)
+        self.assertEqual(message.status, 'sending')
+
+        layer = InMemoryChannelLayer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f"user_{receiver.id}", channel)
+        with mock.patch('accounts.event_log.get_channel_layer', return_value=layer):
+            job.start(message.id)
+
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'sent')
+        self.assertEqual((message.image_width, message.image_height), (1920, 1440))
+        self.assertEqual(sorted(message.image_variants['webp']), ['1920', '300', '960'])
+        self.assertEqual(message.thumbnail_url, message.image_variants['jpeg']['300'])
+
+        # Renditions live in protected storage and clients only see the access-checked URLs
+        self.assertTrue(message.file_url.startswith('protected/'))
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'message_updated')
+        self.assertEqual(event['message']['file_url'], f'/api/media/messages/{message.id}/')
+        self.assertEqual(event['message']['image_variants']['webp']['300'],
+                         f'/api/media/messages/{message.id}/?format=webp&size=300')
+        self.assertNotIn(message.thumbnail_url, json.dumps(event))
+
+
+class ResponsiveImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = self.settings(MEDIA_ROOT=media_root, MESSAGE_IMAGE_WORKERS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def make_upload(self, name, size):
+        output = BytesIO()
+        Image.new('RGB', size, (20, 120, 40)).save(output, format='PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def test_variants_are_content_addressed(self):
+        first = Category.objects.create(name='Groceries', icon=self.make_upload('a.png', (900, 600)))
+        second = Category.objects.create(name='Bakery', icon=self.make_upload('b.png', (900, 600)))
+        first.refresh_from_db()
+        second.refresh_from_db()
+
+        self.assertEqual(sorted(first.icon_variants['webp'], key=int), ['160', '320', '640', '900'])
+        # Identical bytes share one set of immutable files
+        self.assertEqual(first.icon_variants['jpeg'], second.icon_variants['jpeg'])
+        # ...and, with content-addressed storage, one source file
+        self.assertEqual(first.icon_variants['source'], second.icon_variants['source'])
+
+        urls = variant_urls(first.icon_variants)
+        self.assertEqual(urls['width'], 900)
+        self.assertIn('/variants/', urls['srcset']['webp'])
+        self.assertTrue(urls['srcset']['webp'].endswith(' 900w'))
+
+
+class ContentStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.protected_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.protected_root)
+        overrides = self.settings(MEDIA_ROOT=self.media_root, PROTECTED_MEDIA_ROOT=self.protected_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_identical_uploads_share_one_blob(self):
+        first = default_storage.save('documents/1_license.pdf', ContentFile(b'%PDF same bytes'))
+        second = default_storage.save('documents/2_license.pdf', ContentFile(b'%PDF same bytes'))
+        other = default_storage.save('documents/3_license.pdf', ContentFile(b'%PDF other bytes'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(is_blob(first) and first.endswith('.pdf'))
+        self.assertEqual(MediaBlob.objects.get(name=first).refcount, 2)
+
+        # The file stays until its last reference is deleted
+        default_storage.delete(first)
+        self.assertTrue(default_storage.exists(first))
+        default_storage.delete(second)
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(MediaBlob.objects.filter(name=first).exists())
+
+    def test_passthrough_paths_keep_their_name(self):
+        name = default_storage.save('variants/ab/abcdef_320w.webp', ContentFile(b'webp'))
+        self.assertEqual(name, 'variants/ab/abcdef_320w.webp')
+
+    def test_protected_uploads_stay_outside_media_root(self):
+        document = default_storage.save('documents/1_license.pdf', ContentFile(b'%PDF same bytes'))
+        image = default_storage.save('shop_images/1.pdf', ContentFile(b'%PDF same bytes'))
+
+        self.assertTrue(document.startswith('protected/') and image.startswith('blobs/'))
+        self.assertTrue(default_storage.path(document).startswith(self.protected_root))
+        self.assertTrue(default_storage.path(image).startswith(self.media_root))
+        self.assertEqual(MediaBlob.objects.get(name=document).digest, MediaBlob.objects.get(name=image).digest)
+        with self.assertRaises(ValueError):
+            default_storage.url(document)
+
+    def test_dedupe_command_rewrites_references(self):
+        user = CustomUser.objects.create_user(username='shop', password='x', user_type='vendor')
+        vendor = VendorProfile.objects.create(user=user, business_name='Shop', business_email='s@example.com',
+                                              business_phone='980000000', business_address='Kathmandu', state='Bagmati')
+        for name in ('documents/a.pdf', 'documents/b.pdf'):
+            default_storage.backend.save(name, ContentFile(b'%PDF duplicate'))
+            VendorDocument.objects.create(vendor_profile=vendor, document=name)
+
+        call_command('dedupe_media', stdout=StringIO())
+
+        documents = set(VendorDocument.objects.values_list('document', flat=True))
+        self.assertEqual(len(documents), 1)
+        blob = documents.pop()
+        self.assertTrue(blob.startswith('protected/'))
+        self.assertEqual(MediaBlob.objects.get(name=blob).refcount, 2)
+        self.assertFalse(default_storage.exists('documents/a.pdf'))
+
+    def test_dedupe_command_moves_public_blobs_of_protected_fields(self):
+        user = CustomUser.objects.create_user(username='shop', password='x', user_type='vendor')
+        vendor = VendorProfile.objects.create(user=user, business_name='Shop', business_email='s@example.com',
+                                              business_phone='980000000', business_address='Kathmandu', state='Bagmati')
+        with self.settings(PROTECTED_UPLOAD_PREFIXES=()):
+            public = default_storage.save('documents/a.pdf', ContentFile(b'%PDF leaked'))
+        VendorDocument.objects.create(vendor_profile=vendor, document=public)
+
+        call_command('dedupe_media', stdout=StringIO())
+
+        document = VendorDocument.objects.get().document
+        self.assertTrue(document.startswith('protected/'))
+        self.assertFalse(default_storage.exists(public))
+        self.assertFalse(MediaBlob.objects.filter(name=public).exists())
+
+
+class ProtectedMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        protected_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, protected_root)
+        overrides = self.settings(MEDIA_ROOT=media_root, PROTECTED_MEDIA_ROOT=protected_root, PROTECTED_MEDIA_SERVER=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.owner = CustomUser.objects.create_user(username='owner', password='x', user_type='vendor')
+        self.stranger = CustomUser.objects.create_user(username='stranger', password='x')
+        vendor = VendorProfile.objects.create(user=self.owner, business_name='Shop', business_email='s@example.com',
+                                              business_phone='980000000', business_address='Pokhara', state='Gandaki')
+        name = default_storage.save('documents/license.pdf', ContentFile(b'0123456789' * 10))
+        self.document = VendorDocument.objects.create(vendor_profile=vendor, document=name)
+        self.factory = APIRequestFactory()
+
+    def get(self, user, **headers):
+        request = self.factory.get(f'/api/media/vendor-documents/{self.document.pk}/', **headers)
+        force_authenticate(request, user=user)
+        return vendor_document_api(request, pk=self.document.pk)
+
+    def test_only_owner_can_download(self):
+        self.assertEqual(self.get(self.stranger).status_code, 403)
+        response = self.get(self.owner)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_range_and_conditional_requests(self):
+        response = self.get(self.owner, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+        self.assertEqual(self.get(self.owner, HTTP_RANGE='bytes=500-').status_code, 416)
+        etag = self.get(self.owner)['ETag']
+        self.assertEqual(self.get(self.owner, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_web_server_transfer(self):
+        with self.settings(PROTECTED_MEDIA_SERVER='x-accel'):
+            response = self.get(self.owner)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.document.document}')
+        self.assertEqual(response.content, b'')
+
+    def test_serializers_hand_out_no_storage_paths(self):
+        conversation = Conversation.objects.create()
+        message = Message.objects.create(
+            conversation=conversation, sender=self.owner, message_type='image', file_url=self.document.document,
+            thumbnail_url=self.document.document, image_variants={'webp': {'300': self.document.document}},
+        )
+        refund = OrderRefund(pk=5, customer=self.stranger, evidence_photos=[
+            {'filename': 'receipt.pdf', 'saved_filename': 'abc.pdf', 'file_path': self.document.document,
+             'file_url': f'/media/{self.document.document}'},
+        ])
+
+        data = json.dumps([MessageSerializer(message).data, OrderRefundSerializer(refund).data], default=str)
+        self.assertNotIn(self.document.document, data)
+        self.assertIn(f'/api/media/messages/{message.id}/?thumbnail=1', data)
+        self.assertIn('/api/media/refunds/5/evidence_photos/0/', data)
+
+    def test_storage_url_links_to_the_download_view(self):
+        self.assertEqual(default_storage.url(self.document.document),
+                         f'/api/media/vendor-documents/{self.document.pk}/')
+
+        license_file = default_storage.save('business_license/1.pdf', ContentFile(b'%PDF license'))
+        VendorProfile.objects.filter(pk=self.document.vendor_profile_id).update(gst_certificate=license_file)
+        self.assertEqual(default_storage.url(license_file),
+                         f'/api/media/vendor-profiles/{self.document.vendor_profile_id}/gst_certificate/')
+
+        attachment = default_storage.save('messages/photo_thumb.jpg', ContentFile(b'thumbnail'))
+        message = Message.objects.create(conversation=Conversation.objects.create(), sender=self.owner,
+                                         message_type='image', thumbnail_url=attachment)
+        self.assertEqual(default_storage.url(attachment), f'/api/media/messages/{message.id}/?thumbnail=1')
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        catalog_cache.clear()
+        Category.objects.create(name='Groceries')
+        self.factory = APIRequestFactory()
+
+    def get(self, **headers):
+        return get_categories_api(self.factory.get('/api/categories/', **headers))
+
+    def test_cached_bytes_and_not_modified(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([c['name'] for c in json.loads(first.content)['categories']], ['Groceries'])
+
+        with self.assertNumQueries(0):
+            second = self.get()
+            not_modified = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_not_modified_through_compression(self):
+        # GZipMiddleware weakens the ETag; clients send the weak form back
+        Category.objects.bulk_create(Category(name=f'Category {i}') for i in range(30))
+        with self.settings(RESPONSE_COMPRESSION_MIN_SIZE=1):
+            view = CompressionMiddleware(get_categories_api)
+            first = view(self.factory.get('/api/categories/', HTTP_ACCEPT_ENCODING='gzip'))
+            self.assertEqual(first['Content-Encoding'], 'gzip')
+            self.assertTrue(first['ETag'].startswith('W/'))
+            second = view(self.factory.get('/api/categories/', HTTP_ACCEPT_ENCODING='gzip',
+                                           HTTP_IF_NONE_MATCH=first['ETag']))
+        self.assertEqual(second.status_code, 304)
+
+    def test_model_change_bumps_version(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Bakery')
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content)['categories']), 2)
+
+
+class ProductFragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='grocer', password='x', user_type='vendor')
+        self.vendor = VendorProfile.objects.create(user=user, business_name='Grocer', business_email='g@example.com',
+                                                   business_phone='980000000', business_address='Lalitpur', state='Bagmati')
+        self.products = [Product.objects.create(vendor=self.vendor, name=f'Rice {i}', category='Groceries',
+                                                price=100, description='Rice') for i in range(5)]
+        self.request = APIRequestFactory().get('/api/search/products/')
+
+    def serialize(self):
+        queryset = Product.objects.filter(vendor=self.vendor).select_related('vendor').order_by('id')
+        return CustomerProductSerializer(queryset, many=True, context={'request': self.request}).data
+
+    def test_page_is_assembled_from_cached_fragments(self):
+        first = self.serialize()
+        # Products + one multi-get: no image or per-product total_sold queries
+        with self.assertNumQueries(2):
+            second = self.serialize()
+        self.assertEqual(json.loads(json.dumps(first)), json.loads(json.dumps(second)))
+        self.assertEqual(second[0]['total_sold'], 0)
+        self.assertEqual(product_fragment_cache.stats()['hit_rate'], 0.5)
+
+    def test_product_changes_replace_the_fragment(self):
+        self.serialize()
+        ProductImage.objects.create(product=self.products[0], image='products/rice.jpg')
+        product = self.products[1]
+        product.name = 'Basmati'
+        product.save()
+
+        data = {item['id']: item for item in self.serialize()}
+        self.assertEqual(len(data[self.products[0].id]['images']), 1)
+        self.assertEqual(data[product.id]['name'], 'Basmati')
+
+
+class DynamicFieldsTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(username='admin', password='x', email='a@example.com')
+        for i in range(3):
+            user = CustomUser.objects.create_user(username=f'vendor{i}', password='x', user_type='vendor')
+            VendorProfile.objects.create(user=user, business_name=f'Shop {i}', business_email=f's{i}@example.com',
+                                         business_phone='980000000', business_address='Butwal', state='Lumbini')
+        self.factory = APIRequestFactory()
+
+    def list_vendors(self, query='', view=VendorProfileListCreateView):
+        request = self.factory.get(f'/api/vendor-profiles/{query}')
+        force_authenticate(request, user=self.admin)
+        response = view.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data.get('results', response.data) if isinstance(response.data, dict) else response.data
+
+    def test_lists_are_lite_unless_expanded(self):
+        VendorProfile.objects.update(is_approved=True, is_open_now=True)
+        with contextlib.redirect_stdout(StringIO()):
+            lite = self.list_vendors(view=CustomerVendorSearchView)[0]
+        self.assertIn('business_name', lite)
+        self.assertNotIn('documents', lite)
+        self.assertIn('profile_picture', lite['user_info'])  # The search card image
+
+        self.assertEqual(set(self.list_vendors('?fields=business_name,city')[0]), {'id', 'business_name', 'city'})
+        self.assertIn('shop_images', self.list_vendors('?profile=lite&expand=shop_images')[0])
+        self.assertNotIn('shop_images', self.list_vendors('?profile=lite')[0])
+
+    def test_own_profile_list_is_full(self):
+        # The vendor profile screen reads documents, hours and bank details from this list
+        profile = self.list_vendors()[0]
+        for field in ('documents', 'shop_images', 'user_info', 'monday_open', 'bank_document_url', 'is_approved'):
+            self.assertIn(field, profile)
+
+    def test_conversation_list_queries_do_not_grow_per_conversation(self):
+        request = self.factory.get('/api/conversations/')
+        request.user = self.admin
+        for i in range(4):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.admin, CustomUser.objects.get(username=f'vendor{i % 3}'))
+            Message.objects.create(conversation=conversation, sender=self.admin, content=f'hello {i}')
+
+        selection = selected_fields(ConversationSerializer, profile='lite')
+        queryset = optimize_queryset(Conversation.objects.filter(participants=self.admin),
+                                     ConversationSerializer, selection)
+        # Conversations, participants, their vendor profiles, latest messages, their reads
+        # and the unread counts of the page
+        with self.assertNumQueries(6):
+            data = ConversationSerializer(queryset, many=True, context={'request': request}, profile='lite').data
+        self.assertEqual(len(data), 4)
+        self.assertTrue(all(item['last_message']['content'].startswith('hello') for item in data))
+        self.assertTrue(all(item['other_participant']['username'].startswith('vendor') for item in data))
+        self.assertNotIn('participants', data[0])
+
+
+class FastJSONTests(SimpleTestCase):
+    payload = {
+        'price': Decimal('99.50'),
+        'created_at': timezone.now(),
+        'date': timezone.now().date(),
+        'id': uuid.uuid4(),
+        'label': gettext_lazy('Groceries'),
+        'line': 'a\u2028b',
+        7: [None, True, 1.5],
+    }
+
+    def test_renderer_matches_drf_and_parser_round_trips(self):
+        body = FastJSONRenderer().render(self.payload)
+        self.assertEqual(json.loads(body), json.loads(JSONRenderer().render(self.payload)))
+        self.assertIn(b'\\u2028', body)
+
+        parsed = FastJSONParser().parse(BytesIO(body))
+        self.assertEqual(parsed['price'], 99.5)
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"broken":'))
+
+    def test_consumer_send_json_uses_the_same_encoder(self):
+        consumer = JSONWebsocketConsumer()
+        consumer.send = mock.AsyncMock()
+        async_to_sync(consumer.send_json)({'amount': Decimal('5.00'), 'at': self.payload['created_at']})
+        frame = json.loads(consumer.send.call_args.kwargs['text_data'])
+        self.assertEqual(frame['amount'], 5.0)
+        self.assertEqual(frame['at'], json.loads(JSONRenderer().render({'at': self.payload['created_at']}))['at'])
+
+    def test_compression_above_threshold(self):
+        request = RequestFactory().get('/api/orders/', HTTP_ACCEPT_ENCODING='gzip')
+        with self.settings(RESPONSE_COMPRESSION_MIN_SIZE=100):
+            middleware = CompressionMiddleware(lambda request: HttpResponse(b'{}', content_type='application/json'))
+            self.assertFalse(middleware(request).has_header('Content-Encoding'))
+            middleware.get_response = lambda request: HttpResponse(b'[1]' * 100, content_type='application/json')
+            self.assertEqual(middleware(request)['Content-Encoding'], 'gzip')
+
+
+class CartPricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = CustomUser.objects.create_user(username='shopper', password='x')
+        self.cart = Cart.objects.create(user=self.customer)
+        self.vendors = []
+        for i, fee in enumerate((Decimal('40.00'), Decimal('60.00'))):
+            user = CustomUser.objects.create_user(username=f'shop{i}', password='x', user_type='vendor')
+            self.vendors.append(VendorProfile.objects.create(
+                user=user, business_name=f'Shop {i}', business_email=f'shop{i}@example.com', business_phone='980000000',
+                business_address='Biratnagar', state='Koshi', delivery_fee=fee, is_active=True,
+                status_override=True, status_override_date=timezone.now().date()))
+        rice = Product.objects.create(vendor=self.vendors[0], name='Rice', category='Groceries', price=Decimal('100.00'),
+                                      quantity=10, description='Rice', custom_delivery_fee_enabled=True,
+                                      custom_delivery_fee=Decimal('75.00'))
+        self.tea = Product.objects.create(vendor=self.vendors[1], name='Tea', category='Groceries',
+                                          price=Decimal('250.00'), quantity=1, description='Tea')
+        CartItem.objects.create(cart=self.cart, product=rice, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.tea, quantity=2)
+
+    def test_quote_in_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            quote = cart_pricing.quote(self.cart)
+        self.assertEqual((quote.total_items, quote.subtotal, quote.delivery_fee), (4, Decimal('700.00'), Decimal('135.00')))
+        self.assertEqual([vendor['delivery_fee'] for vendor in quote.vendors], [Decimal('75.00'), Decimal('60.00')])
+        self.assertEqual(list(quote.unavailable.values()), ['out_of_stock'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_pricing.quote(Cart(pk=self.cart.pk)).total, Decimal('835.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.free_delivery = True
+            self.tea.save()
+        self.assertEqual(cart_pricing.quote(Cart.objects.get(pk=self.cart.pk)).delivery_fee, Decimal('75.00'))
+
+    def test_get_cart_drops_offline_vendor_items(self):
+        VendorProfile.objects.filter(pk=self.vendors[1].pk).update(is_active=False)
+        request = APIRequestFactory().get('/api/cart/', HTTP_HOST='localhost')
+        force_authenticate(request, user=self.customer)
+        data = get_cart_api(request).data
+
+        self.assertEqual([item['product']['name'] for item in data['items']], ['Rice'])
+        self.assertEqual(data['quote']['subtotal'], '200.00')
+        self.assertEqual(data['quote']['total'], '275.00')
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
+
+    def test_vendors_closed_by_their_hours_are_offline_as_in_search(self):
+        monday_9_to_17 = {'monday_open': datetime.time(9), 'monday_close': datetime.time(17), 'status_override': False}
+        for vendor in self.vendors:
+            VendorProfile.objects.filter(pk=vendor.pk).update(**monday_9_to_17)
+            vendor.refresh_from_db()
+            vendor.save()  # Compiles the hours
+        monday_noon = datetime.datetime(2026, 10, 19, 12, tzinfo=zoneinfo.ZoneInfo('Asia/Kathmandu'))
+        items = cart_pricing.load_items(self.cart)
+
+        with mock.patch('django.utils.timezone.now', return_value=monday_noon):
+            quote = price_items(self.cart.pk, items)
+        self.assertEqual(quote.item_ids('vendor_offline'), [])
+        self.assertEqual([vendor['is_active'] for vendor in quote.vendors], [True, True])
+        self.assertEqual(quote.changes_at, datetime.datetime(2026, 10, 19, 17,
+                                                             tzinfo=zoneinfo.ZoneInfo('Asia/Kathmandu')).timestamp())
+
+        with mock.patch('django.utils.timezone.now', return_value=monday_noon + timedelta(hours=6)):
+            quote = price_items(self.cart.pk, items)
+        self.assertEqual(sorted(quote.item_ids('vendor_offline')), sorted(item.id for item in items))
+
+
+class VendorScheduleTests(TestCase):
+    def at(self, day, hour, minute=0):
+        """Kathmandu wall-clock time in the week of Monday 19 October 2026"""
+        return datetime.datetime(2026, 10, 19 + day, hour, minute, tzinfo=zoneinfo.ZoneInfo('Asia/Kathmandu'))
+
+    def test_schedule_compiles_and_flips_at_transitions(self):
+        user = CustomUser.objects.create_user(username='bakery', password='x', user_type='vendor')
+        with mock.patch('django.utils.timezone.now', return_value=self.at(0, 8, 30)):
+            vendor = VendorProfile.objects.create(
+                user=user, business_name='Bakery', business_email='b@example.com', business_phone='980000000',
+                business_address='Bhaktapur', state='Bagmati', is_approved=True, is_active=True,
+                monday_open=datetime.time(9), monday_close=datetime.time(17),
+                tuesday_open=datetime.time(9), tuesday_close=datetime.time(17), tuesday_closed=True,
+                sunday_open=datetime.time(22), sunday_close=datetime.time(2),  # Runs into Monday
+            )
+        self.assertEqual(vendor.opening_schedule, [[0, 120], [540, 1020], [9960, 10080]])
+        self.assertFalse(vendor.is_open_now)
+        self.assertEqual(vendor.next_transition_at, self.at(0, 9))
+
+        self.assertEqual(vendor_scheduler.apply_due(self.at(0, 8, 59)), 0)
+        self.assertEqual(vendor_scheduler.apply_due(self.at(0, 9)), 1)
+        vendor.refresh_from_db()
+        self.assertEqual((vendor.is_open_now, vendor.next_transition_at), (True, self.at(0, 17)))
+        self.assertEqual(list(filter_open(VendorProfile.objects.all())), [vendor])
+
+        self.assertFalse(filter_open(VendorProfile.objects.all(), when=self.at(1, 10)).exists())
+        self.assertTrue(filter_open(VendorProfile.objects.all(), when=self.at(0, 1, 30)).exists())
+
+        # Switched on for the day: open whatever the hours, until midnight
+        self.assertEqual(state_at(vendor, self.at(1, 10)), (False, self.at(6, 22)))
+        vendor.status_override = True
+        vendor.status_override_date = self.at(1, 10).date()
+        self.assertTrue(state_at(vendor, self.at(1, 10))[0])
+        self.assertFalse(state_at(vendor, self.at(2, 6))[0])
+
+        # Switched off (by hand or for a low wallet balance): closed through the hours and past midnight
+        with mock.patch('django.utils.timezone.now', return_value=self.at(0, 10)):
+            vendor.is_active = False
+            vendor.status_override_date = timezone.now().date()
+            vendor.save(update_fields=['is_active', 'status_override', 'status_override_date'])
+        vendor.refresh_from_db()
+        self.assertEqual((vendor.is_open_now, vendor.next_transition_at), (False, None))
+        self.assertFalse(VendorProfileSerializer(vendor).data['is_active'])
+        self.assertFalse(filter_open(VendorProfile.objects.all(), when=self.at(3, 10)).exists())
+        self.assertEqual(vendor_scheduler.apply_due(self.at(3, 10)), 0)
+
+
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = CustomUser.objects.create_user(username='critic', password='x')
+        vendor_user = CustomUser.objects.create_user(username='momo', password='x', user_type='vendor')
+        self.vendor = VendorProfile.objects.create(user=vendor_user, business_name='Momo House', business_email='m@example.com',
+                                                   business_phone='980000000', business_address='Patan', state='Bagmati')
+        self.products = [Product.objects.create(vendor=self.vendor, name=name, category='Food', price=Decimal('150.00'),
+                                                quantity=10, description=name) for name in ('Momo', 'Chowmein')]
+        self.orders = []
+        for products in (self.products, self.products[:1]):
+            order = Order.objects.create(customer=self.customer, vendor=self.vendor, status='delivered', delivery_name='Critic',
+                                         delivery_phone='9800000000', delivery_address='Patan', delivery_latitude=27.67,
+                                         delivery_longitude=85.32, delivery_distance=1, subtotal=150, total_amount=150,
+                                         payment_method='cash_on_delivery')
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=150, total_price=150,
+                                         product_name=product.name, vendor_name='Momo House')
+            self.orders.append(order)
+
+    def review(self, order, **ratings):
+        request = APIRequestFactory().post(f'/api/orders/{order.id}/review/', ratings, format='json')
+        force_authenticate(request, user=self.customer)
+        return create_review_api(request, order_id=order.id)
+
+    def test_reviews_update_summaries_incrementally(self):
+        self.review(self.orders[0], overall_rating=5, food_quality_rating=4)
+        self.review(self.orders[1], overall_rating=3)
+        self.review(self.orders[1], overall_rating=1, delivery_rating=2)  # Edited
+
+        momo, chowmein = ProductRatingSummary.objects.get(product=self.products[0]), self.products[1].rating_summary
+        self.assertEqual((momo.review_count, momo.overall_sum, momo.average_rating), (2, 6, 3.0))
+        self.assertEqual(momo.histogram, {'1': 1, '2': 0, '3': 0, '4': 0, '5': 1})
+        self.assertEqual(chowmein.as_aggregate()['average_quality'], 4.0)
+        self.assertEqual(VendorRatingSummary.objects.get(vendor=self.vendor).as_aggregate()['average_value'], 2.0)
+
+        request = APIRequestFactory().get(f'/api/products/{self.products[0].id}/reviews/')
+        with self.assertNumQueries(2):  # Product with its summary, recent reviews
+            aggregate = get_product_reviews_api(request, product_id=self.products[0].id).data['aggregate']
+        self.assertEqual((aggregate['total_reviews'], aggregate['average_rating']), (2, 3.0))
+
+        expected = {summary.pk: summary.as_aggregate() for summary in ProductRatingSummary.objects.all()}
+        ProductRatingSummary.objects.update(review_count=0, overall_sum=0)
+        call_command('rebuild_rating_summaries', stdout=StringIO())
+        self.assertEqual({summary.pk: summary.as_aggregate() for summary in ProductRatingSummary.objects.all()}, expected)
+
+        # MySQL upserts without a conflict target and raises NotSupportedError when given one
+        ProductRatingSummary.objects.all().delete()
+        VendorRatingSummary.objects.all().delete()
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            call_command('rebuild_rating_summaries', stdout=StringIO())
+        self.assertEqual({summary.pk: summary.as_aggregate() for summary in ProductRatingSummary.objects.all()}, expected)
+
+
+class RiderTrackingTests(TestCase):
+    def setUp(self):
+        customer = CustomUser.objects.create_user(username='hungry', password='x')
+        vendor_user = CustomUser.objects.create_user(username='kitchen', password='x', user_type='vendor')
+        vendor = VendorProfile.objects.create(user=vendor_user, business_name='Kitchen', business_email='k@example.com',
+                                              business_phone='980000000', business_address='Dharan', state='Koshi')
+        order = Order.objects.create(customer=customer, vendor=vendor, delivery_name='Hungry', delivery_phone='9800000000',
+                                     delivery_address='Dharan', delivery_latitude=26.81, delivery_longitude=87.28,
+                                     delivery_distance=2, subtotal=100, total_amount=100, payment_method='cash_on_delivery')
+        self.rider = DeliveryRider.objects.create(name='Ram', phone='9811111111', vehicle_type='bike', vehicle_number='KO 1')
+        self.delivery = OrderDelivery.objects.create(order=order, rider=self.rider)
+        self.tracker = RiderTracker(store=InMemoryLocationStore(), persist_interval=60)
+
+    def test_fixes_are_filtered_fanned_out_and_written_in_batches(self):
+        layer = InMemoryChannelLayer()
+        fixes = [
+            LocationFix(self.rider.id, self.delivery.id, 26.8100, 87.2800, recorded_at=1000),
+            LocationFix(self.rider.id, self.delivery.id, 26.8100, 87.2801, recorded_at=1005),  # ~10m short
+            LocationFix(self.rider.id, self.delivery.id, 26.8110, 87.2800, recorded_at=1010),  # ~110m on
+        ]
+
+        async def stream():
+            await layer.group_add(tracking_group_name(self.delivery.id), 'customer')
+            accepted = [await self.tracker.ingest(layer, fix) for fix in fixes]
+            received = [(await layer.receive('customer'))['location'] for _ in range(2)]
+            return accepted, received
+
+        with self.assertNumQueries(0):
+            accepted, received = async_to_sync(stream)()
+        self.assertEqual(accepted, [True, False, True])
+        self.assertEqual([location['latitude'] for location in received], [26.81, 26.811])
+        self.assertEqual(self.tracker.latest(self.delivery.id).latitude, 26.811)
+
+        async_to_sync(self.tracker.flush)()
+        self.rider.refresh_from_db()
+        self.delivery.refresh_from_db()
+        self.assertEqual((self.rider.current_latitude, self.delivery.current_latitude), (26.811, 26.811))
+        self.assertIsNotNone(self.rider.last_location_update)
+
+    def test_only_the_linked_account_reports_for_a_rider(self):
+        delivery = OrderDelivery.objects.select_related('rider', 'order__vendor').get(pk=self.delivery.pk)
+        same_phone = CustomUser.objects.create_user(username='impostor', password='x', phone_number=self.rider.phone)
+        self.assertFalse(can_report_location(same_phone, delivery))
+
+        rider_user = CustomUser.objects.create_user(username='ram', password='x')
+        DeliveryRider.objects.filter(pk=self.rider.pk).update(user=rider_user)
+        delivery.rider.refresh_from_db()
+        self.assertTrue(can_report_location(rider_user, delivery))
+        self.assertTrue(can_report_location(delivery.order.vendor.user, delivery))
+        self.assertFalse(can_report_location(delivery.order.customer, delivery))
+
+
+class RiderDispatchTests(TestCase):
+    def setUp(self):
+        rider_dispatcher.reset()
+        self.addCleanup(rider_dispatcher.reset)
+        self.admin = CustomUser.objects.create_superuser(username='dispatcher', password='x')
+        customer = CustomUser.objects.create_user(username='hungry', password='x')
+        vendor_user = CustomUser.objects.create_user(username='kitchen', password='x', user_type='vendor')
+        vendor = VendorProfile.objects.create(user=vendor_user, business_name='Kitchen', business_email='k@example.com',
+                                              business_phone='980000000', business_address='Thamel', state='Bagmati',
+                                              latitude=27.7150, longitude=85.3120)
+        self.orders = [
+            Order.objects.create(customer=customer, vendor=vendor, status='confirmed', delivery_name='Hungry',
+                                 delivery_phone='9800000000', delivery_address='Baluwatar', delivery_latitude=27.73,
+                                 delivery_longitude=85.33, delivery_distance=2, subtotal=100, total_amount=100,
+                                 payment_method='cash_on_delivery')
+            for _ in range(2)
+        ]
+        now = timezone.now()
+        self.near, self.nearer, self.far = [
+            DeliveryRider.objects.create(name=name, phone='98', vehicle_type='bike', vehicle_number=name,
+                                         current_latitude=lat, current_longitude=85.3120, last_location_update=now)
+            for name, lat in (('near', 27.7250), ('nearer', 27.7160), ('far', 27.9000))
+        ]
+        DeliveryRider.objects.create(name='silent', phone='98', vehicle_type='bike', vehicle_number='S',
+                                     current_latitude=27.7150, current_longitude=85.3120,
+                                     last_location_update=now - timedelta(hours=1))
+
+    def test_grid_matches_brute_force(self):
+        rng = random.Random(7)
+        index = RiderGridIndex(0.01)
+        positions = {n: (27.7 + rng.uniform(-0.2, 0.2), 85.3 + rng.uniform(-0.2, 0.2)) for n in range(500)}
+        for rider_id, (lat, lon) in positions.items():
+            index.update(rider_id, lat, lon)
+        index.update(0, 35.0, 80.0)  # Moved far away: the search falls back to a scan
+        positions[0] = (35.0, 80.0)
+        for _ in range(20):
+            lat, lon = 27.7 + rng.uniform(-0.3, 0.3), 85.3 + rng.uniform(-0.3, 0.3)
+            expected = sorted((distance_m(lat, lon, *position), rider_id) for rider_id, position in positions.items())
+            self.assertEqual(index.nearest(lat, lon, 5), expected[:5])
+            self.assertEqual(index.nearest(lat, lon, 5, max_distance=2000),
+                             [match for match in expected[:5] if match[0] <= 2000])
+        self.assertEqual(index.nearest(35.0, 80.0, 1)[0][1], 0)
+
+    def test_batch_dispatch_takes_closest_free_riders(self):
+        request = APIRequestFactory().get(f'/api/delivery/orders/{self.orders[0].id}/nearest-riders/', {'k': 5})
+        force_authenticate(request, user=self.admin)
+        response = nearest_riders_api(request, order_id=self.orders[0].id)
+        self.assertEqual([rider['name'] for rider in response.data['riders']], ['nearer', 'near', 'far'])
+
+        request = APIRequestFactory().post('/api/delivery/dispatch/', {}, format='json')
+        force_authenticate(request, user=self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = dispatch_orders_api(request)
+        self.assertEqual(sorted(match['rider_id'] for match in response.data['assigned']),
+                         sorted([self.nearer.id, self.near.id]))
+        self.assertEqual(response.data['unassigned'], [])
+        self.assertEqual([match[1] for match in rider_dispatcher.nearest(27.7150, 85.3120, 5)], [self.far.id])
+
+        # Delivered: the rider is offered again at their last reported position
+        rider_dispatcher.record_position(self.near.id, 27.7151, 85.3120)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderDelivery.objects.filter(rider=self.near).update(status='delivered')
+            OrderDelivery.objects.get(rider=self.near).save()
+        self.assertEqual(rider_dispatcher.nearest(27.7150, 85.3120, 1)[0][1], self.near.id)
+
+    def test_idle_rider_stays_dispatchable_by_reporting_without_a_delivery(self):
+        rider_user = CustomUser.objects.create_user(username='silent', password='x')
+        silent = DeliveryRider.objects.get(name='silent')
+        DeliveryRider.objects.filter(pk=silent.pk).update(user=rider_user)
+        self.assertNotIn(silent.id, [match[1] for match in rider_dispatcher.nearest(27.7150, 85.3120, 5)])
+
+        request = APIRequestFactory().post('/api/delivery/riders/me/location/',
+                                           {'latitude': 27.7149, 'longitude': 85.3120}, format='json')
+        force_authenticate(request, user=rider_user)
+        self.assertTrue(update_rider_location_api(request).data['accepted'])
+        self.assertEqual(rider_dispatcher.nearest(27.7150, 85.3120, 1)[0][1], silent.id)
+        rider_dispatcher.rebuild()  # As another worker sees it
+        self.assertEqual(rider_dispatcher.nearest(27.7150, 85.3120, 1)[0][1], silent.id)
+
+        request = APIRequestFactory().post('/api/delivery/riders/me/location/',
+                                           {'latitude': 27.7149, 'longitude': 85.3120}, format='json')
+        force_authenticate(request, user=self.admin)
+        self.assertEqual(update_rider_location_api(request).status_code, 403)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    def view(self, request):
+        request.resolver_match = ResolverMatch(self.view, (), {}, route='api/products/<int:pk>/')
+        list(CustomUser.objects.all())
+        cache.set('instrumented', 1)
+        cache.get('instrumented')
+        cache.get_many(['instrumented', 'absent'])
+        return HttpResponse(b'{}', content_type='application/json')
+
+    def test_requests_and_events_per_route(self):
+        with self.settings(INSTRUMENTATION_SAMPLE_RATE=0):
+            with self.assertRaises(MiddlewareNotUsed):
+                InstrumentationMiddleware(self.view)
+
+        with self.settings(INSTRUMENTATION_SAMPLE_RATE=1):
+            middleware = InstrumentationMiddleware(self.view)
+            middleware(RequestFactory().get('/api/products/1/'))
+            middleware(RequestFactory().get('/api/products/2/'))
+
+            class EchoConsumer(JSONWebsocketConsumer):
+                async def receive(self, text_data=None, bytes_data=None):
+                    await cache.aget('absent')
+
+            async_to_sync(EchoConsumer().dispatch)({'type': 'websocket.receive', 'text': '{}'})
+
+        self.view(RequestFactory().get('/api/products/3/'))  # Not sampled: nothing recorded
+        metrics = instrumentation.render()
+        labels = 'protocol="http",route="api/products/<int:pk>/",method="GET"'
+        self.assertIn(f'ezeyway_duration_seconds_count{{{labels}}} 2', metrics)
+        self.assertIn(f'ezeyway_db_queries_bucket{{{labels},le="1"}} 2', metrics)
+        self.assertIn(f'ezeyway_db_queries_bucket{{{labels},le="0"}} 0', metrics)
+        self.assertIn(f'ezeyway_cache_hits_total{{{labels}}} 4', metrics)
+        self.assertIn(f'ezeyway_cache_misses_total{{{labels}}} 2', metrics)
+        self.assertIn('ezeyway_cache_misses_total{protocol="websocket",route="EchoConsumer",'
+                      'method="websocket.receive"} 1', metrics)
+
+
+def slow_vendor_orders(request):
+    list(CustomUser.objects.filter(is_superuser=False))
+    time.sleep(0.05)
+    return HttpResponse(b'[]', content_type='application/json')
+
+
+class RequestProfilerTests(TestCase):
+    def setUp(self):
+        self.store = InMemoryProfileStore(capacity=2)
+        request_profiler._store = self.store
+        self.addCleanup(setattr, request_profiler, '_store', None)
+        self.middleware = RequestProfilerMiddleware(slow_vendor_orders)
+        self.admin = CustomUser.objects.create(username='admin', is_superuser=True)
+        self.vendor = CustomUser.objects.create(username='vendor')
+
+    def request(self, user, **extra):
+        request = RequestFactory().get('/api/vendor/orders/', {'_profile': '1'},
+                                       HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}',
+                                       **extra)
+        request.user = AnonymousUser()
+        return self.middleware(request)
+
+    def test_superuser_flag_stores_call_tree_and_sql(self):
+        self.assertFalse(self.request(self.vendor).has_header('X-Profile-Id'))
+        response = self.request(self.admin)
+        profile = request_profiler.get(int(response['X-Profile-Id']))
+        self.assertEqual((profile['trigger'], profile['status'], profile['query_count']), ('flag', 200, 1))
+        self.assertIn('accounts_customuser', profile['queries'][0]['sql'])
+        self.assertGreater(profile['samples'], 0)
+        self.assertIn('accounts.tests:slow_vendor_orders', [node['function'] for node in profile['tree']])
+        self.assertIn('accounts.tests:slow_vendor_orders', profile['collapsed'])
+
+        # Anyone holding the profiler token can profile their own request
+        with self.settings(REQUEST_PROFILER_TOKEN='secret'):
+            response = self.request(self.vendor, HTTP_X_PROFILE='secret')
+        self.assertEqual(request_profiler.get(int(response['X-Profile-Id']))['trigger'], 'header')
+
+        self.request(self.admin)
+        self.assertEqual([profile['id'] for profile in request_profiler.recent()], [3, 2])
+        self.assertNotIn('queries', request_profiler.recent()[0])
+
+
+class ApiBenchmarkTests(TestCase):
+    def test_query_counts_do_not_grow_with_data(self):
+        small = {'vendors': 3, 'products_per_vendor': 4, 'customers': 5, 'orders_per_vendor': 4,
+                 'conversations': 4, 'messages_per_conversation': 3}
+        results = api_benchmarks.run(api_benchmarks.seed(small, prefix='small'), rounds=1)
+        self.assertEqual(api_benchmarks.compare(results), [])
+
+        large = {**small, 'products_per_vendor': 12, 'orders_per_vendor': 15, 'conversations': 12,
+                 'messages_per_conversation': 6}
+        larger = api_benchmarks.run(api_benchmarks.seed(large, seed_value=1, prefix='large'), rounds=1)
+        self.assertEqual({name: result['queries'] for name, result in larger.items()},
+                         {name: result['queries'] for name, result in results.items()})
+
+        baseline = {name: {**result, 'queries': result['queries'] - 1} for name, result in results.items()}
+        self.assertIn(f"conversations: {results['conversations']['queries']} queries, baseline has "
+                      f"{results['conversations']['queries'] - 1}", api_benchmarks.compare(results, baseline))
+
+    def test_unread_counts_match_per_conversation_count(self):
+        users = api_benchmarks.seed({'vendors': 2, 'products_per_vendor': 1, 'customers': 2, 'orders_per_vendor': 1,
+                                     'conversations': 2, 'messages_per_conversation': 4})
+        customer = users['customer']
+        conversation = Conversation.objects.filter(participants=customer).first()
+        message = conversation.messages.exclude(sender=customer).first()
+        if message is not None:
+            message.read_by.create(user=customer)
+        request = APIRequestFactory().get('/api/messaging/conversations/')
+        force_authenticate(request, user=customer)
+        response = api_benchmarks.ConversationListView.as_view()(request)
+        for row in response.data['results']:
+            conversation = Conversation.objects.get(id=row['id'])
+            expected = conversation.messages.exclude(read_by__user=customer).exclude(sender=customer).count()
+            self.assertEqual(row['unread_count'], expected)
+
+
+class MarketplaceSeedTests(TestCase):
+    options = ['--vendors', '6', '--customers', '30', '--carts', '8', '--orders', '300', '--conversations', '5',
+               '--messages-per-conversation', '4', '--visitors', '10', '--page-views', '50', '--seed', '3']
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('sku').values_list('name', 'price', 'tags', 'dynamic_fields')),
+            list(Order.objects.order_by('order_number').values_list('order_number', 'status', 'total_amount')),
+            list(VendorProfile.objects.order_by('business_name').values_list('business_name', 'latitude', 'city')),
+        )
+
+    def test_seeding_is_deterministic_and_does_the_signal_work_in_bulk(self):
+        call_command('seed_marketplace', *self.options, stdout=StringIO())
+        first = self.snapshot()
+        self.assertEqual(len(first[1]), 300)
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)),
+                         {status for status, _ in Order.ORDER_STATUS_CHOICES})
+        self.assertFalse(Order.objects.filter(status='delivered', delivered_at=None).exists())
+        self.assertTrue(all(product.dynamic_fields and product.tags for product in Product.objects.all()))
+        self.assertEqual(Token.objects.count(), CustomUser.objects.count())
+        self.assertEqual(VendorProfile.objects.filter(wallet__isnull=False).count(), 6)
+        self.assertTrue(VendorProfile.objects.filter(is_open_now=True).exists())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_marketplace', *self.options, stdout=StringIO())
+        call_command('seed_marketplace', *self.options, '--replace', stdout=StringIO())
+        self.assertEqual(self.snapshot(), first)
+
+        # The muted receivers are connected again afterwards
+        user = CustomUser.objects.create_user(username='after_seeding', password='x')
+        self.assertTrue(Token.objects.filter(user=user).exists())
+
+
+class SocketLoadTests(TestCase):
+    def test_every_phase_delivers_and_measures_latency(self):
+        users, conversations, tokens = socket_load.seed(6, group_size=3)
+        harness = socket_load.SocketLoadHarness(users, conversations, tokens, timeout=5)
+        with contextlib.redirect_stdout(StringIO()):
+            results = async_to_sync(harness.run)(messages=4, typing=2, calls=2, candidates=2, notifications=3)
+
+        self.assertEqual((results['connect']['connected'], results['connect']['sockets']), (12, 12))
+        self.assertGreater(results['connect']['traced_bytes_per_socket'], 0)
+        # Two conversations of three: messages reach all three, typing the other two
+        self.assertEqual(results['chat']['expected'], 2 * 4 * 3)
+        self.assertEqual(results['typing']['expected'], 6 * 2 * 2)
+        self.assertEqual(results['calls']['expected'], 2 * (2 + 2 * 2))
+        self.assertEqual(results['notifications']['expected'], 6 * 3)
+        for name in ('chat', 'typing', 'calls', 'notifications'):
+            self.assertEqual(results[name]['lost'], 0, name)
+            self.assertLessEqual(results[name]['p50_ms'], results[name]['p99_ms'])
+        self.assertIn('setup_p50_ms', results['calls'])
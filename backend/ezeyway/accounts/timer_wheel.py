@@ -0,0 +1,119 @@
+"""
+Hashed Timer Wheel
+One asyncio task per event loop drives every timeout, instead of an OS
+thread (threading.Timer) per scheduled callback
+"""
+
+import asyncio
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    __slots__ = ('callback', 'args', 'rounds', 'cancelled')
+
+    def __init__(self, callback, args, rounds):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class HashedTimerWheel:
+    """Timer wheel with `slots` buckets advanced every `tick` seconds.
+
+    Scheduling and cancelling are O(1); each tick only looks at one bucket.
+    Callbacks may be plain functions or coroutine functions and fire with a
+    resolution of one tick.
+    """
+
+    def __init__(self, tick=0.5, slots=128):
+        self.tick = tick
+        self.slots = slots
+        self._buckets = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._pending = 0
+        self._loop = None
+        self._task = None
+        self._next_tick_at = None
+
+    def __len__(self):
+        return self._pending
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) after `delay` seconds; must be called inside the loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._pending and self._loop is not None and not self._loop.is_closed():
+                raise RuntimeError('HashedTimerWheel is bound to another event loop')
+            self._reset(loop)
+
+        start = self._task is None or self._task.done()
+        if start:
+            self._next_tick_at = loop.time() + self.tick
+
+        # Bucket cursor+k fires at _next_tick_at + (k - 1) * tick; pick the first one not before the deadline
+        wait = max(0.0, loop.time() + delay - self._next_tick_at)
+        ticks_ahead = 1 + math.ceil(wait / self.tick)
+        rounds, offset = divmod(ticks_ahead - 1, self.slots)
+        handle = TimerHandle(callback, args, rounds)
+        self._buckets[(self._cursor + 1 + offset) % self.slots].append(handle)
+        self._pending += 1
+
+        if start:
+            self._task = loop.create_task(self._run())
+        return handle
+
+    def _reset(self, loop):
+        self._loop = loop
+        self._buckets = [[] for _ in range(self.slots)]
+        self._cursor = 0
+        self._pending = 0
+        self._task = None
+        self._next_tick_at = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            await asyncio.sleep(max(0, self._next_tick_at - loop.time()))
+            # Catch up on ticks missed while the loop was busy
+            while self._next_tick_at <= loop.time() and self._pending:
+                self._next_tick_at += self.tick
+                self._advance()
+        self._task = None
+
+    def _advance(self):
+        self._cursor = (self._cursor + 1) % self.slots
+        bucket = self._buckets[self._cursor]
+        if not bucket:
+            return
+        keep = []
+        for handle in bucket:
+            if handle.cancelled:
+                self._pending -= 1
+            elif handle.rounds:
+                handle.rounds -= 1
+                keep.append(handle)
+            else:
+                self._pending -= 1
+                self._fire(handle)
+        self._buckets[self._cursor] = keep
+
+    def _fire(self, handle):
+        try:
+            result = handle.callback(*handle.args)
+            if asyncio.iscoroutine(result):
+                task = self._loop.create_task(result)
+                task.add_done_callback(_log_task_error)
+        except Exception as e:
+            logger.error(f"Timer callback {handle.callback!r} failed: {e}")
+
+
+def _log_task_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Timer callback failed: {task.exception()}")
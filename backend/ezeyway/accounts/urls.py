@@ -44,6 +44,8 @@ urlpatterns = [
     path('superadmin/sliders/', views.manage_sliders, name='manage_sliders'),
     path('superadmin/sliders/edit/<int:slider_id>/', views.edit_slider, name='edit_slider'),
     path('superadmin/push-notifications/', views.manage_push_notifications, name='manage_push_notifications'),
+    path('superadmin/profiles/', views.request_profiles, name='request_profiles'),
+    path('superadmin/profiles/<int:profile_id>/', views.request_profile_detail, name='request_profile_detail'),
     path('superadmin/messages/', views.admin_messages, name='admin_messages'),
     path('superadmin/messages/<int:conversation_id>/', views.admin_conversation, name='admin_conversation'),
     path('superadmin/user-profile/<int:user_id>/', views.user_profile_details, name='user_profile_details'),
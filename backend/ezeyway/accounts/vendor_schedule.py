@@ -0,0 +1,228 @@
+"""
+Vendor Schedule
+Opening hours compiled from VendorProfile's 21 day columns into a sorted
+list of [open, close) minute-of-week intervals (Monday 00:00 is minute 0),
+in VENDOR_HOURS_TIME_ZONE wall-clock time. A close time at or before the
+open time runs past midnight into the next day.
+
+VendorProfile.save() recompiles the schedule and stores two derived
+fields: is_open_now (indexed, what search filters on) and
+next_transition_at, the next moment is_open_now changes.
+
+state_at() is the one availability rule, used by search (through
+is_open_now), the vendor serializer and cart pricing:
+
+- is_active False (switched off by hand, or for a wallet balance below
+  the minimum) keeps a vendor closed until it is switched back on;
+- switched on today (status_override for today's date), it is open until
+  the end of the day whatever the hours;
+- otherwise the opening hours decide.
+
+The scheduler sleeps until the earliest next_transition_at and flips only
+the vendors due at that moment:
+
+    python manage.py run_vendor_schedule --loop
+"""
+
+import datetime
+import time
+import logging
+import zoneinfo
+from bisect import bisect_right
+from operator import itemgetter
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Min
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DEFAULT_TIME_ZONE = 'Asia/Kathmandu'
+DEFAULT_MAX_SLEEP = 60
+UPDATE_BATCH_SIZE = 500
+
+# Columns the schedule is computed from, and what is derived from them
+SOURCE_FIELDS = frozenset(
+    [f'{day}_{part}' for day in DAYS for part in ('open', 'close', 'closed')]
+    + ['is_active', 'status_override', 'status_override_date']
+)
+DERIVED_FIELDS = ('opening_schedule', 'is_open_now', 'next_transition_at')
+
+
+def hours_time_zone():
+    return zoneinfo.ZoneInfo(getattr(settings, 'VENDOR_HOURS_TIME_ZONE', DEFAULT_TIME_ZONE))
+
+
+def _minute_of_day(value):
+    if isinstance(value, str):
+        value = datetime.time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def compile_schedule(vendor):
+    """[[open, close], ...] minutes of the week, sorted and merged"""
+    intervals = []
+    for index, day in enumerate(DAYS):
+        opens, closes = getattr(vendor, f'{day}_open'), getattr(vendor, f'{day}_close')
+        if getattr(vendor, f'{day}_closed') or opens is None or closes is None:
+            continue
+        start = index * MINUTES_PER_DAY + _minute_of_day(opens)
+        end = index * MINUTES_PER_DAY + _minute_of_day(closes)
+        if end <= start:
+            end += MINUTES_PER_DAY
+        if end > MINUTES_PER_WEEK:
+            # Sunday night into Monday morning
+            intervals.append([0, end - MINUTES_PER_WEEK])
+            end = MINUTES_PER_WEEK
+        intervals.append([start, end])
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def minute_of_week(when):
+    local = when.astimezone(hours_time_zone())
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+def is_open_at(schedule, minute):
+    index = bisect_right(schedule, minute, key=itemgetter(0)) - 1
+    return index >= 0 and minute < schedule[index][1]
+
+
+def minutes_to_next_boundary(schedule, minute):
+    """Minutes from `minute` to the next open or close in the schedule, None if it has none"""
+    if not schedule:
+        return None
+    boundaries = [edge for interval in schedule for edge in interval]
+    later = [edge for edge in boundaries if edge > minute]
+    if later:
+        return min(later) - minute
+    return min(boundaries) + MINUTES_PER_WEEK - minute
+
+
+def override_applies(vendor, now):
+    # Overrides are dated with timezone.now().date() where they are set
+    return vendor.status_override and vendor.status_override_date == now.date()
+
+
+def state_at(vendor, now=None):
+    """(open, next transition time) of a vendor, see the module docstring"""
+    now = now or timezone.now()
+    if not vendor.is_active:
+        # No transition: only switching the vendor back on (a save) reopens it
+        return False, None
+    if override_applies(vendor, now):
+        end_of_day = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                               tzinfo=now.tzinfo)
+        return True, end_of_day
+
+    schedule = vendor.opening_schedule or []
+    minute = minute_of_week(now)
+    wait = minutes_to_next_boundary(schedule, minute)
+    if wait is None:
+        return False, None
+    local_minute = now.astimezone(hours_time_zone()).replace(second=0, microsecond=0)
+    return is_open_at(schedule, minute), local_minute + datetime.timedelta(minutes=wait)
+
+
+def is_open(vendor, now=None):
+    return state_at(vendor, now)[0]
+
+
+def refresh(vendor, now=None):
+    """Recompile a vendor's schedule and derived state in place (not saved)"""
+    vendor.opening_schedule = compile_schedule(vendor)
+    vendor.is_open_now, vendor.next_transition_at = state_at(vendor, now)
+
+
+def filter_open(queryset, when=None):
+    """Vendors open now (indexed flag) or at another time (evaluated on the compiled schedules)"""
+    if when is None:
+        return queryset.filter(is_open_now=True)
+    from .models import VendorProfile
+    vendors = queryset.only('id', 'opening_schedule', 'is_active', 'status_override', 'status_override_date')
+    open_ids = [vendor.id for vendor in vendors if state_at(vendor, when)[0]]
+    return VendorProfile.objects.filter(id__in=open_ids)
+
+
+class VendorScheduler:
+    def __init__(self, max_sleep=None):
+        self._max_sleep = max_sleep
+
+    @property
+    def max_sleep(self):
+        return self._max_sleep or getattr(settings, 'VENDOR_SCHEDULE_MAX_SLEEP', DEFAULT_MAX_SLEEP)
+
+    def apply_due(self, now=None):
+        """Update every vendor whose next transition has come; returns how many flipped"""
+        from .models import VendorProfile
+        now = now or timezone.now()
+        due = (VendorProfile.objects.filter(next_transition_at__lte=now)
+               .only(*SOURCE_FIELDS, *DERIVED_FIELDS))
+        groups, flipped = {}, 0
+        for vendor in due.iterator(chunk_size=1000):
+            was_open = vendor.is_open_now
+            is_open, next_at = state_at(vendor, now)
+            flipped += is_open != was_open
+            groups.setdefault((is_open, next_at), []).append(vendor.id)
+
+        # Vendors sharing hours share the update; one saved meanwhile has a future transition and is left alone
+        for (is_open, next_at), ids in groups.items():
+            for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+                VendorProfile.objects.filter(id__in=ids[start:start + UPDATE_BATCH_SIZE],
+                                             next_transition_at__lte=now).update(
+                    is_open_now=is_open, next_transition_at=next_at
+                )
+        return flipped
+
+    def next_due(self):
+        from .models import VendorProfile
+        return VendorProfile.objects.aggregate(next_at=Min('next_transition_at'))['next_at']
+
+    def rebuild(self, batch_size=500):
+        """Recompile every vendor, e.g. for rows saved before schedules existed"""
+        from .models import VendorProfile
+        now = timezone.now()
+        batch, total = [], 0
+        for vendor in VendorProfile.objects.only(*SOURCE_FIELDS, *DERIVED_FIELDS).iterator(chunk_size=batch_size):
+            refresh(vendor, now)
+            batch.append(vendor)
+            if len(batch) >= batch_size:
+                total += VendorProfile.objects.bulk_update(batch, DERIVED_FIELDS)
+                batch = []
+        if batch:
+            total += VendorProfile.objects.bulk_update(batch, DERIVED_FIELDS)
+        return total
+
+    def run(self, stop=None):
+        """Flip vendors at their transition times until stop (a threading.Event) is set"""
+        while stop is None or not stop.is_set():
+            close_old_connections()
+            try:
+                flipped = self.apply_due()
+                if flipped:
+                    logger.info(f"Vendor schedule: {flipped} vendor(s) opened or closed")
+                next_at = self.next_due()
+            except Exception as e:
+                logger.error(f"Vendor schedule error: {e}")
+                next_at = None
+            # Wake up at the next transition; newly saved vendors are picked up within max_sleep
+            wait = self.max_sleep
+            if next_at is not None:
+                wait = min(max((next_at - timezone.now()).total_seconds(), 0), wait)
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+
+# Global instance
+vendor_scheduler = VendorScheduler()
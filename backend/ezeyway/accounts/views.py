@@ -1120,28 +1120,20 @@ def manage_push_notifications(request):
                         created_by=request.user
                     )
                     
+                    # The dispatch_push_campaigns worker sends it once due; "send now" is due immediately
+                    notification.status = 'scheduled'
                     if scheduled_time:
                         from datetime import datetime
-                        notification.scheduled_time = datetime.strptime(scheduled_time, '%Y-%m-%dT%H:%M')
-                        notification.status = 'scheduled'
+                        notification.scheduled_time = timezone.make_aware(datetime.strptime(scheduled_time, '%Y-%m-%dT%H:%M'))
                     else:
-                        notification.status = 'sent'
-                        notification.sent_at = timezone.now()
-                        # Here you would integrate with your push notification service
-                        # For now, we'll simulate sending
-                        if recipient_type == 'customer':
-                            notification.sent_count = CustomUser.objects.filter(user_type='customer').count()
-                        elif recipient_type == 'vendor':
-                            notification.sent_count = CustomUser.objects.filter(user_type='vendor').count()
-                        else:
-                            notification.sent_count = CustomUser.objects.exclude(user_type='superuser').count()
+                        notification.scheduled_time = timezone.now()
                     
                     notification.save()
                     
-                    if notification.status == 'sent':
-                        messages.success(request, f'Notification sent to {notification.sent_count} users!')
-                    else:
+                    if scheduled_time:
                         messages.success(request, 'Notification scheduled successfully!')
+                    else:
+                        messages.success(request, 'Notification queued for sending!')
                         
                 except Exception as e:
                     messages.error(request, f'Error sending notification: {str(e)}')
@@ -1164,6 +1156,39 @@ def manage_push_notifications(request):
     }
     return render(request, 'accounts/manage_push_notifications.html', context)
 
+@login_required
+def request_profiles(request):
+    if not request.user.is_superuser:
+        messages.error(request, 'Access denied.')
+        return redirect('login')
+
+    from .request_profiler import request_profiler
+    context = {
+        'profiles': request_profiler.recent(),
+        'profiler_token_set': bool(getattr(settings, 'REQUEST_PROFILER_TOKEN', None)),
+    }
+    return render(request, 'accounts/request_profiles.html', context)
+
+@login_required
+def request_profile_detail(request, profile_id):
+    if not request.user.is_superuser:
+        messages.error(request, 'Access denied.')
+        return redirect('login')
+
+    from django.http import Http404, HttpResponse
+    from .request_profiler import request_profiler
+    profile = request_profiler.get(profile_id)
+    if profile is None:
+        raise Http404('Profile no longer in the buffer')
+
+    if request.GET.get('format') == 'collapsed':
+        response = HttpResponse(profile['collapsed'], content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.folded"'
+        return response
+
+    queries = sorted(profile['queries'], key=lambda query: -query['ms'])
+    return render(request, 'accounts/request_profile_detail.html', {'profile': profile, 'slowest_queries': queries})
+
 @login_required
 def admin_messages(request):
     if not request.user.is_superuser:
@@ -4,15 +4,19 @@ import os
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ezeyway.settings')
 
 from django.core.asgi import get_asgi_application
+
+# Sets up Django (app registry included) before the consumers import models
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from accounts.websocket_auth import TokenAuthMiddlewareStack
 from accounts.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": TokenAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -1,3 +1,12 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+
+from accounts.instrumentation import instrumentation
+from accounts.request_profiler import request_profiler
+
+
 class DisableCSRFMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -37,4 +46,80 @@ class NgrokCorsMiddleware:
             response['ngrok-skip-browser-warning'] = 'any'
             response['Access-Control-Allow-Origin'] = '*'
         
-        return response
\ No newline at end of file
+        return response
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip text responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes (None turns it off)"""
+
+    COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+    def __init__(self, get_response):
+        self.min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', None)
+        if self.min_size is None:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith(self.COMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        return super().process_response(request, response)
+
+
+class InstrumentationMiddleware:
+    """Measures sampled requests per route (accounts/instrumentation.py); not loaded with sampling off"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not instrumentation.enabled:
+            raise MiddlewareNotUsed
+        instrumentation.install()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        sample = instrumentation.start()
+        if sample is None:
+            return self.get_response(request)
+        token = instrumentation.activate(sample)
+        try:
+            return self.get_response(request)
+        finally:
+            self.finish(token, sample, request)
+
+    async def __acall__(self, request):
+        sample = instrumentation.start()
+        if sample is None:
+            return await self.get_response(request)
+        token = instrumentation.activate(sample)
+        try:
+            return await self.get_response(request)
+        finally:
+            self.finish(token, sample, request)
+
+    def finish(self, token, sample, request):
+        match = getattr(request, 'resolver_match', None)
+        instrumentation.finish(token, sample, 'http', match.route if match else None, request.method)
+
+
+class RequestProfilerMiddleware:
+    """Profiles requests asked for with X-Profile or ?_profile=1 (accounts/request_profiler.py).
+
+    Sync only: the stack sampler follows the thread the view runs in.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = request_profiler.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        return request_profiler.profile(request, self.get_response, trigger)
@@ -33,8 +33,106 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Shared cache (same Redis as the channel layer) so state is visible to every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    }
+}
+
+# Presence (online/offline) registry; entries expire without a heartbeat
+PRESENCE_BACKEND = 'accounts.presence.CachePresenceStore'
+PRESENCE_TTL_SECONDS = 60
+PRESENCE_TIMER_TICK_SECONDS = 1  # Lapsed entries are announced offline this long after the TTL
+
+# Chat socket tuning
+CONVERSATION_PARTICIPANTS_CACHE_TIMEOUT = 60 * 60
+TYPING_THROTTLE_SECONDS = 3
+
+# Per-user event log replayed to clients on reconnect
+EVENT_LOG_BACKEND = 'accounts.event_log.CacheEventLogStore'
+EVENT_LOG_CAPACITY = 200
+
+# Call reconnect bookkeeping shared between workers
+CALL_STATE_BACKEND = 'accounts.call_state_manager.CacheCallStateStore'
+CALL_RECONNECT_TIMEOUT = 30
+
+# Active calls served from memory; status changes are written behind in batches
+CALL_REGISTRY_FLUSH_INTERVAL = 0.25
+
+# Push notifications: FCM HTTP v1 sends are spread over a bounded worker pool.
+# Set FCM_ENDPOINT_URL to a local fake FCM server for development and tests.
+PUSH_TRANSPORT = 'accounts.push_sender.FCMTransport'
+PUSH_MAX_WORKERS = 32
+FCM_ENDPOINT_URL = None
+
+# Push campaigns (manage.py dispatch_push_campaigns): recipients per chunk,
+# socket sends in flight, FCM messages per second and dispatcher lease
+PUSH_CAMPAIGN_CHUNK_SIZE = 1000
+PUSH_CAMPAIGN_CONCURRENCY = 50
+PUSH_CAMPAIGN_RATE = 5000
+PUSH_CAMPAIGN_LEASE_SECONDS = 120
+
+# Worker processes rendering chat images (WebP + JPEG per size); 0 renders inline
+MESSAGE_IMAGE_WORKERS = 2
+
+# Widths rendered for product, shop, slider and category images (WebP + JPEG)
+RESPONSIVE_IMAGE_WIDTHS = (160, 320, 640, 1280)
+
+# Rendered catalog responses (categories, parameters, sliders, ...) kept per worker process
+CATALOG_CACHE_MAX_ENTRIES = 512
+
+# Cached product cards (keys include product and vendor updated_at, so this only bounds memory)
+PRODUCT_FRAGMENT_TIMEOUT = 3600
+
+# Cart quotes are invalidated by model signals; the timeout covers queryset.update() changes
+CART_QUOTE_TIMEOUT = 300
+
+# Rider locations (ws/deliveries/<id>/location/): latest positions live in the shared cache,
+# fixes closer than MIN_DISTANCE metres are dropped unless MAX_SILENCE seconds passed, and the
+# newest fix per rider and delivery is written to the database every PERSIST_INTERVAL seconds
+RIDER_LOCATION_BACKEND = 'accounts.rider_tracking.CacheLocationStore'
+RIDER_LOCATION_TTL = 60 * 30
+RIDER_LOCATION_MIN_DISTANCE = 10
+RIDER_LOCATION_MAX_SILENCE = 30
+RIDER_LOCATION_PERSIST_INTERVAL = 15
+
+# Rider dispatch: grid cells of CELL_DEGREES (~1km), riders silent for STALE_AFTER seconds are
+# not offered, each worker reloads its index every REFRESH_INTERVAL seconds and batch
+# assignment weighs the CANDIDATES nearest riders of every order
+RIDER_DISPATCH_CELL_DEGREES = 0.01
+RIDER_DISPATCH_STALE_AFTER = 60 * 5
+RIDER_DISPATCH_REFRESH_INTERVAL = 15
+RIDER_DISPATCH_CANDIDATES = 5
+
+# Vendor opening hours are wall-clock times here; run_vendor_schedule wakes at each open/close
+# transition and at least every MAX_SLEEP seconds to pick up vendors saved meanwhile
+VENDOR_HOURS_TIME_ZONE = 'Asia/Kathmandu'
+VENDOR_SCHEDULE_MAX_SLEEP = 60
+
+# Request and socket event instrumentation (accounts/instrumentation.py): share of requests
+# and events measured (0 turns it off, 1 measures all) and the bearer token Prometheus sends
+# to /metrics/ (staff sessions are always let in)
+INSTRUMENTATION_SAMPLE_RATE = 0
+INSTRUMENTATION_METRICS_TOKEN = None
+
+# On-demand request profiles (accounts/request_profiler.py), browsed at /accounts/superadmin/profiles/:
+# requests sending "X-Profile: <TOKEN>" (None disables the header), superusers adding ?_profile=1
+# and a SAMPLE_RATE share of all requests are profiled; the newest CAPACITY profiles are kept with
+# up to MAX_QUERIES SQL statements each, and stacks are sampled every INTERVAL seconds
+REQUEST_PROFILER_BACKEND = 'accounts.request_profiler.CacheProfileStore'
+REQUEST_PROFILER_TOKEN = None
+REQUEST_PROFILER_SAMPLE_RATE = 0
+REQUEST_PROFILER_CAPACITY = 50
+REQUEST_PROFILER_MAX_QUERIES = 500
+REQUEST_PROFILER_INTERVAL = 0.005
+
 # Middleware
 MIDDLEWARE = [
+    'ezeyway.middleware.InstrumentationMiddleware',  # Per-route timings, see INSTRUMENTATION_SAMPLE_RATE
+    'ezeyway.middleware.CompressionMiddleware',  # Gzip large text responses, see RESPONSE_COMPRESSION_MIN_SIZE
     'ezeyway.middleware.DisableCSRFMiddleware',  # Force disable CSRF for /api/ endpoints
     'corsheaders.middleware.CorsMiddleware',
     'ezeyway.middleware.CapacitorMiddleware',
@@ -44,6 +142,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',  # Disabled for API development
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ezeyway.middleware.RequestProfilerMiddleware',  # ?_profile=1 for superusers, see REQUEST_PROFILER_TOKEN
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'analytics.middleware.AnalyticsMiddleware',  # Track all visitors
@@ -73,6 +172,27 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Uploads are stored once per unique content under blobs/ (accounts/content_storage.py);
+# paths that are already content-hashed (responsive variants) are written as-is
+STORAGES = {
+    'default': {'BACKEND': 'accounts.content_storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+CONTENT_STORAGE_BACKEND = 'django.core.files.storage.FileSystemStorage'
+CONTENT_STORAGE_PASSTHROUGH = ('variants/',)
+
+# Protected media (vendor documents, refund documents, message files) is stored under protected/
+# in PROTECTED_MEDIA_ROOT, outside MEDIA_ROOT, so the web server never serves it publicly.
+# Django checks access and the web server sends the file: 'x-accel' (nginx internal location
+# PROTECTED_MEDIA_INTERNAL_URL aliased to PROTECTED_MEDIA_ROOT), 'x-sendfile' (Apache) or None to
+# stream from Django
+PROTECTED_MEDIA_ROOT = BASE_DIR / "protected_media"
+PROTECTED_STORAGE_BACKEND = 'django.core.files.storage.FileSystemStorage'
+PROTECTED_UPLOAD_PREFIXES = ('documents/', 'business_license/', 'refund_documents/', 'messages/')
+PROTECTED_MEDIA_SERVER = None
+PROTECTED_MEDIA_INTERNAL_URL = '/protected-media/'
+PROTECTED_MEDIA_MAX_AGE = 3600
+
 # Use HTTPS URLs for production domains
 if 'ezeyway.com' in str(ALLOWED_HOSTS):
     MEDIA_URL = 'https://ezeyway.com/media/'
@@ -134,12 +254,24 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'accounts.fast_json.FastJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'accounts.fast_json.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20
 }
 
+# JSON encoding for API responses and socket frames (accounts/fast_json.py): 'orjson' when
+# installed, 'stdlib' to force the standard library
+FAST_JSON_BACKEND = 'orjson'
+
+# Gzip API and page responses of at least this many bytes; None leaves compression to the web server
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+
 # CORS Settings - Optimized for ngrok and mobile
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -23,6 +23,23 @@ def react_frontend_view(request):
     except FileNotFoundError:
         return HttpResponse("React app not found", status=404)
 
+def media_blob_view(request, path):
+    """Content-addressed media never changes, so clients may cache it for a year"""
+    from django.views.static import serve
+    response = serve(request, f"blobs/{path}", document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for the instrumentation histograms of this worker"""
+    from django.utils.crypto import constant_time_compare
+    from accounts.instrumentation import instrumentation
+    token = getattr(settings, 'INSTRUMENTATION_METRICS_TOKEN', None)
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(instrumentation.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def superadmin_login_redirect(request):
     """Redirect API login attempts to proper superadmin login"""
     from django.shortcuts import redirect
@@ -42,19 +59,24 @@ urlpatterns = [
     path('api/', include('accounts.api_urls')),
     path('api/analytics/', include('analytics.api_urls')),
     
+    # Instrumentation histograms, see INSTRUMENTATION_SAMPLE_RATE
+    path('metrics/', metrics_view, name='metrics'),
+
     # Redirect for common mistake - trying to access superadmin via API
     path('api/accounts/login/', superadmin_login_redirect, name='api_login_redirect'),
     
     # React SPA root
     re_path(r'^$', react_frontend_view, name='react_frontend'),
 
-    # React SPA catch-all (exclude /admin/, /accounts/, /api/, /media/, /static/, /analytics/)
-    re_path(r'^(?!admin/|accounts/|api/|media/|static/|analytics/).*$', react_frontend_view, name='react_spa'),
+    # React SPA catch-all (exclude /admin/, /accounts/, /api/, /media/, /static/, /analytics/, /metrics/)
+    re_path(r'^(?!admin/|accounts/|api/|media/|static/|analytics/|metrics/).*$', react_frontend_view, name='react_spa'),
 ]
 
 # ---------------------------
 # Static and media files
 # ---------------------------
 # Always serve media files in development
+if settings.DEBUG and settings.MEDIA_URL.startswith('/'):
+    urlpatterns += [re_path(rf'^{settings.MEDIA_URL.lstrip("/")}blobs/(?P<path>.*)$', media_blob_view)]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)